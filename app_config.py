@@ -11,8 +11,19 @@ DEFAULT_DB_NAME = "mimiciv3" # 常用名
 DEFAULT_DB_USER = "postgres"
 # DEFAULT_DB_PASSWORD = ""
 
+# 本地执行后端 (不需要 PostgreSQL): 用 DuckDB 直接查询 MIMIC-IV 的 Parquet / CSV.gz 文件，见 sql_logic/db_backend.py
+# 数据目录下按模块分子目录 (hosp/、icu/)，分别注册为以下 schema 的视图；派生表保存在本地数据库文件中
+MIMIC_MODULE_SCHEMAS = {"hosp": "mimiciv_hosp", "icu": "mimiciv_icu"}
+DEFAULT_LOCAL_DATA_DIR = ""
+DEFAULT_DUCKDB_DATABASE_FILE = "mimic_local.duckdb"
+DEFAULT_DUCKDB_THREADS = 0 # 0 = 使用全部 CPU 核心
+# 分区 Parquet 的分区列名 (目录 part_bucket=N)，注册视图时从列中去掉
+PARQUET_PARTITION_COLUMN = "part_bucket"
+
 # 默认导出路径
 DEFAULT_EXPORT_PATH = "USER_DESKTOP"
+# 数据库内合并结果流式导出时，服务器端游标每次取回的行数
+DB_EXPORT_FETCH_ROWS = 50000
 
 # 基础数据提取中“患者既往病史”的默认关键词类别
 DEFAULT_PAST_DIAGNOSIS_CATEGORIES = [
@@ -24,6 +35,58 @@ DEFAULT_PAST_DIAGNOSIS_CATEGORIES = [
 SQL_PREVIEW_LIMIT = 100
 SQL_BUILDER_DUMMY_DB_FOR_AS_STRING = "dbname=dummy user=dummy"
 
+# 数据预览: TABLESAMPLE 抽样比例 = 预览行数 * 放大系数 / 估计总行数 (下限为最小百分比)
+PREVIEW_SAMPLE_OVERSAMPLE_FACTOR = 3
+PREVIEW_SAMPLE_MIN_PERCENT = 0.01
+
+# 队列规模估计: 条件变化后的防抖间隔，以及精确计数的语句超时 (超时后只显示 EXPLAIN 估计)
+COHORT_SIZE_ESTIMATE_DEBOUNCE_MS = 800
+COHORT_SIZE_COUNT_TIMEOUT_MS = 30000
+
+# 长任务的服务端超时 (每个任务连接单独设置，0 = 不限制)，可在连接页修改
+DEFAULT_JOB_STATEMENT_TIMEOUT_MIN = 0
+DEFAULT_JOB_LOCK_TIMEOUT_SEC = 30
+
+# 会话调优配置: 任务连接开始时设置的内存、并行与 JIT 参数 (按任务类型选择，可在连接页修改长任务使用的配置)。
+# 取值需在服务器允许的范围内 (work_mem 按每个排序/哈希节点分配，并发任务多时不宜过大)；
+# temp_buffers 只能在会话首次使用临时表之前设置，因此只在连接开始时设置
+SESSION_TUNING_PROFILES = {
+    "server_default": {"label": "服务器默认 (不修改)", "settings": {}},
+    "interactive_preview": {"label": "交互预览", "settings": {
+        "work_mem": "64MB", "max_parallel_workers_per_gather": 2, "jit": "off", "temp_buffers": "32MB"}},
+    "bulk_extraction": {"label": "批量提取", "settings": {
+        "work_mem": "256MB", "maintenance_work_mem": "512MB", "max_parallel_workers_per_gather": 4, "jit": "on",
+        "temp_buffers": "256MB"}},
+    "index_build": {"label": "索引构建", "settings": {
+        "maintenance_work_mem": "1GB", "max_parallel_maintenance_workers": 4, "jit": "off"}},
+}
+DEFAULT_JOB_TUNING_PROFILE = "bulk_extraction"
+PREVIEW_TUNING_PROFILE = "interactive_preview"
+INDEX_BUILD_TUNING_PROFILE = "index_build"
+
+# 队列表提交后并行建索引的连接数 (每个连接按索引构建配置使用 maintenance_work_mem，总内存随连接数增加)
+COHORT_INDEX_BUILD_PARALLELISM = 3
+
+# 只读副本 (可选): 只读的聚合步骤 (CREATE TEMPORARY TABLE ... AS SELECT) 在副本上计算，结果经 COPY 传回主库；
+# 副本回放落后于主库时最多等待的秒数 (超时则该任务仍在主库执行)，以及传输结果在内存中缓存的上限 (超出部分写临时文件)
+DEFAULT_REPLICA_MAX_LAG_WAIT_SEC = 30
+REPLICA_COPY_SPOOL_MEMORY_BYTES = 64 * 1024 * 1024
+# 副本会话的锁等待上限: 备库回放主库 DDL 的排他锁时副本查询会等待，超时即放弃路由 (任务的 lock_timeout 更短时用任务的)
+REPLICA_LOCK_TIMEOUT_MS = 2000
+
+# 任务队列: 同时运行的长任务总数、同一数据库上同时运行的任务数 (可在任务队列页修改)；
+# 本地 DuckDB 数据库文件同一时间只运行一个任务 (DuckDB 自身已多线程执行单个查询)
+DEFAULT_JOB_MAX_CONCURRENT = 3
+DEFAULT_JOB_MAX_PER_DATABASE = 2
+DUCKDB_MAX_CONCURRENT_JOBS = 1
+JOB_LOG_MAX_LINES = 2000
+
+# 分块执行 UPDATE: 每块包含的 hadm_id 个数 (每块单独提交并记录检查点，可断点续传)
+DEFAULT_UPDATE_CHUNK_SIZE = 5000
+
+# 本地任务历史 (SQLite): 每次长任务的语句耗时、影响行数和结果
+JOB_HISTORY_DB_PATH = "job_history.sqlite3"
+
 # UI相关的配置
 DEFAULT_MAIN_WINDOW_WIDTH = 950
 DEFAULT_MAIN_WINDOW_HEIGHT = 880
@@ -55,6 +118,7 @@ AGGREGATION_METHODS_DISPLAY = [
     ("四分位距 (IQR)", "IQR"),
     ("值域 (Range)", "RANGE"),
     ("原始时间序列 (JSON)", "TIMESERIES_JSON"), #
+    ("原始时间序列 (数组: 值+时间)", "TIMESERIES_ARRAY"),
 ]
 
 # 内部键对应的SQL聚合函数模板
@@ -97,15 +161,102 @@ AGGREGATE_RESULT_TYPES = {
     "IQR": "DOUBLE PRECISION",
     "RANGE": "NUMERIC",        # 结果类型依赖于 MIN/MAX
     "TIMESERIES_JSON": "JSONB", # <-- 新增
+    "TIMESERIES_ARRAY": "DOUBLE PRECISION[]", # 值数组的类型，时间数组见 AGGREGATE_MULTI_COLUMN_OUTPUTS
+}
+
+# 一个聚合键生成多列的方法: 键 -> [(列名后缀, SQL模板, 列类型)]
+# TIMESERIES_ARRAY 输出两个按时间排序、一一对应的类型化数组，比 TIMESERIES_JSON 省去每个点的键名和时间字符串，
+# 导出 Parquet 时可直接写为 list 列。
+AGGREGATE_MULTI_COLUMN_OUTPUTS = {
+    "TIMESERIES_ARRAY": [
+        ("values", "ARRAY_AGG({val_col}::double precision ORDER BY {time_col} ASC NULLS LAST)", "DOUBLE PRECISION[]"),
+        ("times", "ARRAY_AGG({time_col} ORDER BY {time_col} ASC NULLS LAST)", "TIMESTAMP[]"),
+    ],
 }
 # 注意: 对于 MIN, MAX, FIRST_VALUE, LAST_VALUE, RANGE，如果原始列是文本 (value)，
 # 则结果类型应为 TEXT。这需要在 sql_builder_special.py 中根据 is_text_extraction 动态调整。
 # 为了简化，这里先假设主要用于 valuenum。sql_builder_special.py 中会处理文本情况。
 
 
+# --- 时间分箱提取 (time_binning) 定义 ---
+# 锚点时间 (来自队列表) 及 UI 显示名
+TIME_BINNING_ANCHORS = [
+    ("ICU入住时间 (icu_intime)", "icu_intime"),
+    ("入院时间 (admittime)", "admittime"),
+]
+# 输出布局: long = 每个 (stay_id, bin_start, item_id) 一行; array = 每个 (stay_id, item_id) 一行，各聚合为按箱排序的数组
+TIME_BINNING_LAYOUTS = [
+    ("长表 (stay_id, bin_start, item_id, 聚合值)", "long"),
+    ("数组 (每个 stay_id/item_id 一行, double precision[])", "array"),
+]
+# 分箱模式下不适用的聚合方法 (每箱一个标量)
+TIME_BINNING_EXCLUDED_METHODS = ["TIMESERIES_JSON", "TIMESERIES_ARRAY"]
+
+
+# --- 时间窗口定义 ---
+# 可作为窗口锚点的队列表时间列: (UI 显示名, 列名, 列名代码)
+TIME_WINDOW_ANCHOR_COLUMNS = [
+    ("ICU入住时间 (icu_intime)", "icu_intime", "icu"),
+    ("ICU出科时间 (icu_outtime)", "icu_outtime", "icuout"),
+    ("入院时间 (admittime)", "admittime", "adm"),
+    ("出院时间 (dischtime)", "dischtime", "disch"),
+]
+# 预设时间窗口 (UI 文本) -> 窗口规格，见 sql_logic/time_window.py；
+# 多窗口模式下每个 (窗口 x 聚合方法) 输出一列 {base}_{method}_{name_code}
+TIME_WINDOW_PRESETS = {
+    "ICU入住后24小时": {"anchor": "icu_intime", "start_offset_hours": 0, "end_anchor": "icu_intime", "end_offset_hours": 24, "name_code": "icu24h"},
+    "ICU入住后48小时": {"anchor": "icu_intime", "start_offset_hours": 0, "end_anchor": "icu_intime", "end_offset_hours": 48, "name_code": "icu48h"},
+    "整个ICU期间": {"anchor": "icu_intime", "start_offset_hours": 0, "end_anchor": "icu_outtime", "end_offset_hours": 0, "name_code": "icuall"},
+    "整个住院期间": {"anchor": "admittime", "start_offset_hours": 0, "end_anchor": "dischtime", "end_offset_hours": 0, "name_code": "hospall"},
+    "整个住院期间 (当前入院)": {"anchor": "admittime", "start_offset_hours": 0, "end_anchor": "dischtime", "end_offset_hours": 0, "name_code": "hosp"},
+    "整个ICU期间 (当前入院)": {"anchor": "icu_intime", "start_offset_hours": 0, "end_anchor": "icu_outtime", "end_offset_hours": 0, "name_code": "icu"},
+}
+# 自定义窗口的默认偏移 (小时)
+DEFAULT_CUSTOM_TIME_WINDOW_HOURS = (-6, 72)
+
+
+# --- FilteredEvents 去重方式 ---
+# none: 不去重 (保留重复测量)；exact: SELECT DISTINCT (完全相同的行合并)；
+# latest_storetime: 同一 (stay_id/hadm_id, charttime, itemid) 只保留 storetime 最新的一行 (DISTINCT ON)
+EVENT_DEDUP_STRATEGIES = [
+    ("完全重复行去重 (DISTINCT)", "exact"),
+    ("不去重 (保留重复测量)", "none"),
+    ("同一时间点取最新录入 (storetime)", "latest_storetime"),
+]
+DEFAULT_EVENT_DEDUP_STRATEGY = "exact"
+
+
 # 默认的值列和时间列名
 DEFAULT_VALUE_COLUMN = "valuenum" # 通常用于 chartevents, labevents
 DEFAULT_TEXT_VALUE_COLUMN = "value" # 通常用于 chartevents 的文本值
 DEFAULT_TIME_COLUMN = "charttime" # 通常用于 chartevents, labevents, outputevents
+DEFAULT_STORETIME_COLUMN = "storetime" # chartevents, labevents 的录入时间 (用于 latest_storetime 去重)
+
+
+# --- 本地 Parquet 数据 (MIMIC-IV CSV.gz -> Parquet 转换，见 sql_logic/parquet_ingest.py) ---
+# 大事件表按 itemid 分桶 (itemid % 桶数)，桶内按 itemid 排序写入，行组的 min/max 统计可跳过无关项目；
+# 以患者为单位查询的大表按 subject_id 哈希分桶；未列出的表 (字典表等) 写为单个 Parquet 文件
+PARQUET_PARTITION_SPECS = {
+    "chartevents": ("itemid", 32), "labevents": ("itemid", 16), "datetimeevents": ("itemid", 8),
+    "inputevents": ("itemid", 8), "ingredientevents": ("itemid", 8), "outputevents": ("itemid", 4),
+    "procedureevents": ("itemid", 4),
+    "emar": ("subject_id", 16), "emar_detail": ("subject_id", 16), "poe": ("subject_id", 16),
+    "poe_detail": ("subject_id", 4), "pharmacy": ("subject_id", 8), "prescriptions": ("subject_id", 8),
+    "microbiologyevents": ("subject_id", 4),
+}
+# 固定的列类型 (其余列由 DuckDB 按样本推断): 代码类列必须保持文本，否则 '0010' 等代码会被推断为整数丢失前导零
+PARQUET_COLUMN_TYPES = {
+    "subject_id": "INTEGER", "hadm_id": "INTEGER", "stay_id": "INTEGER", "itemid": "INTEGER",
+    DEFAULT_VALUE_COLUMN: "DOUBLE", DEFAULT_TEXT_VALUE_COLUMN: "VARCHAR",
+    DEFAULT_TIME_COLUMN: "TIMESTAMP", DEFAULT_STORETIME_COLUMN: "TIMESTAMP",
+    "starttime": "TIMESTAMP", "endtime": "TIMESTAMP", "intime": "TIMESTAMP", "outtime": "TIMESTAMP",
+    "admittime": "TIMESTAMP", "dischtime": "TIMESTAMP", "deathtime": "TIMESTAMP",
+    "icd_code": "VARCHAR", "icd_version": "INTEGER", "ndc": "VARCHAR", "gsn": "VARCHAR", "valueuom": "VARCHAR",
+}
+PARQUET_ROW_GROUP_SIZE = 122880
+PARQUET_COMPRESSION = "zstd"
+# 转换时的内存上限 (超出部分的排序数据溢出到输出目录下的临时目录) 与同时转换的表数
+DEFAULT_INGEST_MEMORY_LIMIT = "4GB"
+DEFAULT_INGEST_PARALLEL_TABLES = 2
 
 # --- END OF FILE app_config.py ---
\ No newline at end of file
@@ -13,6 +13,9 @@ from tabs.tab_special_data_master import SpecialDataMasterTab # 导入新的主
 from tabs.tab_data_dictionary import DataDictionaryTab     # <-- 新增导入
 from tabs.tab_data_export import DataExportTab
 from tabs.tab_data_merge import DataMergeTab # <-- 新增导入数据合并Tab
+from tabs.tab_job_history import JobHistoryTab
+from tabs.tab_job_queue import JobQueueTab
+from ui_components.job_scheduler import JobScheduler
 
 class MedicalDataExtractor(QMainWindow):
     def __init__(self):
@@ -27,15 +30,23 @@ class MedicalDataExtractor(QMainWindow):
         self.tabs = QTabWidget()
         self.setCentralWidget(self.tabs)
 
+        # 所有长任务 (队列创建/基础数据/专项数据) 共用一个任务队列，统一排队、限流与取消
+        self.job_scheduler = JobScheduler(self)
+
         # Instantiate tabs
         self.connection_tab = ConnectionTab()
         self.structure_tab = StructureTab(self.get_db_params)
         self.data_dictionary_tab = DataDictionaryTab(self.get_db_params) # <-- 实例化
-        self.query_cohort_tab = QueryCohortTab(self.get_db_params)
-        self.data_extraction_tab = BaseInfoDataExtractionTab(self.get_db_params)
-        self.special_data_master_tab = SpecialDataMasterTab(self.get_db_params) # 实例化新的
+        self.query_cohort_tab = QueryCohortTab(self.get_db_params, self.get_job_timeouts, self.get_tuning_profile, self.job_scheduler)
+        self.data_extraction_tab = BaseInfoDataExtractionTab(self.get_db_params, self.get_job_timeouts, self.get_replica_settings,
+                                                             self.get_tuning_profile, self.job_scheduler)
+        self.special_data_master_tab = SpecialDataMasterTab(self.get_db_params, self.get_job_timeouts, self.get_replica_settings,
+                                                            self.get_tuning_profile, self.job_scheduler) # 实例化新的
         self.data_export_tab = DataExportTab(self.get_db_params)
-        self.data_merge_tab = DataMergeTab() # <-- 实例化数据合并Tab
+        self.data_merge_tab = DataMergeTab(self.get_db_params, self.get_job_timeouts, self.get_tuning_profile,
+                                           self.job_scheduler) # <-- 实例化数据合并Tab (支持数据库表合并)
+        self.job_queue_tab = JobQueueTab(self.job_scheduler) # 排队/运行中的任务
+        self.job_history_tab = JobHistoryTab() # 本地任务历史，无需数据库连接
 
         # Add tabs (调整顺序，将字典查看器放在结构查看后)
         self.tabs.addTab(self.connection_tab, "1. 数据库连接")         # Index 0
@@ -46,11 +57,14 @@ class MedicalDataExtractor(QMainWindow):
         self.tabs.addTab(self.special_data_master_tab, "4. 添加专项数据")     # Index 5
         self.tabs.addTab(self.data_export_tab, "5. 数据预览与导出")     # Index 6
         self.tabs.addTab(self.data_merge_tab, "6. 数据合并")     # Index 7
+        self.tabs.addTab(self.job_queue_tab, "任务队列")     # Index 8
+        self.tabs.addTab(self.job_history_tab, "任务历史")     # Index 9
 
         # --- Signal Connections ---
         self.connection_tab.connected_signal.connect(self.on_db_connected)
         self.special_data_master_tab.request_preview_signal.connect(self.data_export_tab.preview_specific_table)
         self.structure_tab.request_table_preview_signal.connect(self.handle_structure_table_preview)
+        self.tabs.currentChanged.connect(lambda index: self.tabs.widget(index) is self.job_history_tab and self.job_history_tab.refresh_jobs())
         # (未来)可以添加从其他面板到数据字典的联动信号连接
         # 例如，如果 CharteventsConfigPanel 发出一个信号，可以在这里连接到 data_dictionary_tab.lookup_and_display_item
 
@@ -101,47 +115,18 @@ class MedicalDataExtractor(QMainWindow):
     def get_db_params(self):
         return self.connection_tab.db_params if hasattr(self.connection_tab, 'connected') and self.connection_tab.connected else None
 
-    def closeEvent(self, event):
-        # 尝试优雅地关闭/取消任何正在运行的工作线程
-        tabs_with_workers = [
-            self.query_cohort_tab,      # Has cohort_worker_thread
-            self.data_extraction_tab,    # Has worker_thread (for base info)
-            self.special_data_master_tab # Has worker_thread (for special info merge)
-        ]
-
-        for tab_instance in tabs_with_workers:
-            worker_thread_attr_name = None
-            worker_obj_attr_name = None
-
-            if hasattr(tab_instance, 'cohort_worker_thread'): # For QueryCohortTab
-                worker_thread_attr_name = 'cohort_worker_thread'
-                worker_obj_attr_name = 'cohort_worker'
-            elif hasattr(tab_instance, 'worker_thread'): # For BaseInfoDataExtractionTab and SpecialDataMasterTab
-                worker_thread_attr_name = 'worker_thread'
-                if hasattr(tab_instance, 'worker'): # BaseInfo
-                     worker_obj_attr_name = 'worker'
-                elif hasattr(tab_instance, 'merge_worker'): # SpecialDataMasterTab
-                     worker_obj_attr_name = 'merge_worker'
-            
-            if worker_thread_attr_name and worker_obj_attr_name:
-                thread = getattr(tab_instance, worker_thread_attr_name, None)
-                worker = getattr(tab_instance, worker_obj_attr_name, None)
-                
-                if thread and thread.isRunning():
-                    tab_name = tab_instance.__class__.__name__
-                    print(f"Attempting to stop worker in {tab_name} on close...")
-                    if worker and hasattr(worker, 'cancel'):
-                        worker.cancel()
-                    thread.quit()
-                    if not thread.wait(1500): # 稍增加等待时间
-                        print(f"Warning: Worker thread in {tab_name} did not quit in time.")
-                        # thread.terminate() # 强制终止作为最后手段，可能不安全
-                elif thread: # 如果线程对象存在但未运行，确保清理
-                    if thread.isFinished():
-                         thread.deleteLater() # 确保已完成的线程被删除
-                    # else: # 线程对象存在但从未启动或以其他方式结束
-                    #     pass
+    def get_job_timeouts(self):
+        return self.connection_tab.get_job_timeouts()
+
+    def get_replica_settings(self):
+        return self.connection_tab.get_replica_settings()
 
+    def get_tuning_profile(self):
+        return self.connection_tab.get_tuning_profile()
+
+    def closeEvent(self, event):
+        # 丢弃排队的任务，取消运行中的任务 (同时在服务端取消正在执行的语句) 并等待工作线程结束
+        self.job_scheduler.shutdown()
 
         # 关闭特定Tab持有的数据库连接 (如果它们实现了 _close_db 或 _close_main_db)
         # 例如, SpecialDataMasterTab 可能会有一个 _close_main_db
@@ -3,6 +3,8 @@ from PySide6.QtWidgets import QWidget, QMessageBox
 from PySide6.QtCore import Signal
 import psycopg2
 from PySide6.QtCore import Qt, Slot
+from sql_logic.condition_tree import get_cached_column_types
+from sql_logic.db_backend import connect_database
 
 class BaseSourceConfigPanel(QWidget):
     config_changed_signal = Signal() # 当面板内部配置变化，可能影响主Tab按钮状态时发出
@@ -35,7 +37,7 @@ class BaseSourceConfigPanel(QWidget):
             # QMessageBox.warning(self, "数据库未连接", "无法获取数据库连接参数。") # 面板内部不宜直接弹窗
             return False
         try:
-            self._db_conn = psycopg2.connect(**db_params)
+            self._db_conn = connect_database(db_params)
             self._db_cursor = self._db_conn.cursor()
             return True
         except Exception as e:
@@ -59,6 +61,18 @@ class BaseSourceConfigPanel(QWidget):
         """
         pass
 
+    def load_condition_field_types(self):
+        """
+        按筛选表 (字典表，或没有字典表时的事件表) 的真实列类型编译条件，使条件不必 CAST 为文本、可以使用索引。
+        列类型按数据库与表缓存，每个表只查询一次；未连接时条件沿用按列名推测的规则。
+        """
+        condition_widget = getattr(self, "condition_widget", None)
+        if condition_widget is None:
+            return
+        details = self.get_item_filtering_details()
+        filter_table = details[0] or details[4]
+        condition_widget.set_field_types(get_cached_column_types(self.get_db_params(), filter_table))
+
     def get_panel_config(self) -> dict:
         """
         子类必须实现此方法，返回一个包含该面板特定配置的字典。
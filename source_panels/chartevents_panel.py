@@ -9,9 +9,11 @@ from .base_panel import BaseSourceConfigPanel
 from ui_components.conditiongroup import ConditionGroupWidget
 from ui_components.value_aggregation_widget import ValueAggregationWidget # 使用更新后的
 from ui_components.time_window_selector_widget import TimeWindowSelectorWidget
-from app_config import DEFAULT_VALUE_COLUMN, DEFAULT_TEXT_VALUE_COLUMN, DEFAULT_TIME_COLUMN # 导入默认列名
+from app_config import (DEFAULT_VALUE_COLUMN, DEFAULT_TEXT_VALUE_COLUMN, DEFAULT_TIME_COLUMN, # 导入默认列名
+                        EVENT_DEDUP_STRATEGIES, DEFAULT_EVENT_DEDUP_STRATEGY)
 
 import psycopg2.sql as pgsql
+from sql_logic.sql_render import render_sql
 import traceback
 from typing import Optional
 
@@ -90,9 +92,21 @@ class CharteventsConfigPanel(BaseSourceConfigPanel):
         self.value_agg_widget.aggregation_changed.connect(self.config_changed_signal.emit)
         logic_group_layout.addWidget(self.value_agg_widget)
 
-        self.time_window_widget = TimeWindowSelectorWidget(label_text="时间窗口:")
+        self.time_window_widget = TimeWindowSelectorWidget(label_text="时间窗口:", allow_multiple=True, allow_custom=True)
         self.time_window_widget.time_window_changed.connect(lambda: self.config_changed_signal.emit())
         logic_group_layout.addWidget(self.time_window_widget)
+
+        dedup_layout = QHBoxLayout()
+        dedup_layout.addWidget(QLabel("重复事件处理:"))
+        self.dedup_strategy_combo = QComboBox()
+        for display_name, strategy_key in EVENT_DEDUP_STRATEGIES:
+            self.dedup_strategy_combo.addItem(display_name, strategy_key)
+        self.dedup_strategy_combo.setCurrentIndex(self.dedup_strategy_combo.findData(DEFAULT_EVENT_DEDUP_STRATEGY))
+        self.dedup_strategy_combo.setToolTip("只有所选方式会产生额外的排序开销；“不去重”最快，但会保留重复录入的测量值")
+        self.dedup_strategy_combo.currentIndexChanged.connect(lambda: self.config_changed_signal.emit())
+        dedup_layout.addWidget(self.dedup_strategy_combo)
+        dedup_layout.addStretch()
+        logic_group_layout.addLayout(dedup_layout)
         
         panel_layout.addWidget(logic_group)
         self.setLayout(panel_layout)
@@ -159,6 +173,9 @@ class CharteventsConfigPanel(BaseSourceConfigPanel):
             "aggregation_methods": aggregation_methods_from_widget, # 来自 ValueAggregationWidget
             "event_outputs": {}, # Chartevents 使用 aggregation_methods，所以 event_outputs 为空
             "time_window_text": self.time_window_widget.get_current_time_window_text(),
+            "time_window_spec": self.time_window_widget.get_custom_time_window_spec(), # 自定义窗口 (锚点 + 偏移)，None 时使用预设文本
+            "time_windows": self.time_window_widget.get_selected_time_windows(), # 含附加窗口时为多窗口提取
+            "dedup_strategy": self.dedup_strategy_combo.currentData(), # FilteredEvents 去重方式
             "primary_item_label_for_naming": self._get_primary_item_label_for_naming(), # 用于主Tab列名生成
             "cte_join_on_cohort_override": None # Chartevents 通常不需要覆盖默认JOIN (stay_id)
         }
@@ -182,6 +199,8 @@ class CharteventsConfigPanel(BaseSourceConfigPanel):
         self.value_agg_widget.clear_selections()
         if self.time_window_widget.combo_box.count() > 0: # 确保有选项才设置
             self.time_window_widget.combo_box.setCurrentIndex(0) # 或者使用 clear_selection
+        self.time_window_widget.clear_extra_options()
+        self.dedup_strategy_combo.setCurrentIndex(self.dedup_strategy_combo.findData(DEFAULT_EVENT_DEDUP_STRATEGY))
         # self.config_changed_signal.emit()
 
     def _on_item_selection_changed(self):
@@ -220,7 +239,7 @@ class CharteventsConfigPanel(BaseSourceConfigPanel):
             # 更新SQL预览文本框
             try:
                 if self._db_conn and not self._db_conn.closed:
-                    base_sql_str = query_template_obj.as_string(self._db_conn) # 使用连接获取字符串
+                    base_sql_str = render_sql(query_template_obj) # 使用连接获取字符串
                     if condition_params:
                         mogrified_sql = self._db_cursor.mogrify(base_sql_str, condition_params).decode(self._db_conn.encoding or 'utf-8')
                     else:
@@ -10,6 +10,7 @@ from ui_components.event_output_widget import EventOutputWidget
 from ui_components.time_window_selector_widget import TimeWindowSelectorWidget
 
 import psycopg2.sql as pgsql
+from sql_logic.sql_render import render_sql
 import traceback
 
 class DiagnosisConfigPanel(BaseSourceConfigPanel):
@@ -193,7 +194,7 @@ class DiagnosisConfigPanel(BaseSourceConfigPanel):
                 if self._db_conn and not self._db_conn.closed:
                     # Mogrify expects a query string, not a Composed object directly for params
                     # We need to get the string version of query_template_obj first
-                    base_sql_str = query_template_obj.as_string(self._db_conn)
+                    base_sql_str = render_sql(query_template_obj)
                     if condition_params: # mogrify needs params as a tuple or dict
                         mogrified_sql = self._db_conn.cursor().mogrify(base_sql_str, condition_params).decode(self._db_conn.encoding or 'utf-8')
                     else:
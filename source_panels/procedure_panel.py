@@ -11,6 +11,7 @@ from ui_components.time_window_selector_widget import TimeWindowSelectorWidget
 
 import psycopg2
 import psycopg2.sql as pgsql
+from sql_logic.sql_render import render_sql
 import traceback
 
 class ProcedureConfigPanel(BaseSourceConfigPanel):
@@ -181,7 +182,7 @@ class ProcedureConfigPanel(BaseSourceConfigPanel):
             
             try:
                 if self._db_conn and not self._db_conn.closed:
-                    base_sql_str = query_template_obj.as_string(self._db_conn)
+                    base_sql_str = render_sql(query_template_obj)
                     if condition_params: 
                         mogrified_sql = self._db_conn.cursor().mogrify(base_sql_str, condition_params).decode(self._db_conn.encoding or 'utf-8')
                     else:
@@ -0,0 +1,73 @@
+# --- START OF FILE sql_logic/aggregate_planner.py ---
+from typing import List, Tuple
+
+# 可共享一次排序的百分位类方法: 方法键 -> 分位点
+SHARED_PERCENTILE_FRACTIONS = {"P25": 0.25, "MEDIAN": 0.5, "P75": 0.75}
+# IQR 由 P75 - P25 推导，不单独排序
+IQR_METHOD_KEY = "IQR"
+IQR_FRACTIONS = (0.25, 0.75)
+# 可共享一个按时间排序数组的方法
+FIRST_VALUE_METHOD_KEY = "FIRST_VALUE"
+LAST_VALUE_METHOD_KEY = "LAST_VALUE"
+
+PERCENTILES_ALIAS = "_pcts"
+ORDERED_VALUES_ALIAS = "_ordered_vals"
+TIMED_COUNT_ALIAS = "_n_timed"
+
+
+def plan_aggregate_expressions(requested: List[Tuple[str, str]], alias_suffix: str = "") -> Tuple[List[Tuple[str, str]], List[str]]:
+    """
+    聚合规划: 输入 [(方法键, SQL模板)]，输出两层聚合所需的
+      - inner_items: [(内层别名, SQL模板)]，在 GROUP BY 子查询中计算，每种昂贵的排序只出现一次；
+      - final_exprs: 与 requested 顺序一致的外层表达式 (引用内层别名)。
+    共享规则:
+      - P25 / MEDIAN / P75 / IQR -> 一次 PERCENTILE_CONT(ARRAY[...])，IQR = p75 - p25；
+      - FIRST_VALUE / LAST_VALUE -> 一次按时间升序的 ARRAY_AGG，LAST 取最后一个有时间的元素
+        (与原模板 ORDER BY time DESC NULLS LAST 的结果一致)。
+    其余方法按原模板各自计算。模板中的 {val_col}/{time_col} 由调用方格式化。
+    alias_suffix 用于同一查询中多次规划 (如多时间窗口) 时区分内层别名。
+    """
+    pcts_alias = f"{PERCENTILES_ALIAS}{alias_suffix}"
+    ordered_alias = f"{ORDERED_VALUES_ALIAS}{alias_suffix}"
+    timed_count_alias = f"{TIMED_COUNT_ALIAS}{alias_suffix}"
+    fractions = set()
+    needs_ordered_values = False
+    for method_key, _ in requested:
+        if method_key in SHARED_PERCENTILE_FRACTIONS:
+            fractions.add(SHARED_PERCENTILE_FRACTIONS[method_key])
+        elif method_key == IQR_METHOD_KEY:
+            fractions.update(IQR_FRACTIONS)
+        elif method_key in (FIRST_VALUE_METHOD_KEY, LAST_VALUE_METHOD_KEY):
+            needs_ordered_values = True
+
+    inner_items: List[Tuple[str, str]] = []
+    sorted_fractions = sorted(fractions)
+    if sorted_fractions:
+        fraction_list = ", ".join(str(f) for f in sorted_fractions)
+        inner_items.append((pcts_alias,
+                            f"PERCENTILE_CONT(ARRAY[{fraction_list}]::double precision[]) WITHIN GROUP (ORDER BY {{val_col}})"))
+    if needs_ordered_values:
+        inner_items.append((ordered_alias, "ARRAY_AGG({val_col} ORDER BY {time_col} ASC NULLS LAST)"))
+        inner_items.append((timed_count_alias, "COUNT({time_col})"))
+
+    def pct(fraction: float) -> str:
+        # PostgreSQL 数组下标从 1 开始
+        return f"{pcts_alias}[{sorted_fractions.index(fraction) + 1}]"
+
+    final_exprs: List[str] = []
+    for idx, (method_key, template) in enumerate(requested):
+        if method_key in SHARED_PERCENTILE_FRACTIONS:
+            final_exprs.append(pct(SHARED_PERCENTILE_FRACTIONS[method_key]))
+        elif method_key == IQR_METHOD_KEY:
+            final_exprs.append(f"{pct(IQR_FRACTIONS[1])} - {pct(IQR_FRACTIONS[0])}")
+        elif method_key == FIRST_VALUE_METHOD_KEY:
+            final_exprs.append(f"{ordered_alias}[1]")
+        elif method_key == LAST_VALUE_METHOD_KEY:
+            final_exprs.append(f"{ordered_alias}[GREATEST({timed_count_alias}, 1)]")
+        else:
+            inner_alias = f"_agg{idx}{alias_suffix}"
+            inner_items.append((inner_alias, template))
+            final_exprs.append(inner_alias)
+    return inner_items, final_exprs
+
+# --- END OF FILE sql_logic/aggregate_planner.py ---
@@ -96,9 +96,11 @@ WHERE EXISTS (
 );
     """.format(table_name=table_name)
 
-    # Optimized Calculation for ALL Four Weights (remains the same)
+    # Optimized Calculation for ALL Four Weights: 只读的聚合部分先物化为临时表 (可由只读副本计算)，再用一条 UPDATE 写回
     update_sql += f"""
 
+DROP TABLE IF EXISTS weight_values_temp;
+CREATE TEMPORARY TABLE weight_values_temp AS
 WITH ChartEventsFiltered AS (
     SELECT ce.stay_id, ce.charttime, ce.valuenum, af_ref.icu_intime, af_ref.icu_outtime
     FROM mimiciv_icu.chartevents ce
@@ -122,27 +124,26 @@ RankedWeights AS (
         ROW_NUMBER() OVER(PARTITION BY stay_id ORDER BY charttime ASC, valuenum ASC) as rn_adm_ever,
         ROW_NUMBER() OVER(PARTITION BY stay_id ORDER BY charttime DESC, valuenum ASC) as rn_dis_ever
     FROM ChartEventsFiltered
-),
-WeightValues AS (
-    SELECT
-        stay_id,
-        MAX(CASE WHEN rn_adm_24h = 1 THEN valuenum ELSE NULL END) as first_day_adm_w,
-        MAX(CASE WHEN rn_dis_24h = 1 THEN valuenum ELSE NULL END) as first_day_dis_w,
-        MAX(CASE WHEN rn_adm_ever = 1 THEN valuenum ELSE NULL END) as first_ever_adm_w,
-        MAX(CASE WHEN rn_dis_ever = 1 THEN valuenum ELSE NULL END) as last_ever_dis_w
-    FROM RankedWeights
-    GROUP BY stay_id
 )
+SELECT
+    stay_id,
+    MAX(CASE WHEN rn_adm_24h = 1 THEN valuenum ELSE NULL END) as first_day_adm_w,
+    MAX(CASE WHEN rn_dis_24h = 1 THEN valuenum ELSE NULL END) as first_day_dis_w,
+    MAX(CASE WHEN rn_adm_ever = 1 THEN valuenum ELSE NULL END) as first_ever_adm_w,
+    MAX(CASE WHEN rn_dis_ever = 1 THEN valuenum ELSE NULL END) as last_ever_dis_w
+FROM RankedWeights
+GROUP BY stay_id;
+ANALYZE weight_values_temp;
+
 UPDATE {table_name} af
 SET
     first_day_admission_weight = wv.first_day_adm_w,
     first_day_discharge_weight = wv.first_day_dis_w,
     first_ever_admission_weight = wv.first_ever_adm_w,
     last_ever_discharge_weight = wv.last_ever_dis_w
-FROM
-    {table_name} af_join_alias
-    JOIN WeightValues wv ON af_join_alias.stay_id = wv.stay_id
-WHERE af.stay_id = af_join_alias.stay_id;
+FROM weight_values_temp wv
+WHERE af.stay_id = wv.stay_id;
+DROP TABLE IF EXISTS weight_values_temp;
 
 UPDATE {table_name} af
 SET bmi = weight / (height / 100)^2
@@ -364,6 +365,7 @@ FROM (
     INNER JOIN {table_name_placeholder} target_af ON ie.stay_id = target_af.stay_id -- JOIN with target table
   ) AS derived
 GROUP BY derived.subject_id, derived.stay_id;
+ANALYZE heart_rate_arv_temp;
 """.format(table_name_placeholder=table_name) # Pass table_name for JOIN
 
     cols_hr_arv = ["heart_rate_arv NUMERIC"]
@@ -428,6 +430,7 @@ FROM (
     WHERE ce.charttime >= ie.intime - INTERVAL '6 HOUR' AND ce.charttime <= ie.intime + INTERVAL '1 DAY'
 ) AS derived
 GROUP BY derived.subject_id, derived.hadm_id;
+ANALYZE blood_mean_temp;
 
 UPDATE {table_name} af
 SET
@@ -444,6 +447,9 @@ CREATE TEMPORARY TABLE blood_first_temp AS ( -- Removed mimiciv_data. prefix
     FROM mimiciv_derived.complete_blood_count cbc
     WHERE cbc.hadm_id IN (SELECT hadm_id FROM {table_name})
 );
+-- 每次检验一行 (比队列表大得多): 连接键建索引后再收集统计信息
+CREATE INDEX ON blood_first_temp (hadm_id);
+ANALYZE blood_first_temp;
 
 UPDATE {table_name} af
 SET
@@ -495,8 +501,10 @@ def add_medicine(table_name, sql_accumulator):
         "used_warfarin integer", "used_sacubactril_valsartan integer"
     ]
     update_sql = f"-- Update Medication Usage for {table_name}\n"
+    # 先物化为临时表并 ANALYZE (可由只读副本计算)，UPDATE 不再带顶层 WITH，分块执行时也可按 hadm_id 拆分
     update_sql += """
-WITH used_drugs_temp as (
+DROP TABLE IF EXISTS used_drugs_temp;
+CREATE TEMPORARY TABLE used_drugs_temp AS (
     SELECT
         pre.hadm_id,
         MAX(CASE WHEN drug ILIKE '%aspirin%' THEN 1 ELSE 0 END) AS used_aspirin,
@@ -519,7 +527,9 @@ WITH used_drugs_temp as (
     FROM mimiciv_hosp.prescriptions pre
     WHERE pre.hadm_id IN (SELECT hadm_id FROM {table_name})
     GROUP BY pre.hadm_id
-)
+);
+ANALYZE used_drugs_temp;
+
 UPDATE {table_name} af
 SET
     used_aspirin = ud.used_aspirin, used_clopidogrel = ud.used_clopidogrel, used_furosemide = ud.used_furosemide,
@@ -530,6 +540,7 @@ SET
     used_warfarin = ud.used_warfarin, used_sacubactril_valsartan = ud.used_sacubactril_valsartan
 FROM used_drugs_temp ud
 WHERE af.hadm_id = ud.hadm_id;
+DROP TABLE IF EXISTS used_drugs_temp;
 """.format(table_name=table_name)
     return cols, update_sql
 
@@ -0,0 +1,302 @@
+# --- START OF FILE sql_logic/chunked_update.py ---
+import hashlib
+import re
+import time
+import psycopg2.sql as pgsql
+
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# 分块执行长任务 (特征合并、基础数据提取) 中的 UPDATE:
+#   - 每条 UPDATE 按目标表 hadm_id 的键范围拆成若干块，每块单独提交，锁和 WAL 都分散到各块；
+#   - 每完成一块 (或一条非 UPDATE 的持久语句) 就在同一事务中写入检查点日志表，
+#     任务崩溃或被取消后再次运行相同任务时，从最后完成的块继续；
+#   - 临时表等会话级语句不写日志 (新连接上不存在)，只要其后还有未完成的语句就重新执行。
+# 带顶层 WITH 的 UPDATE 不拆分: 每块都会重新计算 CTE，整体执行反而更快。
+
+CHUNK_JOURNAL_SCHEMA = "mimiciv_data"
+CHUNK_JOURNAL_TABLE = "chunked_job_journal"
+DEFAULT_CHUNK_KEY_COLUMN = "hadm_id"
+WHOLE_STATEMENT_CHUNK_INDEX = -1 # 不拆分的持久语句在日志中的块编号
+
+STATEMENT_KIND_UPDATE = "update"
+STATEMENT_KIND_SESSION = "session"
+STATEMENT_KIND_DURABLE = "durable"
+
+_UPDATE_TARGET_RE = re.compile(
+    r'UPDATE\s+(?:ONLY\s+)?(?P<table>(?:"[^"]+"|\w+)(?:\.(?:"[^"]+"|\w+))?)'
+    r'(?:\s+(?:AS\s+)?(?P<alias>(?!SET\b)(?:"[^"]+"|\w+)))?\s+SET\b', re.IGNORECASE)
+_CREATE_TEMP_RE = re.compile(
+    r'CREATE\s+(?:LOCAL\s+|GLOBAL\s+)?TEMP(?:ORARY)?\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(?P<name>"[^"]+"|\w+)', re.IGNORECASE)
+
+
+def _scan_top_level(sql_text: str) -> Tuple[List[Tuple[str, int]], Optional[int]]:
+    """
+    扫描 SQL 文本 (跳过字符串、带引号标识符和注释)，返回括号深度为 0 的单词及其位置，
+    以及第一个顶层分号的位置。
+    """
+    words: List[Tuple[str, int]] = []
+    depth, i, n = 0, 0, len(sql_text)
+    while i < n:
+        ch = sql_text[i]
+        if ch == "-" and sql_text.startswith("--", i):
+            newline = sql_text.find("\n", i)
+            i = n if newline == -1 else newline + 1
+        elif ch == "/" and sql_text.startswith("/*", i):
+            end = sql_text.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+        elif ch in ("'", '"'):
+            end = sql_text.find(ch, i + 1)
+            while end != -1 and sql_text.startswith(ch * 2, end):
+                end = sql_text.find(ch, end + 2)
+            i = n if end == -1 else end + 1
+        elif ch == "(":
+            depth += 1; i += 1
+        elif ch == ")":
+            depth -= 1; i += 1
+        elif ch == ";" and depth == 0:
+            return words, i
+        elif ch.isalpha() or ch == "_":
+            start = i
+            while i < n and (sql_text[i].isalnum() or sql_text[i] in "_$"):
+                i += 1
+            if depth == 0:
+                words.append((sql_text[start:i].upper(), start))
+        else:
+            i += 1
+    return words, None
+
+
+def _strip_ident_quotes(name: str) -> str:
+    return name.replace('"', '')
+
+
+def collect_session_tables(statement_texts: List[str]) -> List[str]:
+    """任务中 CREATE TEMPORARY TABLE 创建的表名 (按出现顺序，去重)。"""
+    names: List[str] = []
+    for text in statement_texts:
+        for match in _CREATE_TEMP_RE.finditer(text):
+            name = _strip_ident_quotes(match.group("name"))
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def parse_chunkable_update(sql_text: str) -> Optional[Dict[str, Any]]:
+    """
+    可拆分的 UPDATE -> {"key_ref": 目标表别名或表名, "where_pos": 顶层 WHERE 位置或 None, "end_pos": 语句结束位置}；
+    不是 UPDATE 或带顶层 WITH 时返回 None。
+    """
+    words, semicolon_pos = _scan_top_level(sql_text)
+    if not words or words[0][0] != "UPDATE":
+        return None
+    match = _UPDATE_TARGET_RE.match(sql_text, words[0][1])
+    if not match:
+        return None
+    where_positions = [pos for word, pos in words if word == "WHERE"]
+    return {"key_ref": match.group("alias") or match.group("table"),
+            "where_pos": where_positions[0] if where_positions else None,
+            "end_pos": semicolon_pos if semicolon_pos is not None else len(sql_text.rstrip())}
+
+
+def build_key_range_predicate(key_ref: str, key_column: str, lower: Optional[int], upper: Optional[int]) -> Optional[str]:
+    """键范围 [lower, upper)；第一块 (lower 为 None) 同时包含键为 NULL 的行。键值只接受整数。"""
+    key_expr = f'{key_ref}."{key_column}"'
+    parts = []
+    if lower is not None:
+        parts.append(f"{key_expr} >= {int(lower)}")
+    if upper is not None:
+        parts.append(f"{key_expr} < {int(upper)}")
+    if not parts:
+        return None
+    predicate = " AND ".join(parts)
+    return f"({predicate} OR {key_expr} IS NULL)" if lower is None else predicate
+
+
+def add_key_range_to_update(sql_text: str, parsed_update: Dict[str, Any], key_column: str,
+                            lower: Optional[int], upper: Optional[int]) -> str:
+    """在 UPDATE 的顶层 WHERE 上追加键范围条件 (原条件整体加括号，避免与 OR 的优先级问题)。"""
+    predicate = build_key_range_predicate(parsed_update["key_ref"], key_column, lower, upper)
+    body = sql_text[:parsed_update["end_pos"]].rstrip()
+    if predicate is None:
+        return body + ";"
+    where_pos = parsed_update["where_pos"]
+    if where_pos is None:
+        return f"{body}\nWHERE {predicate};"
+    condition_start = where_pos + len("WHERE")
+    return f"{body[:condition_start]} (\n{body[condition_start:]}\n) AND {predicate};"
+
+
+def classify_job_statement(sql_text: str, session_tables: List[str]) -> str:
+    words, _ = _scan_top_level(sql_text)
+    if not words:
+        return STATEMENT_KIND_SESSION
+    if _CREATE_TEMP_RE.match(sql_text, words[0][1]):
+        return STATEMENT_KIND_SESSION
+    if words[0][0] in ("DROP", "ANALYZE", "CREATE") and session_tables:
+        referenced = {_strip_ident_quotes(m) for m in re.findall(r'"[^"]+"|\w+', sql_text)}
+        if referenced & set(session_tables):
+            return STATEMENT_KIND_SESSION
+    if parse_chunkable_update(sql_text):
+        return STATEMENT_KIND_UPDATE
+    return STATEMENT_KIND_DURABLE
+
+
+def normalize_session_table_names(statement_texts: List[str]) -> List[str]:
+    """把临时表名按出现顺序替换为占位符 (合并任务的临时表名带时间戳，不应影响任务标识)。"""
+    session_tables = collect_session_tables(statement_texts)
+    normalized = []
+    for text in statement_texts:
+        for idx, name in enumerate(session_tables):
+            text = re.sub(rf'"?\b{re.escape(name)}\b"?', f"__session_table_{idx}__", text)
+        normalized.append(text)
+    return normalized
+
+
+def compute_job_key(target_table: str, statement_texts: List[str], chunk_size: int) -> str:
+    """任务标识: 目标表 + 语句 (临时表名已规范化) + 块大小的哈希。"""
+    digest = hashlib.sha1(f"{target_table}|{chunk_size}".encode("utf-8"))
+    for text in normalize_session_table_names(statement_texts):
+        digest.update(b"\x00" + text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def chunk_ranges(lower_bounds: List[int]) -> List[Tuple[Optional[int], Optional[int]]]:
+    """每块起始键 (升序) -> [(lower, upper)]；首块下界与末块上界不限。"""
+    if len(lower_bounds) <= 1:
+        return [(None, None)]
+    ranges: List[Tuple[Optional[int], Optional[int]]] = [(None, lower_bounds[1])]
+    for idx in range(1, len(lower_bounds) - 1):
+        ranges.append((lower_bounds[idx], lower_bounds[idx + 1]))
+    ranges.append((lower_bounds[-1], None))
+    return ranges
+
+
+def build_chunk_bounds_sql(target_schema: str, target_table: str, chunk_size: int,
+                           key_column: str = DEFAULT_CHUNK_KEY_COLUMN) -> Any:
+    """目标表中每 chunk_size 个不同键取一个作为块起始键。"""
+    return pgsql.SQL(
+        "SELECT k FROM (SELECT k, ROW_NUMBER() OVER (ORDER BY k) AS rn "
+        "FROM (SELECT DISTINCT {key} AS k FROM {table} WHERE {key} IS NOT NULL) d) numbered "
+        "WHERE (rn - 1) % {size} = 0 ORDER BY k"
+    ).format(key=pgsql.Identifier(key_column), table=pgsql.Identifier(target_schema, target_table),
+             size=pgsql.Literal(max(1, int(chunk_size))))
+
+
+def _journal_ident() -> Any:
+    return pgsql.Identifier(CHUNK_JOURNAL_SCHEMA, CHUNK_JOURNAL_TABLE)
+
+
+def build_chunk_journal_table_sql() -> Any:
+    return pgsql.SQL(
+        "CREATE SCHEMA IF NOT EXISTS {schema}; "
+        "CREATE TABLE IF NOT EXISTS {journal} (job_key TEXT NOT NULL, target_table TEXT, step_index INTEGER NOT NULL, "
+        "chunk_index INTEGER NOT NULL, completed_at TIMESTAMPTZ NOT NULL DEFAULT now(), "
+        "PRIMARY KEY (job_key, step_index, chunk_index));"
+    ).format(schema=pgsql.Identifier(CHUNK_JOURNAL_SCHEMA), journal=_journal_ident())
+
+
+def build_journal_select_sql() -> Any:
+    return pgsql.SQL("SELECT step_index, chunk_index FROM {} WHERE job_key = %s").format(_journal_ident())
+
+
+def build_journal_insert_sql() -> Any:
+    return pgsql.SQL("INSERT INTO {} (job_key, target_table, step_index, chunk_index) VALUES (%s, %s, %s, %s) "
+                     "ON CONFLICT DO NOTHING").format(_journal_ident())
+
+
+def build_journal_clear_sql() -> Any:
+    return pgsql.SQL("DELETE FROM {} WHERE job_key = %s").format(_journal_ident())
+
+
+def plan_chunked_job(statement_texts: List[str]) -> List[Dict[str, Any]]:
+    session_tables = collect_session_tables(statement_texts)
+    plan = []
+    for idx, text in enumerate(statement_texts):
+        kind = classify_job_statement(text, session_tables)
+        plan.append({"index": idx, "kind": kind, "sql": text,
+                     "update": parse_chunkable_update(text) if kind == STATEMENT_KIND_UPDATE else None})
+    return plan
+
+
+def pending_units(plan: List[Dict[str, Any]], ranges: List[Tuple[Optional[int], Optional[int]]],
+                  completed: Set[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    需要执行的 (语句序号, 块编号) 列表，按执行顺序。会话级语句只要其后仍有未完成的持久语句/块就重新执行。
+    """
+    units: List[Tuple[int, int]] = []
+    for step in plan:
+        idx = step["index"]
+        if step["kind"] == STATEMENT_KIND_UPDATE:
+            units.extend((idx, c) for c in range(len(ranges)) if (idx, c) not in completed)
+        elif step["kind"] == STATEMENT_KIND_DURABLE:
+            if (idx, WHOLE_STATEMENT_CHUNK_INDEX) not in completed:
+                units.append((idx, WHOLE_STATEMENT_CHUNK_INDEX))
+    needed_after = {}
+    has_pending_after = False
+    pending_steps = {idx for idx, _ in units}
+    for step in reversed(plan):
+        needed_after[step["index"]] = has_pending_after
+        if step["index"] in pending_steps:
+            has_pending_after = True
+    ordered: List[Tuple[int, int]] = []
+    for step in plan:
+        idx = step["index"]
+        if step["kind"] == STATEMENT_KIND_SESSION:
+            if needed_after[idx]:
+                ordered.append((idx, WHOLE_STATEMENT_CHUNK_INDEX))
+        else:
+            ordered.extend(u for u in units if u[0] == idx)
+    return ordered
+
+
+def run_chunked_job(conn: Any, statement_texts: List[str], target_schema: str, target_table: str, chunk_size: int,
+                    log: Callable[[str], None], progress: Callable[[int, int], None],
+                    is_cancelled: Callable[[], bool], router: Any = None) -> None:
+    """
+    在已打开的连接上分块执行任务 (conn.autocommit 须为 False)。每个块、每条持久语句单独提交并写检查点；
+    全部完成后删除该任务的检查点。取消时抛出 InterruptedError，已提交的块保留，下次运行自动续做。
+    router (ReplicaRouter) 非空时，会话级的临时表物化语句优先在只读副本上计算。
+    """
+    cur = conn.cursor()
+    cur.execute(build_chunk_journal_table_sql())
+    conn.commit()
+    job_key = compute_job_key(f"{target_schema}.{target_table}", statement_texts, chunk_size)
+    cur.execute(build_journal_select_sql(), (job_key,))
+    completed = {(row[0], row[1]) for row in cur.fetchall()}
+    cur.execute(build_chunk_bounds_sql(target_schema, target_table, chunk_size))
+    ranges = chunk_ranges([row[0] for row in cur.fetchall()])
+    plan = plan_chunked_job(statement_texts)
+    units = pending_units(plan, ranges, completed)
+    if completed:
+        log(f"发现未完成任务的检查点: 已完成 {len(completed)} 个块/语句，从断点继续。")
+    log(f"分块执行: 每块 {chunk_size} 个 hadm_id，共 {len(ranges)} 块，待执行 {len(units)} 个单元。")
+
+    total_units = len(units)
+    progress(0, total_units)
+    for done, (step_index, chunk_index) in enumerate(units, start=1):
+        if is_cancelled():
+            raise InterruptedError("操作已取消，已完成的块已保存，可再次运行以继续。")
+        step = plan[step_index]
+        if chunk_index == WHOLE_STATEMENT_CHUNK_INDEX:
+            sql_text = step["sql"]
+            unit_desc = f"语句 {step_index + 1}/{len(plan)}"
+        else:
+            lower, upper = ranges[chunk_index]
+            sql_text = add_key_range_to_update(step["sql"], step["update"], DEFAULT_CHUNK_KEY_COLUMN, lower, upper)
+            unit_desc = f"语句 {step_index + 1}/{len(plan)} 块 {chunk_index + 1}/{len(ranges)}"
+        start_time = time.time()
+        if not (router and step["kind"] == STATEMENT_KIND_SESSION and router.try_materialize(cur, sql_text)):
+            cur.execute(sql_text)
+        rowcount = cur.rowcount
+        if step["kind"] != STATEMENT_KIND_SESSION:
+            cur.execute(build_journal_insert_sql(), (job_key, f"{target_schema}.{target_table}", step_index, chunk_index))
+        conn.commit()
+        row_info = f"，影响 {rowcount} 行" if rowcount is not None and rowcount >= 0 and step["kind"] == STATEMENT_KIND_UPDATE else ""
+        log(f"{unit_desc} 完成 (耗时: {time.time() - start_time:.2f} 秒{row_info})。")
+        progress(done, total_units)
+
+    cur.execute(build_journal_clear_sql(), (job_key,))
+    conn.commit()
+    log("分块任务全部完成，检查点已清除。")
+
+# --- END OF FILE sql_logic/chunked_update.py ---
@@ -0,0 +1,105 @@
+# --- START OF FILE sql_logic/column_provenance.py ---
+import psycopg2.sql as pgsql
+
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sql_logic.job_history import compute_config_hash
+
+# 列来源记录 (provenance): 队列表中每个派生列由哪份配置 (配置哈希) 在哪个队列行集版本上计算得到。
+# 再次运行相同配方时，配置哈希与行集版本都一致、且列仍存在的特征直接跳过，只重算过期的特征。
+# 行集版本 = 行数 + 全部 hadm_id (排序后) 的 md5；队列表被重建或增删行后版本随之变化。
+# 源数据表 (MIMIC 原始表) 视为只读，不参与版本计算。
+
+PROVENANCE_SCHEMA = "mimiciv_data"
+PROVENANCE_TABLE = "column_provenance"
+COHORT_VERSION_KEY_COLUMN = "hadm_id"
+
+
+def _provenance_ident() -> Any:
+    return pgsql.Identifier(PROVENANCE_SCHEMA, PROVENANCE_TABLE)
+
+
+def build_provenance_table_sql() -> Any:
+    return pgsql.SQL(
+        "CREATE SCHEMA IF NOT EXISTS {schema}; "
+        "CREATE TABLE IF NOT EXISTS {table} (cohort_schema TEXT NOT NULL, cohort_table TEXT NOT NULL, "
+        "column_name TEXT NOT NULL, feature TEXT, config_hash TEXT NOT NULL, cohort_version TEXT NOT NULL, "
+        "computed_at TIMESTAMPTZ NOT NULL DEFAULT now(), PRIMARY KEY (cohort_schema, cohort_table, column_name));"
+    ).format(schema=pgsql.Identifier(PROVENANCE_SCHEMA), table=_provenance_ident())
+
+
+def build_cohort_version_sql(cohort_schema: str, cohort_table: str,
+                             key_column: str = COHORT_VERSION_KEY_COLUMN) -> Any:
+    """队列表行集版本 (单行单列文本)。队列表通常只有数千到数万行，一次扫描的代价可以忽略。"""
+    return pgsql.SQL(
+        "SELECT COUNT(*)::text || ':' || md5(COALESCE(string_agg({key}::text, ',' ORDER BY {key}), '')) FROM {table}"
+    ).format(key=pgsql.Identifier(key_column), table=pgsql.Identifier(cohort_schema, cohort_table))
+
+
+def build_provenance_select_sql() -> Any:
+    """已记录且仍存在于队列表中的列: (column_name, config_hash, cohort_version)。参数: (schema, table)。"""
+    return pgsql.SQL(
+        "SELECT p.column_name, p.config_hash, p.cohort_version FROM {table} p "
+        "JOIN information_schema.columns c ON c.table_schema = p.cohort_schema AND c.table_name = p.cohort_table "
+        "AND c.column_name = p.column_name WHERE p.cohort_schema = %s AND p.cohort_table = %s"
+    ).format(table=_provenance_ident())
+
+
+def build_provenance_upsert_sql() -> Any:
+    """参数: (cohort_schema, cohort_table, column_name, feature, config_hash, cohort_version)。"""
+    return pgsql.SQL(
+        "INSERT INTO {table} (cohort_schema, cohort_table, column_name, feature, config_hash, cohort_version) "
+        "VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (cohort_schema, cohort_table, column_name) DO UPDATE SET "
+        "feature = EXCLUDED.feature, config_hash = EXCLUDED.config_hash, "
+        "cohort_version = EXCLUDED.cohort_version, computed_at = now()"
+    ).format(table=_provenance_ident())
+
+
+def compute_feature_config_hash(statement_texts: List[str]) -> str:
+    """特征配置哈希: 生成该特征的全部语句 (临时表名规范化后)。"""
+    return compute_config_hash(statement_texts)
+
+
+def find_stale_features(features: List[Tuple[str, List[str], str]], recorded: Dict[str, Tuple[str, str]],
+                        cohort_version: str) -> List[str]:
+    """
+    features: [(feature_key, column_names, config_hash)]；recorded: {column_name: (config_hash, cohort_version)}。
+    任一列缺少记录、配置哈希或行集版本不同，该特征即过期。返回过期特征的 key (保持原顺序)。
+    """
+    stale = []
+    for feature_key, column_names, config_hash in features:
+        if not column_names or any(recorded.get(col) != (config_hash, cohort_version) for col in column_names):
+            stale.append(feature_key)
+    return stale
+
+
+def fetch_cohort_version(cursor: Any, cohort_schema: str, cohort_table: str) -> str:
+    cursor.execute(build_cohort_version_sql(cohort_schema, cohort_table))
+    return cursor.fetchone()[0]
+
+
+def fetch_recorded_provenance(cursor: Any, cohort_schema: str, cohort_table: str) -> Dict[str, Tuple[str, str]]:
+    cursor.execute(build_provenance_select_sql(), (cohort_schema, cohort_table))
+    return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+
+def check_stale_features(conn: Any, cohort_schema: str, cohort_table: str,
+                         features: List[Tuple[str, List[str], str]]) -> Tuple[str, Set[str]]:
+    """建表 (如需) 并提交，返回 (当前行集版本, 过期特征 key 集合)。conn.autocommit 须为 False。"""
+    cur = conn.cursor()
+    cur.execute(build_provenance_table_sql())
+    conn.commit()
+    cohort_version = fetch_cohort_version(cur, cohort_schema, cohort_table)
+    recorded = fetch_recorded_provenance(cur, cohort_schema, cohort_table)
+    conn.commit()
+    return cohort_version, set(find_stale_features(features, recorded, cohort_version))
+
+
+def record_provenance(cursor: Any, cohort_schema: str, cohort_table: str, column_names: List[str],
+                      feature: Optional[str], config_hash: str, cohort_version: str) -> None:
+    """在调用方的事务中写入/更新来源记录，与特征列的计算一同提交。"""
+    for column_name in column_names:
+        cursor.execute(build_provenance_upsert_sql(),
+                       (cohort_schema, cohort_table, column_name, feature, config_hash, cohort_version))
+
+# --- END OF FILE sql_logic/column_provenance.py ---
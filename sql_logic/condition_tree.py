@@ -0,0 +1,199 @@
+# --- START OF FILE sql_logic/condition_tree.py ---
+import decimal
+import psycopg2.sql as pgsql
+
+from typing import Any, Dict, List, Optional, Tuple
+from sql_logic.sql_render import render_sql
+from sql_logic.db_backend import connect_database, DATABASE_ERRORS
+
+# 条件树 (ConditionGroupWidget 的结构化表示，纯数据，不依赖界面和数据库连接):
+#   关键词节点: {"type": "keyword", "field": 列名, "op": "包含"/"排除"/"等于"/..., "value": 输入文本}
+#   条件组节点: {"type": "group", "logic": "AND"/"OR", "children": [节点, ...]}
+# compile_condition_tree 把树编译为 psycopg2.sql 对象 + 参数列表 (值一律走 %s 参数)，
+# build_condition_sql 再用 sql_render 渲染为文本模板，供各面板拼接到查询中。
+#
+# 列类型 (column_types: {列名: information_schema.columns.data_type}) 已知时按真实类型生成原生谓词，
+# 不再包一层 CAST(... AS TEXT)，列上的索引才可用:
+#   - 整数/小数列的比较直接使用 int / Decimal 参数 (float 参数会让整数列被隐式转换为 double，索引失效)；
+#   - 文本列的 等于/不等于 为原生比较；以 % 或 * 结尾的值视为前缀搜索 (如 I21%)，生成区分大小写的 LIKE 'I21%'，
+#     可由 text_pattern_ops (或 C 排序规则) 的 btree 索引转换为范围扫描；
+#   - 只有真正的子串搜索才使用 ILIKE '%值%'，可由 pg_trgm 的 gin_trgm_ops 索引支持；
+#   - 日期/时间等其他类型的比较直接与参数比较，由 PostgreSQL 按列类型解析字面量。
+# 列类型未知 (未连接数据库或查询失败) 时沿用按列名推测数值列的旧规则。
+
+NODE_KEYWORD = "keyword"
+NODE_GROUP = "group"
+
+CONDITION_LOGIC_OPERATORS = ("AND", "OR")
+COMPARISON_OPERATORS = {"等于": "=", "不等于": "!=", "大于": ">", "小于": "<", "大于等于": ">=", "小于等于": "<="}
+_NUMERIC_FIELD_HINTS = ("id", "version", "count", "age", "num")
+_PREFIX_WILDCARDS = ("%", "*")
+
+TYPE_CATEGORY_INTEGER = "integer"
+TYPE_CATEGORY_DECIMAL = "decimal"
+TYPE_CATEGORY_FLOAT = "float"
+TYPE_CATEGORY_TEXT = "text"
+TYPE_CATEGORY_OTHER = "other"
+_TYPE_CATEGORIES = {
+    "smallint": TYPE_CATEGORY_INTEGER, "integer": TYPE_CATEGORY_INTEGER, "bigint": TYPE_CATEGORY_INTEGER,
+    "numeric": TYPE_CATEGORY_DECIMAL, "decimal": TYPE_CATEGORY_DECIMAL,
+    "real": TYPE_CATEGORY_FLOAT, "double precision": TYPE_CATEGORY_FLOAT,
+    "text": TYPE_CATEGORY_TEXT, "character varying": TYPE_CATEGORY_TEXT, "character": TYPE_CATEGORY_TEXT,
+    "varchar": TYPE_CATEGORY_TEXT, "char": TYPE_CATEGORY_TEXT,
+}
+
+# (数据库标识, 表全名) -> {列名: data_type}；字典表结构在会话内不会变化，每个表只查询一次
+_COLUMN_TYPE_CACHE: Dict[Tuple[Any, str], Dict[str, str]] = {}
+
+
+def make_keyword_node(field: Optional[str], op: str, value: str) -> Dict[str, Any]:
+    return {"type": NODE_KEYWORD, "field": field, "op": op, "value": value}
+
+
+def make_group_node(logic: str, children: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"type": NODE_GROUP, "logic": logic if logic in CONDITION_LOGIC_OPERATORS else "AND", "children": children}
+
+
+def is_numeric_field_name(field: str) -> bool:
+    """按列名推测是否为数值列 (如 itemid、seq_num)。"""
+    lowered = field.lower()
+    return any(hint in lowered for hint in _NUMERIC_FIELD_HINTS)
+
+
+def column_type_category(data_type: Optional[str]) -> Optional[str]:
+    """information_schema 的 data_type -> 类型类别；None 表示类型未知。"""
+    if not data_type:
+        return None
+    return _TYPE_CATEGORIES.get(data_type.strip().lower(), TYPE_CATEGORY_OTHER)
+
+
+def prefix_like_pattern(value: str) -> Optional[str]:
+    """'I21%' / 'I21*' -> LIKE 模式 'I21%' (前缀中的 _ 与反斜杠被转义)；不是前缀搜索时返回 None。"""
+    if len(value) < 2 or value[-1] not in _PREFIX_WILDCARDS:
+        return None
+    prefix = value[:-1]
+    if any(wildcard in prefix for wildcard in _PREFIX_WILDCARDS):
+        return None
+    return prefix.replace("\\", "\\\\").replace("_", "\\_") + "%"
+
+
+def _numeric_param(value: str, category: str) -> Optional[Any]:
+    """按列类型转换比较参数，使参数类型与列一致；无法转换时返回 None。"""
+    try:
+        if category == TYPE_CATEGORY_INTEGER:
+            number = decimal.Decimal(value)
+            return int(number) if number == number.to_integral_value() else float(number)
+        if category == TYPE_CATEGORY_DECIMAL:
+            number = decimal.Decimal(value)
+            return number if number.is_finite() else None
+        return float(value)
+    except (decimal.InvalidOperation, ValueError):
+        return None
+
+
+def _compile_keyword(node: Dict[str, Any], column_types: Optional[Dict[str, str]] = None) -> Tuple[Optional[Any], List[Any]]:
+    field, op = node.get("field"), node.get("op")
+    value = (node.get("value") or "").strip()
+    if not field or not value:
+        return None, []
+    field_ident = pgsql.Identifier(field)
+    category = column_type_category((column_types or {}).get(field))
+    prefix_pattern = prefix_like_pattern(value)
+    if op in ("包含", "排除"):
+        negation = pgsql.SQL("NOT " if op == "排除" else "")
+        if category == TYPE_CATEGORY_TEXT:
+            if prefix_pattern is not None:
+                return pgsql.SQL("{fld} {neg}LIKE %s").format(fld=field_ident, neg=negation), [prefix_pattern]
+            return pgsql.SQL("{fld} {neg}ILIKE %s").format(fld=field_ident, neg=negation), [f"%{value}%"]
+        pattern = prefix_pattern if prefix_pattern is not None else f"%{value}%"
+        return pgsql.SQL("CAST({fld} AS TEXT) {neg}ILIKE %s").format(fld=field_ident, neg=negation), [pattern]
+    if op in COMPARISON_OPERATORS:
+        sql_op = pgsql.SQL(COMPARISON_OPERATORS[op])
+        native_sql = pgsql.SQL("{identifier} {operator} %s").format(identifier=field_ident, operator=sql_op)
+        if category in (TYPE_CATEGORY_INTEGER, TYPE_CATEGORY_DECIMAL, TYPE_CATEGORY_FLOAT):
+            param = _numeric_param(value, category)
+            if param is not None:
+                return native_sql, [param]
+        elif category == TYPE_CATEGORY_TEXT:
+            if prefix_pattern is not None and op in ("等于", "不等于"):
+                negation = pgsql.SQL("NOT " if op == "不等于" else "")
+                return pgsql.SQL("{fld} {neg}LIKE %s").format(fld=field_ident, neg=negation), [prefix_pattern]
+            return native_sql, [value]
+        elif category == TYPE_CATEGORY_OTHER:
+            return native_sql, [value]
+        elif is_numeric_field_name(field):
+            try:
+                return native_sql, [float(value)]
+            except ValueError:
+                pass
+        return pgsql.SQL("CAST({identifier} AS TEXT) {operator} %s").format(identifier=field_ident, operator=sql_op), [value]
+    return None, []
+
+
+def compile_condition_tree(node: Dict[str, Any],
+                           column_types: Optional[Dict[str, str]] = None) -> Tuple[Optional[Any], List[Any]]:
+    """条件树 -> (psycopg2.sql 对象或 None, 参数列表)。空输入的关键词和空组被忽略。"""
+    if node.get("type") == NODE_KEYWORD:
+        return _compile_keyword(node, column_types)
+    parts, params = [], []
+    for child in node.get("children", []):
+        child_sql, child_params = compile_condition_tree(child, column_types)
+        if child_sql is None:
+            continue
+        parts.append(pgsql.SQL("({})").format(child_sql) if child.get("type") == NODE_GROUP else child_sql)
+        params.extend(child_params)
+    if not parts:
+        return None, []
+    logic = node.get("logic") if node.get("logic") in CONDITION_LOGIC_OPERATORS else "AND"
+    return pgsql.SQL(f" {logic} ").join(parts), params
+
+
+def build_condition_sql(node: Dict[str, Any], column_types: Optional[Dict[str, str]] = None) -> Tuple[str, List[Any]]:
+    """条件树 -> (含 %s 占位符的 SQL 文本, 参数列表)；没有有效条件时返回 ("", [])。"""
+    condition_sql, params = compile_condition_tree(node, column_types)
+    if condition_sql is None:
+        return "", []
+    return render_sql(condition_sql), params
+
+
+def build_column_types_sql() -> Any:
+    """参数: (schema, table)。返回 (column_name, data_type)。"""
+    return pgsql.SQL("SELECT column_name, data_type FROM information_schema.columns "
+                     "WHERE table_schema = %s AND table_name = %s")
+
+
+def fetch_column_types(cursor: Any, table_full_name: str) -> Dict[str, str]:
+    schema, _, table = table_full_name.rpartition(".")
+    cursor.execute(build_column_types_sql(), (schema or "public", table))
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+def _db_cache_key(db_params: Dict[str, Any]) -> Tuple[Any, ...]:
+    return tuple(sorted((k, str(v)) for k, v in db_params.items() if k != "password"))
+
+
+def get_cached_column_types(db_params: Optional[Dict[str, Any]], table_full_name: Optional[str]) -> Dict[str, str]:
+    """
+    表的列类型 (按数据库连接参数与表名缓存)。未配置连接或查询失败时返回 {}，
+    此时条件编译退回按列名推测的规则，失败结果不缓存，下次仍会重试。
+    """
+    if not db_params or not table_full_name:
+        return {}
+    key = (_db_cache_key(db_params), table_full_name)
+    if key not in _COLUMN_TYPE_CACHE:
+        conn = None
+        try:
+            conn = connect_database(db_params)
+            column_types = fetch_column_types(conn.cursor(), table_full_name)
+        except DATABASE_ERRORS as e:
+            print(f"Error fetching column types for {table_full_name}: {e}")
+            return {}
+        finally:
+            if conn:
+                conn.close()
+        if not column_types:
+            return {}
+        _COLUMN_TYPE_CACHE[key] = column_types
+    return dict(_COLUMN_TYPE_CACHE[key])
+
+# --- END OF FILE sql_logic/condition_tree.py ---
@@ -0,0 +1,428 @@
+# --- START OF FILE sql_logic/db_backend.py ---
+import csv
+import glob
+import os
+import re
+import time
+import psycopg2
+import psycopg2.extensions
+
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from sql_logic.sql_render import render_sql, quote_literal
+from app_config import MIMIC_MODULE_SCHEMAS, PARQUET_PARTITION_COLUMN, DB_EXPORT_FETCH_ROWS
+
+try:
+    import duckdb
+except ImportError:  # 可选依赖: 只有选择本地 DuckDB 后端时才需要
+    duckdb = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # 可选依赖: 只有导出 Parquet 时才需要
+    pyarrow = None
+
+# 执行后端: 默认是 PostgreSQL (psycopg2)；本地后端用嵌入式 DuckDB 直接查询 MIMIC-IV 的 Parquet (或 CSV.gz) 文件，
+# 不需要数据库服务器。除数据导出页的抽样预览与无主键分页 (TABLESAMPLE、ctid 写法不同，见 sql_builder_preview) 外，
+# 各 SQL 构建器不为本地后端单独生成语句，由 DuckDBConnection 以 psycopg2 连接的接口执行:
+#   - %s 占位符转换为 ?，%% 还原为 %；一次 execute 中的多条语句按引号/注释安全地拆分，参数按顺序分配；
+#   - 一条 ALTER TABLE 中的多个动作 (ADD COLUMN ..., ADD COLUMN ...) 拆成多条执行；
+#   - 只对 PostgreSQL 有意义的语句 (SET 会话参数、ANALYZE、VACUUM、CREATE INDEX) 直接跳过:
+#     列式引擎按列扫描并使用 Parquet 行组统计跳过数据，不需要也不适合在临时结果上建 B-tree 索引；
+#   - 有直接等价物的 PostgreSQL 专有函数与类型在引号之外改写 (translate_for_duckdb):
+#     date_bin -> time_bucket (时间分箱模式，同样按起点对齐)，to_jsonb -> to_json、JSONB -> JSON (窄表特征库)；
+#   - autocommit = False 时与 psycopg2 相同，第一条语句隐式开始事务，commit()/rollback() 结束；
+#   - cancel() 中断正在执行的查询，抛出与 PostgreSQL 取消相同的 QueryCanceledError。
+# 目录结构: <本地数据目录>/<模块>/<表>/**/*.parquet (分区目录 part_bucket=N)、<表>.parquet 或 <表>.csv.gz，
+# 模块 hosp / icu 分别注册为 mimiciv_hosp / mimiciv_icu schema 下的视图；派生表 (mimiciv_data) 保存在本地数据库文件中。
+# 没有等价物的功能在本地后端不可用: TIMESERIES_JSON 聚合 (JSONB_AGG 的有序聚合，专项数据页在构建 SQL 时拒绝)、
+# 任务历史中的 pg_stat_database 统计 (不记录)、只读副本路由 (连接页的副本设置被忽略)。
+
+BACKEND_POSTGRES = "postgres"
+BACKEND_DUCKDB = "duckdb"
+
+DATABASE_ERRORS: Tuple[type, ...] = (psycopg2.Error,) + ((duckdb.Error,) if duckdb is not None else ())
+
+_PG_ONLY_STATEMENT_RE = re.compile(r"^\s*(SET|RESET|ANALYZE|VACUUM|CREATE\s+(UNIQUE\s+)?INDEX)\b", re.IGNORECASE)
+_ROWCOUNT_STATEMENT_RE = re.compile(r"^\s*(INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+_PLACEHOLDER_RE = re.compile(r"%(%|s)")
+_DUCKDB_REWRITES = ((re.compile(r"\bdate_bin\s*\(", re.IGNORECASE), "time_bucket("),
+                    (re.compile(r"\bto_jsonb\s*\(", re.IGNORECASE), "to_json("),
+                    (re.compile(r"\bjsonb\b", re.IGNORECASE), "JSON"))
+_SQL_NAME = r'(?:"(?:[^"]|"")*"|\w+)'
+_ALTER_TABLE_RE = re.compile(rf"^\s*(ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?{_SQL_NAME}(?:\.{_SQL_NAME})*)\s+(.*)$",
+                             re.IGNORECASE | re.DOTALL)
+
+
+def is_duckdb_available() -> bool:
+    return duckdb is not None
+
+
+def backend_of(db_params: Optional[Dict[str, Any]]) -> str:
+    return (db_params or {}).get("backend") or BACKEND_POSTGRES
+
+
+def connect_database(db_params: Dict[str, Any], **pg_kwargs: Any) -> Any:
+    """按连接参数中的 backend 打开连接；PostgreSQL 的额外参数 (如 connection_factory) 对本地后端无效。"""
+    if backend_of(db_params) == BACKEND_DUCKDB:
+        return connect_duckdb(db_params.get("local_data_dir"), db_params.get("database_path"), db_params.get("threads"))
+    return psycopg2.connect(**db_params, **pg_kwargs)
+
+
+def split_sql_statements(sql_text: str) -> List[str]:
+    """按分号拆分语句 (忽略单引号字符串、双引号标识符和 -- 注释中的分号)，去掉空语句。"""
+    statements, current, i, length = [], [], 0, len(sql_text)
+    while i < length:
+        char = sql_text[i]
+        if char in ("'", '"'):
+            end = i + 1
+            while end < length:
+                if sql_text[end] == char:
+                    if end + 1 < length and sql_text[end + 1] == char:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            current.append(sql_text[i:end + 1])
+            i = end + 1
+            continue
+        if char == "-" and sql_text.startswith("--", i):
+            end = sql_text.find("\n", i)
+            end = length if end == -1 else end
+            current.append(sql_text[i:end])
+            i = end
+            continue
+        if char == ";":
+            statements.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    statements.append("".join(current))
+    return [s.strip() for s in statements if s.strip() and not all(line.strip().startswith("--") or not line.strip()
+                                                                 for line in s.strip().splitlines())]
+
+
+def _split_top_level_commas(text: str) -> List[str]:
+    parts, depth, quote, start = [], 0, None, 0
+    for i, char in enumerate(text):
+        if quote:
+            quote = None if char == quote else quote
+        elif char in ("'", '"'):
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append(text[start:i].strip())
+            start = i + 1
+    parts.append(text[start:].strip())
+    return parts
+
+
+def split_alter_table_actions(statement: str) -> List[str]:
+    """ALTER TABLE t ADD COLUMN a ..., ADD COLUMN b ... -> 每个动作一条语句 (DuckDB 每条 ALTER 只支持一个动作)。"""
+    match = _ALTER_TABLE_RE.match(statement)
+    if not match:
+        return [statement]
+    actions = _split_top_level_commas(match.group(2))
+    return [f"{match.group(1)} {action}" for action in actions] if len(actions) > 1 else [statement]
+
+
+def prepare_statements(sql_text: str, params: Optional[Sequence[Any]]) -> List[Tuple[str, Optional[List[Any]]]]:
+    """psycopg2 风格的 SQL 文本 + 参数 -> [(单条语句, 该语句的参数)]。没有参数时与 psycopg2 一样不处理 %。"""
+    if params is None:
+        return [(statement, None) for statement in split_sql_statements(sql_text)]
+    remaining = list(params)
+    prepared = []
+    for statement in split_sql_statements(sql_text):
+        count = sum(1 for m in _PLACEHOLDER_RE.finditer(statement) if m.group(1) == "s")
+        prepared.append((statement, remaining[:count]))
+        remaining = remaining[count:]
+    if remaining:
+        raise ValueError(f"参数个数多于 SQL 中的占位符 (多出 {len(remaining)} 个)。")
+    return prepared
+
+
+def to_duckdb_placeholders(statement: str) -> str:
+    """%s -> ?，%% -> % (只用于带参数的语句)。"""
+    return _PLACEHOLDER_RE.sub(lambda m: "%" if m.group(1) == "%" else "?", statement)
+
+
+def translate_for_duckdb(statement: str) -> str:
+    """PostgreSQL 专有函数/类型 -> DuckDB 等价物；单引号字符串和双引号标识符内的文本不变。"""
+    parts, i, length = [], 0, len(statement)
+    while i < length:
+        quote_start = min((pos for pos in (statement.find("'", i), statement.find('"', i)) if pos != -1), default=length)
+        code = statement[i:quote_start]
+        for pattern, replacement in _DUCKDB_REWRITES:
+            code = pattern.sub(replacement, code)
+        parts.append(code)
+        if quote_start == length:
+            break
+        quote_char, end = statement[quote_start], quote_start + 1
+        while end < length:
+            if statement[end] == quote_char:
+                if end + 1 < length and statement[end + 1] == quote_char:
+                    end += 2
+                    continue
+                break
+            end += 1
+        parts.append(statement[quote_start:end + 1])
+        i = end + 1
+    return "".join(parts)
+
+
+def inline_sql_params(sql_text: str, params: Optional[Sequence[Any]]) -> str:
+    """把参数以字面量形式嵌入 SQL 文本 (相当于 psycopg2 的 mogrify)，用于日志与配置哈希。"""
+    if params is None:
+        return sql_text
+    values = iter(params)
+    return _PLACEHOLDER_RE.sub(lambda m: "%" if m.group(1) == "%" else quote_literal(next(values)), sql_text)
+
+
+class DuckDBCursor:
+    """psycopg2 游标接口的子集: execute / fetch* / description / rowcount / mogrify。"""
+
+    def __init__(self, connection: "DuckDBConnection"):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self.closed = False
+        self._rows: Optional[List[Tuple[Any, ...]]] = None
+
+    def execute(self, query: Any, params: Optional[Sequence[Any]] = None) -> None:
+        sql_text = render_sql(query)
+        self.description, self.rowcount, self._rows = None, -1, None
+        for statement, statement_params in prepare_statements(sql_text, params):
+            if _PG_ONLY_STATEMENT_RE.match(statement):
+                continue
+            actions = split_alter_table_actions(statement)
+            if len(actions) > 1:
+                self.execute(";\n".join(actions), statement_params)
+                continue
+            statement = translate_for_duckdb(statement)
+            self.connection._begin_if_needed()
+            start_time = time.time()
+            try:
+                if statement_params is None:
+                    result = self.connection._duck.execute(statement)
+                else:
+                    result = self.connection._duck.execute(to_duckdb_placeholders(statement), statement_params)
+                if _ROWCOUNT_STATEMENT_RE.match(statement):
+                    row = result.fetchone()
+                    self.rowcount, self.description, self._rows = (row[0] if row else 0), None, None
+                elif result.description:
+                    self.description, self._rows = result.description, result.fetchall()
+                    self.rowcount = len(self._rows)
+            except duckdb.InterruptException as e:
+                raise psycopg2.extensions.QueryCanceledError(str(e)) from e
+            finally:
+                journal = self.connection.job_journal
+                if journal is not None:
+                    journal.record_statement(inline_sql_params(statement, statement_params),
+                                             time.time() - start_time, self.rowcount)
+
+    def mogrify(self, query: Any, params: Optional[Sequence[Any]] = None) -> bytes:
+        return inline_sql_params(render_sql(query), params).encode("utf-8")
+
+    def fetchone(self) -> Optional[Tuple[Any, ...]]:
+        if not self._rows:
+            return None
+        return self._rows.pop(0)
+
+    def fetchmany(self, size: int = 1) -> List[Tuple[Any, ...]]:
+        rows, self._rows = (self._rows or [])[:size], (self._rows or [])[size:]
+        return rows
+
+    def fetchall(self) -> List[Tuple[Any, ...]]:
+        rows, self._rows = self._rows or [], []
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self) -> None:
+        self.closed = True
+
+    def __enter__(self) -> "DuckDBCursor":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class DuckDBConnection:
+    """以 psycopg2 连接的接口包装 DuckDB 连接，供现有工作线程直接使用 (connection_factory 不适用)。"""
+
+    def __init__(self, duck_conn: Any, database_path: str):
+        self._duck = duck_conn
+        self._in_transaction = False
+        self.autocommit = False
+        self.closed = 0
+        self.encoding = "utf-8"
+        self.dsn = f"duckdb:{database_path}"
+        self.isolation_level = None
+        self.job_journal = None  # 与 JournaledConnection 相同: JobJournal.attach 后记录每条语句
+
+    def _begin_if_needed(self) -> None:
+        if not self.autocommit and not self._in_transaction:
+            self._duck.execute("BEGIN TRANSACTION")
+            self._in_transaction = True
+
+    def cursor(self, *args: Any, **kwargs: Any) -> DuckDBCursor:
+        return DuckDBCursor(self)
+
+    def commit(self) -> None:
+        if self._in_transaction:
+            self._in_transaction = False
+            self._duck.execute("COMMIT")
+
+    def rollback(self) -> None:
+        if self._in_transaction:
+            self._in_transaction = False
+            self._duck.execute("ROLLBACK")
+
+    def cancel(self) -> None:
+        self._duck.interrupt()
+
+    def close(self) -> None:
+        if not self.closed:
+            self._duck.close()
+            self.closed = 1
+
+    def __enter__(self) -> "DuckDBConnection":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+def iter_query_batches(conn: Any, query: Any, fetch_rows: int = DB_EXPORT_FETCH_ROWS,
+                       cursor_name: str = "export") -> Iterator[Tuple[List[str], List[Tuple[Any, ...]]]]:
+    """
+    逐批产生 (列名, 行)；结果为空时也产生一次 (列名, [])。PostgreSQL 上使用服务器端命名游标，
+    客户端每次只持有 fetch_rows 行 (普通游标会在 execute 时取回整个结果集)；本地后端使用普通游标。
+    命名游标需要事务，调用方负责关闭连接。
+    """
+    is_local = isinstance(conn, DuckDBConnection)
+    with conn.cursor() if is_local else conn.cursor(name=cursor_name) as cur:
+        if not is_local:
+            cur.itersize = fetch_rows
+        cur.execute(render_sql(query))
+        rows = cur.fetchmany(fetch_rows)  # 命名游标在第一次 FETCH 之后才有 description
+        columns = [column[0] for column in cur.description]
+        yield columns, rows
+        while rows:
+            rows = cur.fetchmany(fetch_rows)
+            if rows:
+                yield columns, rows
+
+
+def stream_query_to_csv(conn: Any, query: Any, file_path: str, fetch_rows: int = DB_EXPORT_FETCH_ROWS,
+                        cursor_name: str = "csv_export") -> int:
+    """把查询结果逐批写入 CSV (带 BOM 的 UTF-8，首行为列名)，返回行数。"""
+    row_count = 0
+    with open(file_path, "w", newline="", encoding="utf-8-sig") as csv_file:
+        writer = csv.writer(csv_file)
+        for columns, rows in iter_query_batches(conn, query, fetch_rows, cursor_name):
+            if row_count == 0:
+                writer.writerow(columns)
+            writer.writerows(rows)
+            row_count += len(rows)
+    return row_count
+
+
+def stream_query_to_parquet(conn: Any, query: Any, file_path: str, fetch_rows: int = DB_EXPORT_FETCH_ROWS,
+                            cursor_name: str = "parquet_export") -> int:
+    """
+    把查询结果逐批写入一个 Parquet 文件 (每批一个行组，snappy 压缩)，返回行数。列类型由第一批推断；
+    第一批中全为 NULL 的列按文本列写出。需要 pyarrow。
+    """
+    if pyarrow is None:
+        raise ImportError("导出 Parquet 需要安装 pyarrow (pip install pyarrow)。")
+    row_count = 0
+    schema, writer = None, None
+    try:
+        for columns, rows in iter_query_batches(conn, query, fetch_rows, cursor_name):
+            values = [list(column_values) for column_values in zip(*rows)] if rows else [[] for _ in columns]
+            if schema is None:
+                arrays = [pyarrow.array(column_values) for column_values in values]
+                schema = pyarrow.schema([pyarrow.field(name, pyarrow.string() if pyarrow.types.is_null(array.type) else array.type)
+                                         for name, array in zip(columns, arrays)])
+                writer = pyarrow.parquet.ParquetWriter(file_path, schema, compression="snappy")
+            arrays = [pyarrow.array([None if v is None else str(v) for v in column_values], type=field.type)
+                      if pyarrow.types.is_string(field.type) else pyarrow.array(column_values, type=field.type)
+                      for column_values, field in zip(values, schema)]
+            if rows:
+                writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+                row_count += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    return row_count
+
+
+def _scan_expression(path: str) -> Optional[str]:
+    """表文件 (或目录) -> DuckDB 表函数调用；不是可识别的数据文件时返回 None。"""
+    normalized = path.replace("\\", "/")  # DuckDB 在 Windows 上同样接受正斜杠
+    if os.path.isdir(path):
+        if not glob.glob(os.path.join(path, "**", "*.parquet"), recursive=True):
+            return None
+        partitioned = any(name.startswith(f"{PARQUET_PARTITION_COLUMN}=") for name in os.listdir(path))
+        scan = f"read_parquet({quote_literal(normalized + '/**/*.parquet')}, hive_partitioning = {str(partitioned).lower()})"
+        return f"SELECT * EXCLUDE ({PARQUET_PARTITION_COLUMN}) FROM {scan}" if partitioned else f"SELECT * FROM {scan}"
+    if path.endswith(".parquet"):
+        return f"SELECT * FROM read_parquet({quote_literal(normalized)})"
+    if path.endswith((".csv.gz", ".csv")):
+        return f"SELECT * FROM read_csv_auto({quote_literal(normalized)}, header = true)"
+    return None
+
+
+def discover_mimic_tables(local_data_dir: str) -> Dict[Tuple[str, str], str]:
+    """{(schema, 表名): 扫描语句}。同一张表既有 Parquet 又有 CSV.gz 时优先使用 Parquet。"""
+    tables: Dict[Tuple[str, str], str] = {}
+    for module, schema in MIMIC_MODULE_SCHEMAS.items():
+        module_dir = os.path.join(local_data_dir, module)
+        if not os.path.isdir(module_dir):
+            continue
+        for entry in sorted(os.listdir(module_dir)):
+            if entry.startswith((".", "_")):  # 转换中的临时输出等
+                continue
+            table = re.sub(r"\.(parquet|csv\.gz|csv)$", "", entry)
+            scan = _scan_expression(os.path.join(module_dir, entry))
+            if scan is None or (schema, table) in tables and "read_parquet" in tables[(schema, table)]:
+                continue
+            tables[(schema, table)] = scan
+    return tables
+
+
+def connect_duckdb(local_data_dir: Optional[str], database_path: Optional[str] = None,
+                   threads: Optional[int] = None) -> DuckDBConnection:
+    """打开本地数据库文件，并把 MIMIC-IV 各模块的数据文件注册为视图。threads 为空或 0 时使用全部核心。"""
+    if duckdb is None:
+        raise ImportError("本地 DuckDB 后端需要安装 duckdb (pip install duckdb)。")
+    if not local_data_dir or not os.path.isdir(local_data_dir):
+        raise FileNotFoundError(f"本地数据目录不存在: {local_data_dir}")
+    tables = discover_mimic_tables(local_data_dir)
+    if not tables:
+        raise FileNotFoundError(f"在 {local_data_dir} 下没有找到 hosp/ 或 icu/ 模块的 Parquet 或 CSV.gz 文件。")
+    database_path = database_path or ":memory:"
+    duck_conn = duckdb.connect(database_path)
+    try:
+        if threads:
+            duck_conn.execute(f"SET threads = {int(threads)}")
+        for schema in sorted({schema for schema, _ in tables} | {"mimiciv_data"}):
+            duck_conn.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+        for (schema, table), scan in tables.items():
+            duck_conn.execute(f'CREATE OR REPLACE VIEW {schema}."{table}" AS {scan}')
+    except Exception:
+        duck_conn.close()
+        raise
+    return DuckDBConnection(duck_conn, database_path)
+
+# --- END OF FILE sql_logic/db_backend.py ---
@@ -0,0 +1,131 @@
+# --- START OF FILE sql_logic/feature_store.py ---
+import re
+import psycopg2.sql as pgsql
+
+from typing import Any, List, Optional, Sequence, Tuple
+
+# 窄表特征库: 特征不再以列的形式 ALTER 到队列表上，而是以 (hadm_id, feature_name, 值) 行追加写入同一张表。
+# 队列表保持窄表，UPDATE 不再改写越来越宽的元组，也不会触及 PostgreSQL 1600 列的上限。
+#   - 写入只有 INSERT (追加)；同一特征重新计算时追加新的一批行，导出时只取每个特征最近一批 (computed_at 最大)。
+#   - 数值 (含布尔) 写 num_value，文本/日期写 text_value，数组等其他类型写 json_value。
+#   - 导出时按特征目录生成 MAX(...) FILTER (WHERE feature_name = ...) 透视为宽表，与队列表按 hadm_id 左连接。
+
+FEATURE_STORE_SCHEMA = "mimiciv_data"
+FEATURE_STORE_TABLE = "feature_store"
+
+STORAGE_MODE_WIDE = "wide"
+STORAGE_MODE_NARROW = "narrow"
+
+VALUE_SLOT_NUM = "num_value"
+VALUE_SLOT_TEXT = "text_value"
+VALUE_SLOT_JSON = "json_value"
+_VALUE_SLOT_CASTS = {VALUE_SLOT_NUM: "double precision", VALUE_SLOT_TEXT: "text", VALUE_SLOT_JSON: "jsonb"}
+
+_NUMERIC_BASE_TYPES = {"numeric", "decimal", "integer", "int", "int2", "int4", "int8", "bigint", "smallint",
+                       "double", "real", "float", "float4", "float8", "boolean", "bool"}
+_TEXT_BASE_TYPES = {"text", "character", "char", "varchar", "date", "timestamp", "timestamptz", "time", "interval"}
+
+
+def feature_store_ident() -> Any:
+    return pgsql.Identifier(FEATURE_STORE_SCHEMA, FEATURE_STORE_TABLE)
+
+
+def build_feature_store_table_sql() -> Any:
+    return pgsql.SQL(
+        "CREATE SCHEMA IF NOT EXISTS {schema}; "
+        "CREATE TABLE IF NOT EXISTS {table} (cohort_table TEXT NOT NULL, hadm_id INTEGER NOT NULL, feature_name TEXT NOT NULL, "
+        "num_value DOUBLE PRECISION, text_value TEXT, json_value JSONB, computed_at TIMESTAMPTZ NOT NULL DEFAULT now()); "
+        "CREATE INDEX IF NOT EXISTS {index} ON {table} (cohort_table, feature_name, computed_at);"
+    ).format(schema=pgsql.Identifier(FEATURE_STORE_SCHEMA), table=feature_store_ident(),
+             index=pgsql.Identifier(f"idx_{FEATURE_STORE_TABLE}_lookup"))
+
+
+def value_slot_for_type(type_str: str) -> str:
+    """列类型 (如 'NUMERIC'、'CHARACTER(100)'、'DOUBLE PRECISION[]') -> 写入的值列。"""
+    normalized = (type_str or "").strip().lower()
+    base_type = re.split(r"[\s(\[]", normalized, maxsplit=1)[0]
+    if normalized.endswith("[]"):
+        return VALUE_SLOT_JSON
+    if base_type in _NUMERIC_BASE_TYPES:
+        return VALUE_SLOT_NUM
+    if base_type in _TEXT_BASE_TYPES:
+        return VALUE_SLOT_TEXT
+    return VALUE_SLOT_JSON
+
+
+def _slot_expression(slot: str, type_str: str, source_alias: Any, column_name: str) -> List[Any]:
+    """VALUES 中 (num_value, text_value, json_value) 三个表达式，未使用的槽为带类型的 NULL。"""
+    column = pgsql.SQL("{}.{}").format(source_alias, pgsql.Identifier(column_name))
+    if slot == VALUE_SLOT_NUM and (type_str or "").strip().lower().startswith("bool"):
+        value = pgsql.SQL("{}::int::double precision").format(column)
+    elif slot == VALUE_SLOT_JSON:
+        value = pgsql.SQL("to_jsonb({})").format(column)
+    else:
+        value = pgsql.SQL("{}::{}").format(column, pgsql.SQL(_VALUE_SLOT_CASTS[slot]))
+    return [value if s == slot else pgsql.SQL("NULL::{}").format(pgsql.SQL(cast)) for s, cast in _VALUE_SLOT_CASTS.items()]
+
+
+def build_feature_store_insert_sql(cohort_table_full_name: str, source_table: Any, hadm_column: str,
+                                   columns: Sequence[Tuple[str, str]]) -> Any:
+    """
+    把 source_table 中每行的特征列展开为特征库行并追加写入 (只写非空值)。
+    columns: [(列名 = 特征名, 列类型)]；cohort_table_full_name 形如 'mimiciv_data.first_icu_stays'。
+    """
+    src = pgsql.Identifier("src")
+    value_rows = [pgsql.SQL("({})").format(pgsql.SQL(", ").join(
+        [pgsql.Literal(name)] + _slot_expression(value_slot_for_type(type_str), type_str, src, name)))
+        for name, type_str in columns]
+    return pgsql.SQL(
+        "INSERT INTO {store} (cohort_table, hadm_id, feature_name, num_value, text_value, json_value) "
+        "SELECT {cohort}, {src}.{hadm}, v.feature_name, v.num_value, v.text_value, v.json_value "
+        "FROM {source} {src} CROSS JOIN LATERAL (VALUES {rows}) AS v(feature_name, num_value, text_value, json_value) "
+        "WHERE {src}.{hadm} IS NOT NULL AND (v.num_value IS NOT NULL OR v.text_value IS NOT NULL OR v.json_value IS NOT NULL);"
+    ).format(store=feature_store_ident(), cohort=pgsql.Literal(cohort_table_full_name), src=src,
+             hadm=pgsql.Identifier(hadm_column), source=source_table, rows=pgsql.SQL(", ").join(value_rows))
+
+
+def build_feature_catalog_sql() -> Any:
+    """特征目录: (feature_name, 有数值, 有文本)，按首次写入排序。参数: (cohort_table_full_name,)。"""
+    return pgsql.SQL(
+        "SELECT feature_name, bool_or(num_value IS NOT NULL), bool_or(text_value IS NOT NULL) FROM {} "
+        "WHERE cohort_table = %s GROUP BY feature_name ORDER BY MIN(computed_at), feature_name"
+    ).format(feature_store_ident())
+
+
+def catalog_value_slots(catalog_rows: Sequence[Tuple[str, bool, bool]]) -> List[Tuple[str, str]]:
+    """目录行 -> [(feature_name, 透视时取值的槽)]。"""
+    return [(name, VALUE_SLOT_NUM if has_num else VALUE_SLOT_TEXT if has_text else VALUE_SLOT_JSON)
+            for name, has_num, has_text in catalog_rows]
+
+
+def build_feature_pivot_sql(cohort_schema: str, cohort_table: str, feature_slots: Sequence[Tuple[str, str]],
+                            exclude_names: Optional[Sequence[str]] = None, limit: Optional[int] = None) -> Any:
+    """
+    导出用: 队列表全部列 + 特征库中该队列的特征 (每个特征只取最近一批)，透视为宽表。
+    与队列表已有列同名的特征被跳过 (队列表中的列优先)。
+    """
+    excluded = set(exclude_names or [])
+    feature_slots = [(name, slot) for name, slot in feature_slots if name not in excluded]
+    cohort_ident = pgsql.Identifier(cohort_schema, cohort_table)
+    if not feature_slots:
+        query = pgsql.SQL("SELECT * FROM {}").format(cohort_ident)
+    else:
+        cohort_literal = pgsql.Literal(f"{cohort_schema}.{cohort_table}")
+        pivot_columns = [pgsql.SQL("MAX(fs.{slot}{cast}) FILTER (WHERE fs.feature_name = {name}) AS {alias}").format(
+            slot=pgsql.Identifier(slot), cast=pgsql.SQL("::text") if slot == VALUE_SLOT_JSON else pgsql.SQL(""),
+            name=pgsql.Literal(name), alias=pgsql.Identifier(name)) for name, slot in feature_slots]
+        query = pgsql.SQL(
+            "WITH latest AS (SELECT feature_name, MAX(computed_at) AS computed_at FROM {store} "
+            "WHERE cohort_table = {cohort_literal} GROUP BY feature_name), "
+            "pivoted AS (SELECT fs.hadm_id, {pivot_columns} FROM {store} fs "
+            "JOIN latest ON latest.feature_name = fs.feature_name AND latest.computed_at = fs.computed_at "
+            "WHERE fs.cohort_table = {cohort_literal} GROUP BY fs.hadm_id) "
+            "SELECT c.*, {feature_columns} FROM {cohort} c LEFT JOIN pivoted p ON p.hadm_id = c.hadm_id"
+        ).format(store=feature_store_ident(), cohort_literal=cohort_literal, cohort=cohort_ident,
+                 pivot_columns=pgsql.SQL(", ").join(pivot_columns),
+                 feature_columns=pgsql.SQL(", ").join(pgsql.SQL("p.{}").format(pgsql.Identifier(name)) for name, _ in feature_slots))
+    if limit:
+        query += pgsql.SQL(" LIMIT {}").format(pgsql.Literal(int(limit)))
+    return query
+
+# --- END OF FILE sql_logic/feature_store.py ---
@@ -0,0 +1,254 @@
+# --- START OF FILE sql_logic/icd_hierarchy.py ---
+import bisect
+import os
+import re
+import psycopg2.sql as pgsql
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from sql_logic.sql_render import render_sql
+
+# ICD 代码前缀/章节索引: 临床上按代码前缀与章节定义队列 (I21*、I50.*、ICD-9 410.x、ICD-10 第 IX 章)，
+# 而不是按 long_title 做文本匹配。字典表 (d_icd_diagnoses / d_icd_procedures) 的代码载入内存后，
+# 每个 ICD 版本保存一份排序数组: 前缀与章节区间的展开都是两次二分查找，不再访问数据库。
+# 展开得到的代码列表在建队列时以 e.icd_code = ANY(%s) 直接作用于事件表 (diagnoses_icd / procedures_icd)，
+# 可以使用事件表上 icd_code 的索引，不必在大表连接中逐行计算文本条件。
+# 可选的 ICD-9 <-> ICD-10 对应关系来自 CMS 发布的 GEM 文件 (General Equivalence Mappings)。
+
+ICD_VERSIONS = (9, 10)
+_TOKEN_SEPARATORS = re.compile(r"[,，;；\s]+")
+_TRAILING_PLACEHOLDER = re.compile(r"\.[xX*%]*$")
+
+# (ICD 版本, 起始代码, 结束代码 (按前缀包含), 章节名称)
+DIAGNOSIS_CHAPTERS = [
+    (10, "A00", "B99", "某些传染病和寄生虫病"),
+    (10, "C00", "D49", "肿瘤"),
+    (10, "D50", "D89", "血液及造血器官疾病和某些免疫疾患"),
+    (10, "E00", "E89", "内分泌、营养和代谢疾病"),
+    (10, "F01", "F99", "精神、行为和神经发育障碍"),
+    (10, "G00", "G99", "神经系统疾病"),
+    (10, "H00", "H59", "眼和附器疾病"),
+    (10, "H60", "H95", "耳和乳突疾病"),
+    (10, "I00", "I99", "循环系统疾病"),
+    (10, "J00", "J99", "呼吸系统疾病"),
+    (10, "K00", "K95", "消化系统疾病"),
+    (10, "L00", "L99", "皮肤和皮下组织疾病"),
+    (10, "M00", "M99", "肌肉骨骼系统和结缔组织疾病"),
+    (10, "N00", "N99", "泌尿生殖系统疾病"),
+    (10, "O00", "O9A", "妊娠、分娩和产褥期"),
+    (10, "P00", "P96", "起源于围生期的某些情况"),
+    (10, "Q00", "Q99", "先天性畸形、变形和染色体异常"),
+    (10, "R00", "R99", "症状、体征和临床与实验室异常所见"),
+    (10, "S00", "T88", "损伤、中毒和外因的某些其他后果"),
+    (10, "U00", "U85", "特殊目的编码"),
+    (10, "V00", "Y99", "疾病和死亡的外因"),
+    (10, "Z00", "Z99", "影响健康状态和与保健机构接触的因素"),
+    (9, "001", "139", "传染病和寄生虫病"),
+    (9, "140", "239", "肿瘤"),
+    (9, "240", "279", "内分泌、营养和代谢疾病及免疫疾患"),
+    (9, "280", "289", "血液及造血器官疾病"),
+    (9, "290", "319", "精神障碍"),
+    (9, "320", "389", "神经系统和感觉器官疾病"),
+    (9, "390", "459", "循环系统疾病"),
+    (9, "460", "519", "呼吸系统疾病"),
+    (9, "520", "579", "消化系统疾病"),
+    (9, "580", "629", "泌尿生殖系统疾病"),
+    (9, "630", "679", "妊娠、分娩和产褥期并发症"),
+    (9, "680", "709", "皮肤和皮下组织疾病"),
+    (9, "710", "739", "肌肉骨骼系统和结缔组织疾病"),
+    (9, "740", "759", "先天性异常"),
+    (9, "760", "779", "起源于围生期的某些情况"),
+    (9, "780", "799", "症状、体征和不明确情况"),
+    (9, "800", "999", "损伤和中毒"),
+    (9, "V01", "V91", "影响健康状态和与保健机构接触的因素 (V 代码)"),
+    (9, "E000", "E999", "损伤和中毒的外因 (E 代码)"),
+]
+
+PROCEDURE_CHAPTERS = [
+    (10, "0", "0", "内科和外科"),
+    (10, "1", "1", "产科"),
+    (10, "2", "2", "放置"),
+    (10, "3", "3", "给药"),
+    (10, "4", "4", "测量和监测"),
+    (10, "5", "5", "体外辅助和功能支持"),
+    (10, "6", "6", "体外治疗"),
+    (10, "7", "7", "整骨疗法"),
+    (10, "8", "8", "其他操作"),
+    (10, "9", "9", "脊椎推拿"),
+    (10, "B", "B", "影像"),
+    (10, "C", "C", "核医学"),
+    (10, "D", "D", "放射治疗"),
+    (10, "F", "F", "物理康复和诊断性听力学"),
+    (10, "G", "G", "精神卫生"),
+    (10, "H", "H", "物质滥用治疗"),
+    (10, "X", "X", "新技术"),
+    (9, "00", "00", "其他操作和干预"),
+    (9, "01", "05", "神经系统手术"),
+    (9, "06", "07", "内分泌系统手术"),
+    (9, "08", "16", "眼部手术"),
+    (9, "17", "17", "其他杂项操作"),
+    (9, "18", "20", "耳部手术"),
+    (9, "21", "29", "鼻、口和咽部手术"),
+    (9, "30", "34", "呼吸系统手术"),
+    (9, "35", "39", "心血管系统手术"),
+    (9, "40", "41", "血液和淋巴系统手术"),
+    (9, "42", "54", "消化系统手术"),
+    (9, "55", "59", "泌尿系统手术"),
+    (9, "60", "64", "男性生殖器官手术"),
+    (9, "65", "71", "女性生殖器官手术"),
+    (9, "72", "75", "产科操作"),
+    (9, "76", "84", "肌肉骨骼系统手术"),
+    (9, "85", "86", "皮肤和皮下组织手术"),
+    (9, "87", "99", "其他诊断和治疗操作"),
+]
+
+
+def normalize_icd_code(text: str) -> str:
+    """'I21.4' / 'i21.*' / '410.x' -> 'I214' / 'I21' / '410' (MIMIC 中的代码不含小数点)。"""
+    code = _TRAILING_PLACEHOLDER.sub("", text.strip().upper())
+    return code.rstrip("*%").replace(".", "")
+
+
+def parse_icd_selection_text(text: str) -> List[Tuple[str, str]]:
+    """
+    'I21*, I50.*; 410.x I20-I25' -> [(起始, 结束)]。单个前缀的起始与结束相同；区间按结束代码的前缀包含。
+    无法解析的片段抛出 ValueError。
+    """
+    selections = []
+    for token in filter(None, _TOKEN_SEPARATORS.split(text or "")):
+        start_text, _, end_text = token.partition("-")
+        start, end = normalize_icd_code(start_text), normalize_icd_code(end_text or start_text)
+        if not start or not end or not start.isalnum() or not end.isalnum():
+            raise ValueError(f"无法识别的 ICD 代码或前缀: '{token}'")
+        if end < start[:len(end)]:
+            raise ValueError(f"代码区间的起止顺序不正确: '{token}'")
+        selections.append((start, end))
+    return selections
+
+
+class IcdPrefixIndex:
+    """字典表代码的前缀索引: 每个 ICD 版本一份排序后的代码数组，前缀与章节区间的查找都是两次二分。"""
+
+    def __init__(self, rows: Iterable[Tuple[str, int, Optional[str]]]):
+        self._codes: Dict[int, List[str]] = {}
+        self._titles: Dict[Tuple[int, str], Optional[str]] = {}
+        for code, version, title in rows:
+            if code is None or version is None:
+                continue
+            code = str(code).strip()  # icd_code 为 CHAR(7) 时带有尾随空格
+            self._titles[(int(version), code)] = title
+        for version, code in self._titles:
+            self._codes.setdefault(version, []).append(code)
+        for codes in self._codes.values():
+            codes.sort()
+
+    def __len__(self) -> int:
+        return len(self._titles)
+
+    def versions(self) -> List[int]:
+        return sorted(self._codes)
+
+    def title(self, version: int, code: str) -> Optional[str]:
+        return self._titles.get((version, code))
+
+    def codes_in_range(self, version: int, start: str, end: str) -> List[str]:
+        """start <= 代码，且代码的前 len(end) 位 <= end；start == end 时即为前缀查找。"""
+        codes = self._codes.get(version, [])
+        lo = bisect.bisect_left(codes, start)
+        hi = bisect.bisect_right(codes, end + "\uffff")
+        return codes[lo:hi]
+
+    def expand(self, selections: Sequence[Tuple[str, str]],
+               versions: Optional[Sequence[int]] = None) -> Dict[int, List[str]]:
+        """[(起始, 结束)] -> {版本: 排序后的代码列表}；没有匹配的版本不出现在结果中。"""
+        expanded: Dict[int, Set[str]] = {}
+        for version in versions or self.versions():
+            for start, end in selections:
+                matches = self.codes_in_range(version, start, end)
+                if matches:
+                    expanded.setdefault(version, set()).update(matches)
+        return {version: sorted(codes) for version, codes in expanded.items()}
+
+
+def gem_source_version(file_name: str) -> Optional[int]:
+    """按 CMS 的 GEM 文件命名判断映射方向 (源代码的 ICD 版本)；无法判断时返回 None。"""
+    name = os.path.basename(file_name).lower()
+    if "i10gem" in name or "pcsi9" in name or "i10_to_i9" in name:
+        return 10
+    if "i9gem" in name or "i9pcs" in name or "i9_to_i10" in name:
+        return 9
+    return None
+
+
+def parse_gem_lines(lines: Iterable[str], source_version: int) -> List[Tuple[Tuple[int, str], Tuple[int, str]]]:
+    """GEM 文件行 ('源代码 目标代码 标志') -> [((源版本, 源代码), (目标版本, 目标代码))]，跳过“无对应”行。"""
+    target_version = 9 if source_version == 10 else 10
+    pairs = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+        flags = parts[2] if len(parts) > 2 else ""
+        if len(flags) > 1 and flags[1] == "1":  # 第二位标志: 无对应 (目标为 NoDx / NoPCS)
+            continue
+        pairs.append(((source_version, parts[0].upper()), (target_version, parts[1].upper())))
+    return pairs
+
+
+def build_version_map(pairs: Iterable[Tuple[Tuple[int, str], Tuple[int, str]]]) -> Dict[Tuple[int, str], Set[Tuple[int, str]]]:
+    """双向对应: 正向与反向 GEM 合并后，任一方向出现的对应关系都可用于扩展代码列表。"""
+    version_map: Dict[Tuple[int, str], Set[Tuple[int, str]]] = {}
+    for source, target in pairs:
+        version_map.setdefault(source, set()).add(target)
+        version_map.setdefault(target, set()).add(source)
+    return version_map
+
+
+def add_mapped_codes(codes_by_version: Dict[int, List[str]],
+                     version_map: Dict[Tuple[int, str], Set[Tuple[int, str]]]) -> Dict[int, List[str]]:
+    """把代码列表扩展为同时包含另一版本的对应代码。"""
+    expanded = {version: set(codes) for version, codes in codes_by_version.items()}
+    for version, codes in codes_by_version.items():
+        for code in codes:
+            for mapped_version, mapped_code in version_map.get((version, code), ()):
+                expanded.setdefault(mapped_version, set()).add(mapped_code)
+    return {version: sorted(codes) for version, codes in sorted(expanded.items())}
+
+
+def build_icd_dictionary_sql(dict_table_full_name: str, code_column: str = "icd_code",
+                             title_column: str = "long_title") -> Any:
+    return pgsql.SQL("SELECT {code}, icd_version, {title} FROM {table}").format(
+        code=pgsql.Identifier(code_column), title=pgsql.Identifier(title_column),
+        table=pgsql.Identifier(*dict_table_full_name.split('.')))
+
+
+def load_icd_prefix_index(cursor: Any, dict_table_full_name: str, code_column: str = "icd_code",
+                          title_column: str = "long_title") -> IcdPrefixIndex:
+    cursor.execute(build_icd_dictionary_sql(dict_table_full_name, code_column, title_column))
+    return IcdPrefixIndex(cursor.fetchall())
+
+
+def build_code_list_condition(codes_by_version: Dict[int, List[str]], table_alias: Optional[str] = None,
+                              code_column: str = "icd_code") -> Tuple[str, List[Any]]:
+    """
+    {版本: 代码列表} -> (条件 SQL 文本, 参数)，例如
+    ("dd"."icd_version" = 10 AND "dd"."icd_code" = ANY(%s::bpchar[])) OR (...)。
+    参数数组转换为 bpchar[]: MIMIC-IV 的 icd_code 为 CHAR(7)，text[] 会使列被转换为 text 而用不上索引；
+    对 VARCHAR/TEXT 列，bpchar 参数同样只在参数一侧转换。没有代码时返回 ("", [])。
+    """
+    def column(name: str) -> Any:
+        return pgsql.Identifier(table_alias, name) if table_alias else pgsql.Identifier(name)
+
+    parts, params = [], []
+    for version in sorted(codes_by_version):
+        codes = list(codes_by_version[version])
+        if not codes:
+            continue
+        parts.append(pgsql.SQL("({version_col} = {version} AND {code_col} = ANY(%s::bpchar[]))").format(
+            version_col=column("icd_version"), version=pgsql.Literal(int(version)), code_col=column(code_column)))
+        params.append(codes)
+    if not parts:
+        return "", []
+    condition = parts[0] if len(parts) == 1 else pgsql.SQL("({})").format(pgsql.SQL(" OR ").join(parts))
+    return render_sql(condition), params
+
+# --- END OF FILE sql_logic/icd_hierarchy.py ---
@@ -0,0 +1,91 @@
+# --- START OF FILE sql_logic/job_control.py ---
+import psycopg2
+import psycopg2.extensions
+from app_config import DEFAULT_JOB_STATEMENT_TIMEOUT_MIN, DEFAULT_JOB_LOCK_TIMEOUT_SEC, SESSION_TUNING_PROFILES
+
+from typing import Any, Dict, List, Optional, Tuple
+
+# 长任务 (队列创建、特征合并、基础数据提取) 的服务端控制:
+#   - 每个任务连接开始时设置 statement_timeout / lock_timeout (会话级，连接关闭即失效)；
+#   - 取消时从 GUI 线程调用 connection.cancel() (与 pg_cancel_backend 相同的取消协议)，
+#     正在执行的语句立即以 QueryCanceledError 结束，工作线程回滚并关闭连接，释放服务端资源；
+#   - 会话调优配置 (app_config.SESSION_TUNING_PROFILES) 设置 work_mem、并行 worker 数、JIT 等，
+#     只允许下列参数名 (参数名直接拼入 SET 语句)。
+
+TUNING_SETTING_NAMES = ("work_mem", "maintenance_work_mem", "max_parallel_workers_per_gather",
+                        "max_parallel_maintenance_workers", "jit", "temp_buffers")
+SESSION_ONLY_SETTING_NAMES = ("temp_buffers",)
+
+
+def default_job_timeouts() -> Dict[str, int]:
+    return {"statement_timeout_ms": DEFAULT_JOB_STATEMENT_TIMEOUT_MIN * 60 * 1000,
+            "lock_timeout_ms": DEFAULT_JOB_LOCK_TIMEOUT_SEC * 1000}
+
+
+def build_job_timeout_statements(job_timeouts: Optional[Dict[str, int]]) -> List[Tuple[str, Tuple[int]]]:
+    """任务超时设置 -> [(SET 语句, 参数)]；0 表示不限制 (与 PostgreSQL 的含义一致)。"""
+    timeouts = default_job_timeouts()
+    timeouts.update(job_timeouts or {})
+    return [("SET statement_timeout = %s", (max(0, int(timeouts["statement_timeout_ms"])),)),
+            ("SET lock_timeout = %s", (max(0, int(timeouts["lock_timeout_ms"])),))]
+
+
+def apply_job_timeouts(cursor: Any, job_timeouts: Optional[Dict[str, int]]) -> None:
+    for statement, params in build_job_timeout_statements(job_timeouts):
+        cursor.execute(statement, params)
+
+
+def build_session_tuning_statements(profile_key: Optional[str], transaction_local: bool = False) -> List[Tuple[str, Tuple[Any]]]:
+    """
+    调优配置 -> [(SET 语句, 参数)]。任务连接在开始时按会话设置 (连接只属于该任务，关闭即失效)；
+    transaction_local=True 时生成 SET LOCAL，只对当前事务的步骤生效 (如索引构建)，提交或回滚后恢复，此时跳过 temp_buffers。
+    未知或空的配置名不修改任何设置。
+    """
+    profile = SESSION_TUNING_PROFILES.get(profile_key or "")
+    if not profile:
+        return []
+    statements = []
+    for name, value in profile["settings"].items():
+        if name not in TUNING_SETTING_NAMES:
+            raise ValueError(f"不支持的会话参数: {name}")
+        if transaction_local and name in SESSION_ONLY_SETTING_NAMES:
+            continue
+        statements.append((f"SET {'LOCAL ' if transaction_local else ''}{name} = %s", (str(value),)))
+    return statements
+
+
+def apply_session_tuning(cursor: Any, profile_key: Optional[str], transaction_local: bool = False) -> None:
+    for statement, params in build_session_tuning_statements(profile_key, transaction_local):
+        cursor.execute(statement, params)
+
+
+def describe_tuning_profile(profile_key: Optional[str]) -> str:
+    """任务日志与任务历史中显示的配置说明，如 "批量提取 (work_mem=256MB, ...)"。"""
+    profile = SESSION_TUNING_PROFILES.get(profile_key or "")
+    if not profile:
+        return profile_key or ""
+    settings = ", ".join(f"{name}={value}" for name, value in profile["settings"].items())
+    return f"{profile['label']} ({settings})" if settings else profile["label"]
+
+
+def cancel_backend_query(conn: Any) -> bool:
+    """从其他线程取消连接上正在执行的语句；连接不存在或已关闭时返回 False。"""
+    if conn is None or conn.closed:
+        return False
+    try:
+        conn.cancel()
+        return True
+    except (psycopg2.Error, AttributeError):
+        return False
+
+
+def describe_query_canceled(error: Exception, is_cancelled: bool) -> str:
+    """QueryCanceledError 既可能来自用户取消，也可能来自 statement_timeout，按取消标志区分。"""
+    if is_cancelled:
+        return "操作已取消"
+    return f"语句执行超时，已被服务器取消 (statement_timeout): {error}"
+
+
+QueryCanceledError = psycopg2.extensions.QueryCanceledError
+
+# --- END OF FILE sql_logic/job_control.py ---
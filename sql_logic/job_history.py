@@ -0,0 +1,255 @@
+# --- START OF FILE sql_logic/job_history.py ---
+import hashlib
+import re
+from contextlib import contextmanager
+import sqlite3
+import time
+import psycopg2
+import psycopg2.extensions
+from app_config import JOB_HISTORY_DB_PATH
+from sql_logic.chunked_update import normalize_session_table_names
+from sql_logic.job_control import describe_tuning_profile
+
+from typing import Any, Dict, Iterator, List, Optional
+
+# 本地任务历史 (SQLite): 每个长任务一行 (类型、队列表、配置哈希、结果、总耗时、数据库级缓冲区统计差值)，
+# 每条执行的语句一行 (耗时、影响行数)。语句由 JournaledConnection 的游标自动记录，工作线程无需逐条埋点。
+# 缓冲区统计取自 pg_stat_database 在任务前后的差值: 服务器上同时运行的其他会话也会计入，只作近似参考。
+
+JOB_OUTCOME_RUNNING = "running"
+JOB_OUTCOME_SUCCESS = "success"
+JOB_OUTCOME_CANCELLED = "cancelled"
+JOB_OUTCOME_FAILED = "failed"
+
+_DB_STATS_COLUMNS = ("blks_hit", "blks_read", "temp_bytes", "tup_inserted", "tup_updated")
+# 不记录的辅助语句 (会话设置、检查点日志、统计快照、只读副本的一致性检查)
+_IGNORED_STATEMENT_RE = re.compile(r"^\s*(SET\s|SHOW\s)|chunked_job_journal|column_provenance|pg_stat_database|information_schema"
+                                   r"|pg_current_wal_lsn|replica_consistency_rows|replica_pending_write", re.IGNORECASE)
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_type TEXT NOT NULL,
+    cohort_table TEXT,
+    description TEXT,
+    config_hash TEXT,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    duration_s REAL,
+    outcome TEXT NOT NULL,
+    error_message TEXT,
+    blks_hit INTEGER, blks_read INTEGER, temp_bytes INTEGER, tup_inserted INTEGER, tup_updated INTEGER,
+    tuning_profile TEXT
+);
+CREATE TABLE IF NOT EXISTS job_statements (
+    job_id INTEGER NOT NULL REFERENCES jobs(job_id),
+    statement_index INTEGER NOT NULL,
+    label TEXT,
+    sql_text TEXT,
+    duration_s REAL,
+    rows_affected INTEGER,
+    PRIMARY KEY (job_id, statement_index)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_cohort ON jobs (cohort_table, job_type);
+"""
+# 旧版本创建的历史库缺少的列: 打开时补上 (列名, 类型)
+_ADDED_JOB_COLUMNS = (("tuning_profile", "TEXT"),)
+
+
+def compute_config_hash(config_parts: List[str]) -> str:
+    """任务配置哈希: 临时表名规范化后再哈希，同一配置的多次运行哈希相同，便于前后对比。"""
+    digest = hashlib.sha1()
+    for part in normalize_session_table_names([str(p) for p in config_parts]):
+        digest.update(part.encode("utf-8") + b"\x00")
+    return digest.hexdigest()[:16]
+
+
+def statement_label(sql_text: str, max_length: int = 80) -> str:
+    """语句的简短标签: 去掉注释后的第一行有效内容。"""
+    for line in sql_text.splitlines():
+        stripped = line.split("--", 1)[0].strip()
+        if stripped:
+            return stripped[:max_length]
+    return ""
+
+
+@contextmanager
+def _connect(db_path: str) -> Iterator[sqlite3.Connection]:
+    """打开历史库 (必要时建表)，退出时提交并关闭。工作线程各自打开连接，SQLite 负责并发写入的加锁。"""
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        conn.executescript(_SCHEMA_SQL)
+        existing_columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column_name, column_type in _ADDED_JOB_COLUMNS:
+            if column_name not in existing_columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column_name} {column_type}")
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class JobJournal:
+    """一个任务的历史记录。写入失败只打印警告，不影响任务本身。"""
+
+    def __init__(self, job_type: str, cohort_table: Optional[str], description: str,
+                 config_parts: List[str], db_path: str = JOB_HISTORY_DB_PATH, tuning_profile: Optional[str] = None):
+        self.db_path = db_path
+        self.job_id: Optional[int] = None
+        self.statement_count = 0
+        self.started_at = time.time()
+        self.db_stats_before: Optional[Dict[str, int]] = None
+        self.is_finished = False
+        try:
+            with _connect(db_path) as conn:
+                cursor = conn.execute(
+                    "INSERT INTO jobs (job_type, cohort_table, description, config_hash, started_at, outcome, tuning_profile) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_type, cohort_table, description, compute_config_hash(config_parts), self.started_at, JOB_OUTCOME_RUNNING,
+                     describe_tuning_profile(tuning_profile) or None))
+                self.job_id = cursor.lastrowid
+        except sqlite3.Error as e:
+            print(f"Warning: 无法写入任务历史 ({db_path}): {e}")
+
+    def attach(self, pg_conn: Any) -> None:
+        """绑定到任务的数据库连接: 之后该连接上执行的语句自动记录，并取任务开始时的统计快照。"""
+        if hasattr(pg_conn, "job_journal"):  # JournaledConnection 或本地后端的 DuckDBConnection
+            pg_conn.job_journal = self
+        self.db_stats_before = _fetch_db_stats(pg_conn)
+
+    def record_statement(self, sql_text: str, duration_s: float, rows_affected: Optional[int]) -> None:
+        if self.job_id is None or _IGNORED_STATEMENT_RE.search(sql_text):
+            return
+        self.statement_count += 1
+        try:
+            with _connect(self.db_path) as conn:
+                conn.execute("INSERT INTO job_statements (job_id, statement_index, label, sql_text, duration_s, rows_affected) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             (self.job_id, self.statement_count, statement_label(sql_text), sql_text, duration_s,
+                              rows_affected if rows_affected is not None and rows_affected >= 0 else None))
+        except sqlite3.Error as e:
+            print(f"Warning: 无法写入任务历史语句: {e}")
+
+    def finish(self, outcome: str, error_message: Optional[str] = None, pg_conn: Any = None) -> None:
+        """结束任务 (只记录第一次的结果)。成功时传入已提交的连接，以记录任务前后的数据库统计差值。"""
+        if self.job_id is None or self.is_finished:
+            return
+        self.is_finished = True
+        stats_delta: Dict[str, Optional[int]] = {col: None for col in _DB_STATS_COLUMNS}
+        if pg_conn is not None and self.db_stats_before:
+            stats_after = _fetch_db_stats(pg_conn)
+            if stats_after:
+                stats_delta = {col: stats_after[col] - self.db_stats_before[col] for col in _DB_STATS_COLUMNS}
+        finished_at = time.time()
+        try:
+            with _connect(self.db_path) as conn:
+                conn.execute(
+                    "UPDATE jobs SET finished_at = ?, duration_s = ?, outcome = ?, error_message = ?, "
+                    "blks_hit = ?, blks_read = ?, temp_bytes = ?, tup_inserted = ?, tup_updated = ? WHERE job_id = ?",
+                    (finished_at, finished_at - self.started_at, outcome, error_message,
+                     *[stats_delta[col] for col in _DB_STATS_COLUMNS], self.job_id))
+        except sqlite3.Error as e:
+            print(f"Warning: 无法更新任务历史: {e}")
+
+
+def _fetch_db_stats(pg_conn: Any) -> Optional[Dict[str, int]]:
+    """当前数据库的累计统计 (需在事务外调用才是最新值)；失败或不是 PostgreSQL 连接时返回 None。"""
+    if not isinstance(pg_conn, psycopg2.extensions.connection) or pg_conn.closed or pg_conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        return None
+    try:
+        with pg_conn.cursor() as cur:
+            cur.execute("SELECT " + ", ".join(_DB_STATS_COLUMNS) + " FROM pg_stat_database WHERE datname = current_database()")
+            row = cur.fetchone()
+        pg_conn.rollback()
+        return dict(zip(_DB_STATS_COLUMNS, row)) if row else None
+    except psycopg2.Error:
+        pg_conn.rollback()
+        return None
+
+
+class JournalingCursor(psycopg2.extensions.cursor):
+    """记录每条语句的耗时与影响行数到所属连接的 job_journal。"""
+
+    def execute(self, query, vars=None):
+        start_time = time.time()
+        try:
+            return super().execute(query, vars)
+        finally:
+            journal = getattr(self.connection, "job_journal", None)
+            if journal is not None and self.query is not None:
+                journal.record_statement(self.query.decode("utf-8", errors="replace"), time.time() - start_time, self.rowcount)
+
+
+class JournaledConnection(psycopg2.extensions.connection):
+    """psycopg2.connect(..., connection_factory=JournaledConnection)；绑定 JobJournal 前与普通连接相同。"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.job_journal: Optional[JobJournal] = None
+        self.cursor_factory = JournalingCursor
+
+
+# --- 历史查询 (任务历史标签页) ---
+
+def list_jobs(limit: int = 200, cohort_table: Optional[str] = None, db_path: str = JOB_HISTORY_DB_PATH) -> List[tuple]:
+    """
+    [(job_id, job_type, cohort_table, description, config_hash, started_at, duration_s, outcome, blks_hit, blks_read, temp_bytes,
+      tuning_profile)]；tuning_profile 为任务使用的会话调优配置说明 (旧记录为 None)
+    """
+    sql = ("SELECT job_id, job_type, cohort_table, description, config_hash, started_at, duration_s, outcome, "
+           "blks_hit, blks_read, temp_bytes, tuning_profile FROM jobs")
+    params: List[Any] = []
+    if cohort_table:
+        sql += " WHERE cohort_table = ?"
+        params.append(cohort_table)
+    sql += " ORDER BY job_id DESC LIMIT ?"
+    params.append(limit)
+    with _connect(db_path) as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def get_job_statements(job_id: int, db_path: str = JOB_HISTORY_DB_PATH) -> List[tuple]:
+    """[(statement_index, label, duration_s, rows_affected, sql_text)]"""
+    with _connect(db_path) as conn:
+        return conn.execute("SELECT statement_index, label, duration_s, rows_affected, sql_text FROM job_statements "
+                            "WHERE job_id = ? ORDER BY statement_index", (job_id,)).fetchall()
+
+
+def compare_job_statements(job_id_a: int, job_id_b: int, db_path: str = JOB_HISTORY_DB_PATH) -> List[Dict[str, Any]]:
+    """
+    两次运行逐条对比 (按语句序号对齐，同配置的任务语句顺序一致):
+    [{"index", "label", "duration_a", "duration_b", "delta_s", "ratio"}]
+    """
+    statements_a = {row[0]: row for row in get_job_statements(job_id_a, db_path)}
+    statements_b = {row[0]: row for row in get_job_statements(job_id_b, db_path)}
+    comparison = []
+    for index in sorted(set(statements_a) | set(statements_b)):
+        row_a, row_b = statements_a.get(index), statements_b.get(index)
+        duration_a = row_a[2] if row_a else None
+        duration_b = row_b[2] if row_b else None
+        delta = duration_b - duration_a if duration_a is not None and duration_b is not None else None
+        comparison.append({"index": index, "label": (row_b or row_a)[1],
+                           "duration_a": duration_a, "duration_b": duration_b, "delta_s": delta,
+                           "ratio": duration_b / duration_a if delta is not None and duration_a > 0 else None})
+    return comparison
+
+
+def summarize_durations_by_description(cohort_table: Optional[str] = None,
+                                       db_path: str = JOB_HISTORY_DB_PATH) -> List[tuple]:
+    """
+    各特征 (任务描述) 的耗时汇总，用于找出主导总提取时间的特征:
+    [(job_type, description, 运行次数, 最近一次耗时, 平均耗时)]，按平均耗时降序。
+    """
+    sql = ("SELECT job_type, description, COUNT(*), "
+           "(SELECT j2.duration_s FROM jobs j2 WHERE j2.job_type = j.job_type AND j2.description = j.description "
+           " AND j2.outcome = ? ORDER BY j2.job_id DESC LIMIT 1), AVG(duration_s) "
+           "FROM jobs j WHERE outcome = ?")
+    params: List[Any] = [JOB_OUTCOME_SUCCESS, JOB_OUTCOME_SUCCESS]
+    if cohort_table:
+        sql += " AND cohort_table = ?"
+        params.append(cohort_table)
+    sql += " GROUP BY job_type, description ORDER BY AVG(duration_s) DESC"
+    with _connect(db_path) as conn:
+        return conn.execute(sql, params).fetchall()
+
+# --- END OF FILE sql_logic/job_history.py ---
@@ -0,0 +1,152 @@
+# --- START OF FILE sql_logic/job_queue.py ---
+import itertools
+import time
+
+from typing import Any, Dict, Iterable, List, Optional
+from app_config import (DEFAULT_JOB_MAX_CONCURRENT, DEFAULT_JOB_MAX_PER_DATABASE, DUCKDB_MAX_CONCURRENT_JOBS,
+                        JOB_LOG_MAX_LINES)
+from sql_logic.db_backend import BACKEND_DUCKDB
+
+# 长任务队列的调度规则 (不依赖 Qt，由 ui_components/job_scheduler.py 驱动):
+#   - 排队的任务按优先级从高到低、同优先级按提交顺序启动；
+#   - 同时运行的任务总数不超过 max_concurrent，同一数据库上不超过 max_per_database (DuckDB 文件为 1)；
+#   - 任务声明其写入的表 (exclusive_keys)。写同一张表的任务严格按提交顺序依次运行，不受优先级影响，
+#     例如先创建队列表、再向其添加列的两个任务不会颠倒或并发；不冲突的后续任务可以越过被阻塞的任务先启动。
+
+JOB_STATE_QUEUED = "queued"
+JOB_STATE_RUNNING = "running"
+JOB_STATE_SUCCEEDED = "succeeded"
+JOB_STATE_FAILED = "failed"
+JOB_STATE_CANCELLED = "cancelled"
+FINISHED_JOB_STATES = (JOB_STATE_SUCCEEDED, JOB_STATE_FAILED, JOB_STATE_CANCELLED)
+
+JOB_PRIORITY_LOW = -1
+JOB_PRIORITY_NORMAL = 0
+JOB_PRIORITY_HIGH = 1
+
+
+def database_key_for(db_params: Optional[Dict[str, Any]]) -> str:
+    """连接参数 -> 数据库标识 (并发上限按此分组)。"""
+    params = db_params or {}
+    if params.get("backend") == BACKEND_DUCKDB:
+        return f"{BACKEND_DUCKDB}:{params.get('database_path') or params.get('local_data_dir', '')}"
+    return f"postgresql://{params.get('host', '')}:{params.get('port', '')}/{params.get('dbname', '')}"
+
+
+class JobQueue:
+    """任务记录为普通字典 (见 submit)；所有方法在同一线程 (GUI 线程) 中调用。"""
+
+    def __init__(self, max_concurrent: int = DEFAULT_JOB_MAX_CONCURRENT,
+                 max_per_database: int = DEFAULT_JOB_MAX_PER_DATABASE):
+        self.max_concurrent = max_concurrent
+        self.max_per_database = max_per_database
+        self._jobs: Dict[int, Dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+
+    def set_limits(self, max_concurrent: int, max_per_database: int) -> None:
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_per_database = max(1, int(max_per_database))
+
+    def database_limit(self, database_key: str) -> int:
+        if database_key.startswith(f"{BACKEND_DUCKDB}:"):
+            return min(self.max_per_database, DUCKDB_MAX_CONCURRENT_JOBS)
+        return self.max_per_database
+
+    def submit(self, title: str, owner: str, database_key: str, priority: int = JOB_PRIORITY_NORMAL,
+               exclusive_keys: Iterable[str] = (), job_type: str = "") -> int:
+        job_id = next(self._ids)
+        self._jobs[job_id] = {
+            "job_id": job_id, "title": title, "owner": owner, "job_type": job_type,
+            "priority": priority, "database_key": database_key, "exclusive_keys": list(exclusive_keys),
+            "state": JOB_STATE_QUEUED, "submitted_at": time.time(), "started_at": None, "finished_at": None,
+            "progress": (0, 0), "message": "", "log": [],
+        }
+        return job_id
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        return [self._jobs[job_id] for job_id in sorted(self._jobs)]
+
+    def active_job_ids(self, owner: Optional[str] = None) -> List[int]:
+        return [job["job_id"] for job in self.jobs()
+                if job["state"] not in FINISHED_JOB_STATES and (owner is None or job["owner"] == owner)]
+
+    def startable_job_ids(self) -> List[int]:
+        """现在可以启动的排队任务 (已考虑并发上限，按启动顺序)；不修改状态。"""
+        running = [job for job in self._jobs.values() if job["state"] == JOB_STATE_RUNNING]
+        free_slots = self.max_concurrent - len(running)
+        per_database: Dict[str, int] = {}
+        for job in running:
+            per_database[job["database_key"]] = per_database.get(job["database_key"], 0) + 1
+        # 写同一张表的任务按提交顺序: 任何更早提交、尚未结束的任务占用的表都视为被占用
+        claimed_before: Dict[int, set] = {}
+        claimed = set()
+        for job_id in sorted(self._jobs):
+            job = self._jobs[job_id]
+            claimed_before[job_id] = set(claimed)
+            if job["state"] not in FINISHED_JOB_STATES:
+                claimed.update(job["exclusive_keys"])
+
+        startable = []
+        queued = sorted((job for job in self._jobs.values() if job["state"] == JOB_STATE_QUEUED),
+                        key=lambda job: (-job["priority"], job["job_id"]))
+        for job in queued:
+            if free_slots <= 0:
+                break
+            database_key = job["database_key"]
+            if per_database.get(database_key, 0) >= self.database_limit(database_key):
+                continue
+            if claimed_before[job["job_id"]] & set(job["exclusive_keys"]):
+                continue
+            startable.append(job["job_id"])
+            free_slots -= 1
+            per_database[database_key] = per_database.get(database_key, 0) + 1
+        return startable
+
+    def queue_position(self, job_id: int) -> Optional[int]:
+        """排队任务在启动顺序中的位置 (从 1 开始)；不在排队时返回 None。"""
+        queued = sorted((job for job in self._jobs.values() if job["state"] == JOB_STATE_QUEUED),
+                        key=lambda job: (-job["priority"], job["job_id"]))
+        for position, job in enumerate(queued, start=1):
+            if job["job_id"] == job_id:
+                return position
+        return None
+
+    def mark_started(self, job_id: int) -> None:
+        job = self._jobs[job_id]
+        job["state"] = JOB_STATE_RUNNING
+        job["started_at"] = time.time()
+
+    def mark_finished(self, job_id: int, state: str, message: Optional[str] = None) -> None:
+        job = self._jobs[job_id]
+        job["state"] = state
+        job["finished_at"] = time.time()
+        if message:
+            job["message"] = message
+
+    def set_priority(self, job_id: int, priority: int) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job["state"] != JOB_STATE_QUEUED:
+            return False
+        job["priority"] = priority
+        return True
+
+    def record_progress(self, job_id: int, done: int, total: int) -> None:
+        self._jobs[job_id]["progress"] = (done, total)
+
+    def append_log(self, job_id: int, message: str) -> None:
+        job = self._jobs[job_id]
+        job["log"].append(message)
+        if len(job["log"]) > JOB_LOG_MAX_LINES:
+            del job["log"][:len(job["log"]) - JOB_LOG_MAX_LINES]
+        job["message"] = message.split("\n", 1)[0]
+
+    def clear_finished(self) -> List[int]:
+        removed = [job_id for job_id, job in self._jobs.items() if job["state"] in FINISHED_JOB_STATES]
+        for job_id in removed:
+            del self._jobs[job_id]
+        return removed
+
+# --- END OF FILE sql_logic/job_queue.py ---
@@ -0,0 +1,154 @@
+# --- START OF FILE sql_logic/parallel_index_build.py ---
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app_config import COHORT_INDEX_BUILD_PARALLELISM, INDEX_BUILD_TUNING_PROFILE
+from sql_logic.db_backend import connect_database, backend_of, BACKEND_DUCKDB, DATABASE_ERRORS
+from sql_logic.job_control import apply_job_timeouts, apply_session_tuning, cancel_backend_query
+from sql_logic.sql_builder_cohort import (build_cohort_index_statements, build_existing_columns_sql,
+                                          ESSENTIAL_COHORT_INDEX_COLUMNS)
+from sql_logic.sql_render import render_sql
+
+# 队列表提交后并行建索引: 建表事务中逐个建索引时，每个索引都要单独完整扫描一遍表，且全部串行。
+# 提交后用几个独立的自动提交连接同时构建 (CREATE INDEX 持有的 SHARE 锁彼此兼容，同一张表上可以并行)，
+# 每个连接按索引构建配置设置 maintenance_work_mem / 并行 worker，从共享的待建列表中依次取下一个索引。
+# 不使用 CREATE INDEX CONCURRENTLY: 表刚刚创建，写入同一张表的后续任务在任务队列中排在本任务之后，
+# 普通 CREATE INDEX 不阻塞读取，CONCURRENTLY 反而要多扫描一遍表并等待其他事务结束。
+# 某个索引失败不影响其他索引 (表已提交)，由调用方决定如何报告。
+
+
+class ParallelIndexBuilder:
+    """一次构建一组索引；cancel() 可从其他线程调用，取消所有连接上正在执行的语句并跳过尚未开始的索引。"""
+
+    def __init__(self, db_params: Dict[str, Any], job_timeouts: Optional[Dict[str, int]] = None,
+                 parallelism: int = COHORT_INDEX_BUILD_PARALLELISM, log: Callable[[str], None] = print,
+                 connect: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        self.db_params = db_params
+        self.job_timeouts = job_timeouts
+        self.parallelism = max(1, int(parallelism))
+        self.log = log
+        self.connect = connect or connect_database
+        self.is_cancelled = False
+        self._conns: List[Any] = []
+        self._lock = threading.Lock()
+
+    def cancel(self) -> bool:
+        self.is_cancelled = True
+        with self._lock:
+            conns = list(self._conns)
+        return any([cancel_backend_query(conn) for conn in conns])
+
+    def build(self, index_statements: List[Tuple[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        index_statements: [(索引名, CREATE INDEX 语句)]。
+        返回按输入顺序的 [{"index_name", "sql_text", "duration_s", "error"}]；被取消而未执行的索引不在结果中。
+        """
+        pending: "queue.Queue[Tuple[int, str, Any]]" = queue.Queue()
+        for position, (index_name, index_sql) in enumerate(index_statements):
+            pending.put((position, index_name, index_sql))
+        results: Dict[int, Dict[str, Any]] = {}
+        worker_count = min(self.parallelism, len(index_statements))
+        if worker_count == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=worker_count) as executor:
+            for future in [executor.submit(self._drain, pending, results) for _ in range(worker_count)]:
+                future.result()
+        return [results[position] for position in sorted(results)]
+
+    def _drain(self, pending: "queue.Queue[Tuple[int, str, Any]]", results: Dict[int, Dict[str, Any]]) -> None:
+        conn = None
+        try:
+            while not self.is_cancelled:
+                try:
+                    position, index_name, index_sql = pending.get_nowait()
+                except queue.Empty:
+                    return
+                if self.is_cancelled:
+                    return
+                sql_text = render_sql(index_sql)
+                result = {"index_name": index_name, "sql_text": sql_text, "duration_s": 0.0, "error": None}
+                start_time = time.time()
+                try:
+                    if conn is None:
+                        conn = self._open_connection()
+                    with conn.cursor() as cur:
+                        cur.execute(sql_text)
+                    result["duration_s"] = time.time() - start_time
+                    self.log(f"    索引 {index_name} 创建完成 ({result['duration_s']:.1f} 秒)。")
+                except DATABASE_ERRORS as e:
+                    result["duration_s"] = time.time() - start_time
+                    result["error"] = "已取消" if self.is_cancelled else str(e).strip()
+                    if not self.is_cancelled:
+                        self.log(f"    索引 {index_name} 创建失败: {result['error']}")
+                    if conn is not None and conn.closed: # 连接已断开: 下一个索引重新连接
+                        self._forget(conn)
+                        conn = None
+                results[position] = result
+        finally:
+            if conn is not None:
+                self._forget(conn)
+                conn.close()
+
+    def _forget(self, conn: Any) -> None:
+        with self._lock:
+            if conn in self._conns:
+                self._conns.remove(conn)
+
+    def _open_connection(self) -> Any:
+        conn = self.connect(self.db_params)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                apply_job_timeouts(cur, self.job_timeouts)
+                apply_session_tuning(cur, INDEX_BUILD_TUNING_PROFILE)
+        except BaseException:
+            conn.close()  # 设置失败的连接不交给调用方，也不登记到可取消的连接中
+            raise
+        with self._lock:
+            self._conns.append(conn)
+        return conn
+
+
+class CommittedInterruptedError(InterruptedError):
+    """队列表已提交后 (建索引阶段) 被取消: 不再回滚，只报告索引未全部创建。"""
+
+
+def plan_cohort_indexes(cursor: Any, target_table_name: str, source_type: str,
+                        essential_only: bool = False) -> List[Tuple[str, Any]]:
+    """在建表事务内 (提交前) 用一次目录查询取队列表实际存在的列，返回要在提交后构建的 [(索引名, CREATE INDEX 语句)]。"""
+    cursor.execute(build_existing_columns_sql(), (target_table_name,))
+    index_columns = {row[0] for row in cursor.fetchall()}
+    if essential_only:
+        index_columns &= set(ESSENTIAL_COHORT_INDEX_COLUMNS)
+    return build_cohort_index_statements(target_table_name, source_type, index_columns)
+
+
+def build_indexes_after_commit(worker: Any, index_statements: List[Tuple[str, Any]], journal: Any) -> None:
+    """
+    队列创建 worker 提交后的建索引步骤；失败的索引只记为警告 (表已可用，后续提取不受影响，只是连接变慢)。
+    worker 需提供 db_params、job_timeouts、is_cancelled、log.emit，构建器保存在 worker.index_builder 供 cancel() 使用。
+    """
+    if backend_of(worker.db_params) == BACKEND_DUCKDB:
+        worker.log.emit("    本地数据库后端不需要创建索引。")
+        return
+    if not index_statements:
+        worker.log.emit("    没有需要创建的索引。")
+        return
+    worker.log.emit(f"    使用最多 {COHORT_INDEX_BUILD_PARALLELISM} 个连接并行创建 {len(index_statements)} 个索引...")
+    worker.index_builder = ParallelIndexBuilder(worker.db_params, worker.job_timeouts, log=worker.log.emit)
+    if worker.is_cancelled: raise CommittedInterruptedError("操作已取消")
+    build_start_time = time.time()
+    results = worker.index_builder.build(index_statements)
+    for result in results:
+        journal.record_statement(result["sql_text"], result["duration_s"], None)
+    if worker.is_cancelled: raise CommittedInterruptedError("操作已取消")
+    failed = [result["index_name"] for result in results if result["error"]]
+    if failed:
+        worker.log.emit(f"警告: {len(failed)} 个索引创建失败 (队列表已创建，可稍后重新创建): {', '.join(failed)}")
+    else:
+        worker.log.emit(f"所有索引创建完毕，用时 {time.time() - build_start_time:.1f} 秒。")
+
+# --- END OF FILE sql_logic/parallel_index_build.py ---
@@ -0,0 +1,218 @@
+# --- START OF FILE sql_logic/parquet_ingest.py ---
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from sql_logic.sql_render import quote_literal, quote_identifier
+from sql_logic.db_backend import duckdb
+from app_config import (MIMIC_MODULE_SCHEMAS, PARQUET_PARTITION_COLUMN, PARQUET_PARTITION_SPECS, PARQUET_COLUMN_TYPES,
+                        PARQUET_ROW_GROUP_SIZE, PARQUET_COMPRESSION, DEFAULT_INGEST_MEMORY_LIMIT,
+                        DEFAULT_INGEST_PARALLEL_TABLES, DEFAULT_TIME_COLUMN)
+
+# MIMIC-IV CSV.gz -> Parquet 转换 (本地 DuckDB 后端的数据来源，见 db_backend.py):
+#   python -m sql_logic.parquet_ingest <MIMIC-IV 目录 (含 hosp/ icu/)> <输出目录> [--tables chartevents labevents ...]
+# - 流式读取: DuckDB 按块解压解析 CSV，不把整表读入内存；memory_limit 限制峰值内存，排序超出部分溢出到磁盘；
+# - 列类型: PARQUET_COLUMN_TYPES 中的列 (id、valuenum、charttime、代码列等) 固定类型，其余按样本推断；
+# - 分区: PARQUET_PARTITION_SPECS 中的表按 itemid 分桶或 subject_id 哈希分桶 (目录 part_bucket=N)，
+#   桶内按分区键排序写入，每个行组带 min/max 统计，查询单个 itemid 时可跳过绝大多数行组；
+# - 并行: 同时转换多张表 (共享同一个 DuckDB 实例的内存上限)，每张表内部由 DuckDB 多线程执行；
+# - 可续做: 每张表先写入临时目录，完成后原子改名并记入 _ingest_manifest.json (源文件大小与修改时间)；
+#   再次运行时跳过源文件未变化的表，中断的表从头重新转换 (续做粒度为整张表)。
+
+MANIFEST_FILE_NAME = "_ingest_manifest.json"
+SPILL_DIR_NAME = ".ingest_spill"
+_TEMP_PREFIX = ".ingest_tmp_"
+_CSV_SUFFIX = ".csv.gz"
+
+
+def discover_csv_tables(source_dir: str, tables: Optional[Sequence[str]] = None) -> List[Tuple[str, str, str]]:
+    """[(模块, 表名, CSV.gz 路径)]；tables 为空时转换 hosp/ 与 icu/ 下的全部表。"""
+    found = []
+    for module in MIMIC_MODULE_SCHEMAS:
+        module_dir = os.path.join(source_dir, module)
+        if not os.path.isdir(module_dir):
+            continue
+        for entry in sorted(os.listdir(module_dir)):
+            if not entry.endswith(_CSV_SUFFIX):
+                continue
+            table = entry[:-len(_CSV_SUFFIX)]
+            if not tables or table in tables:
+                found.append((module, table, os.path.join(module_dir, entry)))
+    return found
+
+
+def read_csv_header(csv_path: str) -> List[str]:
+    with gzip.open(csv_path, "rt", encoding="utf-8") as f:
+        return [name.strip().strip('"') for name in f.readline().rstrip("\r\n").split(",")]
+
+
+def output_path_for(output_dir: str, module: str, table: str) -> str:
+    """分区表 -> 目录 <模块>/<表>；其他表 -> 文件 <模块>/<表>.parquet (与 db_backend 的目录约定一致)。"""
+    if table in PARQUET_PARTITION_SPECS:
+        return os.path.join(output_dir, module, table)
+    return os.path.join(output_dir, module, f"{table}.parquet")
+
+
+def _partition_expression(column: str, buckets: int) -> str:
+    if column == "itemid":
+        return f"{quote_identifier(column)} % {int(buckets)}"
+    return f"hash({quote_identifier(column)}) % {int(buckets)}"
+
+
+def build_ingest_sql(csv_path: str, output_path: str, columns: Sequence[str], table: str,
+                     row_group_size: int = PARQUET_ROW_GROUP_SIZE) -> str:
+    """单张表的 COPY 语句 (DuckDB)。"""
+    types = {col: PARQUET_COLUMN_TYPES[col] for col in columns if col in PARQUET_COLUMN_TYPES}
+    types_sql = "{" + ", ".join(f"{quote_literal(col)}: {quote_literal(col_type)}" for col, col_type in types.items()) + "}"
+    source = (f"read_csv({quote_literal(csv_path.replace(os.sep, '/'))}, header = true, compression = 'gzip'"
+              + (f", types = {types_sql}" if types else "") + ")")
+    options = f"FORMAT PARQUET, COMPRESSION {PARQUET_COMPRESSION}, ROW_GROUP_SIZE {int(row_group_size)}"
+    target = quote_literal(output_path.replace(os.sep, "/"))
+    if table not in PARQUET_PARTITION_SPECS:
+        return f"COPY (SELECT * FROM {source}) TO {target} ({options})"
+    partition_column, buckets = PARQUET_PARTITION_SPECS[table]
+    sort_columns = [partition_column] + [col for col in ("subject_id", "stay_id", DEFAULT_TIME_COLUMN)
+                                         if col in columns and col != partition_column]
+    return (f"COPY (SELECT *, {_partition_expression(partition_column, buckets)} AS {PARQUET_PARTITION_COLUMN} "
+            f"FROM {source} ORDER BY {', '.join(quote_identifier(col) for col in sort_columns)}) "
+            f"TO {target} ({options}, PARTITION_BY ({PARQUET_PARTITION_COLUMN}))")
+
+
+def source_signature(csv_path: str) -> List[int]:
+    stat = os.stat(csv_path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def load_manifest(output_dir: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(output_dir: str, manifest: Dict[str, Any]) -> None:
+    path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def is_up_to_date(manifest: Dict[str, Any], output_dir: str, module: str, table: str, csv_path: str) -> bool:
+    entry = manifest.get(f"{module}/{table}")
+    return (entry is not None and entry.get("source_signature") == source_signature(csv_path)
+            and os.path.exists(output_path_for(output_dir, module, table)))
+
+
+def _remove_path(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def ingest_table(cursor: Any, csv_path: str, output_dir: str, module: str, table: str) -> int:
+    """转换一张表到临时位置，完成后替换正式输出。返回行数。"""
+    final_path = output_path_for(output_dir, module, table)
+    temp_path = os.path.join(os.path.dirname(final_path), _TEMP_PREFIX + os.path.basename(final_path))
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    _remove_path(temp_path)
+    try:
+        row = cursor.execute(build_ingest_sql(csv_path, temp_path, read_csv_header(csv_path), table)).fetchone()
+    except BaseException:
+        _remove_path(temp_path)
+        raise
+    _remove_path(final_path)
+    os.replace(temp_path, final_path)
+    return row[0] if row else 0
+
+
+def run_ingestion(source_dir: str, output_dir: str, tables: Optional[Sequence[str]] = None,
+                  parallel_tables: int = DEFAULT_INGEST_PARALLEL_TABLES, threads: int = 0,
+                  memory_limit: str = DEFAULT_INGEST_MEMORY_LIMIT, force: bool = False,
+                  log: Callable[[str], None] = print) -> Dict[str, str]:
+    """转换 source_dir 下的 MIMIC-IV 表。返回 {模块/表: "converted" / "skipped" / 错误信息}。"""
+    if duckdb is None:
+        raise ImportError("CSV.gz -> Parquet 转换需要安装 duckdb (pip install duckdb)。")
+    work = discover_csv_tables(source_dir, tables)
+    if not work:
+        raise FileNotFoundError(f"在 {source_dir} 下没有找到 hosp/ 或 icu/ 模块的 *.csv.gz 文件。")
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    manifest_lock = threading.Lock()
+    results: Dict[str, str] = {}
+
+    pending = []
+    for module, table, csv_path in work:
+        if not force and is_up_to_date(manifest, output_dir, module, table, csv_path):
+            results[f"{module}/{table}"] = "skipped"
+            log(f"跳过 {module}/{table} (源文件未变化，已转换)")
+        else:
+            pending.append((module, table, csv_path))
+
+    spill_dir = os.path.join(output_dir, SPILL_DIR_NAME)
+    database = duckdb.connect()
+    database.execute(f"SET memory_limit = {quote_literal(memory_limit)}")
+    database.execute(f"SET temp_directory = {quote_literal(spill_dir.replace(os.sep, '/'))}")
+    if threads:
+        database.execute(f"SET threads = {int(threads)}")
+
+    def convert(module: str, table: str, csv_path: str) -> int:
+        start_time = time.time()
+        log(f"开始转换 {module}/{table} ...")
+        cursor = database.cursor()  # 同一实例的独立连接: 可并行执行，共享内存上限
+        try:
+            rows = ingest_table(cursor, csv_path, output_dir, module, table)
+        finally:
+            cursor.close()
+        with manifest_lock:
+            manifest[f"{module}/{table}"] = {"source_signature": source_signature(csv_path), "rows": rows,
+                                             "partition": PARQUET_PARTITION_SPECS.get(table), "finished_at": time.time()}
+            save_manifest(output_dir, manifest)
+        log(f"完成 {module}/{table}: {rows} 行，耗时 {time.time() - start_time:.1f} 秒")
+        return rows
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, parallel_tables)) as executor:
+            futures = {executor.submit(convert, *item): f"{item[0]}/{item[1]}" for item in pending}
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    future.result()
+                    results[key] = "converted"
+                except Exception as e:
+                    results[key] = str(e)
+                    log(f"转换 {key} 失败: {e}")
+    finally:
+        database.close()
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    return results
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="把 MIMIC-IV 的 CSV.gz 转换为分区 Parquet (本地 DuckDB 后端使用)。")
+    parser.add_argument("source_dir", help="MIMIC-IV 目录 (包含 hosp/ 与 icu/ 子目录)")
+    parser.add_argument("output_dir", help="Parquet 输出目录 (连接页的本地数据目录)")
+    parser.add_argument("--tables", nargs="*", help="只转换这些表 (默认全部)")
+    parser.add_argument("--parallel-tables", type=int, default=DEFAULT_INGEST_PARALLEL_TABLES, help="同时转换的表数")
+    parser.add_argument("--threads", type=int, default=0, help="DuckDB 线程数 (0 = 全部核心)")
+    parser.add_argument("--memory-limit", default=DEFAULT_INGEST_MEMORY_LIMIT, help="内存上限，如 4GB")
+    parser.add_argument("--force", action="store_true", help="忽略已完成记录，重新转换")
+    args = parser.parse_args(argv)
+    results = run_ingestion(args.source_dir, args.output_dir, args.tables, args.parallel_tables, args.threads,
+                            args.memory_limit, args.force)
+    failed = {key: message for key, message in results.items() if message not in ("converted", "skipped")}
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# --- END OF FILE sql_logic/parquet_ingest.py ---
@@ -0,0 +1,276 @@
+# --- START OF FILE sql_logic/replica_router.py ---
+import re
+import tempfile
+import time
+import psycopg2
+import psycopg2.extensions
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from sql_logic.sql_render import render_sql, quote_identifier
+from sql_logic.job_control import apply_job_timeouts, apply_session_tuning, cancel_backend_query, QueryCanceledError
+from app_config import DEFAULT_REPLICA_MAX_LAG_WAIT_SEC, REPLICA_COPY_SPOOL_MEMORY_BYTES, REPLICA_LOCK_TIMEOUT_MS
+
+# 只读副本路由: 特征计算中开销最大的是只读的扫描与聚合 (FilteredEvents CTE、体重排序、心率 ARV 等)，
+# 这些步骤的形式统一为 CREATE TEMPORARY TABLE t AS <查询>，结果只是每个入院/ICU 住院一行。路由器把它们改为:
+#   1. 在副本上执行 <查询>，用 COPY (<查询>) TO STDOUT 把结果流式取回 (SpooledTemporaryFile，内存有上限)；
+#   2. 在主库上按结果列类型建同名临时表，COPY ... FROM STDIN 写入；之后的 UPDATE 等写操作照常在主库执行。
+# 只有副本已包含主库当前数据时才路由: 流复制备库 (pg_is_in_recovery) 首次路由时等待回放到主库当前 WAL 位置；
+# 此外每个路由步骤前都比较一致性表 (队列表) 的签名 (行数 + 按键排序的 hadm_id/stay_id 的 md5)，
+# 独立实例 (如本地第二个 PostgreSQL) 只靠签名判断。签名不一致后本任务不再路由。
+# 副本上没有主库任务会话中的临时表: 路由器记录本任务创建的临时表 (经过路由器的 CREATE TEMP 语句，以及调用方用
+# note_session_temp_table 登记的表，如窄表模式的队列表副本)，查询引用其中任何一个时该步骤在主库执行。
+# 任务事务中对一致性表有未提交的写 (宽表模式的 ALTER TABLE ADD COLUMN、UPDATE) 时不路由该步骤: 备库回放到
+# 主库当前位置后会持有同样的排他锁，副本上的签名查询只能等待 (并可能与主库任务互相等待)；分块执行每步提交，不受影响。
+# 副本会话的 lock_timeout 被限制在 REPLICA_LOCK_TIMEOUT_MS 以内，副本不可用或执行出错 (含锁等待超时) 时该步骤回退到
+# 主库执行，且本任务之后不再路由；取消与超时 (QueryCanceledError) 不回退，按原有方式结束任务。
+
+_CREATE_TEMP_AS_RE = re.compile(
+    r'^\s*CREATE\s+(?:LOCAL\s+)?TEMP(?:ORARY)?\s+TABLE\s+(?P<name>"(?:[^"]|"")+"|\w+)\s+AS\s+(?P<query>.*)$',
+    re.IGNORECASE | re.DOTALL)
+_CREATED_TEMP_TABLE_RE = re.compile(
+    r'\bCREATE\s+(?:LOCAL\s+)?TEMP(?:ORARY)?\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(?P<name>"(?:[^"]|"")+"|\w+)',
+    re.IGNORECASE)
+_LEADING_COMMENTS_RE = re.compile(r'^(?:\s*--[^\n]*(?:\n|$))+')
+_QUERY_START_RE = re.compile(r'^(?:\s*--[^\n]*\n)*\s*(SELECT|WITH|VALUES)\b', re.IGNORECASE)
+
+
+def parse_replica_endpoints(text: str, primary_params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    连接页的副本列表 (每行一个: host[:port] 或 libpq 格式 "host=... port=... dbname=...") -> 连接参数列表。
+    未写出的参数 (库名、用户、密码等) 与主库相同；# 开头的行为注释。
+    """
+    endpoints = []
+    for line in (text or "").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        params = {k: v for k, v in primary_params.items() if k != "backend"}
+        if "=" in line:
+            params.update(psycopg2.extensions.parse_dsn(line))
+        else:
+            host, _, port = line.partition(":")
+            params["host"] = host.strip()
+            if port.strip():
+                params["port"] = port.strip()
+        endpoints.append(params)
+    return endpoints
+
+
+def match_temp_table_materialization(sql_text: str) -> Optional[Tuple[str, str]]:
+    """'CREATE TEMPORARY TABLE t AS (<查询>);' -> (表名, 查询)；不是这种形式时返回 None。"""
+    match = _CREATE_TEMP_AS_RE.match(_LEADING_COMMENTS_RE.sub("", sql_text))
+    if not match:
+        return None
+    query = match.group("query").strip()
+    if query.endswith(";"):
+        query = query[:-1].rstrip()
+    if query.startswith("(") and query.endswith(")"):
+        query = query[1:-1].strip()
+    if not _QUERY_START_RE.match(query):
+        return None
+    return match.group("name"), query
+
+
+def normalize_table_name(name: str) -> str:
+    """SQL 中的表名 -> 目录中的名称: 带引号的去掉引号，不带引号的转为小写 (与 PostgreSQL 的规则一致)。"""
+    if name.startswith('"') and name.endswith('"'):
+        return name[1:-1].replace('""', '"')
+    return name.lower()
+
+
+def find_created_temp_tables(sql_text: str) -> List[str]:
+    """语句中 CREATE TEMPORARY TABLE 创建的表名 (已规范化)。"""
+    return [normalize_table_name(match.group("name")) for match in _CREATED_TEMP_TABLE_RE.finditer(sql_text)]
+
+
+def references_table(query: str, table_name: str) -> bool:
+    """查询文本是否 (按标识符) 引用了该表名；宁可误判为引用 (回退主库执行)，不漏判。"""
+    quoted = re.escape('"' + table_name.replace('"', '""') + '"')
+    if re.search(quoted, query):
+        return True
+    if table_name != table_name.lower():
+        return False  # 含大写字母的表名只能以带引号的形式引用
+    return re.search(rf'(?<![\w"]){re.escape(table_name)}(?![\w"])', query, re.IGNORECASE) is not None
+
+
+CONSISTENCY_KEY_COLUMNS = ("hadm_id", "stay_id")
+
+
+def build_consistency_signature_sql(table_full_name: str) -> str:
+    """一致性表的签名: (行数, 按键排序拼接后的 md5)。只用队列表创建时就有的键列，主库任务中新增的特征列不参与。"""
+    key_text = " || ':' || ".join(f"COALESCE({quote_identifier(column)}::text, '')" for column in CONSISTENCY_KEY_COLUMNS)
+    order_by = ", ".join(quote_identifier(column) for column in CONSISTENCY_KEY_COLUMNS)
+    table = ".".join(quote_identifier(part) for part in table_full_name.split("."))
+    return (f"SELECT COUNT(*) AS replica_consistency_rows, "
+            f"md5(COALESCE(string_agg({key_text}, ',' ORDER BY {order_by}), '')) AS replica_consistency_md5 FROM {table}")
+
+
+def build_pending_write_check_sql() -> str:
+    """当前会话是否持有一致性表上 (读锁以外) 的表级锁，即本事务对该表有未提交的 DDL/DML。参数: 表的 regclass 文本。"""
+    return ("SELECT EXISTS (SELECT 1 FROM pg_locks WHERE pid = pg_backend_pid() AND locktype = 'relation' "
+            "AND relation = to_regclass(%s) AND mode <> 'AccessShareLock') AS replica_pending_write")
+
+
+def build_temp_table_definition_sql(table_name: str, columns: List[Tuple[str, str]]) -> str:
+    """主库上接收副本结果的临时表: 列名与 format_type 得到的类型 (无长度修饰)。"""
+    column_defs = ", ".join(f"{quote_identifier(name)} {type_name}" for name, type_name in columns)
+    return f"CREATE TEMPORARY TABLE {table_name} ({column_defs})"
+
+
+class ReplicaRouter:
+    """一个任务使用一个路由器: 首次路由时连接第一个可用的副本并等待其跟上主库，之后每个路由步骤前核对一致性表签名。"""
+
+    def __init__(self, replica_params: List[Dict[str, Any]], max_lag_wait_s: float = DEFAULT_REPLICA_MAX_LAG_WAIT_SEC,
+                 consistency_table: Optional[str] = None, job_timeouts: Optional[Dict[str, int]] = None,
+                 log: Callable[[str], None] = print, tuning_profile: Optional[str] = None):
+        self.replica_params = replica_params
+        self.max_lag_wait_s = max_lag_wait_s
+        self.consistency_table = consistency_table  # "schema.table"；每个路由步骤前核对签名
+        self.job_timeouts = job_timeouts
+        self.tuning_profile = tuning_profile  # 与主库任务连接相同的会话调优配置
+        self.log = log
+        self.conn = None
+        self.is_usable: Optional[bool] = None  # None: 尚未检查
+        self.pending_write_logged = False
+        self.session_temp_tables: set = set()  # 本任务在主库会话中创建的临时表 (副本上不存在)
+
+    @classmethod
+    def from_settings(cls, replica_settings: Optional[Dict[str, Any]], consistency_table: Optional[str] = None,
+                      job_timeouts: Optional[Dict[str, int]] = None,
+                      log: Callable[[str], None] = print, tuning_profile: Optional[str] = None) -> Optional["ReplicaRouter"]:
+        """连接页的副本设置 {"endpoints": [...], "max_lag_wait_s": N}；未配置副本时返回 None。"""
+        if not replica_settings or not replica_settings.get("endpoints"):
+            return None
+        return cls(replica_settings["endpoints"], replica_settings.get("max_lag_wait_s", DEFAULT_REPLICA_MAX_LAG_WAIT_SEC),
+                   consistency_table, job_timeouts, log, tuning_profile)
+
+    def _connect(self) -> Optional[Any]:
+        for params in self.replica_params:
+            try:
+                conn = psycopg2.connect(**params)
+                conn.set_session(readonly=True, autocommit=True)
+                with conn.cursor() as cur:
+                    apply_job_timeouts(cur, self.job_timeouts)
+                    apply_session_tuning(cur, self.tuning_profile)
+                    lock_timeout_ms = int((self.job_timeouts or {}).get("lock_timeout_ms") or 0)
+                    if lock_timeout_ms <= 0 or lock_timeout_ms > REPLICA_LOCK_TIMEOUT_MS:
+                        cur.execute("SET lock_timeout = %s", (REPLICA_LOCK_TIMEOUT_MS,))
+                self.log(f"已连接只读副本 {params.get('host')}:{params.get('port', '')}。")
+                return conn
+            except psycopg2.Error as e:
+                self.log(f"无法连接只读副本 {params.get('host')}: {e}")
+        return None
+
+    def note_session_temp_table(self, table_name: str) -> None:
+        """登记不经过路由器创建的主库会话临时表 (表名按目录中的名称)，之后引用它的查询不路由。"""
+        self.session_temp_tables.add(table_name)
+
+    def _has_pending_write(self, primary_cur: Any) -> bool:
+        if not self.consistency_table:
+            return False
+        table = ".".join(quote_identifier(part) for part in self.consistency_table.split("."))
+        primary_cur.execute(build_pending_write_check_sql(), (table,))
+        return bool(primary_cur.fetchone()[0])
+
+    def _primary_state(self, primary_cur: Any) -> Dict[str, Any]:
+        """主库当前 WAL 位置 (仅首次检查) 与一致性表签名 (在任务事务中查询；出错不吞掉，由任务按原有方式处理)。"""
+        state = {"lsn": None, "signature": None}
+        if self.is_usable is None:
+            primary_cur.execute("SELECT pg_current_wal_lsn()::text")
+            state["lsn"] = primary_cur.fetchone()[0]
+        if self.consistency_table:
+            primary_cur.execute(build_consistency_signature_sql(self.consistency_table))
+            state["signature"] = tuple(primary_cur.fetchone())
+        return state
+
+    def _replica_is_current(self, primary_state: Dict[str, Any], replica_cur: Any) -> bool:
+        if primary_state["lsn"] is not None:
+            replica_cur.execute("SELECT pg_is_in_recovery()")
+            if replica_cur.fetchone()[0]:
+                deadline = time.time() + self.max_lag_wait_s
+                while True:
+                    replica_cur.execute("SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn", (primary_state["lsn"],))
+                    if replica_cur.fetchone()[0]:
+                        break
+                    if time.time() >= deadline:
+                        self.log(f"只读副本回放落后于主库超过 {self.max_lag_wait_s} 秒，本任务在主库执行。")
+                        return False
+                    time.sleep(0.5)
+        if primary_state["signature"] is None:
+            return True
+        replica_cur.execute(build_consistency_signature_sql(self.consistency_table))
+        if tuple(replica_cur.fetchone()) != primary_state["signature"]:
+            self.log(f"只读副本中的 {self.consistency_table} 与主库不一致 (行数或 hadm_id/stay_id 校验和不同)，"
+                     f"本任务之后的步骤在主库执行。")
+            return False
+        return True
+
+    def try_materialize(self, primary_cur: Any, sql: Any, params: Optional[Any] = None) -> bool:
+        """
+        能路由时在副本计算 CREATE TEMPORARY TABLE 的查询并在主库建表写入结果，返回 True；
+        否则返回 False，由调用方在主库照常执行原语句。
+        """
+        sql_text = render_sql(sql)
+        matched = match_temp_table_materialization(sql_text)
+        referenced = [name for name in sorted(self.session_temp_tables)
+                      if matched is not None and references_table(matched[1], name)]
+        self.session_temp_tables.update(find_created_temp_tables(sql_text))
+        if matched is None or self.is_usable is False:
+            return False
+        table_name, query = matched
+        if referenced:
+            self.log(f"临时表 {table_name} 的查询引用了本任务会话中的临时表 {', '.join(referenced)}，该步骤在主库执行。")
+            return False
+        if self._has_pending_write(primary_cur):
+            if not self.pending_write_logged:
+                self.log(f"本任务对 {self.consistency_table} 有未提交的修改，副本上查询会等待该表的锁，相关步骤在主库执行。")
+                self.pending_write_logged = True
+            return False
+        if self.conn is None:
+            self.conn = self._connect()
+            if self.conn is None:
+                self.is_usable = False
+                return False
+        # 每个步骤前都核对: 任务中途的提交 (分块更新等) 之后副本可能不再与主库一致
+        primary_state = self._primary_state(primary_cur)
+        spool = tempfile.SpooledTemporaryFile(max_size=REPLICA_COPY_SPOOL_MEMORY_BYTES)
+        try:
+            replica_cur = self.conn.cursor()
+            self.is_usable = self._replica_is_current(primary_state, replica_cur)
+            if not self.is_usable:
+                spool.close()
+                return False
+            query_text = replica_cur.mogrify(query, params).decode("utf-8") if params else query
+            start_time = time.time()
+            replica_cur.execute(f"SELECT * FROM ({query_text}\n) routed_query LIMIT 0")
+            names = [column.name for column in replica_cur.description]
+            replica_cur.execute("SELECT format_type(t.oid, NULL) FROM unnest(%s::oid[]) WITH ORDINALITY AS t(oid, n) ORDER BY t.n",
+                                ([column.type_code for column in replica_cur.description],))
+            columns = list(zip(names, [row[0] for row in replica_cur.fetchall()]))
+            replica_cur.copy_expert(f"COPY ({query_text}\n) TO STDOUT", spool)
+        except QueryCanceledError:
+            spool.close()
+            raise
+        except psycopg2.Error as e:
+            spool.close()
+            self.is_usable = False
+            self.log(f"只读副本执行失败，该步骤及本任务之后的步骤在主库执行: {str(e).strip()}")
+            return False
+        with spool:
+            transfer_bytes = spool.tell()
+            spool.seek(0)
+            primary_cur.execute(build_temp_table_definition_sql(table_name, columns))
+            primary_cur.copy_expert(f"COPY {table_name} FROM STDIN", spool)
+        self.log(f"临时表 {table_name} 已由只读副本计算 (耗时 {time.time() - start_time:.2f} 秒，"
+                 f"传回 {transfer_bytes / 1024:.0f} KB)。")
+        return True
+
+    def cancel(self) -> bool:
+        return cancel_backend_query(self.conn)
+
+    def close(self) -> None:
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = None
+
+# --- END OF FILE sql_logic/replica_router.py ---
@@ -0,0 +1,280 @@
+# --- START OF FILE sql_logic/sql_builder_cohort.py ---
+import hashlib
+import json
+import psycopg2.sql as pgsql
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 与 tabs/tab_query_cohort.py 中的常量保持一致
+COHORT_TYPE_FIRST_EVENT_KEY = "first_event_admission"
+COHORT_TYPE_ALL_EVENTS_KEY = "all_event_admissions"
+MODE_PROCEDURE_KEY = "procedure"
+
+COHORT_SCHEMA = "mimiciv_data"
+BATCH_MATCHES_TEMP_TABLE = "batch_event_matches_temp_cohort_q"
+BATCH_SELECTED_TEMP_TABLE = "batch_selected_event_ad_temp_cohort_q"
+BATCH_ICU_TEMP_TABLE = "batch_first_icu_stays_temp_cohort_q"
+# 后续提取 (基础数据、专项数据) 连接队列表时实际使用的列；可选只为这些列建索引以缩短建表时间
+ESSENTIAL_COHORT_INDEX_COLUMNS = ("hadm_id", "stay_id")
+
+
+def cohort_index_columns(source_type: str) -> List[Tuple[str, str]]:
+    """队列表上要建立的索引: [(索引名后缀, 列名)]。"""
+    columns = [("sub", "subject_id"), ("hadm", "hadm_id"), ("stay", "stay_id"), ("admt", "admittime"),
+               ("icuin", "icu_intime"), ("evcode", "qualifying_event_code"), ("evvers", "qualifying_event_icd_version")]
+    if source_type == MODE_PROCEDURE_KEY:
+        columns.append(("pdxcode", "primary_diag_code"))
+    return columns
+
+
+def cohort_index_name(target_table_name: str, suffix: str) -> str:
+    """
+    队列表索引名: idx_<表名>_<表名哈希>_<后缀>。索引名在 schema 内唯一，只截断表名会让前缀相同的队列表
+    (如批量创建的 first_sepsis_v1_admissions / first_sepsis_v2_admissions) 得到相同的索引名；
+    表名过长时截断表名部分，哈希保证不同表的索引名不同，总长度不超过 63 字节 (PostgreSQL 标识符上限)。
+    """
+    tail = f"_{hashlib.sha1(target_table_name.encode('utf-8')).hexdigest()[:8]}_{suffix}"
+    head = f"idx_{target_table_name}".encode("utf-8")[:63 - len(tail.encode("utf-8"))].decode("utf-8", errors="ignore")
+    return head + tail
+
+
+def build_cohort_index_statements(target_table_name: str, source_type: str,
+                                  index_columns: Optional[Iterable[str]] = None) -> List[Tuple[str, Any]]:
+    """
+    返回 [(索引名, CREATE INDEX 语句)]，单个与批量队列创建共用，索引名见 cohort_index_name。
+    index_columns 给出时只为其中的列建索引 (如 ESSENTIAL_COHORT_INDEX_COLUMNS，或队列表中实际存在的列)。
+    """
+    target_table_ident = pgsql.Identifier(COHORT_SCHEMA, target_table_name)
+    wanted_columns = None if index_columns is None else set(index_columns)
+    statements = []
+    for suffix, column_name in cohort_index_columns(source_type):
+        if wanted_columns is not None and column_name not in wanted_columns:
+            continue
+        index_name = cohort_index_name(target_table_name, suffix)
+        statements.append((index_name, pgsql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} ({});").format(
+            pgsql.Identifier(index_name), target_table_ident, pgsql.Identifier(column_name))))
+    return statements
+
+
+def build_existing_columns_sql() -> Any:
+    """队列表实际存在的列 (一次目录查询，参数: 表名)。"""
+    return pgsql.SQL("SELECT column_name FROM information_schema.columns WHERE table_schema = {} AND table_name = %s").format(
+        pgsql.Literal(COHORT_SCHEMA))
+
+
+def build_cohort_analyze_sql(target_table_name: str) -> Any:
+    """新建的队列表在提交前 ANALYZE (索引在提交后并行构建，普通 B-tree 索引不依赖统计信息): 之后的提取任务都以队列表驱动连接，没有统计信息时规划器只能猜测行数。"""
+    return pgsql.SQL("ANALYZE {};").format(pgsql.Identifier(COHORT_SCHEMA, target_table_name))
+
+
+def build_batch_cohort_sql(cohort_specs: List[Dict[str, Any]],
+                           source_mode_details: Dict[str, Any]) -> Tuple[Optional[List[Tuple[str, Any, Optional[list]]]], Optional[str]]:
+    """
+    批量创建多个队列 (同一来源: 诊断或操作)，对事件表只扫描一次。
+    cohort_specs: [{"table_name", "condition_sql", "condition_params", "admission_type"}]，队列编号为列表下标 + 1。
+    步骤:
+      1. 在字典表上为每个代码标记其满足的队列编号数组 (条件作用于字典列，如 long_title)，
+         与事件表、admissions 连接一次，得到所有队列的候选事件行 (带 cohort_ids)；
+      2. 展开 cohort_ids，按 (队列编号, subject_id) 排名；"首次事件" 队列只保留排名第一的行；
+      3. 为所有涉及的入院只计算一次首次 ICU 入住；
+      4. 每个队列从共享临时表按编号 CREATE TABLE AS。
+    每个临时表建好后立即 ANALYZE，后续步骤按实际行数选择连接方式。
+    返回 ([(步骤描述, SQL, 参数)], 错误信息)。索引语句见 build_cohort_index_statements，统计信息见 build_cohort_analyze_sql。
+    """
+    if not cohort_specs:
+        return None, "批量列表为空。"
+    table_names = [spec.get("table_name") for spec in cohort_specs]
+    if any(not name for name in table_names) or len(set(table_names)) != len(table_names):
+        return None, "批量列表中的目标表名为空或重复。"
+    for spec in cohort_specs:
+        if not (spec.get("condition_sql") or "").strip():
+            return None, f"队列 '{spec.get('table_name')}' 缺少筛选条件。"
+        if spec.get("admission_type") not in (COHORT_TYPE_FIRST_EVENT_KEY, COHORT_TYPE_ALL_EVENTS_KEY):
+            return None, f"队列 '{spec.get('table_name')}' 的入院类型未知: {spec.get('admission_type')}"
+
+    event_table_ident = pgsql.Identifier(*source_mode_details["event_table"].split('.'))
+    dict_table_ident = pgsql.Identifier(*source_mode_details["dictionary_table"].split('.'))
+    event_code_col_ident = pgsql.Identifier(source_mode_details["event_icd_col"])
+    dict_code_col_ident = pgsql.Identifier(source_mode_details["dict_icd_col"])
+    dict_title_col_ident = pgsql.Identifier(source_mode_details.get("dict_title_col") or "long_title")
+    event_seq_num_col_ident = pgsql.Identifier(source_mode_details["event_seq_num_col"])
+    event_time_col_name = source_mode_details.get("event_time_col")
+    source_type = source_mode_details["source_type"]
+
+    matches_ident = pgsql.Identifier(BATCH_MATCHES_TEMP_TABLE)
+    selected_ident = pgsql.Identifier(BATCH_SELECTED_TEMP_TABLE)
+    icu_ident = pgsql.Identifier(BATCH_ICU_TEMP_TABLE)
+
+    # 1. 一次扫描: 字典代码打标签 -> 事件表
+    tag_exprs, all_params = [], []
+    for cohort_id, spec in enumerate(cohort_specs, start=1):
+        tag_exprs.append(pgsql.SQL("CASE WHEN ({cond}) THEN {cid} END").format(
+            cond=pgsql.SQL(spec["condition_sql"]), cid=pgsql.Literal(cohort_id)))
+        all_params.extend(spec.get("condition_params") or [])
+
+    event_cols = [
+        pgsql.SQL("e.subject_id"), pgsql.SQL("e.hadm_id"), pgsql.SQL("adm.admittime"),
+        pgsql.SQL("e.{} AS qualifying_event_code").format(event_code_col_ident),
+        pgsql.SQL("e.icd_version AS qualifying_event_icd_version"),
+        pgsql.SQL("tc.{} AS qualifying_event_title").format(dict_title_col_ident),
+        pgsql.SQL("e.{} AS qualifying_event_seq_num").format(event_seq_num_col_ident),
+    ]
+    if event_time_col_name:
+        event_cols.append(pgsql.SQL("e.{} AS qualifying_event_time").format(pgsql.Identifier(event_time_col_name)))
+
+    create_matches_sql = pgsql.SQL("""
+        DROP TABLE IF EXISTS {matches};
+        CREATE TEMPORARY TABLE {matches} AS
+        WITH tagged_codes AS (
+            SELECT * FROM (
+                SELECT dd.{dict_code_col}, dd.icd_version, dd.{title_col},
+                       ARRAY_REMOVE(ARRAY[{tags}]::int[], NULL) AS cohort_ids
+                FROM {dict_table} dd
+            ) t WHERE cardinality(t.cohort_ids) > 0
+        )
+        SELECT {event_cols}, tc.cohort_ids
+        FROM {event_table} e
+        JOIN tagged_codes tc ON e.{event_code_col} = tc.{dict_code_col} AND e.icd_version = tc.icd_version
+        JOIN mimiciv_hosp.admissions adm ON e.hadm_id = adm.hadm_id;
+        ANALYZE {matches};
+    """).format(
+        matches=matches_ident, dict_code_col=dict_code_col_ident, title_col=dict_title_col_ident,
+        tags=pgsql.SQL(', ').join(tag_exprs), dict_table=dict_table_ident,
+        event_cols=pgsql.SQL(', ').join(event_cols), event_table=event_table_ident, event_code_col=event_code_col_ident)
+
+    # 2. 每个队列内排名 (与单个队列创建时的排序规则相同)
+    order_by_parts = [pgsql.SQL("m.admittime ASC"), pgsql.SQL("m.hadm_id ASC")]
+    if event_time_col_name and source_type == MODE_PROCEDURE_KEY:
+        order_by_parts.append(pgsql.SQL("m.qualifying_event_time ASC NULLS LAST"))
+    order_by_parts.append(pgsql.SQL("m.qualifying_event_seq_num ASC"))
+    all_events_ids = [pgsql.Literal(i) for i, spec in enumerate(cohort_specs, start=1)
+                      if spec["admission_type"] == COHORT_TYPE_ALL_EVENTS_KEY]
+    keep_condition = pgsql.SQL("ranked.admission_rank_for_event = 1")
+    if all_events_ids:
+        keep_condition = pgsql.SQL("({} OR ranked.cohort_id IN ({}))").format(keep_condition, pgsql.SQL(', ').join(all_events_ids))
+    selected_cols = [pgsql.SQL("ranked.cohort_id")] + [
+        pgsql.SQL("ranked.{}").format(pgsql.Identifier(col)) for col in
+        ["subject_id", "hadm_id", "admittime", "qualifying_event_code", "qualifying_event_icd_version",
+         "qualifying_event_title", "qualifying_event_seq_num"] + (["qualifying_event_time"] if event_time_col_name else [])]
+    create_selected_sql = pgsql.SQL("""
+        DROP TABLE IF EXISTS {selected};
+        CREATE TEMPORARY TABLE {selected} AS
+        SELECT {selected_cols} FROM (
+            SELECT m.*, cid.cohort_id,
+                   ROW_NUMBER() OVER (PARTITION BY cid.cohort_id, m.subject_id ORDER BY {order_by}) AS admission_rank_for_event
+            FROM {matches} m CROSS JOIN LATERAL unnest(m.cohort_ids) AS cid(cohort_id)
+        ) ranked
+        WHERE {keep_condition};
+        CREATE INDEX ON {selected} (cohort_id);
+        ANALYZE {selected};
+    """).format(selected=selected_ident, selected_cols=pgsql.SQL(', ').join(selected_cols),
+                order_by=pgsql.SQL(', ').join(order_by_parts), matches=matches_ident, keep_condition=keep_condition)
+
+    # 3. 所有队列共享的首次 ICU 入住
+    create_icu_sql = pgsql.SQL("""
+        DROP TABLE IF EXISTS {icu};
+        CREATE TEMPORARY TABLE {icu} AS (
+          SELECT * FROM (
+            SELECT icu.subject_id, icu.hadm_id, icu.stay_id, icu.intime AS icu_intime, icu.outtime AS icu_outtime,
+                   EXTRACT(EPOCH FROM (icu.outtime - icu.intime)) / 3600.0 AS los_icu_hours,
+                   ROW_NUMBER() OVER (PARTITION BY icu.hadm_id ORDER BY icu.intime ASC, icu.stay_id ASC) AS icu_stay_rank_in_admission
+            FROM mimiciv_icu.icustays icu
+            WHERE EXISTS (SELECT 1 FROM {selected} seat WHERE seat.hadm_id = icu.hadm_id)
+          ) sub WHERE icu_stay_rank_in_admission = 1);
+        ANALYZE {icu};
+    """).format(icu=icu_ident, selected=selected_ident)
+
+    steps = [
+        ("确保 'mimiciv_data' schema 存在", pgsql.SQL("CREATE SCHEMA IF NOT EXISTS mimiciv_data;"), None),
+        (f"一次扫描事件表并为 {len(cohort_specs)} 个队列打标签", create_matches_sql, all_params),
+        ("按队列排名并筛选入院记录", create_selected_sql, None),
+        ("计算共享的首次ICU入住", create_icu_sql, None),
+    ]
+
+    # 4. 每个队列的目标表 (列与单个队列创建时相同)
+    target_select_list = [
+        pgsql.SQL("evt_ad.subject_id"), pgsql.SQL("evt_ad.hadm_id"), pgsql.SQL("evt_ad.admittime"), pgsql.SQL("adm.dischtime"),
+        pgsql.SQL("icu.stay_id"), pgsql.SQL("icu.icu_intime"), pgsql.SQL("icu.icu_outtime"), pgsql.SQL("icu.los_icu_hours"),
+        pgsql.SQL("evt_ad.qualifying_event_code"), pgsql.SQL("evt_ad.qualifying_event_icd_version"),
+        pgsql.SQL("CAST({} AS VARCHAR(20)) AS {}").format(pgsql.Literal(source_type), pgsql.Identifier("qualifying_event_source")),
+        pgsql.SQL("evt_ad.qualifying_event_title"), pgsql.SQL("evt_ad.qualifying_event_seq_num"),
+    ]
+    if event_time_col_name:
+        target_select_list.append(pgsql.SQL("evt_ad.qualifying_event_time"))
+    main_diag_join_sql = pgsql.SQL("")
+    if source_type == MODE_PROCEDURE_KEY:
+        target_select_list.extend([
+            pgsql.SQL("primary_dx.icd_code AS primary_diag_code"),
+            pgsql.SQL("primary_dx.icd_version AS primary_diag_icd_version"),
+            pgsql.SQL("primary_d_dx.long_title AS primary_diag_title")])
+        main_diag_join_sql = pgsql.SQL("""
+        LEFT JOIN (
+            SELECT dx.hadm_id, dx.icd_code, dx.icd_version, dx.seq_num
+            FROM mimiciv_hosp.diagnoses_icd dx
+            WHERE dx.seq_num = 1
+        ) primary_dx ON evt_ad.hadm_id = primary_dx.hadm_id
+        LEFT JOIN mimiciv_hosp.d_icd_diagnoses primary_d_dx
+            ON primary_dx.icd_code = primary_d_dx.icd_code
+            AND primary_dx.icd_version = primary_d_dx.icd_version
+        """)
+
+    for cohort_id, spec in enumerate(cohort_specs, start=1):
+        target_ident = pgsql.Identifier(COHORT_SCHEMA, spec["table_name"])
+        create_target_sql = pgsql.SQL("""
+            DROP TABLE IF EXISTS {target};
+            CREATE TABLE {target} AS (
+             SELECT {select_cols}
+             FROM {selected} evt_ad
+             JOIN mimiciv_hosp.admissions adm ON evt_ad.hadm_id = adm.hadm_id
+             LEFT JOIN {icu} icu ON evt_ad.hadm_id = icu.hadm_id
+             {main_diag_join}
+             WHERE evt_ad.cohort_id = {cohort_id}
+            );
+        """).format(target=target_ident, select_cols=pgsql.SQL(', ').join(target_select_list),
+                    selected=selected_ident, icu=icu_ident, main_diag_join=main_diag_join_sql,
+                    cohort_id=pgsql.Literal(cohort_id))
+        steps.append((f"创建队列表 {spec['table_name']}", create_target_sql, None))
+    return steps, None
+
+
+def _build_cohort_match_from_where(condition_sql: str, source_mode_details: Dict[str, Any]) -> Any:
+    return pgsql.SQL("FROM {event_table} e JOIN {dict_table} dd ON e.{event_code_col} = dd.{dict_code_col} "
+                     "AND e.icd_version = dd.icd_version WHERE ({condition})").format(
+        event_table=pgsql.Identifier(*source_mode_details["event_table"].split('.')),
+        dict_table=pgsql.Identifier(*source_mode_details["dictionary_table"].split('.')),
+        event_code_col=pgsql.Identifier(source_mode_details["event_icd_col"]),
+        dict_code_col=pgsql.Identifier(source_mode_details["dict_icd_col"]),
+        condition=pgsql.SQL(condition_sql))
+
+
+def build_cohort_size_explain_sql(condition_sql: str, source_mode_details: Dict[str, Any]) -> Any:
+    """EXPLAIN (FORMAT JSON) 事件 ⨝ 字典: 只做规划不执行，顶层 Plan Rows 即匹配事件行数的估计。"""
+    return pgsql.SQL("EXPLAIN (FORMAT JSON) SELECT e.subject_id, e.hadm_id {}").format(
+        _build_cohort_match_from_where(condition_sql, source_mode_details))
+
+
+def build_cohort_size_count_sql(condition_sql: str, source_mode_details: Dict[str, Any]) -> Any:
+    """
+    精确计数: (患者数, 入院数, 事件行数)。
+    首次事件队列每位患者一行 -> 患者数 = 入院数 = COUNT(DISTINCT subject_id)；
+    所有事件队列的入院数为 COUNT(DISTINCT hadm_id)，行数为匹配事件行数。
+    """
+    return pgsql.SQL("SELECT COUNT(DISTINCT e.subject_id), COUNT(DISTINCT e.hadm_id), COUNT(*) {}").format(
+        _build_cohort_match_from_where(condition_sql, source_mode_details))
+
+
+def parse_explain_row_estimate(explain_result: Any) -> Optional[int]:
+    """从 EXPLAIN (FORMAT JSON) 的结果 (psycopg2 已解析为 list) 中取顶层计划的估计行数。"""
+    try:
+        if isinstance(explain_result, str):
+            explain_result = json.loads(explain_result)
+        return int(explain_result[0]["Plan"]["Plan Rows"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def build_batch_cleanup_sql() -> Any:
+    return pgsql.SQL("DROP TABLE IF EXISTS {}, {}, {};").format(
+        pgsql.Identifier(BATCH_ICU_TEMP_TABLE), pgsql.Identifier(BATCH_SELECTED_TEMP_TABLE), pgsql.Identifier(BATCH_MATCHES_TEMP_TABLE))
+
+# --- END OF FILE sql_logic/sql_builder_cohort.py ---
@@ -0,0 +1,118 @@
+# --- START OF FILE sql_logic/sql_builder_merge.py ---
+import psycopg2.sql as pgsql
+from utils import validate_column_name
+
+from typing import List, Tuple, Any, Optional
+
+# UI上的合并类型 -> SQL JOIN 关键字 (与 DataMergeTab 中 pandas 的 how 参数一一对应)
+JOIN_TYPE_SQL = {
+    "inner": "INNER JOIN",
+    "left": "LEFT JOIN",
+    "right": "RIGHT JOIN",
+    "outer": "FULL OUTER JOIN",
+}
+
+
+def _split_table_name(full_name: str) -> Optional[Tuple[str, str]]:
+    parts = full_name.split('.') if full_name else []
+    if len(parts) != 2 or not all(parts):
+        return None
+    return parts[0], parts[1]
+
+
+def build_table_merge_sql(
+    left_table_name: str,
+    right_table_name: str,
+    left_keys: List[str],
+    right_keys: List[str],
+    left_columns: List[str],
+    right_columns: List[str],
+    join_type: str = "left",
+    suffixes: Tuple[str, str] = ("_left", "_right"),
+    target_table_name: Optional[str] = None,
+    preview_limit: Optional[int] = None
+) -> Tuple[Optional[Any], Optional[str], List[str]]:
+    """
+    在数据库内合并两张 schema.table 表，列命名规则与 pandas.merge 保持一致:
+    - 左右同名的合并键只输出一列 (RIGHT/OUTER JOIN 时用 COALESCE 合并两侧取值)。
+    - 其余同名列分别追加 suffixes。
+    返回 (sql, 错误信息, 输出列名列表)。
+    target_table_name 不为空时生成 CREATE TABLE ... AS，否则生成 SELECT (可选 LIMIT 用于预览)。
+    """
+    left_parts = _split_table_name(left_table_name)
+    right_parts = _split_table_name(right_table_name)
+    if not left_parts or not right_parts:
+        return None, "左右数据源必须为 schema.table 格式。", []
+    if not left_keys or not right_keys:
+        return None, "请为左右数据集选择至少一个合并键。", []
+    if len(left_keys) != len(right_keys):
+        return None, "左右两侧选择的合并键数量必须相同。", []
+    join_sql_keyword = JOIN_TYPE_SQL.get(join_type)
+    if not join_sql_keyword:
+        return None, f"不支持的合并类型: {join_type}", []
+
+    # 合并键总是保留 (与 pandas 路径中的行为一致)，并去重保持顺序
+    final_left_cols = list(dict.fromkeys(list(left_columns) + list(left_keys)))
+    final_right_cols = list(dict.fromkeys(list(right_columns) + list(right_keys)))
+
+    left_alias = pgsql.Identifier("l")
+    right_alias = pgsql.Identifier("r")
+
+    # pandas 对于 left_on/right_on 同名的键只保留一列
+    shared_keys = {lk for lk, rk in zip(left_keys, right_keys) if lk == rk}
+    overlapping = (set(final_left_cols) & set(final_right_cols)) - shared_keys
+
+    select_items = []
+    output_columns = []
+
+    for col in final_left_cols:
+        out_name = f"{col}{suffixes[0]}" if col in overlapping else col
+        if col in shared_keys and join_type in ("right", "outer"):
+            expr = pgsql.SQL("COALESCE({la}.{c}, {ra}.{c})").format(la=left_alias, ra=right_alias, c=pgsql.Identifier(col))
+        else:
+            expr = pgsql.SQL("{}.{}").format(left_alias, pgsql.Identifier(col))
+        select_items.append(pgsql.SQL("{} AS {}").format(expr, pgsql.Identifier(out_name)))
+        output_columns.append(out_name)
+
+    for col in final_right_cols:
+        if col in shared_keys:
+            continue
+        out_name = f"{col}{suffixes[1]}" if col in overlapping else col
+        select_items.append(pgsql.SQL("{}.{} AS {}").format(right_alias, pgsql.Identifier(col), pgsql.Identifier(out_name)))
+        output_columns.append(out_name)
+
+    if len(set(output_columns)) != len(output_columns):
+        return None, "合并后存在重复列名，请调整列选择或后缀。", output_columns
+
+    on_conditions = [
+        pgsql.SQL("{la}.{lk} = {ra}.{rk}").format(
+            la=left_alias, lk=pgsql.Identifier(lk), ra=right_alias, rk=pgsql.Identifier(rk))
+        for lk, rk in zip(left_keys, right_keys)
+    ]
+
+    select_sql = pgsql.SQL(
+        "SELECT {select_list} FROM {left_table} {la} {join_kw} {right_table} {ra} ON {on_conditions}"
+    ).format(
+        select_list=pgsql.SQL(', ').join(select_items),
+        left_table=pgsql.Identifier(*left_parts), la=left_alias,
+        join_kw=pgsql.SQL(join_sql_keyword),
+        right_table=pgsql.Identifier(*right_parts), ra=right_alias,
+        on_conditions=pgsql.SQL(' AND ').join(on_conditions)
+    )
+
+    if target_table_name:
+        target_parts = _split_table_name(target_table_name)
+        if not target_parts:
+            return None, f"目标表名 '{target_table_name}' 格式不正确 (应为 schema.table)。", output_columns
+        is_valid, err = validate_column_name(target_parts[1])
+        if not is_valid:
+            return None, f"目标表名 '{target_parts[1]}' 无效: {err}", output_columns
+        create_sql = pgsql.SQL("CREATE TABLE {target} AS {select_sql};").format(
+            target=pgsql.Identifier(*target_parts), select_sql=select_sql)
+        return create_sql, None, output_columns
+
+    if preview_limit:
+        select_sql = select_sql + pgsql.SQL(" LIMIT {}").format(pgsql.Literal(preview_limit))
+    return select_sql, None, output_columns
+
+# --- END OF FILE sql_logic/sql_builder_merge.py ---
@@ -0,0 +1,114 @@
+# --- START OF FILE sql_logic/sql_builder_preview.py ---
+import psycopg2.sql as pgsql
+from app_config import PREVIEW_SAMPLE_OVERSAMPLE_FACTOR, PREVIEW_SAMPLE_MIN_PERCENT
+from sql_logic.db_backend import BACKEND_POSTGRES, BACKEND_DUCKDB
+
+from typing import List, Tuple, Any, Optional, Sequence
+
+SAMPLE_METHOD_SYSTEM = "SYSTEM"       # 按数据页抽样，最快，但同一页内的行会成簇出现
+SAMPLE_METHOD_BERNOULLI = "BERNOULLI" # 按行抽样，更均匀，但仍需扫描全表
+# 本地 DuckDB 后端: 抽样写作 TABLESAMPLE n PERCENT (system|bernoulli) (system 按向量抽样)，无主键时用 rowid 代替 ctid 分页
+
+# pg_class.reltuples 为统计信息中的估计行数 (从未 ANALYZE 的表在 PG14+ 上为 -1)
+APPROX_ROW_COUNT_SQL = """
+    SELECT c.reltuples::bigint
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = %s AND c.relname = %s;
+"""
+
+# 主键列 (按主键定义中的顺序)
+PRIMARY_KEY_COLUMNS_SQL = """
+    SELECT a.attname
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+    WHERE n.nspname = %s AND c.relname = %s AND i.indisprimary
+    ORDER BY array_position(i.indkey::int2[], a.attnum);
+"""
+
+# 表是否存在 (information_schema，两种后端通用；DuckDB 没有 to_regclass)
+TABLE_EXISTS_SQL = """
+    SELECT EXISTS (SELECT 1 FROM information_schema.tables WHERE table_schema = %s AND table_name = %s);
+"""
+
+
+def compute_sample_percent(approx_row_count: Optional[int], limit: int) -> float:
+    """
+    根据估计行数计算 TABLESAMPLE 百分比，使抽样结果大约为 limit 的若干倍 (之后再 LIMIT)。
+    行数未知 (None / <=0) 时返回 100，即退化为普通扫描。
+    """
+    if not approx_row_count or approx_row_count <= 0:
+        return 100.0
+    percent = 100.0 * limit * PREVIEW_SAMPLE_OVERSAMPLE_FACTOR / approx_row_count
+    return round(min(100.0, max(PREVIEW_SAMPLE_MIN_PERCENT, percent)), 6)
+
+
+def build_sample_preview_sql(
+    schema_name: str,
+    table_name: str,
+    limit: int,
+    sample_percent: float,
+    sample_method: str = SAMPLE_METHOD_SYSTEM,
+    backend: str = BACKEND_POSTGRES
+) -> Tuple[Optional[Any], Optional[str]]:
+    """随机抽样预览: 用 TABLESAMPLE 代替 ORDER BY RANDOM()，避免对全表排序。"""
+    if sample_method not in (SAMPLE_METHOD_SYSTEM, SAMPLE_METHOD_BERNOULLI):
+        return None, f"不支持的抽样方法: {sample_method}"
+    table_ident = pgsql.Identifier(schema_name, table_name)
+    if sample_percent >= 100:
+        query = pgsql.SQL("SELECT * FROM {table} LIMIT {limit}").format(
+            table=table_ident, limit=pgsql.Literal(limit))
+    elif backend == BACKEND_DUCKDB:
+        query = pgsql.SQL("SELECT * FROM {table} TABLESAMPLE {percent} PERCENT ({method}) LIMIT {limit}").format(
+            table=table_ident, method=pgsql.SQL(sample_method.lower()),
+            percent=pgsql.Literal(sample_percent), limit=pgsql.Literal(limit))
+    else:
+        query = pgsql.SQL("SELECT * FROM {table} TABLESAMPLE {method} ({percent}) LIMIT {limit}").format(
+            table=table_ident, method=pgsql.SQL(sample_method),
+            percent=pgsql.Literal(sample_percent), limit=pgsql.Literal(limit))
+    return query, None
+
+
+def build_keyset_page_sql(
+    schema_name: str,
+    table_name: str,
+    key_columns: Sequence[str],
+    last_key_values: Optional[Sequence[Any]],
+    limit: int,
+    backend: str = BACKEND_POSTGRES
+) -> Tuple[Any, List[Any]]:
+    """
+    按键集分页 (keyset pagination): WHERE (k1, k2) > (%s, %s) ORDER BY k1, k2 LIMIT n。
+    key_columns 为空时使用 ctid (DuckDB 为 rowid) 作为物理顺序键 (无主键的队列表)，别名均为 _ctid。
+    last_key_values 为 None 表示第一页。返回 (sql, params)。
+    """
+    table_ident = pgsql.Identifier(schema_name, table_name)
+    if key_columns:
+        key_idents = [pgsql.Identifier(k) for k in key_columns]
+        select_list = pgsql.SQL("*")
+    else:
+        row_key = "rowid" if backend == BACKEND_DUCKDB else "ctid"
+        key_idents = [pgsql.SQL(row_key)]
+        # ctid/rowid 不在 SELECT * 中，单独取出以便记录下一页的起点
+        select_list = pgsql.SQL("{row_key} AS {ctid_alias}, *").format(row_key=key_idents[0], ctid_alias=pgsql.Identifier("_ctid"))
+    key_tuple = pgsql.SQL("({})").format(pgsql.SQL(', ').join(key_idents))
+
+    params = []
+    where_clause = pgsql.SQL("")
+    if last_key_values is not None:
+        placeholders = pgsql.SQL(', ').join([pgsql.Placeholder()] * len(key_idents))
+        if key_columns:
+            where_clause = pgsql.SQL(" WHERE {keys} > ({ph})").format(keys=key_tuple, ph=placeholders)
+        elif backend == BACKEND_DUCKDB:
+            where_clause = pgsql.SQL(" WHERE rowid > {ph}::BIGINT").format(ph=placeholders)
+        else:
+            where_clause = pgsql.SQL(" WHERE ctid > {ph}::tid").format(ph=placeholders)
+        params = list(last_key_values)
+
+    query = pgsql.SQL("SELECT {select_list} FROM {table}{where} ORDER BY {order_by} LIMIT {limit}").format(
+        select_list=select_list, table=table_ident, where=where_clause,
+        order_by=pgsql.SQL(', ').join(key_idents), limit=pgsql.Literal(limit))
+    return query, params
+
+# --- END OF FILE sql_logic/sql_builder_preview.py ---
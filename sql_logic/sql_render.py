@@ -0,0 +1,88 @@
+# --- START OF FILE sql_logic/sql_render.py ---
+import datetime
+import decimal
+import math
+import psycopg2.sql as pgsql
+
+from typing import Any
+
+# 无需数据库连接的 psycopg2.sql 渲染: Composable.as_string() 需要连接 (或游标) 才能转义字面量，
+# 界面上为了显示/拼接条件而临时建立连接，在远程或不可用的 DSN 下每次按键都会卡在连接超时上。
+# 这里按 PostgreSQL 语法自行转义，结果与 as_string 等价:
+#   - 标识符: 双引号包围，内部双引号加倍；
+#   - 字符串字面量: 单引号加倍；含反斜杠时使用 E'...' 并把反斜杠加倍 (与 standard_conforming_strings 设置无关)；
+#   - Placeholder 渲染为 %s / %(name)s，参数仍由 cursor.execute 传递。
+
+
+def quote_identifier(name: str) -> str:
+    if "\x00" in name:
+        raise ValueError("标识符中不能包含 NUL 字符。")
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _quote_string(value: str) -> str:
+    if "\x00" in value:
+        raise ValueError("字符串字面量中不能包含 NUL 字符。")
+    escaped = value.replace("'", "''")
+    if "\\" in escaped:
+        return "E'" + escaped.replace("\\", "\\\\") + "'"
+    return "'" + escaped + "'"
+
+
+def _signed_number(text: str) -> str:
+    # 负数前加空格，避免紧跟在减号后形成 "--" 注释 (与 psycopg2 相同)
+    return " " + text if text.startswith("-") else text
+
+
+def quote_literal(value: Any) -> str:
+    """Python 值 -> SQL 字面量文本 (支持的类型与 psycopg2 默认适配器一致的常用子集)。"""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return _signed_number(str(value))
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "'NaN'::float"
+        if math.isinf(value):
+            return "'Infinity'::float" if value > 0 else "'-Infinity'::float"
+        return _signed_number(repr(value))
+    if isinstance(value, decimal.Decimal):
+        return "'NaN'::numeric" if value.is_nan() else _signed_number(str(value))
+    if isinstance(value, str):
+        return _quote_string(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "'\\x" + bytes(value).hex() + "'::bytea"
+    if isinstance(value, datetime.datetime):
+        return _quote_string(value.isoformat()) + ("::timestamptz" if value.tzinfo else "::timestamp")
+    if isinstance(value, datetime.date):
+        return _quote_string(value.isoformat()) + "::date"
+    if isinstance(value, datetime.time):
+        return _quote_string(value.isoformat()) + ("::timetz" if value.tzinfo else "::time")
+    if isinstance(value, datetime.timedelta):
+        return _quote_string(f"{value.days} days {value.seconds} seconds {value.microseconds} microseconds") + "::interval"
+    if isinstance(value, tuple):
+        return "(" + ", ".join(quote_literal(v) for v in value) + ")"
+    if isinstance(value, list):
+        return "ARRAY[" + ", ".join(quote_literal(v) for v in value) + "]" if value else "'{}'"
+    raise TypeError(f"无法渲染为 SQL 字面量的类型: {type(value).__name__}")
+
+
+def render_sql(composable: Any) -> str:
+    """psycopg2.sql 对象 (或普通字符串) -> SQL 文本，不访问数据库。"""
+    if isinstance(composable, str):
+        return composable
+    if isinstance(composable, pgsql.Composed):
+        return "".join(render_sql(part) for part in composable.seq)
+    if isinstance(composable, pgsql.SQL):
+        return composable.string
+    if isinstance(composable, pgsql.Identifier):
+        return ".".join(quote_identifier(s) for s in composable.strings)
+    if isinstance(composable, pgsql.Literal):
+        return quote_literal(composable.wrapped)
+    if isinstance(composable, pgsql.Placeholder):
+        return f"%({composable.name})s" if composable.name else "%s"
+    raise TypeError(f"无法渲染的 SQL 对象: {composable!r}")
+
+# --- END OF FILE sql_logic/sql_render.py ---
@@ -0,0 +1,77 @@
+# --- START OF FILE sql_logic/time_window.py ---
+import psycopg2.sql as pgsql
+from app_config import TIME_WINDOW_ANCHOR_COLUMNS, TIME_WINDOW_PRESETS
+
+from typing import Any, Dict, Optional, Tuple, Union
+
+# 时间窗口规格 (dict):
+#   anchor / start_offset_hours: 窗口开始 = 队列表.anchor + start_offset_hours
+#   end_anchor / end_offset_hours: 窗口结束 = 队列表.end_anchor + end_offset_hours (end_anchor 缺省为 anchor)
+#   name_code (可选): 列名中的窗口代码，预设窗口自带，自定义窗口按偏移生成
+# 编译结果为 evt.time >= 开始 AND evt.time <= 结束，两端都只依赖队列行，
+# 因此在 (stay_id, itemid, charttime) 等索引上可以作为索引范围条件使用。
+
+
+def resolve_time_window_spec(window: Union[str, Dict[str, Any], None]) -> Optional[Dict[str, Any]]:
+    """预设窗口文本或窗口规格 -> 规范化的窗口规格；无法识别时返回 None。"""
+    if isinstance(window, dict):
+        spec = dict(window)
+    elif isinstance(window, str) and window in TIME_WINDOW_PRESETS:
+        spec = dict(TIME_WINDOW_PRESETS[window])
+    else:
+        return None
+    spec.setdefault("start_offset_hours", 0)
+    spec.setdefault("end_anchor", spec.get("anchor"))
+    spec.setdefault("end_offset_hours", 0)
+    return spec
+
+
+def validate_time_window_spec(spec: Dict[str, Any]) -> Tuple[bool, str]:
+    valid_anchors = [col for _, col, _ in TIME_WINDOW_ANCHOR_COLUMNS]
+    for key in ("anchor", "end_anchor"):
+        if spec.get(key) not in valid_anchors:
+            return False, f"不支持的时间窗口锚点: {spec.get(key)}"
+    try:
+        start_offset = float(spec.get("start_offset_hours", 0))
+        end_offset = float(spec.get("end_offset_hours", 0))
+    except (TypeError, ValueError):
+        return False, "时间窗口偏移必须为数字 (小时)。"
+    if spec.get("anchor") == spec.get("end_anchor") and end_offset <= start_offset:
+        return False, "时间窗口结束偏移必须大于开始偏移。"
+    return True, ""
+
+
+def _anchor_offset_sql(cohort_alias: Any, anchor_column: str, offset_hours: float) -> Any:
+    return pgsql.SQL("({coh}.{anchor} + {offset}::interval)").format(
+        coh=cohort_alias, anchor=pgsql.Identifier(anchor_column), offset=pgsql.Literal(f"{float(offset_hours):g} hours"))
+
+
+def build_time_window_bounds(spec: Dict[str, Any], cohort_alias: Any) -> Tuple[Any, Any]:
+    """窗口规格 -> (开始时间表达式, 结束时间表达式)，调用前应先 validate_time_window_spec。"""
+    return (_anchor_offset_sql(cohort_alias, spec["anchor"], spec.get("start_offset_hours", 0)),
+            _anchor_offset_sql(cohort_alias, spec["end_anchor"], spec.get("end_offset_hours", 0)))
+
+
+def build_time_window_predicate(spec: Dict[str, Any], event_alias: Any, time_col_ident: Any, cohort_alias: Any) -> Any:
+    start_sql, end_sql = build_time_window_bounds(spec, cohort_alias)
+    return pgsql.SQL("{evt}.{time_col} >= {start_ts} AND {evt}.{time_col} <= {end_ts}").format(
+        evt=event_alias, time_col=time_col_ident, start_ts=start_sql, end_ts=end_sql)
+
+
+def _offset_code(offset_hours: float) -> str:
+    text = f"{abs(float(offset_hours)):g}".replace(".", "p")
+    return f"m{text}h" if float(offset_hours) < 0 else f"{text}h"
+
+
+def time_window_name_code(spec: Dict[str, Any]) -> str:
+    """列名用的窗口代码: 预设窗口用 name_code，自定义窗口如 icu_m6h_72h (icu_intime 前 6 小时到后 72 小时)。"""
+    if spec.get("name_code"):
+        return spec["name_code"]
+    anchor_codes = {col: code for _, col, code in TIME_WINDOW_ANCHOR_COLUMNS}
+    parts = [anchor_codes.get(spec.get("anchor"), "t"), _offset_code(spec.get("start_offset_hours", 0))]
+    if spec.get("end_anchor") and spec.get("end_anchor") != spec.get("anchor"):
+        parts.append(anchor_codes.get(spec["end_anchor"], "t"))
+    parts.append(_offset_code(spec.get("end_offset_hours", 0)))
+    return "_".join(parts)
+
+# --- END OF FILE sql_logic/time_window.py ---
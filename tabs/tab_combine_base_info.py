@@ -2,16 +2,51 @@
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
                           QTableWidget, QTableWidgetItem, QMessageBox, QLabel,
                           QSplitter, QTextEdit, QComboBox, QGroupBox, QCheckBox,
-                          QScrollArea, QFormLayout, QProgressBar)
-from PySide6.QtCore import Qt, Signal, QThread, QObject
+                          QScrollArea, QFormLayout, QProgressBar, QSpinBox)
+from PySide6.QtCore import Qt, Signal, QObject
 import psycopg2
+import psycopg2.sql as pgsql
 import re
 import time
 import pandas as pd
 from sql_logic.base_info_sql import (add_demography, add_antecedent, add_vital_sign,
                            add_blood_info, add_cardiovascular_lab, add_medicine,
                            add_surgeries, add_past_diagnostic,add_scores) # Updated imports
-from app_config import DEFAULT_PAST_DIAGNOSIS_CATEGORIES
+from sql_logic.chunked_update import run_chunked_job
+from sql_logic.feature_store import (STORAGE_MODE_WIDE, STORAGE_MODE_NARROW, build_feature_store_table_sql,
+                                     build_feature_store_insert_sql)
+from sql_logic.column_provenance import check_stale_features, record_provenance, compute_feature_config_hash
+from sql_logic.job_history import (JobJournal, JournaledConnection, JOB_OUTCOME_SUCCESS,
+                                   JOB_OUTCOME_CANCELLED, JOB_OUTCOME_FAILED)
+from sql_logic.db_backend import connect_database, DATABASE_ERRORS
+from sql_logic.replica_router import ReplicaRouter
+from sql_logic.job_control import (apply_job_timeouts, apply_session_tuning, describe_tuning_profile, cancel_backend_query,
+                                   describe_query_canceled, QueryCanceledError)
+from ui_components.job_scheduler import JobScheduler
+from app_config import DEFAULT_PAST_DIAGNOSIS_CATEGORIES, DEFAULT_UPDATE_CHUNK_SIZE
+
+def feature_column_names(col_defs):
+    """'name TYPE' 形式的列定义 -> 列名列表。"""
+    return [col_def.split(' ')[0].strip() for col_def in col_defs]
+
+
+def feature_store_stage_table_name(cohort_table):
+    """窄表模式下承接 UPDATE 的临时表 (队列表的会话级副本)。"""
+    return f"feature_stage_{cohort_table}"[:63]
+
+
+def compose_alter_table_sql(qualified_table_name, col_defs):
+    """单条 ALTER TABLE ... ADD COLUMN IF NOT EXISTS ...；按列名去重，没有列时返回空串。"""
+    unique_col_defs_dict = {}
+    for col_def_str, col_name in zip(col_defs, feature_column_names(col_defs)):
+        if col_name not in unique_col_defs_dict:
+            unique_col_defs_dict[col_name] = col_def_str
+    if not unique_col_defs_dict:
+        return ""
+    # Format: ALTER TABLE schema.table ADD COLUMN IF NOT EXISTS col1 type1, ADD COLUMN IF NOT EXISTS col2 type2...;
+    add_clauses = [f"ADD COLUMN IF NOT EXISTS {col_def}" for col_def in unique_col_defs_dict.values()]
+    return f"ALTER TABLE {qualified_table_name}\n    " + ",\n    ".join(add_clauses) + ";\n"
+
 
 class SQLWorker(QObject):
     finished = Signal(list, list)
@@ -19,25 +54,69 @@ class SQLWorker(QObject):
     progress = Signal(int, int)
     log = Signal(str)
 
-    def __init__(self, sql_to_execute, db_params, table_name):
+    def __init__(self, sql_to_execute, db_params, table_name, job_timeouts=None, chunk_size=None, description="",
+                 features=None, skip_if_fresh=False, feature_store_columns=None, replica_settings=None, tuning_profile=None):
         super().__init__()
         self.sql_to_execute = sql_to_execute
+        # [(特征名, 列定义列表, UPDATE SQL)]: 提供时记录列来源，skip_if_fresh 时只执行过期的特征
+        self.features = features
+        self.skip_if_fresh = skip_if_fresh
+        self.cohort_version = None
+        self.features_to_run = []
+        # 窄表模式: [(列名, 类型)]。UPDATE 作用于队列表的临时副本，完成后把这些列追加写入特征库
+        self.feature_store_columns = feature_store_columns
+        self.description = description # 任务历史中的描述 (所选的基础数据项)
         self.db_params = db_params
         self.table_name = table_name
+        self.job_timeouts = job_timeouts
+        self.chunk_size = chunk_size # None: 整个批处理一个事务；否则 UPDATE 按 hadm_id 分块提交
+        self.replica_settings = replica_settings # 只读副本: 临时表的只读计算可路由到副本
+        self.tuning_profile = tuning_profile # 会话调优配置 (work_mem、并行、JIT)，整个任务连接使用
         self.is_cancelled = False
+        self.conn = None
+        self.router = None
 
     def cancel(self):
         self.log.emit("SQL 执行被请求取消...")
         self.is_cancelled = True
+        if cancel_backend_query(self.conn): self.log.emit("已请求服务器取消正在执行的语句。")
+        if self.router and self.router.cancel(): self.log.emit("已请求只读副本取消正在执行的语句。")
 
     def run(self):
         conn_extract = None
+        journal = None
         try:
             self.log.emit(f"准备为表 '{self.table_name}' 执行SQL批处理...")
             self.log.emit("连接数据库...")
-            conn_extract = psycopg2.connect(**self.db_params)
+            conn_extract = connect_database(self.db_params, connection_factory=JournaledConnection)
+            self.conn = conn_extract
             conn_extract.autocommit = False # Important for batch processing
             cur = conn_extract.cursor()
+            journal = JobJournal("base_info_extraction", self.table_name, self.description, [self.sql_to_execute],
+                                 tuning_profile=self.tuning_profile)
+            journal.attach(conn_extract)
+            apply_job_timeouts(cur, self.job_timeouts)
+            # 会话级设置: 不受来源检查与分块执行中间提交的影响，连接关闭即失效
+            apply_session_tuning(cur, self.tuning_profile)
+            if self.tuning_profile:
+                self.log.emit(f"会话调优: {describe_tuning_profile(self.tuning_profile)}")
+            self.router = ReplicaRouter.from_settings(self.replica_settings, f"mimiciv_data.{self.table_name}",
+                                                      self.job_timeouts, self.log.emit, self.tuning_profile)
+
+            if self.features:
+                if not self._select_stale_features(conn_extract):
+                    journal.finish(JOB_OUTCOME_SUCCESS)
+                    self._emit_table_preview(cur)
+                    return
+
+            if self.feature_store_columns:
+                stage_table = feature_store_stage_table_name(self.table_name)
+                self.log.emit(f"窄表模式: 创建队列表的临时副本 {stage_table}，特征计算完成后写入特征库。")
+                cur.execute(build_feature_store_table_sql())
+                cur.execute(pgsql.SQL("CREATE TEMPORARY TABLE {} AS SELECT * FROM {}").format(
+                    pgsql.Identifier(stage_table), pgsql.Identifier('mimiciv_data', self.table_name)))
+                if self.router:
+                    self.router.note_session_temp_table(stage_table)
 
             self.log.emit("开始解析和执行SQL语句...")
             sql_statements = self._parse_sql(self.sql_to_execute)
@@ -45,76 +124,90 @@ class SQLWorker(QObject):
 
             if total_statements == 0:
                 self.log.emit("没有可执行的SQL语句。")
+                journal.finish(JOB_OUTCOME_SUCCESS)
                 self.progress.emit(0, 0)
                 self.finished.emit([], []) # Ensure finished signal is emitted
                 return
 
-            self.progress.emit(0, total_statements)
-            executed_count = 0
-
-            for i, stmt in enumerate(sql_statements):
-                if self.is_cancelled:
-                    self.log.emit("SQL 执行已取消。正在回滚任何未提交的更改...")
-                    if conn_extract: conn_extract.rollback()
-                    self.error.emit("操作已取消")
-                    return
-
-                stmt_trimmed = stmt.strip()
-                if not stmt_trimmed or stmt_trimmed.startswith('--'):
-                    self.log.emit(f"跳过空语句或注释: 第 {i+1}/{total_statements} 条")
-                    self.progress.emit(i + 1, total_statements) # Still count for progress
-                    continue
-
-                max_log_length = 150
-                log_stmt_display = stmt_trimmed[:max_log_length] + ("..." if len(stmt_trimmed) > max_log_length else "")
-                self.log.emit(f"执行第 {i+1}/{total_statements} 条语句: {log_stmt_display}")
-
-                try:
-                    start_time = time.time()
-                    cur.execute(stmt_trimmed)
-                    end_time = time.time()
-                    self.log.emit(f"语句执行成功 (耗时: {end_time - start_time:.2f} 秒)")
-                    executed_count +=1
-                except psycopg2.Error as db_err:
-                    self.log.emit(f"数据库语句执行出错: {db_err}")
-                    self.log.emit(f"出错的SQL语句: {stmt_trimmed}") # Log full failing statement
-                    if conn_extract: conn_extract.rollback()
-                    self.log.emit("事务已回滚。")
-                    self.error.emit(f"数据库错误: {db_err}\n问题语句: {log_stmt_display}")
+            if self.chunk_size:
+                if not self._run_chunked(conn_extract, sql_statements):
                     return
-                except Exception as e: # Catch other unexpected errors
-                    self.log.emit(f"发生意外错误: {str(e)}")
+                if self.cohort_version:
+                    self._record_provenance(cur)
+                    conn_extract.commit()
+                journal.finish(JOB_OUTCOME_SUCCESS, pg_conn=conn_extract)
+            else:
+                self.progress.emit(0, total_statements)
+                executed_count = 0
+
+                for i, stmt in enumerate(sql_statements):
+                    if self.is_cancelled:
+                        self.log.emit("SQL 执行已取消。正在回滚任何未提交的更改...")
+                        if conn_extract: conn_extract.rollback()
+                        self.error.emit("操作已取消")
+                        return
+
+                    stmt_trimmed = stmt.strip()
+                    if not stmt_trimmed or stmt_trimmed.startswith('--'):
+                        self.log.emit(f"跳过空语句或注释: 第 {i+1}/{total_statements} 条")
+                        self.progress.emit(i + 1, total_statements) # Still count for progress
+                        continue
+
+                    max_log_length = 150
+                    log_stmt_display = stmt_trimmed[:max_log_length] + ("..." if len(stmt_trimmed) > max_log_length else "")
+                    self.log.emit(f"执行第 {i+1}/{total_statements} 条语句: {log_stmt_display}")
+
+                    try:
+                        start_time = time.time()
+                        if not (self.router and self.router.try_materialize(cur, stmt_trimmed)):
+                            cur.execute(stmt_trimmed)
+                        end_time = time.time()
+                        self.log.emit(f"语句执行成功 (耗时: {end_time - start_time:.2f} 秒)")
+                        executed_count +=1
+                    except QueryCanceledError as qc_err:
+                        err_msg = describe_query_canceled(qc_err, self.is_cancelled)
+                        self.log.emit(err_msg)
+                        if conn_extract: conn_extract.rollback()
+                        self.log.emit("事务已回滚。")
+                        self.error.emit(err_msg)
+                        return
+                    except DATABASE_ERRORS as db_err:
+                        self.log.emit(f"数据库语句执行出错: {db_err}")
+                        self.log.emit(f"出错的SQL语句: {stmt_trimmed}") # Log full failing statement
+                        if conn_extract: conn_extract.rollback()
+                        self.log.emit("事务已回滚。")
+                        self.error.emit(f"数据库错误: {db_err}\n问题语句: {log_stmt_display}")
+                        return
+                    except Exception as e: # Catch other unexpected errors
+                        self.log.emit(f"发生意外错误: {str(e)}")
+                        if conn_extract: conn_extract.rollback()
+                        self.log.emit("事务已回滚。")
+                        self.error.emit(f"意外错误: {str(e)}\n问题语句: {log_stmt_display}")
+                        return
+
+                    self.progress.emit(i + 1, total_statements)
+
+                if self.is_cancelled: # Check again before commit
+                    self.log.emit("SQL 执行在提交前已取消。正在回滚...")
                     if conn_extract: conn_extract.rollback()
-                    self.log.emit("事务已回滚。")
-                    self.error.emit(f"意外错误: {str(e)}\n问题语句: {log_stmt_display}")
+                    self.error.emit("操作已取消")
                     return
 
-                self.progress.emit(i + 1, total_statements)
-
-            if self.is_cancelled: # Check again before commit
-                self.log.emit("SQL 执行在提交前已取消。正在回滚...")
-                if conn_extract: conn_extract.rollback()
-                self.error.emit("操作已取消")
-                return
-
-            if executed_count > 0: # Only commit if something was actually run
-                self.log.emit("所有语句执行完毕。正在提交事务...")
-                conn_extract.commit()
-                self.log.emit("事务已成功提交。")
-            else:
-                self.log.emit("没有实际执行的修改语句，无需提交。")
+                if executed_count > 0: # Only commit if something was actually run
+                    if self.cohort_version:
+                        self._record_provenance(cur)
+                    if self.feature_store_columns:
+                        self._write_feature_store(cur)
+                    self.log.emit("所有语句执行完毕。正在提交事务...")
+                    conn_extract.commit()
+                    self.log.emit("事务已成功提交。")
+                    journal.finish(JOB_OUTCOME_SUCCESS, pg_conn=conn_extract)
+                else:
+                    self.log.emit("没有实际执行的修改语句，无需提交。")
+                    journal.finish(JOB_OUTCOME_SUCCESS)
 
 
-            self.log.emit("准备获取更新后的表结构和预览数据...")
-            cur.execute(f"""
-                SELECT column_name, data_type FROM information_schema.columns
-                WHERE table_schema = 'mimiciv_data' AND table_name = %s ORDER BY ordinal_position
-            """, (self.table_name,))
-            columns = cur.fetchall()
-            cur.execute(f"SELECT * FROM mimiciv_data.{self.table_name} LIMIT 100") # Use f-string carefully, table_name is controlled
-            rows = cur.fetchall()
-            self.log.emit("数据提取和预览准备完成。")
-            self.finished.emit(columns, rows)
+            self._emit_table_preview(cur)
 
         except psycopg2.OperationalError as op_err: # e.g. connection lost during operation
             self.log.emit(f"数据库操作错误 (如连接问题): {op_err}")
@@ -129,10 +222,85 @@ class SQLWorker(QObject):
                     self.log.emit(f"尝试回滚失败: {rb_err}")
             self.error.emit(f"SQLWorker 意外错误: {str(e)}")
         finally:
+            # 成功时已在提交后记录；其余各返回路径在此按取消标志记录结果
+            if journal: journal.finish(JOB_OUTCOME_CANCELLED if self.is_cancelled else JOB_OUTCOME_FAILED)
+            if self.router: self.router.close()
             if conn_extract:
                 self.log.emit("关闭数据库连接。")
                 conn_extract.close()
 
+    def _emit_table_preview(self, cur):
+        self.log.emit("准备获取更新后的表结构和预览数据...")
+        cur.execute(f"""
+            SELECT column_name, data_type FROM information_schema.columns
+            WHERE table_schema = 'mimiciv_data' AND table_name = %s ORDER BY ordinal_position
+        """, (self.table_name,))
+        columns = cur.fetchall()
+        cur.execute(f"SELECT * FROM mimiciv_data.{self.table_name} LIMIT 100") # Use f-string carefully, table_name is controlled
+        rows = cur.fetchall()
+        self.log.emit("数据提取和预览准备完成。")
+        self.finished.emit(columns, rows)
+
+    def _feature_config_hash(self, feature):
+        label, col_defs, update_sql = feature
+        return compute_feature_config_hash([label] + list(col_defs) + [update_sql])
+
+    def _select_stale_features(self, conn_extract):
+        """对照列来源记录确定要执行的特征并据此重组 SQL；全部已是最新且允许跳过时返回 False。"""
+        self.cohort_version, stale = check_stale_features(
+            conn_extract, 'mimiciv_data', self.table_name,
+            [(f[0], feature_column_names(f[1]), self._feature_config_hash(f)) for f in self.features])
+        if not self.skip_if_fresh:
+            self.features_to_run = list(self.features)
+            return True
+        self.features_to_run = [f for f in self.features if f[0] in stale]
+        skipped = [f[0] for f in self.features if f[0] not in stale]
+        if skipped:
+            self.log.emit(f"以下项目的列已由相同配置在当前队列行集上计算过，跳过: {', '.join(skipped)}")
+        if not self.features_to_run:
+            self.log.emit("所选项目均已是最新，无需重新计算。")
+            return False
+        qualified_table_name = f"mimiciv_data.{self.table_name}"
+        alter_sql = compose_alter_table_sql(qualified_table_name, [d for f in self.features_to_run for d in f[1]])
+        self.sql_to_execute = (alter_sql + "\n\n" + "\n\n".join(f[2] for f in self.features_to_run)).strip()
+        return True
+
+    def _write_feature_store(self, cur):
+        stage_ident = pgsql.Identifier(feature_store_stage_table_name(self.table_name))
+        start_time = time.time()
+        cur.execute(build_feature_store_insert_sql(f"mimiciv_data.{self.table_name}", stage_ident, "hadm_id",
+                                                   self.feature_store_columns))
+        self.log.emit(f"已向特征库追加 {cur.rowcount} 行 ({len(self.feature_store_columns)} 个特征，耗时: {time.time() - start_time:.2f} 秒)。")
+        cur.execute(pgsql.SQL("DROP TABLE IF EXISTS {}").format(stage_ident))
+
+    def _record_provenance(self, cur):
+        for feature in self.features_to_run:
+            record_provenance(cur, 'mimiciv_data', self.table_name, feature_column_names(feature[1]), feature[0],
+                              self._feature_config_hash(feature), self.cohort_version)
+
+    def _run_chunked(self, conn_extract, sql_statements):
+        """分块执行并在出错时发出 error 信号；成功返回 True。已提交的块由检查点保存，再次执行时续做。"""
+        statement_texts = [stmt.strip() for stmt in sql_statements
+                           if stmt.strip() and not all(line.strip().startswith('--') for line in stmt.strip().splitlines())]
+        try:
+            run_chunked_job(conn_extract, statement_texts, 'mimiciv_data', self.table_name, self.chunk_size,
+                            self.log.emit, self.progress.emit, lambda: self.is_cancelled, self.router)
+            return True
+        except InterruptedError as ie:
+            conn_extract.rollback()
+            self.log.emit(str(ie))
+            self.error.emit("操作已取消")
+        except QueryCanceledError as qc_err:
+            conn_extract.rollback()
+            err_msg = describe_query_canceled(qc_err, self.is_cancelled)
+            self.log.emit(f"{err_msg} (已完成的块已保存，可再次执行以继续)")
+            self.error.emit(err_msg)
+        except DATABASE_ERRORS as db_err:
+            conn_extract.rollback()
+            self.log.emit(f"数据库语句执行出错: {db_err} (已完成的块已保存，可再次执行以继续)")
+            self.error.emit(f"数据库错误: {db_err}")
+        return False
+
     def _parse_sql(self, sql_script):
         statements = []
         current_statement = []
@@ -172,13 +340,20 @@ class SQLWorker(QObject):
 
 
 class BaseInfoDataExtractionTab(QWidget):
-    def __init__(self, get_db_params_func, parent=None):
+    JOB_OWNER = "添加基础数据"
+
+    def __init__(self, get_db_params_func, get_job_timeouts_func=None, get_replica_settings_func=None,
+                 get_tuning_profile_func=None, job_scheduler=None, parent=None):
         super().__init__(parent)
         self.get_db_params = get_db_params_func
+        self.get_job_timeouts = get_job_timeouts_func or (lambda: None)
+        self.get_replica_settings = get_replica_settings_func or (lambda: None)
+        self.get_tuning_profile = get_tuning_profile_func or (lambda: None)
         self.selected_table = None
         self.sql_confirmed = False
-        self.worker = None
-        self.worker_thread = None
+        self.job_scheduler = job_scheduler or JobScheduler(self)
+        self.current_job_id = None # 进度条显示最近提交的任务
+        self.job_tables = {} # job_id -> 该任务写入的队列表
         self.option_checkboxes = [] # List to hold checkboxes
         self.DIAG_CATEGORY_KEYWORDS = DEFAULT_PAST_DIAGNOSIS_CATEGORIES
         self.init_ui()
@@ -255,6 +430,26 @@ class BaseInfoDataExtractionTab(QWidget):
         top_layout.addWidget(QLabel("SQL预览:"))
         self.sql_preview = QTextEdit(); self.sql_preview.setReadOnly(True); self.sql_preview.setMinimumHeight(150) # Increased height
         top_layout.addWidget(self.sql_preview)
+        chunk_layout = QHBoxLayout()
+        self.cb_chunked_update = QCheckBox("分块执行 UPDATE (按 hadm_id 分块提交，中断后再次执行可从断点继续)")
+        chunk_layout.addWidget(self.cb_chunked_update)
+        chunk_layout.addWidget(QLabel("每块 hadm_id 数:"))
+        self.chunk_size_spin = QSpinBox(); self.chunk_size_spin.setRange(100, 1000000); self.chunk_size_spin.setSingleStep(1000)
+        self.chunk_size_spin.setValue(DEFAULT_UPDATE_CHUNK_SIZE)
+        chunk_layout.addWidget(self.chunk_size_spin); chunk_layout.addStretch()
+        top_layout.addLayout(chunk_layout)
+        self.cb_skip_fresh = QCheckBox("跳过已是最新的项目 (配置与队列行集均未变化时不重新计算)")
+        self.cb_skip_fresh.setChecked(True)
+        top_layout.addWidget(self.cb_skip_fresh)
+        storage_layout = QHBoxLayout()
+        storage_layout.addWidget(QLabel("结果存储方式:"))
+        self.storage_mode_combo = QComboBox()
+        self.storage_mode_combo.addItem("宽表: 作为新列添加到队列表", STORAGE_MODE_WIDE)
+        self.storage_mode_combo.addItem("窄表: 追加写入特征库 feature_store (导出时转为宽表)", STORAGE_MODE_NARROW)
+        self.storage_mode_combo.currentIndexChanged.connect(self._on_storage_mode_changed)
+        storage_layout.addWidget(self.storage_mode_combo); storage_layout.addStretch()
+        top_layout.addLayout(storage_layout)
+        self._on_storage_mode_changed()
         buttons_layout = QHBoxLayout()
         self.confirm_sql_btn = QPushButton("SQL确认预览"); self.confirm_sql_btn.clicked.connect(self.handle_confirm_sql_preview); self.confirm_sql_btn.setEnabled(False)
         buttons_layout.addWidget(self.confirm_sql_btn)
@@ -288,7 +483,7 @@ class BaseInfoDataExtractionTab(QWidget):
             return
         conn = None
         try:
-            conn = psycopg2.connect(**db_params)
+            conn = connect_database(db_params)
             cur = conn.cursor()
             cur.execute("""
                 SELECT table_name FROM information_schema.tables
@@ -356,7 +551,7 @@ class BaseInfoDataExtractionTab(QWidget):
         try:
             if self.cb_past_disease.isChecked():
                 if db_params:
-                    conn_preview = psycopg2.connect(**db_params)
+                    conn_preview = connect_database(db_params)
                 else:
                     alter_sql, update_sql = self.generate_sql_parts(None)
                     generated_sql = (alter_sql + "\n\n" + update_sql).strip()
@@ -383,17 +578,19 @@ class BaseInfoDataExtractionTab(QWidget):
             if conn_preview: conn_preview.close()
 
 
-    def generate_sql_parts(self, conn_for_icd_lookup):
+    def generate_feature_parts(self, conn_for_icd_lookup):
         """
-        Generates column definitions and update SQL statements separately.
+        Generates per-option column definitions and update SQL.
         Returns:
-            tuple: (alter_table_sql_string, update_statements_sql_string)
+            tuple: ([(option_label, col_defs_list, update_sql_str)], notes) - notes are SQL comment strings (header, errors, info)
         """
-        if not self.selected_table: return "", ""
+        if not self.selected_table: return [], []
 
-        qualified_table_name = f"mimiciv_data.{self.selected_table}"
-        all_col_defs = []
-        all_update_sqls = [f"-- SQL for table {qualified_table_name} --\n"]
+        qualified_table_name = self._feature_sql_target_table()
+        features = []
+        notes = [f"-- SQL for table mimiciv_data.{self.selected_table} --\n"]
+        if qualified_table_name != f"mimiciv_data.{self.selected_table}":
+            notes.append(f"-- 窄表模式: 以下语句作用于临时副本 {qualified_table_name}，完成后追加写入特征库 --\n")
         past_diag_data_for_sql = {}
 
         if self.cb_past_disease.isChecked():
@@ -410,63 +607,61 @@ class BaseInfoDataExtractionTab(QWidget):
                         if icd_codes_list:
                             past_diag_data_for_sql[category_key] = icd_codes_list
                 except (Exception, psycopg2.Error) as db_err:
-                    all_update_sqls.append(f"-- [错误] 查询自定义既往病史ICD码时出错: {db_err} --\n")
+                    notes.append(f"-- [错误] 查询自定义既往病史ICD码时出错: {db_err} --\n")
                     past_diag_data_for_sql = {}
             # else: # No connection, add_past_diagnostic will handle empty past_diag_data_for_sql
 
         # Call helper functions which now return (col_defs_list, update_sql_str)
-        if self.cb_demography.isChecked():
-            defs, updates = add_demography(qualified_table_name, "") # sql_accumulator not used by new funcs
-            all_col_defs.extend(defs); all_update_sqls.append(updates)
-        if self.cb_antecedent.isChecked():
-            defs, updates = add_antecedent(qualified_table_name, "")
-            all_col_defs.extend(defs); all_update_sqls.append(updates)
-        if self.cb_vital_sign.isChecked(): # For actual vital signs
-            defs, updates = add_vital_sign(qualified_table_name, "")
-            all_col_defs.extend(defs); all_update_sqls.append(updates)
-        if self.cb_scores.isChecked(): # For patient scores
-            defs, updates = add_scores(qualified_table_name, "")
-            all_col_defs.extend(defs); all_update_sqls.append(updates)
-        if self.cb_blood_info.isChecked():
-            defs, updates = add_blood_info(qualified_table_name, "")
-            all_col_defs.extend(defs); all_update_sqls.append(updates)
-        if self.cb_cardiovascular_lab.isChecked():
-            defs, updates = add_cardiovascular_lab(qualified_table_name, "")
-            all_col_defs.extend(defs); all_update_sqls.append(updates)
-        if self.cb_medications.isChecked():
-            defs, updates = add_medicine(qualified_table_name, "")
-            all_col_defs.extend(defs); all_update_sqls.append(updates)
-        if self.cb_surgery.isChecked():
-            defs, updates = add_surgeries(qualified_table_name, "")
-            all_col_defs.extend(defs); all_update_sqls.append(updates)
+        option_builders = [
+            (self.cb_demography, add_demography), (self.cb_antecedent, add_antecedent),
+            (self.cb_vital_sign, add_vital_sign), # For actual vital signs
+            (self.cb_scores, add_scores), # For patient scores
+            (self.cb_blood_info, add_blood_info), (self.cb_cardiovascular_lab, add_cardiovascular_lab),
+            (self.cb_medications, add_medicine), (self.cb_surgery, add_surgeries),
+        ]
+        for checkbox, builder in option_builders:
+            if checkbox.isChecked():
+                defs, updates = builder(qualified_table_name, "") # sql_accumulator not used by new funcs
+                features.append((checkbox.text(), defs, updates))
 
         if self.cb_past_disease.isChecked():
             # This function now also returns (col_defs, update_sql)
             defs, updates = add_past_diagnostic(qualified_table_name, "", past_diag_data_for_sql)
-            all_col_defs.extend(defs)
-            all_update_sqls.append(updates)
+            features.append((self.cb_past_disease.text(), defs, updates))
             if not conn_for_icd_lookup and not past_diag_data_for_sql : # if no connection AND no data (meaning lookup wasn't even tried or failed early)
                  # Check if the specific warning was already added by add_past_diagnostic
-                 if not any("-- No past diagnoses data provided" in s for s in all_update_sqls):
-                    all_update_sqls.append("\n-- [INFO] '患者既往病史 (自定义ICD)' 需要数据库连接才能生成SQL。 --\n")
+                 if "-- No past diagnoses data provided" not in updates:
+                    notes.append("\n-- [INFO] '患者既往病史 (自定义ICD)' 需要数据库连接才能生成SQL。 --\n")
+
+        return features, notes
 
+    def _is_narrow_storage(self):
+        return self.storage_mode_combo.currentData() == STORAGE_MODE_NARROW
 
+    def _on_storage_mode_changed(self, index=None):
+        # 窄表模式的 UPDATE 作用于临时副本，不分块也不记录列来源: 对应选项不可用
+        wide = not self._is_narrow_storage()
+        for widget in (self.cb_chunked_update, self.chunk_size_spin, self.cb_skip_fresh):
+            widget.setEnabled(wide)
+        self._reset_sql_confirmation()
+
+    def _feature_sql_target_table(self):
+        """特征 SQL 作用的表: 宽表模式为队列表本身，窄表模式为其临时副本。"""
+        if self._is_narrow_storage():
+            return feature_store_stage_table_name(self.selected_table)
+        return f"mimiciv_data.{self.selected_table}"
+
+    def generate_sql_parts(self, conn_for_icd_lookup):
+        """
+        Generates column definitions and update SQL statements separately.
+        Returns:
+            tuple: (alter_table_sql_string, update_statements_sql_string)
+        """
+        if not self.selected_table: return "", ""
+        features, notes = self.generate_feature_parts(conn_for_icd_lookup)
         # Construct single ALTER TABLE statement
-        alter_table_sql = ""
-        if all_col_defs:
-            # Deduplicate column definitions (name only) before creating ALTER statement
-            unique_col_defs_dict = {}
-            for col_def_str in all_col_defs:
-                col_name = col_def_str.split(' ')[0].strip()
-                if col_name not in unique_col_defs_dict:
-                    unique_col_defs_dict[col_name] = col_def_str
-
-            if unique_col_defs_dict:
-                # Format: ALTER TABLE schema.table ADD COLUMN IF NOT EXISTS col1 type1, ADD COLUMN IF NOT EXISTS col2 type2...;
-                add_clauses = [f"ADD COLUMN IF NOT EXISTS {col_def}" for col_def in unique_col_defs_dict.values()]
-                alter_table_sql = f"ALTER TABLE {qualified_table_name}\n    " + ",\n    ".join(add_clauses) + ";\n"
-
-        update_statements_sql = "\n\n".join(all_update_sqls)
+        alter_table_sql = compose_alter_table_sql(self._feature_sql_target_table(), [d for f in features for d in f[1]])
+        update_statements_sql = "\n\n".join(notes + [f[2] for f in features])
         return alter_table_sql, update_statements_sql
 
 
@@ -492,10 +687,11 @@ class BaseInfoDataExtractionTab(QWidget):
         conn_generate = None
         try:
             if needs_db_for_generation:
-                conn_generate = psycopg2.connect(**db_params)
+                conn_generate = connect_database(db_params)
 
-            alter_sql, update_sql = self.generate_sql_parts(conn_generate)
-            sql_to_execute = (alter_sql + "\n\n" + update_sql).strip()
+            features, notes = self.generate_feature_parts(conn_generate)
+            alter_sql = compose_alter_table_sql(self._feature_sql_target_table(), [d for f in features for d in f[1]])
+            sql_to_execute = (alter_sql + "\n\n" + "\n\n".join(notes + [f[2] for f in features])).strip()
 
             base_sql_header = f"-- SQL for table mimiciv_data.{self.selected_table} --"
             if not sql_to_execute or sql_to_execute == base_sql_header:
@@ -517,47 +713,43 @@ class BaseInfoDataExtractionTab(QWidget):
             if conn_generate: conn_generate.close()
 
         self.prepare_for_long_operation(True)
-        self.worker = SQLWorker(sql_to_execute, db_params, self.selected_table)
-        self.worker_thread = QThread()
-        self.worker.moveToThread(self.worker_thread)
-        self.worker_thread.started.connect(self.worker.run)
-        self.worker.finished.connect(self.on_sql_execution_finished)
-        self.worker.error.connect(self.on_sql_execution_error)
-        self.worker.progress.connect(self.update_execution_progress)
-        self.worker.log.connect(self.update_execution_log)
-        self.worker.finished.connect(self.worker_thread.quit)
-        self.worker.error.connect(self.worker_thread.quit)
-        self.worker_thread.finished.connect(self.worker_thread.deleteLater)
-        self.worker.finished.connect(self.worker.deleteLater)
-        self.worker_thread.start()
-
-    def prepare_for_long_operation(self, starting=True):
+        if self._is_narrow_storage():
+            # UPDATE 作用于会话级临时副本: 不分块、不记录列来源
+            feature_store_columns = list(dict.fromkeys(tuple(col_def.split(' ', 1)) for f in features for col_def in f[1]))
+            worker = SQLWorker(sql_to_execute, db_params, self.selected_table, self.get_job_timeouts(), None,
+                                    ", ".join(f[0] for f in features), feature_store_columns=feature_store_columns,
+                                    replica_settings=self.get_replica_settings(), tuning_profile=self.get_tuning_profile())
+        else:
+            chunk_size = self.chunk_size_spin.value() if self.cb_chunked_update.isChecked() else None
+            worker = SQLWorker(sql_to_execute, db_params, self.selected_table, self.get_job_timeouts(), chunk_size,
+                                    ", ".join(f[0] for f in features), features, self.cb_skip_fresh.isChecked(),
+                                    replica_settings=self.get_replica_settings(), tuning_profile=self.get_tuning_profile())
+        # 任务交给统一的任务队列: 与其他标签页的任务一起按并发上限排队；提交后本页可继续为其他队列表提交任务
+        job_id = self.job_scheduler.submit(
+            worker, f"{self.selected_table}: {', '.join(f[0] for f in features)}", self.JOB_OWNER, db_params,
+            "base_info_extraction", exclusive_keys=[f"mimiciv_data.{self.selected_table}"],
+            on_finished=self.on_sql_execution_finished, on_error=self.on_sql_execution_error,
+            on_progress=self.update_execution_progress, on_log=lambda j, message: self.update_execution_log(f"[任务 {j}] {message}"))
+        self.current_job_id = job_id
+        self.job_tables[job_id] = self.selected_table
+
+    def prepare_for_long_operation(self, starting=True, finished_job_id=None):
         if starting:
             self.execution_status_group.setVisible(True)
             self.execution_progress.setValue(0)
-            self.execution_log.clear()
-            self.update_execution_log("开始执行SQL操作...")
-            self.extract_btn.setEnabled(False)
-            self.confirm_sql_btn.setEnabled(False)
-            self.refresh_btn.setEnabled(False)
-            self.table_combo.setEnabled(False)
+            if not self.job_scheduler.active_job_ids(self.JOB_OWNER):
+                self.execution_log.clear()
+            self.update_execution_log("提交SQL执行任务...")
             self.cancel_extraction_btn.setEnabled(True)
-            # Disable option checkboxes during execution
-            for cb in self.option_checkboxes: cb.setEnabled(False)
-            self.select_all_btn.setEnabled(False)
-            self.deselect_all_btn.setEnabled(False)
-        else: # Operation finished or cancelled
+        else: # 某个任务结束 (完成/失败/取消)
             self.confirm_sql_btn.setEnabled(bool(self.selected_table))
             self.extract_btn.setEnabled(self.sql_confirmed and bool(self.selected_table))
-            self.refresh_btn.setEnabled(True)
-            self.table_combo.setEnabled(True)
-            self.cancel_extraction_btn.setEnabled(False)
-            # Re-enable option checkboxes
-            for cb in self.option_checkboxes: cb.setEnabled(True)
-            self.select_all_btn.setEnabled(True)
-            self.deselect_all_btn.setEnabled(True)
+            remaining = [j for j in self.job_scheduler.active_job_ids(self.JOB_OWNER) if j != finished_job_id]
+            self.cancel_extraction_btn.setEnabled(bool(remaining))
 
-    def update_execution_progress(self, value, max_value=None):
+    def update_execution_progress(self, job_id, value, max_value=None):
+        if job_id != self.current_job_id:
+            return
         if max_value is not None and self.execution_progress.maximum() != max_value :
              self.execution_progress.setMaximum(max_value)
         self.execution_progress.setValue(value)
@@ -597,12 +789,15 @@ class BaseInfoDataExtractionTab(QWidget):
     # on_options_changed is removed as logic moved to _reset_sql_confirmation
 
     def cancel_extraction(self):
-        if self.worker:
-            self.update_execution_log("正在请求取消SQL执行...")
-            self.worker.cancel()
+        job_ids = self.job_scheduler.active_job_ids(self.JOB_OWNER)
+        if job_ids:
+            self.update_execution_log(f"正在请求取消本页的 {len(job_ids)} 个任务...")
+            for job_id in job_ids:
+                self.job_scheduler.cancel(job_id)
             self.cancel_extraction_btn.setEnabled(False)
 
-    def on_sql_execution_finished(self, columns, rows):
+    def on_sql_execution_finished(self, job_id, columns, rows):
+        table_name = self.job_tables.pop(job_id, self.selected_table)
         self.result_table.setRowCount(len(rows))
         self.result_table.setColumnCount(len(columns))
         column_names = [col[0] for col in columns]
@@ -611,22 +806,19 @@ class BaseInfoDataExtractionTab(QWidget):
             for j, value in enumerate(row):
                 self.result_table.setItem(i, j, QTableWidgetItem(str(value) if value is not None else ""))
         self.result_table.resizeColumnsToContents()
-        self.update_execution_log("SQL执行完成！")
-        QMessageBox.information(self, "提取成功", f"已成功为表 {self.selected_table} 添加基础数据")
-        self.prepare_for_long_operation(False)
-        self.worker = None
-        self.worker_thread = None
-
-    def on_sql_execution_error(self, error_message):
-        self.update_execution_log(f"错误: {error_message}")
+        self.update_execution_log(f"[任务 {job_id}] SQL执行完成！")
+        self.prepare_for_long_operation(False, job_id)
+        QMessageBox.information(self, "提取成功", f"已成功为表 {table_name} 添加基础数据")
+
+    def on_sql_execution_error(self, job_id, error_message):
+        self.job_tables.pop(job_id, None)
+        self.update_execution_log(f"[任务 {job_id}] 错误: {error_message}")
         if "操作已取消" not in error_message:
             QMessageBox.critical(self, "提取失败", f"无法提取基础数据: {error_message}")
         else:
             QMessageBox.information(self, "操作取消", "数据提取操作已取消。")
         self.sql_confirmed = False
         self.extract_btn.setEnabled(False)
-        self.prepare_for_long_operation(False)
-        self.worker = None
-        self.worker_thread = None
+        self.prepare_for_long_operation(False, job_id)
 
 # --- END OF FILE tab_combine_base_info.py ---
\ No newline at end of file
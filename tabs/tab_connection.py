@@ -1,7 +1,13 @@
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QFormLayout, QLineEdit, QPushButton, QHBoxLayout, QMessageBox
+from PySide6.QtWidgets import (QWidget, QVBoxLayout, QFormLayout, QLineEdit, QPushButton, QHBoxLayout, QMessageBox, QSpinBox,
+                               QGroupBox, QComboBox, QFileDialog, QStackedWidget, QPlainTextEdit)
 from PySide6.QtCore import Signal
-from app_config import DEFAULT_DB_HOST, DEFAULT_DB_PORT, DEFAULT_DB_NAME, DEFAULT_DB_USER
-import psycopg2
+from app_config import (DEFAULT_DB_HOST, DEFAULT_DB_PORT, DEFAULT_DB_NAME, DEFAULT_DB_USER,
+                        DEFAULT_JOB_STATEMENT_TIMEOUT_MIN, DEFAULT_JOB_LOCK_TIMEOUT_SEC,
+                        DEFAULT_LOCAL_DATA_DIR, DEFAULT_DUCKDB_DATABASE_FILE, DEFAULT_DUCKDB_THREADS,
+                        DEFAULT_REPLICA_MAX_LAG_WAIT_SEC, SESSION_TUNING_PROFILES, DEFAULT_JOB_TUNING_PROFILE)
+import os
+from sql_logic import db_backend
+from sql_logic.replica_router import parse_replica_endpoints
 
 class ConnectionTab(QWidget):
     connected_signal = Signal()
@@ -17,8 +23,18 @@ class ConnectionTab(QWidget):
     
     def init_ui(self):
         layout = QVBoxLayout(self)
-        form_layout = QFormLayout()
 
+        backend_form = QFormLayout()
+        self.backend_combo = QComboBox()
+        self.backend_combo.addItem("PostgreSQL 数据库", db_backend.BACKEND_POSTGRES)
+        self.backend_combo.addItem("本地文件 (DuckDB + Parquet/CSV.gz，无需数据库服务器)", db_backend.BACKEND_DUCKDB)
+        self.backend_combo.currentIndexChanged.connect(self._on_backend_changed)
+        backend_form.addRow("执行后端:", self.backend_combo)
+        layout.addLayout(backend_form)
+
+        self.backend_stack = QStackedWidget()
+        pg_widget = QWidget()
+        form_layout = QFormLayout(pg_widget)
         form_layout.addRow("数据库名称:", self.db_name_input)
         form_layout.addRow("用户名:", self.db_user_input)
         self.db_password_input = QLineEdit()
@@ -27,7 +43,68 @@ class ConnectionTab(QWidget):
         form_layout.addRow("主机:", self.db_host_input)
         form_layout.addRow("端口:", self.db_port_input)
 
-        layout.addLayout(form_layout)
+        # 只读副本 (连接后仍可修改，对之后启动的任务生效): 临时表的只读聚合在副本上计算，主库只执行写入
+        replica_group = QGroupBox("只读副本 (可选，分担大查询)")
+        replica_form = QFormLayout(replica_group)
+        self.replica_endpoints_input = QPlainTextEdit()
+        self.replica_endpoints_input.setPlaceholderText("每行一个: 主机[:端口] 或 host=... port=... dbname=...\n未写出的参数与主库相同")
+        self.replica_endpoints_input.setMaximumHeight(70)
+        replica_form.addRow("副本地址:", self.replica_endpoints_input)
+        self.replica_lag_wait_spin = QSpinBox()
+        self.replica_lag_wait_spin.setRange(0, 3600)
+        self.replica_lag_wait_spin.setSuffix(" 秒")
+        self.replica_lag_wait_spin.setValue(DEFAULT_REPLICA_MAX_LAG_WAIT_SEC)
+        self.replica_lag_wait_spin.setToolTip("流复制备库回放落后于主库时最多等待的时间，超时则该任务在主库执行。")
+        replica_form.addRow("最长等待回放:", self.replica_lag_wait_spin)
+        form_layout.addRow(replica_group)
+        self.backend_stack.addWidget(pg_widget)
+
+        # 本地后端: 数据目录下为 hosp/、icu/ 模块子目录；派生表 (队列表等) 写入本地数据库文件
+        local_widget = QWidget()
+        local_form = QFormLayout(local_widget)
+        self.local_data_dir_input = QLineEdit(DEFAULT_LOCAL_DATA_DIR)
+        self.local_data_dir_input.setPlaceholderText("包含 hosp/ 与 icu/ 子目录的 MIMIC-IV 数据目录")
+        self.local_data_dir_input.setToolTip("可直接使用官方 CSV.gz；先用 python -m sql_logic.parquet_ingest 转换为分区 Parquet 查询更快。")
+        self.browse_data_dir_btn = QPushButton("浏览...")
+        self.browse_data_dir_btn.clicked.connect(self._browse_local_data_dir)
+        dir_layout = QHBoxLayout()
+        dir_layout.addWidget(self.local_data_dir_input)
+        dir_layout.addWidget(self.browse_data_dir_btn)
+        local_form.addRow("数据目录:", dir_layout)
+        self.duckdb_file_input = QLineEdit(DEFAULT_DUCKDB_DATABASE_FILE)
+        self.duckdb_file_input.setToolTip("相对路径相对于数据目录；队列表与提取结果保存在此文件中。")
+        local_form.addRow("本地数据库文件:", self.duckdb_file_input)
+        self.duckdb_threads_spin = QSpinBox()
+        self.duckdb_threads_spin.setRange(0, 256)
+        self.duckdb_threads_spin.setSpecialValueText("全部核心")
+        self.duckdb_threads_spin.setValue(DEFAULT_DUCKDB_THREADS)
+        local_form.addRow("并行线程数:", self.duckdb_threads_spin)
+        self.backend_stack.addWidget(local_widget)
+        layout.addWidget(self.backend_stack)
+
+        # 长任务超时与会话调优 (连接后仍可修改，对之后启动的任务生效)
+        job_group = QGroupBox("长任务设置 (队列创建 / 数据提取 / 专项数据合并)")
+        job_form = QFormLayout(job_group)
+        self.statement_timeout_spin = QSpinBox()
+        self.statement_timeout_spin.setRange(0, 24 * 60)
+        self.statement_timeout_spin.setSuffix(" 分钟")
+        self.statement_timeout_spin.setSpecialValueText("不限制")
+        self.statement_timeout_spin.setValue(DEFAULT_JOB_STATEMENT_TIMEOUT_MIN)
+        job_form.addRow("单条语句超时:", self.statement_timeout_spin)
+        self.lock_timeout_spin = QSpinBox()
+        self.lock_timeout_spin.setRange(0, 3600)
+        self.lock_timeout_spin.setSuffix(" 秒")
+        self.lock_timeout_spin.setSpecialValueText("不限制")
+        self.lock_timeout_spin.setValue(DEFAULT_JOB_LOCK_TIMEOUT_SEC)
+        job_form.addRow("锁等待超时:", self.lock_timeout_spin)
+        self.tuning_profile_combo = QComboBox()
+        for profile_key, profile in SESSION_TUNING_PROFILES.items():
+            self.tuning_profile_combo.addItem(profile["label"], profile_key)
+        self.tuning_profile_combo.setCurrentIndex(self.tuning_profile_combo.findData(DEFAULT_JOB_TUNING_PROFILE))
+        self.tuning_profile_combo.setToolTip("长任务连接的 work_mem、并行 worker 数、JIT 等会话参数 (记录在任务历史中)；"
+                                             "预览始终使用交互预览配置，建索引步骤使用索引构建配置。本地 DuckDB 后端忽略这些设置。")
+        job_form.addRow("会话调优配置:", self.tuning_profile_combo)
+        layout.addWidget(job_group)
 
         btn_layout = QHBoxLayout()
         self.test_connection_btn = QPushButton("连接测试")
@@ -40,16 +117,52 @@ class ConnectionTab(QWidget):
 
         layout.addLayout(btn_layout)
 
-    def test_connection(self):
-        params = {
+    def get_job_timeouts(self):
+        return {"statement_timeout_ms": self.statement_timeout_spin.value() * 60 * 1000,
+                "lock_timeout_ms": self.lock_timeout_spin.value() * 1000}
+
+    def get_tuning_profile(self):
+        return self.tuning_profile_combo.currentData()
+
+    def get_replica_settings(self):
+        """未配置副本或使用本地后端时返回 None。"""
+        if self.db_params.get('backend') == db_backend.BACKEND_DUCKDB:
+            return None
+        endpoints = parse_replica_endpoints(self.replica_endpoints_input.toPlainText(), self.db_params)
+        if not endpoints:
+            return None
+        return {"endpoints": endpoints, "max_lag_wait_s": self.replica_lag_wait_spin.value()}
+
+    def _on_backend_changed(self, index):
+        self.backend_stack.setCurrentIndex(index)
+
+    def _browse_local_data_dir(self):
+        directory = QFileDialog.getExistingDirectory(self, "选择 MIMIC-IV 数据目录", self.local_data_dir_input.text())
+        if directory:
+            self.local_data_dir_input.setText(directory)
+
+    def _collect_params(self):
+        if self.backend_combo.currentData() == db_backend.BACKEND_DUCKDB:
+            data_dir = self.local_data_dir_input.text().strip()
+            database_file = self.duckdb_file_input.text().strip() or DEFAULT_DUCKDB_DATABASE_FILE
+            return {
+                'backend': db_backend.BACKEND_DUCKDB,
+                'local_data_dir': data_dir,
+                'database_path': database_file if os.path.isabs(database_file) else os.path.join(data_dir, database_file),
+                'threads': self.duckdb_threads_spin.value(),
+            }
+        return {
             'dbname': self.db_name_input.text(),
             'user': self.db_user_input.text(),
             'password': self.db_password_input.text(),
             'host': self.db_host_input.text(),
             'port': self.db_port_input.text()
         }
+
+    def test_connection(self):
+        params = self._collect_params()
         try:
-            conn = psycopg2.connect(**params)
+            conn = db_backend.connect_database(params)
             conn.close()
             self.db_params = params
             self.connected = True
@@ -64,15 +177,9 @@ class ConnectionTab(QWidget):
     def connect_database(self):
         if self.connected:
             return
-        self.db_params = {
-            'dbname': self.db_name_input.text(),
-            'user': self.db_user_input.text(),
-            'password': self.db_password_input.text(),
-            'host': self.db_host_input.text(),
-            'port': self.db_port_input.text()
-        }
+        self.db_params = self._collect_params()
         try:
-            conn = psycopg2.connect(**self.db_params)
+            conn = db_backend.connect_database(self.db_params)
             conn.close()
             self.connected = True
             self.lock_inputs()
@@ -84,6 +191,11 @@ class ConnectionTab(QWidget):
             QMessageBox.critical(self, "连接失败", f"无法连接到数据库: {str(e)}")
 
     def lock_inputs(self):
+        self.backend_combo.setEnabled(False)
+        self.local_data_dir_input.setEnabled(False)
+        self.browse_data_dir_btn.setEnabled(False)
+        self.duckdb_file_input.setEnabled(False)
+        self.duckdb_threads_spin.setEnabled(False)
         self.db_name_input.setEnabled(False)
         self.db_user_input.setEnabled(False)
         self.db_password_input.setEnabled(False)
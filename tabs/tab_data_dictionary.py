@@ -4,12 +4,13 @@ from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
                                QMessageBox, QApplication, QHeaderView, QAbstractItemView,
                                QScrollArea,QGroupBox, QTextEdit, QProgressBar) 
 from PySide6.QtCore import Qt, Slot
-import psycopg2
 import psycopg2.sql as pgsql 
 import traceback
 import re 
 
 from ui_components.conditiongroup import ConditionGroupWidget
+from sql_logic.condition_tree import get_cached_column_types
+from sql_logic.db_backend import connect_database, DATABASE_ERRORS
 
 class DataDictionaryTab(QWidget):
     # ... (常量和 TABLE_COLUMN_CONFIG, AVAILABLE_SEARCH_FIELDS_FOR_CONDITIONS 保持不变) ...
@@ -250,10 +251,16 @@ class DataDictionaryTab(QWidget):
 
     @Slot()
     def on_db_connected(self):
+        self._load_condition_field_types()
         self._update_search_button_state()
         self._update_execution_log("数据库已连接。请选择字典表并构建搜索条件。")
         self._on_condition_changed_update_preview() 
 
+    def _load_condition_field_types(self):
+        # 按字典表的真实列类型编译条件 (文本列不再 CAST，前缀搜索可走索引)；未连接时为空，沿用按列名推测
+        self.condition_group_widget.set_field_types(
+            get_cached_column_types(self.get_db_params(), self.dict_table_combo.currentData()))
+
     @Slot()
     def _on_dict_table_changed(self):
         selected_table_key = self.dict_table_combo.currentData()
@@ -263,6 +270,7 @@ class DataDictionaryTab(QWidget):
         self.result_table.setHorizontalHeaderLabels([c[1] for c in column_config])
         available_fields = self.AVAILABLE_SEARCH_FIELDS_FOR_CONDITIONS.get(selected_table_key, [])
         self.condition_group_widget.set_available_search_fields(available_fields)
+        self._load_condition_field_types()
         self.condition_group_widget.clear_all()
         
         # 当字典表改变时，清除上一次的日志和进度
@@ -342,7 +350,7 @@ class DataDictionaryTab(QWidget):
         conn = None
         try:
             self._update_execution_log("正在连接数据库...")
-            conn = psycopg2.connect(**db_params)
+            conn = connect_database(db_params)
             cur = conn.cursor()
             self._update_execution_progress(25)
 
@@ -386,7 +394,7 @@ class DataDictionaryTab(QWidget):
                 self._update_execution_log(f"在 {selected_table_key} 中未找到符合条件的记录。")
             self._update_execution_progress(100)
 
-        except psycopg2.Error as db_err:
+        except DATABASE_ERRORS as db_err:
             log_msg = f"数据库查询错误: {db_err}\nSQL: {self.sql_preview_textedit.toPlainText()}\nParams: {query_params}"
             self._update_execution_log(log_msg)
             self._update_execution_log(f"Traceback: {traceback.format_exc()}")
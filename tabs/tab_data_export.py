@@ -2,19 +2,32 @@
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
                           QTableWidget, QTableWidgetItem, QMessageBox, QLabel,
                           QSplitter, QTextEdit, QComboBox, QGroupBox,
-                          QFileDialog, QLineEdit, QSpinBox, QGridLayout, QAbstractItemView, QApplication) # Removed unused QCheckBox, QScrollArea, QFormLayout
+                          QFileDialog, QLineEdit, QSpinBox, QGridLayout, QAbstractItemView, QApplication, QCheckBox) # Removed unused QScrollArea, QFormLayout
 from PySide6.QtCore import Qt, Slot
-import psycopg2
 import psycopg2.sql as pgsql
 import os
+import traceback
 import pandas as pd
 
+from sql_logic.db_backend import connect_database, backend_of, BACKEND_DUCKDB, stream_query_to_csv, stream_query_to_parquet
+from sql_logic.sql_render import render_sql
+from sql_logic.sql_builder_preview import (
+    APPROX_ROW_COUNT_SQL, PRIMARY_KEY_COLUMNS_SQL, TABLE_EXISTS_SQL, SAMPLE_METHOD_SYSTEM, SAMPLE_METHOD_BERNOULLI,
+    compute_sample_percent, build_sample_preview_sql, build_keyset_page_sql
+)
+from sql_logic.feature_store import (FEATURE_STORE_SCHEMA, FEATURE_STORE_TABLE, build_feature_catalog_sql,
+                                     catalog_value_slots, build_feature_pivot_sql)
+
+PREVIEW_MODE_KEYSET = "KEYSET"
+
 class DataExportTab(QWidget):
     def __init__(self, get_db_params_func, parent=None):
         super().__init__(parent)
         self.get_db_params = get_db_params_func
         self.selected_table_schema = 'mimiciv_data'
         self.selected_table_name = None
+        # 键集分页状态: {"table": (schema, name), "key_columns": [...], "last_key": tuple|None, "page": int}
+        self._keyset_state = None
         # self.db_conn = None # Connection managed per operation for now
         self.init_ui()
 
@@ -61,6 +74,9 @@ class DataExportTab(QWidget):
         self.limit_spinbox.setSpecialValueText("全部") # For 0
         limit_layout.addWidget(self.limit_spinbox); limit_layout.addStretch()
         export_options_layout.addLayout(limit_layout)
+        self.cb_include_feature_store = QCheckBox("合并特征库 (feature_store 窄表) 中该队列的特征，导出时转为宽表")
+        self.cb_include_feature_store.setChecked(True)
+        export_options_layout.addWidget(self.cb_include_feature_store)
         top_layout.addWidget(export_options_group)
 
         action_layout = QHBoxLayout()
@@ -84,7 +100,20 @@ class DataExportTab(QWidget):
         preview_options_layout = QHBoxLayout()
         preview_options_layout.addWidget(QLabel("预览行数:"))
         self.preview_spinbox = QSpinBox(); self.preview_spinbox.setRange(10, 1000); self.preview_spinbox.setValue(100)
-        preview_options_layout.addWidget(self.preview_spinbox); preview_options_layout.addStretch()
+        preview_options_layout.addWidget(self.preview_spinbox)
+        preview_options_layout.addWidget(QLabel("预览方式:"))
+        self.preview_mode_combo = QComboBox()
+        self.preview_mode_combo.addItem("随机抽样 (TABLESAMPLE SYSTEM, 最快)", SAMPLE_METHOD_SYSTEM)
+        self.preview_mode_combo.addItem("随机抽样 (TABLESAMPLE BERNOULLI, 更均匀)", SAMPLE_METHOD_BERNOULLI)
+        self.preview_mode_combo.addItem("顺序分页 (按主键)", PREVIEW_MODE_KEYSET)
+        preview_options_layout.addWidget(self.preview_mode_combo)
+        self.next_page_btn = QPushButton("下一页"); self.next_page_btn.clicked.connect(self.preview_next_page); self.next_page_btn.setEnabled(False)
+        preview_options_layout.addWidget(self.next_page_btn)
+        self.exact_count_btn = QPushButton("精确计数"); self.exact_count_btn.clicked.connect(self.count_rows_exact); self.exact_count_btn.setEnabled(False)
+        preview_options_layout.addWidget(self.exact_count_btn)
+        preview_options_layout.addStretch()
+        self.row_count_label = QLabel("")
+        preview_options_layout.addWidget(self.row_count_label)
         result_layout.addLayout(preview_options_layout)
         self.result_table = QTableWidget(); self.result_table.setAlternatingRowColors(True)
         self.result_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
@@ -97,7 +126,7 @@ class DataExportTab(QWidget):
             QMessageBox.warning(self, "未连接", "请先在“数据库连接”页面连接数据库")
             return None
         try:
-            conn = psycopg2.connect(**db_params)
+            conn = connect_database(db_params)
             return conn
         except Exception as e:
             QMessageBox.critical(self, "数据库连接失败", f"无法连接到数据库: {str(e)}")
@@ -179,6 +208,10 @@ class DataExportTab(QWidget):
             print(f"Table selected: {self.selected_table_schema}.{self.selected_table_name}")
             self.preview_btn.setEnabled(True)
             self.export_btn.setEnabled(True)
+            self.exact_count_btn.setEnabled(True)
+            self._keyset_state = None
+            self.next_page_btn.setEnabled(False)
+            self.row_count_label.clear()
             self._update_export_path_suggestion()
         else:
             print("Table selection invalid or no table.")
@@ -186,6 +219,10 @@ class DataExportTab(QWidget):
             self.selected_table_name = None
             self.preview_btn.setEnabled(False)
             self.export_btn.setEnabled(False)
+            self.exact_count_btn.setEnabled(False)
+            self._keyset_state = None
+            self.next_page_btn.setEnabled(False)
+            self.row_count_label.clear()
             self.export_path_input.clear()
             self.sql_preview_display.clear()
             self.result_table.clearContents()
@@ -280,6 +317,32 @@ class DataExportTab(QWidget):
             print(f"Preview specific table: Mismatch after programmatic selection. Expected: {schema_name}.{table_name}, Got: {self.selected_table_schema}.{self.selected_table_name}")
             QMessageBox.warning(self, "预览联动失败", f"无法自动选中表 '{schema_name}.{table_name}' 进行预览。\n当前选中: {self.selected_table_schema}.{self.selected_table_name}。请手动选择。")
 
+    def _get_approx_row_count(self, conn):
+        # 读取统计信息中的估计行数，避免 COUNT(*) 全表扫描；未 ANALYZE 时返回 None
+        with conn.cursor() as cur:
+            cur.execute(APPROX_ROW_COUNT_SQL, (self.selected_table_schema, self.selected_table_name))
+            row = cur.fetchone()
+        if not row or row[0] is None or row[0] < 0:
+            return None
+        return int(row[0])
+
+    def _get_primary_key_columns(self, conn):
+        with conn.cursor() as cur:
+            cur.execute(PRIMARY_KEY_COLUMNS_SQL, (self.selected_table_schema, self.selected_table_name))
+            return [r[0] for r in cur.fetchall()]
+
+    def _populate_result_table(self, df):
+        # 一次性把整个 DataFrame 转成字符串 (列表/字典/数组直接 str，缺失值显示为空)，再逐格填充
+        display_values = df.astype(object).where(df.notna(), "").astype(str).values.tolist() if not df.empty else []
+        self.result_table.clearContents() # Clear previous results
+        self.result_table.setRowCount(df.shape[0])
+        self.result_table.setColumnCount(df.shape[1])
+        self.result_table.setHorizontalHeaderLabels([str(c) for c in df.columns])
+        for i, row_values in enumerate(display_values):
+            for j, display_value in enumerate(row_values):
+                self.result_table.setItem(i, j, QTableWidgetItem(display_value))
+        self.result_table.resizeColumnsToContents()
+
     @Slot()
     def preview_data(self):
         print("--- preview_data called ---")
@@ -290,53 +353,144 @@ class DataExportTab(QWidget):
             self.sql_preview_display.clear(); self.result_table.clearContents(); self.result_table.setRowCount(0)
             return
 
+        preview_mode = self.preview_mode_combo.currentData()
+        if preview_mode == PREVIEW_MODE_KEYSET:
+            self._keyset_state = None
+            self.preview_next_page()
+            return
+
         conn = self._connect_db()
         if not conn: return
 
         try:
             preview_limit = self.preview_spinbox.value()
-            table_identifier = pgsql.Identifier(self.selected_table_schema, self.selected_table_name)
-            query = pgsql.SQL("SELECT * FROM {table} ORDER BY RANDOM() LIMIT {limit}").format( # RANDOM() for diverse sample
-                table=table_identifier, limit=pgsql.Literal(preview_limit))
-            
-            final_sql_string = query.as_string(conn)
+            approx_rows = self._get_approx_row_count(conn)
+            sample_percent = compute_sample_percent(approx_rows, preview_limit)
+            backend = backend_of(self.get_db_params())
+            query, err = build_sample_preview_sql(self.selected_table_schema, self.selected_table_name,
+                                                  preview_limit, sample_percent, preview_mode, backend)
+            if err:
+                QMessageBox.warning(self, "预览失败", err); return
+
+            final_sql_string = render_sql(query)
             print("Executing Preview SQL:", final_sql_string)
             self.sql_preview_display.setText(f"-- Preview Query:\n{final_sql_string}")
 
             df = pd.read_sql_query(final_sql_string, conn)
+            if df.empty and sample_percent < 100:
+                # 统计信息过时或表很小时抽样可能为空，退化为直接读取前若干行
+                query, _ = build_sample_preview_sql(self.selected_table_schema, self.selected_table_name, preview_limit, 100)
+                final_sql_string = render_sql(query)
+                self.sql_preview_display.append(f"-- 抽样结果为空，改用:\n{final_sql_string}")
+                df = pd.read_sql_query(final_sql_string, conn)
             print(f"DataFrame shape: {df.shape}")
 
-            self.result_table.clearContents() # Clear previous results
-            self.result_table.setRowCount(df.shape[0])
-            self.result_table.setColumnCount(df.shape[1])
-            self.result_table.setHorizontalHeaderLabels(df.columns)
-            for i in range(df.shape[0]):
-                for j in range(df.shape[1]):
-                    value = df.iloc[i, j]
-                    # Handle different types of values, especially for jsonb columns
-                    if isinstance(value, (list, dict)) or (hasattr(value, 'size') and hasattr(value, 'dtype')):
-                        # Handle array-like objects, lists, dicts, numpy arrays, etc.
-                        display_value = str(value)
-                    else:
-                        # Handle scalar values with standard pd.notna check
-                        display_value = str(value) if pd.notna(value) else ""
-                        
-                    self.result_table.setItem(i, j, QTableWidgetItem(display_value))
-            self.result_table.resizeColumnsToContents()
-
-            with conn.cursor() as cur:
-                cur.execute(pgsql.SQL("SELECT COUNT(*) FROM {table}").format(table=table_identifier))
-                total_rows = cur.fetchone()[0]
-            QMessageBox.information(self, "预览成功", f"表 {self.selected_table_schema}.{self.selected_table_name} (共 {total_rows} 行)\n"
-                                                    f"已加载预览 {df.shape[0]} 行。")
+            self._populate_result_table(df)
+            self.next_page_btn.setEnabled(False)
+            if approx_rows is None:
+                self.row_count_label.setText(f"已预览 {df.shape[0]} 行 (总行数未知，可点击“精确计数”)")
+            else:
+                self.row_count_label.setText(f"已预览 {df.shape[0]} 行 / 约 {approx_rows} 行 (估计)")
         except Exception as e:
             print(f"!!! ERROR in preview_data: {str(e)} !!!")
-            import traceback; traceback.print_exc()
+            traceback.print_exc()
             QMessageBox.critical(self, "预览失败", f"无法预览数据: {str(e)}")
             self.sql_preview_display.append(f"\n-- ERROR: {str(e)}")
         finally:
             if conn: conn.close()
 
+    @Slot()
+    def preview_next_page(self):
+        if not self.selected_table_name or not self.selected_table_schema:
+            QMessageBox.warning(self, "未选择表", "请先选择 Schema 和数据表。")
+            return
+        conn = self._connect_db()
+        if not conn: return
+
+        try:
+            current_table = (self.selected_table_schema, self.selected_table_name)
+            if not self._keyset_state or self._keyset_state.get("table") != current_table:
+                self._keyset_state = {"table": current_table, "key_columns": self._get_primary_key_columns(conn),
+                                      "last_key": None, "page": 0}
+            state = self._keyset_state
+            key_columns = state["key_columns"]
+            page_size = self.preview_spinbox.value()
+
+            backend = backend_of(self.get_db_params())
+            query, params = build_keyset_page_sql(self.selected_table_schema, self.selected_table_name,
+                                                  key_columns, state["last_key"], page_size, backend)
+            final_sql_string = render_sql(query)
+            row_key = "rowid" if backend == BACKEND_DUCKDB else "ctid"
+            key_desc = ", ".join(key_columns) if key_columns else f"{row_key} (无主键)"
+            self.sql_preview_display.setText(f"-- Page Query (键: {key_desc}):\n{final_sql_string}\n-- Params: {params}")
+
+            df = pd.read_sql_query(final_sql_string, conn, params=params or None)
+            if df.empty:
+                self.next_page_btn.setEnabled(False)
+                self.row_count_label.setText(f"第 {state['page']} 页已是最后一页")
+                return
+
+            if key_columns:
+                # numpy 标量需转回 Python 原生类型，psycopg2 才能作为参数传递
+                state["last_key"] = tuple(v.item() if hasattr(v, 'item') else v for v in df.iloc[-1][key_columns].tolist())
+            else:
+                state["last_key"] = (str(df.iloc[-1]["_ctid"]),)
+                df = df.drop(columns=["_ctid"])
+            state["page"] += 1
+
+            self._populate_result_table(df)
+            self.next_page_btn.setEnabled(len(df) >= page_size)
+            self.row_count_label.setText(f"第 {state['page']} 页, 本页 {df.shape[0]} 行")
+        except Exception as e:
+            print(f"!!! ERROR in preview_next_page: {str(e)} !!!")
+            traceback.print_exc()
+            QMessageBox.critical(self, "预览失败", f"无法读取下一页: {str(e)}")
+            self.sql_preview_display.append(f"\n-- ERROR: {str(e)}")
+        finally:
+            if conn: conn.close()
+
+    @Slot()
+    def count_rows_exact(self):
+        if not self.selected_table_name or not self.selected_table_schema: return
+        conn = self._connect_db()
+        if not conn: return
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(pgsql.SQL("SELECT COUNT(*) FROM {table}").format(
+                    table=pgsql.Identifier(self.selected_table_schema, self.selected_table_name)))
+                total_rows = cur.fetchone()[0]
+            self.row_count_label.setText(f"表 {self.selected_table_schema}.{self.selected_table_name} 共 {total_rows} 行 (精确)")
+        except Exception as e:
+            QMessageBox.critical(self, "计数失败", f"无法统计行数: {str(e)}")
+        finally:
+            QApplication.restoreOverrideCursor()
+            conn.close()
+
+    def _build_export_query(self, conn, limit_value):
+        """SELECT * FROM 所选表；勾选合并特征库且该队列在特征库中有特征时，左连接透视后的特征列。"""
+        feature_slots = []
+        if self.cb_include_feature_store.isChecked() and self.selected_table_schema == FEATURE_STORE_SCHEMA \
+                and self.selected_table_name != FEATURE_STORE_TABLE:
+            with conn.cursor() as cur:
+                cur.execute(TABLE_EXISTS_SQL, (FEATURE_STORE_SCHEMA, FEATURE_STORE_TABLE))
+                if cur.fetchone()[0]:
+                    cur.execute(build_feature_catalog_sql(), (f"{self.selected_table_schema}.{self.selected_table_name}",))
+                    feature_slots = catalog_value_slots(cur.fetchall())
+                if feature_slots:
+                    cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s",
+                                (self.selected_table_schema, self.selected_table_name))
+                    existing_columns = [row[0] for row in cur.fetchall()]
+            conn.rollback()
+        if not feature_slots:
+            query_sql = pgsql.SQL("SELECT * FROM {table}").format(
+                table=pgsql.Identifier(self.selected_table_schema, self.selected_table_name))
+            if limit_value > 0: query_sql += pgsql.SQL(" LIMIT {limit}").format(limit=pgsql.Literal(limit_value))
+            return query_sql
+        print(f"Export: 合并特征库中的 {len(feature_slots)} 个特征")
+        return build_feature_pivot_sql(self.selected_table_schema, self.selected_table_name, feature_slots,
+                                       exclude_names=existing_columns, limit=limit_value or None)
+
     def export_data(self):
         if not self.selected_table_name or not self.selected_table_schema:
             QMessageBox.warning(self, "未选择表", "请选择要导出的 Schema 和数据表。"); return
@@ -355,11 +509,10 @@ class DataExportTab(QWidget):
         QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
         try:
             table_identifier = pgsql.Identifier(self.selected_table_schema, self.selected_table_name)
-            query_sql = pgsql.SQL("SELECT * FROM {table}").format(table=table_identifier)
-            if limit_value > 0: query_sql += pgsql.SQL(" LIMIT {limit}").format(limit=pgsql.Literal(limit_value))
+            query_sql = self._build_export_query(conn, limit_value)
             
-            self.sql_preview_display.setText(f"-- Export Query:\n{query_sql.as_string(conn)}")
-            print("Export Query:", query_sql.as_string(conn))
+            self.sql_preview_display.setText(f"-- Export Query:\n{render_sql(query_sql)}")
+            print("Export Query:", render_sql(query_sql))
 
             row_count = 0
             if "Excel" in export_format:
@@ -376,32 +529,21 @@ class DataExportTab(QWidget):
                                               QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No) == QMessageBox.StandardButton.No:
                          QApplication.restoreOverrideCursor(); conn.close(); return
                 try:
-                    df_full = pd.read_sql_query(query_sql.as_string(conn), conn)
+                    df_full = pd.read_sql_query(render_sql(query_sql), conn)
                     df_full.to_excel(export_file_path, index=False, engine='openpyxl')
                     row_count = len(df_full)
                 except ImportError:
                      QApplication.restoreOverrideCursor(); conn.close()
                      QMessageBox.critical(self, "导出失败", "导出 Excel 需 'openpyxl' 库: pip install openpyxl"); return
-            else: # CSV and Parquet chunking
-                chunk_size = 50000 
-                first_chunk = True
-                for chunk_df in pd.read_sql_query(query_sql.as_string(conn), conn, chunksize=chunk_size):
+            else: # CSV / Parquet: 服务器端游标逐批取回并写入，内存只保留一批
+                try:
                     if export_format.startswith("CSV"):
-                        chunk_df.to_csv(export_file_path, mode='w' if first_chunk else 'a', header=first_chunk, index=False, encoding='utf-8')
-                    elif export_format.startswith("Parquet"):
-                        try: # PyArrow needed for Parquet
-                            chunk_df.to_parquet(export_file_path, index=False, engine='pyarrow', compression='snappy', # Append not directly supported by to_parquet for single file
-                                                write_statistics=True, schema=None if first_chunk else chunk_df.columns.tolist()) # schema for subsequent chunks
-                            # Parquet append is tricky; usually means writing multiple files or using Dask/Spark.
-                            # For single file, we overwrite or write first chunk for now.
-                            if not first_chunk: print("Warning: Parquet append to single file is complex. Overwriting or writing first chunk.")
-
-                        except ImportError:
-                            QApplication.restoreOverrideCursor(); conn.close()
-                            QMessageBox.critical(self, "导出失败", "导出 Parquet 需 'pyarrow' 库: pip install pyarrow"); return
-                    row_count += len(chunk_df)
-                    first_chunk = False
-                    print(f"Processed {row_count} rows...")
+                        row_count = stream_query_to_csv(conn, query_sql, export_file_path, cursor_name="data_export")
+                    else:
+                        row_count = stream_query_to_parquet(conn, query_sql, export_file_path, cursor_name="data_export")
+                except ImportError:
+                    QApplication.restoreOverrideCursor(); conn.close()
+                    QMessageBox.critical(self, "导出失败", "导出 Parquet 需 'pyarrow' 库: pip install pyarrow"); return
             QMessageBox.information(self, "导出成功", f"已成功导出 {row_count} 条记录到:\n{export_file_path}")
         except Exception as e:
             QMessageBox.critical(self, "导出失败", f"无法导出数据: {str(e)}\n{traceback.format_exc()}")
@@ -1,16 +1,31 @@
 # tabs/tab_data_merge.py
 import sys
+import time
+import traceback
 import pandas as pd
 import chardet
+import psycopg2.sql as pgsql
 
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QFileDialog,
     QTableView, QListWidget, QComboBox, QLineEdit, QSplitter, QGroupBox, QAbstractItemView,
-    QHeaderView, QMessageBox
+    QHeaderView, QMessageBox, QApplication
 )
-from PySide6.QtCore import Qt, Slot
+from PySide6.QtCore import Qt, Slot, Signal, QObject
 from PySide6.QtGui import QStandardItemModel, QStandardItem
 
+from sql_logic.sql_builder_merge import build_table_merge_sql
+from sql_logic.db_backend import connect_database, stream_query_to_csv
+from sql_logic.sql_render import render_sql
+from sql_logic.job_control import (apply_job_timeouts, apply_session_tuning, cancel_backend_query, describe_query_canceled,
+                                   QueryCanceledError)
+from sql_logic.job_history import (JobJournal, JournaledConnection, JOB_OUTCOME_SUCCESS,
+                                   JOB_OUTCOME_CANCELLED, JOB_OUTCOME_FAILED)
+from ui_components.job_scheduler import JobScheduler
+
+SOURCE_MODE_FILE = "file"
+SOURCE_MODE_DB = "db"
+
 class PandasTableModel(QStandardItemModel):
     def __init__(self, data):
         super().__init__()
@@ -22,11 +37,88 @@ class PandasTableModel(QStandardItemModel):
             items = [QStandardItem(str(val)) for val in row]
             self.appendRow(items)
 
+class MaterializeMergeWorker(QObject):
+    """在数据库中执行 CREATE TABLE ... AS <合并查询> 并统计行数 (一个事务，取消或出错时回滚)。"""
+    finished = Signal(str, int) # target_table, row_count
+    error = Signal(str)
+    progress = Signal(int, int)
+    log = Signal(str)
+
+    def __init__(self, db_params, create_sql, target_table, job_timeouts=None, tuning_profile=None):
+        super().__init__()
+        self.db_params = db_params
+        self.create_sql = create_sql
+        self.target_table = target_table
+        self.job_timeouts = job_timeouts
+        self.tuning_profile = tuning_profile
+        self.is_cancelled = False
+        self.conn = None
+
+    def cancel(self):
+        self.log.emit("创建结果表被请求取消...")
+        self.is_cancelled = True
+        if cancel_backend_query(self.conn): self.log.emit("已请求服务器取消正在执行的语句。")
+
+    def run(self):
+        conn = None
+        journal = None
+        try:
+            self.progress.emit(0, 2)
+            conn = connect_database(self.db_params, connection_factory=JournaledConnection)
+            self.conn = conn
+            conn.autocommit = False
+            cur = conn.cursor()
+            journal = JobJournal("table_merge", self.target_table, "CREATE TABLE AS", [render_sql(self.create_sql)],
+                                 tuning_profile=self.tuning_profile)
+            journal.attach(conn)
+            apply_job_timeouts(cur, self.job_timeouts)
+            apply_session_tuning(cur, self.tuning_profile)
+            self.log.emit(f"正在创建结果表 {self.target_table}...")
+            start_time = time.time()
+            cur.execute(self.create_sql)
+            self.progress.emit(1, 2)
+            if self.is_cancelled: raise InterruptedError("操作已取消")
+            cur.execute(pgsql.SQL("SELECT COUNT(*) FROM {}").format(pgsql.Identifier(*self.target_table.split('.'))))
+            row_count = cur.fetchone()[0]
+            conn.commit()
+            self.log.emit(f"结果表已创建 ({row_count} 行，耗时: {time.time() - start_time:.2f} 秒)。")
+            self.progress.emit(2, 2)
+            journal.finish(JOB_OUTCOME_SUCCESS, pg_conn=conn)
+            self.finished.emit(self.target_table, row_count)
+        except InterruptedError:
+            if conn and not conn.closed: conn.rollback()
+            if journal: journal.finish(JOB_OUTCOME_CANCELLED)
+            self.error.emit("操作已取消")
+        except QueryCanceledError as qc_err:
+            if conn and not conn.closed: conn.rollback()
+            err_msg = describe_query_canceled(qc_err, self.is_cancelled)
+            if journal: journal.finish(JOB_OUTCOME_CANCELLED if self.is_cancelled else JOB_OUTCOME_FAILED, err_msg)
+            self.error.emit(err_msg)
+        except Exception as e:
+            if conn and not conn.closed: conn.rollback()
+            if journal: journal.finish(JOB_OUTCOME_FAILED, str(e))
+            self.log.emit(f"Traceback: {traceback.format_exc()}")
+            self.error.emit(f"无法创建结果表: {e}")
+        finally:
+            if conn and not conn.closed: conn.close()
+
+
 class DataMergeTab(QWidget):
-    def __init__(self):
+    JOB_OWNER = "数据合并"
+
+    def __init__(self, get_db_params_func=None, get_job_timeouts_func=None, get_tuning_profile_func=None, job_scheduler=None):
         super().__init__()
+        self.get_db_params = get_db_params_func
+        self.get_job_timeouts = get_job_timeouts_func or (lambda: None)
+        self.get_tuning_profile = get_tuning_profile_func or (lambda: None)
+        self.job_scheduler = job_scheduler or JobScheduler(self)
         self.df_left = None
         self.df_right = None
+        self.merged_df_result = None
+        # 数据库模式下的左右数据源 (schema.table) 及最近一次生成的合并参数
+        self.left_db_table = None
+        self.right_db_table = None
+        self.last_db_merge_args = None
 
         self.main_layout = QVBoxLayout(self)
         self.setup_ui()
@@ -37,6 +129,17 @@ class DataMergeTab(QWidget):
         return result['encoding']
 
     def setup_ui(self):
+        # 数据来源选择: 本地文件 或 已连接数据库中的 schema.table
+        source_mode_layout = QHBoxLayout()
+        source_mode_layout.addWidget(QLabel("数据来源:"))
+        self.combo_source_mode = QComboBox()
+        self.combo_source_mode.addItem("本地文件 (CSV/Excel)", SOURCE_MODE_FILE)
+        self.combo_source_mode.addItem("数据库表 (schema.table)", SOURCE_MODE_DB)
+        self.combo_source_mode.currentIndexChanged.connect(self._on_source_mode_changed)
+        source_mode_layout.addWidget(self.combo_source_mode)
+        source_mode_layout.addStretch()
+        self.main_layout.addLayout(source_mode_layout)
+
         # Top layout for dataset loading and preview
         top_splitter = QSplitter(Qt.Horizontal)
 
@@ -46,11 +149,15 @@ class DataMergeTab(QWidget):
         self.btn_load_left = QPushButton("加载左侧数据集 (CSV/Excel)")
         self.btn_load_left.clicked.connect(lambda: self.load_data('left'))
         self.lbl_left_file = QLabel("未加载文件")
+        self.combo_left_db_table = QComboBox()
+        self.combo_left_db_table.setEditable(True)
+        self.combo_left_db_table.setVisible(False)
         self.table_left_preview = QTableView()
         self.table_left_preview.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.table_left_preview.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
         self.list_left_cols = QListWidget()
         self.list_left_cols.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        left_layout.addWidget(self.combo_left_db_table)
         left_layout.addWidget(self.btn_load_left)
         left_layout.addWidget(self.lbl_left_file)
         left_preview_columns_splitter = QSplitter(Qt.Vertical)
@@ -67,11 +174,15 @@ class DataMergeTab(QWidget):
         self.btn_load_right = QPushButton("加载右侧数据集 (CSV/Excel)")
         self.btn_load_right.clicked.connect(lambda: self.load_data('right'))
         self.lbl_right_file = QLabel("未加载文件")
+        self.combo_right_db_table = QComboBox()
+        self.combo_right_db_table.setEditable(True)
+        self.combo_right_db_table.setVisible(False)
         self.table_right_preview = QTableView()
         self.table_right_preview.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.table_right_preview.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
         self.list_right_cols = QListWidget()
         self.list_right_cols.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        right_layout.addWidget(self.combo_right_db_table)
         right_layout.addWidget(self.btn_load_right)
         right_layout.addWidget(self.lbl_right_file)
         right_preview_columns_splitter = QSplitter(Qt.Vertical)
@@ -132,12 +243,152 @@ class DataMergeTab(QWidget):
         self.btn_export_merged.clicked.connect(self.export_merged_data)
         self.btn_export_merged.setEnabled(False)
         merged_result_layout.addWidget(self.table_merged_preview)
+        # 数据库模式: 在服务端物化合并结果为新表
+        materialize_layout = QHBoxLayout()
+        materialize_layout.addWidget(QLabel("结果表 (schema.table):"))
+        self.edit_target_table = QLineEdit("mimiciv_data.merged_result")
+        materialize_layout.addWidget(self.edit_target_table)
+        self.btn_materialize = QPushButton("在数据库中创建结果表")
+        self.btn_materialize.clicked.connect(self.materialize_db_merge)
+        self.btn_materialize.setEnabled(False)
+        materialize_layout.addWidget(self.btn_materialize)
+        self.btn_cancel_materialize = QPushButton("取消")
+        self.btn_cancel_materialize.clicked.connect(self.cancel_materialize)
+        self.btn_cancel_materialize.setEnabled(False)
+        materialize_layout.addWidget(self.btn_cancel_materialize)
+        self.materialize_widget = QWidget()
+        self.materialize_widget.setLayout(materialize_layout)
+        self.materialize_widget.setVisible(False)
+        merged_result_layout.addWidget(self.materialize_widget)
         merged_result_layout.addWidget(self.btn_export_merged)
         merged_result_group.setLayout(merged_result_layout)
         self.main_layout.addWidget(merged_result_group, 2) # More space for result
 
+    def _is_db_mode(self):
+        return self.combo_source_mode.currentData() == SOURCE_MODE_DB
+
+    @Slot()
+    def _on_source_mode_changed(self):
+        is_db = self._is_db_mode()
+        self.combo_left_db_table.setVisible(is_db)
+        self.combo_right_db_table.setVisible(is_db)
+        self.materialize_widget.setVisible(is_db)
+        self.btn_load_left.setText("加载左侧数据表" if is_db else "加载左侧数据集 (CSV/Excel)")
+        self.btn_load_right.setText("加载右侧数据表" if is_db else "加载右侧数据集 (CSV/Excel)")
+        self._reset_side('left', "未加载文件")
+        self._reset_side('right', "未加载文件")
+        self.merged_df_result = None
+        self.last_db_merge_args = None
+        self.update_table_preview(self.table_merged_preview, pd.DataFrame())
+        self.btn_export_merged.setEnabled(False)
+        self.btn_materialize.setEnabled(False)
+        if is_db:
+            self.refresh_db_tables()
+
+    def _reset_side(self, side, label_text):
+        if side == 'left':
+            self.df_left = None
+            self.left_db_table = None
+            self.lbl_left_file.setText(label_text)
+            self.update_table_preview(self.table_left_preview, pd.DataFrame())
+            self.update_column_list(self.list_left_cols, [])
+            self.update_column_list(self.list_left_merge_keys, [])
+        else:
+            self.df_right = None
+            self.right_db_table = None
+            self.lbl_right_file.setText(label_text)
+            self.update_table_preview(self.table_right_preview, pd.DataFrame())
+            self.update_column_list(self.list_right_cols, [])
+            self.update_column_list(self.list_right_merge_keys, [])
+
+    def _connect_db(self):
+        db_params = self.get_db_params() if self.get_db_params else None
+        if not db_params:
+            QMessageBox.warning(self, "未连接", "请先在“数据库连接”页面连接数据库")
+            return None
+        try:
+            return connect_database(db_params)
+        except Exception as e:
+            QMessageBox.critical(self, "数据库连接失败", f"无法连接到数据库: {str(e)}")
+            return None
+
+    @Slot()
+    def on_db_connected(self):
+        if self._is_db_mode():
+            self.refresh_db_tables()
+
+    def refresh_db_tables(self):
+        if not self.get_db_params or not self.get_db_params():
+            return
+        conn = self._connect_db()
+        if not conn: return
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT table_schema || '.' || table_name FROM information_schema.tables
+                    WHERE table_schema NOT IN ('pg_catalog', 'information_schema')
+                      AND table_schema NOT LIKE 'pg_toast%' AND table_schema NOT LIKE 'pg_temp%'
+                    ORDER BY (table_schema = 'mimiciv_data') DESC, table_schema, table_name;
+                """)
+                full_names = [r[0] for r in cur.fetchall()]
+            for combo in (self.combo_left_db_table, self.combo_right_db_table):
+                current_text = combo.currentText()
+                combo.clear(); combo.addItems(full_names)
+                if current_text: combo.setCurrentText(current_text)
+        except Exception as e:
+            QMessageBox.critical(self, "查询失败", f"无法获取数据表列表: {str(e)}")
+        finally:
+            conn.close()
+
+    def load_db_table(self, side):
+        combo = self.combo_left_db_table if side == 'left' else self.combo_right_db_table
+        full_name = combo.currentText().strip()
+        parts = full_name.split('.')
+        if len(parts) != 2 or not all(parts):
+            QMessageBox.warning(self, "表名格式错误", "请输入 schema.table 格式的表名。")
+            return
+        conn = self._connect_db()
+        if not conn: return
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT column_name FROM information_schema.columns "
+                            "WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position", (parts[0], parts[1]))
+                columns = [r[0] for r in cur.fetchall()]
+            if not columns:
+                QMessageBox.warning(self, "未找到表", f"数据库中未找到表 '{full_name}' 或该表没有列。")
+                return
+            # 只取少量行用于预览，完整数据保留在数据库中
+            preview_sql = render_sql(pgsql.SQL("SELECT * FROM {} LIMIT 100").format(pgsql.Identifier(*parts)))
+            preview_df = pd.read_sql_query(preview_sql, conn)
+        except Exception as e:
+            QMessageBox.critical(self, "加载错误", f"加载数据表失败: {e}")
+            self._reset_side(side, "加载失败")
+            return
+        finally:
+            conn.close()
+
+        if side == 'left':
+            self.left_db_table = full_name
+            self.lbl_left_file.setText(full_name)
+            self.update_table_preview(self.table_left_preview, preview_df)
+            self.update_column_list(self.list_left_cols, columns)
+            self.update_column_list(self.list_left_merge_keys, columns)
+            for i in range(self.list_left_cols.count()):
+                self.list_left_cols.item(i).setSelected(True)
+        else:
+            self.right_db_table = full_name
+            self.lbl_right_file.setText(full_name)
+            self.update_table_preview(self.table_right_preview, preview_df)
+            self.update_column_list(self.list_right_cols, columns)
+            self.update_column_list(self.list_right_merge_keys, columns)
+            for i in range(self.list_right_cols.count()):
+                self.list_right_cols.item(i).setSelected(True)
+
     @Slot(str)
     def load_data(self, side):
+        if self._is_db_mode():
+            self.load_db_table(side)
+            return
         file_path, _ = QFileDialog.getOpenFileName(self, f"加载{('左侧' if side == 'left' else '右侧')}数据集", "", "CSV 文件 (*.csv);;Excel 文件 (*.xlsx *.xls)")
         if not file_path:
             return
@@ -208,7 +459,11 @@ class DataMergeTab(QWidget):
 
     @Slot()
     def perform_merge(self):
-        if self.df_left is None or self.df_right is None:
+        if self._is_db_mode():
+            if not self.left_db_table or not self.right_db_table:
+                QMessageBox.warning(self, "数据缺失", "请先加载左右两侧的数据表。")
+                return
+        elif self.df_left is None or self.df_right is None:
             QMessageBox.warning(self, "数据缺失", "请先加载左右两侧的数据集。")
             return
 
@@ -236,6 +491,18 @@ class DataMergeTab(QWidget):
         selected_left_cols = [item.text() for item in selected_left_cols_items]
         selected_right_cols = [item.text() for item in selected_right_cols_items]
 
+        merge_type_map = {
+            "Left Join": "left",
+            "Right Join": "right",
+            "Inner Join": "inner",
+            "Outer Join": "outer"
+        }
+        how = merge_type_map.get(self.combo_merge_type.currentText(), "left")
+
+        if self._is_db_mode():
+            self.perform_db_merge(left_keys, right_keys, selected_left_cols, selected_right_cols, how)
+            return
+
         # Ensure merge keys are in selected columns
         for key in left_keys:
             if key not in selected_left_cols:
@@ -251,14 +518,6 @@ class DataMergeTab(QWidget):
         df_left_subset = self.df_left[final_left_cols]
         df_right_subset = self.df_right[final_right_cols]
 
-        merge_type_map = {
-            "Left Join": "left",
-            "Right Join": "right",
-            "Inner Join": "inner",
-            "Outer Join": "outer"
-        }
-        how = merge_type_map.get(self.combo_merge_type.currentText(), "left")
-
         try:
             # Suffixes to handle overlapping column names (excluding keys)
             # If left_key and right_key are different, pandas handles it.
@@ -284,8 +543,111 @@ class DataMergeTab(QWidget):
             self.update_table_preview(self.table_merged_preview, pd.DataFrame())
             self.btn_export_merged.setEnabled(False)
 
+    def perform_db_merge(self, left_keys, right_keys, left_cols, right_cols, how):
+        merge_args = dict(
+            left_table_name=self.left_db_table, right_table_name=self.right_db_table,
+            left_keys=left_keys, right_keys=right_keys,
+            left_columns=left_cols, right_columns=right_cols,
+            join_type=how, suffixes=('_left', '_right')
+        )
+        preview_sql, err, _ = build_table_merge_sql(**merge_args, preview_limit=100)
+        if err:
+            QMessageBox.warning(self, "合并配置错误", err)
+            return
+        conn = self._connect_db()
+        if not conn: return
+        try:
+            preview_df = pd.read_sql_query(render_sql(preview_sql), conn)
+            self.last_db_merge_args = merge_args
+            self.merged_df_result = None # 数据库模式下结果不落到内存
+            self.update_table_preview(self.table_merged_preview, preview_df)
+            self.btn_export_merged.setEnabled(True)
+            self.btn_materialize.setEnabled(True)
+            QMessageBox.information(self, "合并预览", f"已在数据库中生成合并预览 (前 {len(preview_df)} 行)。\n"
+                                                   "可在数据库中创建结果表，或直接导出完整结果。")
+        except Exception as e:
+            QMessageBox.critical(self, "合并错误", f"数据库合并失败: {e}")
+            self.last_db_merge_args = None
+            self.update_table_preview(self.table_merged_preview, pd.DataFrame())
+            self.btn_export_merged.setEnabled(False)
+            self.btn_materialize.setEnabled(False)
+        finally:
+            conn.close()
+
+    @Slot()
+    def materialize_db_merge(self):
+        if not self.last_db_merge_args:
+            QMessageBox.warning(self, "无合并配置", "请先执行合并以生成预览。")
+            return
+        target_table = self.edit_target_table.text().strip()
+        create_sql, err, output_cols = build_table_merge_sql(**self.last_db_merge_args, target_table_name=target_table)
+        if err:
+            QMessageBox.warning(self, "合并配置错误", err)
+            return
+        db_params = self.get_db_params() if self.get_db_params else None
+        if not db_params:
+            QMessageBox.warning(self, "未连接", "请先在“数据库连接”页面连接数据库")
+            return
+        # CREATE TABLE AS 可能运行很久: 交给任务队列在工作线程中执行 (任务超时、可取消)，界面不被阻塞
+        worker = MaterializeMergeWorker(db_params, create_sql, target_table, self.get_job_timeouts(), self.get_tuning_profile())
+        self.btn_materialize.setEnabled(False)
+        self.btn_cancel_materialize.setEnabled(True)
+        self.job_scheduler.submit(
+            worker, f"合并结果表: {target_table}", self.JOB_OWNER, db_params, "table_merge", exclusive_keys=[target_table],
+            on_finished=lambda job_id, table_name, row_count: self.on_materialize_finished(job_id, table_name, row_count, len(output_cols)),
+            on_error=self.on_materialize_error)
+
+    def _on_materialize_job_done(self, job_id):
+        remaining = [j for j in self.job_scheduler.active_job_ids(self.JOB_OWNER) if j != job_id]
+        self.btn_cancel_materialize.setEnabled(bool(remaining))
+        self.btn_materialize.setEnabled(self.last_db_merge_args is not None)
+
+    def on_materialize_finished(self, job_id, target_table, row_count, column_count):
+        self._on_materialize_job_done(job_id)
+        QMessageBox.information(self, "创建成功", f"已在数据库中创建表 {target_table} ({row_count} 行, {column_count} 列)。")
+
+    def on_materialize_error(self, job_id, error_message):
+        self._on_materialize_job_done(job_id)
+        if "操作已取消" in error_message:
+            QMessageBox.information(self, "操作取消", "创建结果表已取消。")
+        else:
+            QMessageBox.critical(self, "创建失败", error_message)
+
+    @Slot()
+    def cancel_materialize(self):
+        for job_id in self.job_scheduler.active_job_ids(self.JOB_OWNER):
+            self.job_scheduler.cancel(job_id)
+        self.btn_cancel_materialize.setEnabled(False)
+
+    def export_db_merged_data(self, file_path):
+        # 通过服务器端游标逐批读取合并结果并写入 CSV，客户端不保留完整结果
+        select_sql, err, _ = build_table_merge_sql(**self.last_db_merge_args)
+        if err:
+            QMessageBox.warning(self, "合并配置错误", err)
+            return
+        conn = self._connect_db()
+        if not conn: return
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            row_count = stream_query_to_csv(conn, select_sql, file_path, cursor_name="db_merge_export")
+            QMessageBox.information(self, "导出成功", f"已导出 {row_count} 条合并记录到: {file_path}")
+        except Exception as e:
+            QMessageBox.critical(self, "导出错误", f"导出文件失败: {e}")
+        finally:
+            QApplication.restoreOverrideCursor()
+            conn.close()
+
     @Slot()
     def export_merged_data(self):
+        if self._is_db_mode():
+            if not self.last_db_merge_args:
+                QMessageBox.warning(self, "无数据", "没有可导出的合并数据。")
+                return
+            file_path, _ = QFileDialog.getSaveFileName(self, "导出合并结果", "", "CSV 文件 (*.csv)")
+            if file_path:
+                self.export_db_merged_data(file_path)
+            return
+
         if self.merged_df_result is None or self.merged_df_result.empty:
             QMessageBox.warning(self, "无数据", "没有可导出的合并数据。")
             return
@@ -307,7 +669,6 @@ class DataMergeTab(QWidget):
             QMessageBox.critical(self, "导出错误", f"导出文件失败: {e}")
 
 if __name__ == '__main__':
-    from PySide6.QtWidgets import QApplication
     app = QApplication(sys.argv)
     main_win = DataMergeTab()
     main_win.show()
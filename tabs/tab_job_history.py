@@ -0,0 +1,134 @@
+# --- START OF FILE tab_job_history.py ---
+
+from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QTableWidget,
+                               QTableWidgetItem, QMessageBox, QLabel, QSplitter, QComboBox,
+                               QAbstractItemView, QHeaderView)
+from PySide6.QtCore import Qt
+import sqlite3
+import time
+from sql_logic.job_history import (list_jobs, get_job_statements, compare_job_statements,
+                                   summarize_durations_by_description)
+
+JOB_TYPE_DISPLAY = {
+    "cohort_creation": "队列创建",
+    "batch_cohort_creation": "批量队列创建",
+    "base_info_extraction": "基础数据提取",
+    "special_data_merge": "专项数据合并",
+    "table_merge": "数据表合并",
+}
+OUTCOME_DISPLAY = {"running": "运行中/中断", "success": "成功", "cancelled": "已取消", "failed": "失败"}
+
+
+def _fmt_seconds(value):
+    return "" if value is None else f"{value:.2f}"
+
+
+class JobHistoryTab(QWidget):
+    """任务历史: 列出本地记录的长任务，查看逐条语句耗时，比较两次运行，汇总各特征的耗时。"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.init_ui()
+        self.refresh_jobs()
+
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+        top_layout = QHBoxLayout()
+        top_layout.addWidget(QLabel("队列表:"))
+        self.cohort_filter_combo = QComboBox(); self.cohort_filter_combo.addItem("全部", None)
+        self.cohort_filter_combo.currentIndexChanged.connect(self.refresh_jobs)
+        top_layout.addWidget(self.cohort_filter_combo)
+        self.refresh_btn = QPushButton("刷新"); self.refresh_btn.clicked.connect(self.refresh_jobs)
+        top_layout.addWidget(self.refresh_btn)
+        self.compare_btn = QPushButton("比较选中的两次运行"); self.compare_btn.clicked.connect(self.compare_selected_jobs)
+        top_layout.addWidget(self.compare_btn)
+        self.summary_btn = QPushButton("各特征耗时汇总"); self.summary_btn.clicked.connect(self.show_duration_summary)
+        top_layout.addWidget(self.summary_btn)
+        top_layout.addStretch()
+        layout.addLayout(top_layout)
+
+        splitter = QSplitter(Qt.Orientation.Vertical)
+        self.jobs_table = QTableWidget(); self.jobs_table.setAlternatingRowColors(True)
+        self.jobs_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.jobs_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.jobs_table.itemSelectionChanged.connect(self.show_selected_job_statements)
+        splitter.addWidget(self.jobs_table)
+        detail_widget = QWidget(); detail_layout = QVBoxLayout(detail_widget); detail_layout.setContentsMargins(0, 0, 0, 0)
+        self.detail_label = QLabel("选择一个任务查看逐条语句耗时；选择两个任务后可比较。")
+        detail_layout.addWidget(self.detail_label)
+        self.detail_table = QTableWidget(); self.detail_table.setAlternatingRowColors(True)
+        self.detail_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        detail_layout.addWidget(self.detail_table)
+        splitter.addWidget(detail_widget)
+        layout.addWidget(splitter)
+
+    def _fill_table(self, table, headers, rows):
+        table.clear()
+        table.setColumnCount(len(headers)); table.setHorizontalHeaderLabels(headers)
+        table.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            for j, value in enumerate(row):
+                table.setItem(i, j, QTableWidgetItem("" if value is None else str(value)))
+        table.resizeColumnsToContents()
+        table.horizontalHeader().setSectionResizeMode(len(headers) - 1, QHeaderView.ResizeMode.Stretch)
+
+    def refresh_jobs(self):
+        cohort_table = self.cohort_filter_combo.currentData()
+        try:
+            jobs = list_jobs(cohort_table=cohort_table)
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "读取失败", f"无法读取任务历史: {e}")
+            return
+        self.jobs = jobs
+        rows = []
+        for (job_id, job_type, cohort, description, config_hash, started_at, duration_s, outcome, blks_hit, blks_read, temp_bytes,
+             tuning_profile) in jobs:
+            rows.append([job_id, JOB_TYPE_DISPLAY.get(job_type, job_type), cohort, config_hash,
+                         time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started_at)), _fmt_seconds(duration_s),
+                         OUTCOME_DISPLAY.get(outcome, outcome), blks_hit, blks_read, temp_bytes, tuning_profile, description])
+        self._fill_table(self.jobs_table, ["编号", "类型", "队列表", "配置哈希", "开始时间", "总耗时(秒)", "结果",
+                                           "缓冲命中", "磁盘读", "临时文件字节", "会话调优", "描述"], rows)
+        if cohort_table is None:
+            # 仅在显示全部时更新筛选列表，避免切换筛选时重建下拉框
+            known = {self.cohort_filter_combo.itemData(i) for i in range(self.cohort_filter_combo.count())}
+            for cohort in sorted({job[2] for job in jobs if job[2]} - known):
+                self.cohort_filter_combo.addItem(cohort, cohort)
+
+    def _selected_job_ids(self):
+        rows = sorted({index.row() for index in self.jobs_table.selectionModel().selectedRows()})
+        return [self.jobs[row][0] for row in rows if row < len(self.jobs)]
+
+    def show_selected_job_statements(self):
+        job_ids = self._selected_job_ids()
+        if len(job_ids) != 1:
+            return
+        statements = get_job_statements(job_ids[0])
+        total = sum(s[2] or 0 for s in statements)
+        self.detail_label.setText(f"任务 {job_ids[0]}: {len(statements)} 条语句，语句耗时合计 {total:.2f} 秒")
+        rows = [[index, _fmt_seconds(duration_s), f"{(duration_s or 0) / total * 100:.1f}%" if total else "",
+                 rows_affected, label] for index, label, duration_s, rows_affected, _ in statements]
+        self._fill_table(self.detail_table, ["序号", "耗时(秒)", "占比", "影响行数", "语句"], rows)
+
+    def compare_selected_jobs(self):
+        job_ids = self._selected_job_ids()
+        if len(job_ids) != 2:
+            QMessageBox.information(self, "比较运行", "请在上方列表中选择两次运行 (按住 Ctrl 多选)。")
+            return
+        older, newer = sorted(job_ids)
+        jobs_by_id = {job[0]: job for job in self.jobs}
+        if jobs_by_id[older][4] != jobs_by_id[newer][4]:
+            QMessageBox.warning(self, "比较运行", "两次运行的配置哈希不同，逐条对比的语句可能不对应。")
+        comparison = compare_job_statements(older, newer)
+        self.detail_label.setText(f"任务 {older} (A) 与任务 {newer} (B) 逐条对比，正值表示 B 更慢")
+        rows = [[c["index"], _fmt_seconds(c["duration_a"]), _fmt_seconds(c["duration_b"]), _fmt_seconds(c["delta_s"]),
+                 f"{c['ratio']:.2f}x" if c["ratio"] is not None else "", c["label"]] for c in comparison]
+        self._fill_table(self.detail_table, ["序号", "A 耗时(秒)", "B 耗时(秒)", "差值(秒)", "B/A", "语句"], rows)
+
+    def show_duration_summary(self):
+        summary = summarize_durations_by_description(self.cohort_filter_combo.currentData())
+        self.detail_label.setText("成功任务按描述 (特征) 汇总，按平均耗时降序")
+        rows = [[JOB_TYPE_DISPLAY.get(job_type, job_type), runs, _fmt_seconds(last_s), _fmt_seconds(avg_s), description]
+                for job_type, description, runs, last_s, avg_s in summary]
+        self._fill_table(self.detail_table, ["类型", "运行次数", "最近耗时(秒)", "平均耗时(秒)", "描述"], rows)
+
+# --- END OF FILE tab_job_history.py ---
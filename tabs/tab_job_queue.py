@@ -0,0 +1,166 @@
+# --- START OF FILE tab_job_queue.py ---
+
+from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QTableWidget, QTableWidgetItem,
+                               QLabel, QSplitter, QSpinBox, QTextEdit, QAbstractItemView, QHeaderView)
+from PySide6.QtCore import Qt, QTimer
+import time
+from sql_logic.job_queue import (JOB_STATE_QUEUED, JOB_STATE_RUNNING, JOB_STATE_SUCCEEDED, JOB_STATE_FAILED,
+                                 JOB_STATE_CANCELLED, JOB_PRIORITY_LOW, JOB_PRIORITY_NORMAL, JOB_PRIORITY_HIGH)
+from tabs.tab_job_history import JOB_TYPE_DISPLAY
+from app_config import DEFAULT_JOB_MAX_CONCURRENT, DEFAULT_JOB_MAX_PER_DATABASE
+
+STATE_DISPLAY = {JOB_STATE_QUEUED: "排队中", JOB_STATE_RUNNING: "运行中", JOB_STATE_SUCCEEDED: "成功",
+                 JOB_STATE_FAILED: "失败", JOB_STATE_CANCELLED: "已取消"}
+PRIORITY_DISPLAY = {JOB_PRIORITY_LOW: "低", JOB_PRIORITY_NORMAL: "普通", JOB_PRIORITY_HIGH: "高"}
+COLUMN_HEADERS = ["编号", "类型", "任务", "来源", "状态", "优先级", "进度", "等待/耗时", "数据库", "最新消息"]
+
+
+def _fmt_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02d}" if minutes < 60 else f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}"
+
+
+class JobQueueTab(QWidget):
+    """任务队列: 所有标签页提交的长任务 (排队/运行/已结束)，可取消、调整排队优先级和并发上限，查看单个任务的日志。"""
+
+    def __init__(self, job_scheduler, parent=None):
+        super().__init__(parent)
+        self.job_scheduler = job_scheduler
+        self.job_rows = {} # job_id -> 表格行号
+        self.init_ui()
+        self.job_scheduler.job_added.connect(self._add_job_row)
+        self.job_scheduler.job_updated.connect(self._update_job_row)
+        self.job_scheduler.job_log.connect(self._append_job_log)
+        self.job_scheduler.jobs_removed.connect(lambda _: self._rebuild_table())
+        # 运行中/排队任务的耗时每秒刷新一次
+        self.elapsed_timer = QTimer(self)
+        self.elapsed_timer.setInterval(1000)
+        self.elapsed_timer.timeout.connect(self._refresh_active_rows)
+        self.elapsed_timer.start()
+
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+        top_layout = QHBoxLayout()
+        top_layout.addWidget(QLabel("同时运行任务数:"))
+        self.max_concurrent_spin = QSpinBox(); self.max_concurrent_spin.setRange(1, 16)
+        self.max_concurrent_spin.setValue(DEFAULT_JOB_MAX_CONCURRENT)
+        top_layout.addWidget(self.max_concurrent_spin)
+        top_layout.addWidget(QLabel("每个数据库:"))
+        self.max_per_database_spin = QSpinBox(); self.max_per_database_spin.setRange(1, 16)
+        self.max_per_database_spin.setValue(DEFAULT_JOB_MAX_PER_DATABASE)
+        self.max_per_database_spin.setToolTip("同一数据库服务器上同时运行的任务数，避免多个大查询争用服务器；本地 DuckDB 文件始终为 1。")
+        top_layout.addWidget(self.max_per_database_spin)
+        self.max_concurrent_spin.valueChanged.connect(self._apply_limits)
+        self.max_per_database_spin.valueChanged.connect(self._apply_limits)
+        top_layout.addStretch()
+        self.raise_priority_btn = QPushButton("提高优先级"); self.raise_priority_btn.clicked.connect(lambda: self._shift_priority(1))
+        top_layout.addWidget(self.raise_priority_btn)
+        self.lower_priority_btn = QPushButton("降低优先级"); self.lower_priority_btn.clicked.connect(lambda: self._shift_priority(-1))
+        top_layout.addWidget(self.lower_priority_btn)
+        self.cancel_job_btn = QPushButton("取消选中任务"); self.cancel_job_btn.clicked.connect(self.cancel_selected_jobs)
+        top_layout.addWidget(self.cancel_job_btn)
+        self.clear_finished_btn = QPushButton("清除已结束"); self.clear_finished_btn.clicked.connect(self.job_scheduler.clear_finished)
+        top_layout.addWidget(self.clear_finished_btn)
+        layout.addLayout(top_layout)
+
+        splitter = QSplitter(Qt.Orientation.Vertical)
+        self.jobs_table = QTableWidget(0, len(COLUMN_HEADERS)); self.jobs_table.setAlternatingRowColors(True)
+        self.jobs_table.setHorizontalHeaderLabels(COLUMN_HEADERS)
+        self.jobs_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.jobs_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.jobs_table.horizontalHeader().setSectionResizeMode(len(COLUMN_HEADERS) - 1, QHeaderView.ResizeMode.Stretch)
+        self.jobs_table.itemSelectionChanged.connect(self._show_selected_job_log)
+        splitter.addWidget(self.jobs_table)
+        log_widget = QWidget(); log_layout = QVBoxLayout(log_widget); log_layout.setContentsMargins(0, 0, 0, 0)
+        self.log_label = QLabel("选择一个任务查看其日志。")
+        log_layout.addWidget(self.log_label)
+        self.job_log_view = QTextEdit(); self.job_log_view.setReadOnly(True)
+        log_layout.addWidget(self.job_log_view)
+        splitter.addWidget(log_widget)
+        layout.addWidget(splitter)
+        self._update_action_buttons()
+
+    def _apply_limits(self):
+        self.job_scheduler.set_limits(self.max_concurrent_spin.value(), self.max_per_database_spin.value())
+
+    def _row_values(self, job):
+        done, total = job["progress"]
+        if job["state"] == JOB_STATE_QUEUED:
+            timing = f"已等待 {_fmt_duration(time.time() - job['submitted_at'])}"
+        elif job["started_at"] is not None:
+            timing = _fmt_duration((job["finished_at"] or time.time()) - job["started_at"])
+        else:
+            timing = ""
+        return [job["job_id"], JOB_TYPE_DISPLAY.get(job["job_type"], job["job_type"]), job["title"], job["owner"],
+                STATE_DISPLAY.get(job["state"], job["state"]), PRIORITY_DISPLAY.get(job["priority"], job["priority"]),
+                f"{done}/{total}" if total else "", timing, job["database_key"], job["message"]]
+
+    def _set_row(self, row, job):
+        for column, value in enumerate(self._row_values(job)):
+            self.jobs_table.setItem(row, column, QTableWidgetItem(str(value)))
+
+    def _add_job_row(self, job_id):
+        job = self.job_scheduler.queue.get(job_id)
+        if job is None:
+            return
+        row = self.jobs_table.rowCount()
+        self.jobs_table.insertRow(row)
+        self.job_rows[job_id] = row
+        self._set_row(row, job)
+
+    def _update_job_row(self, job_id):
+        job = self.job_scheduler.queue.get(job_id)
+        if job is None or job_id not in self.job_rows:
+            return
+        self._set_row(self.job_rows[job_id], job)
+        self._update_action_buttons()
+
+    def _rebuild_table(self):
+        self.jobs_table.setRowCount(0)
+        self.job_rows = {}
+        for job in self.job_scheduler.queue.jobs():
+            self._add_job_row(job["job_id"])
+        self._update_action_buttons()
+
+    def _refresh_active_rows(self):
+        for job_id in self.job_scheduler.active_job_ids():
+            self._update_job_row(job_id)
+
+    def _selected_job_ids(self):
+        rows = {index.row() for index in self.jobs_table.selectionModel().selectedRows()}
+        return [job_id for job_id, row in self.job_rows.items() if row in rows]
+
+    def _update_action_buttons(self):
+        selected = [self.job_scheduler.queue.get(job_id) for job_id in self._selected_job_ids()]
+        self.cancel_job_btn.setEnabled(any(job and job["state"] in (JOB_STATE_QUEUED, JOB_STATE_RUNNING) for job in selected))
+        has_queued = any(job and job["state"] == JOB_STATE_QUEUED for job in selected)
+        self.raise_priority_btn.setEnabled(has_queued)
+        self.lower_priority_btn.setEnabled(has_queued)
+
+    def _show_selected_job_log(self):
+        self._update_action_buttons()
+        job_ids = self._selected_job_ids()
+        if len(job_ids) != 1:
+            return
+        job = self.job_scheduler.queue.get(job_ids[0])
+        self.log_label.setText(f"任务 {job['job_id']}: {job['title']} ({STATE_DISPLAY.get(job['state'], job['state'])})")
+        self.job_log_view.setPlainText("\n".join(job["log"]))
+
+    def _append_job_log(self, job_id, message):
+        if self._selected_job_ids() == [job_id]:
+            self.job_log_view.append(message)
+        self._update_job_row(job_id)
+
+    def _shift_priority(self, delta):
+        for job_id in self._selected_job_ids():
+            job = self.job_scheduler.queue.get(job_id)
+            if job and job["state"] == JOB_STATE_QUEUED:
+                priority = max(JOB_PRIORITY_LOW, min(JOB_PRIORITY_HIGH, job["priority"] + delta))
+                self.job_scheduler.set_priority(job_id, priority)
+
+    def cancel_selected_jobs(self):
+        for job_id in self._selected_job_ids():
+            self.job_scheduler.cancel(job_id)
+        self._update_action_buttons()
+
+# --- END OF FILE tab_job_queue.py ---
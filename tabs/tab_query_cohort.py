@@ -4,24 +4,42 @@ from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
                           QTableWidget, QTableWidgetItem, QMessageBox, QLabel,
                           QSplitter, QTextEdit, QDialog, QLineEdit, QFormLayout,
                           QApplication, QProgressBar, QGroupBox, QComboBox,
-                          QRadioButton, QButtonGroup, QScrollArea, QAbstractButton) # 增加了 QScrollArea, QAbstractButton
-from PySide6.QtCore import Qt, Signal, QObject, QThread, Slot
+                          QRadioButton, QButtonGroup, QScrollArea, QAbstractButton, # 增加了 QScrollArea, QAbstractButton
+                          QListWidget, QFileDialog, QCheckBox)
+from PySide6.QtCore import Qt, Signal, QObject, QThread, Slot, QTimer
 import psycopg2
 from psycopg2 import sql as psql
 import re
 import time
 import traceback
+import json
 from ui_components.conditiongroup import ConditionGroupWidget 
+from sql_logic.sql_builder_cohort import (COHORT_TYPE_FIRST_EVENT_KEY, COHORT_TYPE_ALL_EVENTS_KEY, MODE_PROCEDURE_KEY,
+                                          build_batch_cohort_sql, build_cohort_analyze_sql,
+                                          build_batch_cleanup_sql,
+                                          build_cohort_size_explain_sql, build_cohort_size_count_sql, parse_explain_row_estimate)
+from sql_logic.job_history import (JobJournal, JournaledConnection, JOB_OUTCOME_SUCCESS,
+                                   JOB_OUTCOME_CANCELLED, JOB_OUTCOME_FAILED)
+from sql_logic.job_control import (apply_job_timeouts, apply_session_tuning, describe_tuning_profile, cancel_backend_query,
+                                   describe_query_canceled, QueryCanceledError)
+from sql_logic.condition_tree import get_cached_column_types
+from sql_logic.db_backend import connect_database, DATABASE_ERRORS
+from sql_logic.parallel_index_build import CommittedInterruptedError, plan_cohort_indexes, build_indexes_after_commit
+from sql_logic.sql_render import render_sql
+from sql_logic.icd_hierarchy import (DIAGNOSIS_CHAPTERS, PROCEDURE_CHAPTERS, ICD_VERSIONS, parse_icd_selection_text,
+                                     load_icd_prefix_index, gem_source_version, parse_gem_lines, build_version_map,
+                                     add_mapped_codes, build_code_list_condition)
+from ui_components.job_scheduler import JobScheduler
+from app_config import (COHORT_SIZE_ESTIMATE_DEBOUNCE_MS, COHORT_SIZE_COUNT_TIMEOUT_MS,
+                        PREVIEW_TUNING_PROFILE)
 
 # --- Constants for Cohort Types (Admission criteria) ---
 COHORT_TYPE_FIRST_EVENT_STR = "首次事件入院 (基于该事件的患者首次入院)"
 COHORT_TYPE_ALL_EVENTS_STR = "所有事件入院 (所有包含该事件的入院)"
-COHORT_TYPE_FIRST_EVENT_KEY = "first_event_admission"
-COHORT_TYPE_ALL_EVENTS_KEY = "all_event_admissions"
 
 # --- Constants for Source Mode (Disease or Procedure) ---
 MODE_DISEASE_KEY = "disease"
-MODE_PROCEDURE_KEY = "procedure"
+
 
 class CohortCreationWorker(QObject):
     # ... (CohortCreationWorker 类代码保持不变) ...
@@ -32,7 +50,8 @@ class CohortCreationWorker(QObject):
 
     def __init__(self, db_params, target_table_name_str,
                  condition_sql_template, condition_params,
-                 admission_cohort_type, source_mode_details):
+                 admission_cohort_type, source_mode_details, job_timeouts=None, tuning_profile=None,
+                 essential_indexes_only=False):
         super().__init__()
         self.db_params = db_params
         self.target_table_name_str = target_table_name_str
@@ -40,14 +59,22 @@ class CohortCreationWorker(QObject):
         self.condition_params = condition_params
         self.admission_cohort_type = admission_cohort_type
         self.source_mode_details = source_mode_details
+        self.job_timeouts = job_timeouts
+        self.tuning_profile = tuning_profile
+        self.essential_indexes_only = essential_indexes_only
         self.is_cancelled = False
+        self.conn = None
+        self.index_builder = None
 
     def cancel(self):
         self.log.emit("队列创建操作被请求取消...")
         self.is_cancelled = True
+        if cancel_backend_query(self.conn): self.log.emit("已请求服务器取消正在执行的语句。")
+        if self.index_builder and self.index_builder.cancel(): self.log.emit("已请求服务器取消正在创建的索引。")
 
     def run(self):
         conn = None
+        journal = None
         total_steps = 6 
         current_step = 0
 
@@ -73,10 +100,17 @@ class CohortCreationWorker(QObject):
             self.log.emit(f"开始创建队列数据表: {self.target_table_name_str} (类型: {self.admission_cohort_type}, 来源: {event_source_type_str})...")
             self.progress.emit(current_step, total_steps)
             self.log.emit("连接数据库...")
-            conn = psycopg2.connect(**self.db_params)
+            conn = connect_database(self.db_params, connection_factory=JournaledConnection)
+            self.conn = conn
             cur = conn.cursor()
             conn.autocommit = False
-            self.log.emit("数据库已连接。")
+            journal = JobJournal("cohort_creation", self.target_table_name_str, self.admission_cohort_type,
+                                 [self.condition_sql_template, repr(self.condition_params), self.admission_cohort_type,
+                                  repr(sorted(self.source_mode_details.items()))], tuning_profile=self.tuning_profile)
+            journal.attach(conn)
+            apply_job_timeouts(cur, self.job_timeouts)
+            apply_session_tuning(cur, self.tuning_profile)
+            self.log.emit(f"数据库已连接。会话调优: {describe_tuning_profile(self.tuning_profile) or '服务器默认'}")
 
             current_step += 1 
             self.log.emit(f"步骤 {current_step}/{total_steps}: 确保 'mimiciv_data' schema 存在...")
@@ -136,6 +170,7 @@ class CohortCreationWorker(QObject):
                         FROM ({base_select}) AS base
                     ) ranked_base
                     WHERE ranked_base.admission_rank_for_event = 1;
+                    ANALYZE {temp_table_ident};
                 """).format(
                     temp_table_ident=selected_event_ad_temp_ident,
                     base_select=base_event_select_sql,
@@ -145,6 +180,8 @@ class CohortCreationWorker(QObject):
                 create_event_admission_sql = psql.SQL("""
                     DROP TABLE IF EXISTS {temp_table_ident};
                     CREATE TEMPORARY TABLE {temp_table_ident} AS ({base_select});
+                    CREATE INDEX ON {temp_table_ident} (hadm_id);
+                    ANALYZE {temp_table_ident};
                 """).format(
                     temp_table_ident=selected_event_ad_temp_ident,
                     base_select=base_event_select_sql
@@ -168,6 +205,7 @@ class CohortCreationWorker(QObject):
                     FROM mimiciv_icu.icustays icu
                     WHERE EXISTS (SELECT 1 FROM {selected_event_temp_table} seat WHERE seat.hadm_id = icu.hadm_id)
                   ) sub WHERE icu_stay_rank_in_admission = 1);
+                ANALYZE {temp_table_ident};
             """).format(temp_table_ident=first_icu_stays_temp_ident, selected_event_temp_table=selected_event_ad_temp_ident)
             cur.execute(create_first_icu_stay_for_admission_sql)
             self.progress.emit(current_step, total_steps)
@@ -232,53 +270,157 @@ class CohortCreationWorker(QObject):
             if self.is_cancelled: raise InterruptedError("操作已取消")
 
             current_step += 1 
-            self.log.emit(f"步骤 {current_step}/{total_steps}: 为表 {self.target_table_name_str} 创建索引...")
-            idx_prefix_base = f"{event_source_type_str}_{self.target_table_name_str.replace('first_', '').replace('all_', '').replace('_admissions', '')}"[:15]
-            indexes_to_create = [
-                (f"idx_{idx_prefix_base}_sub", "subject_id"), (f"idx_{idx_prefix_base}_hadm", "hadm_id"),
-                (f"idx_{idx_prefix_base}_stay", "stay_id"), (f"idx_{idx_prefix_base}_admt", "admittime"),
-                (f"idx_{idx_prefix_base}_icuin", "icu_intime"), (f"idx_{idx_prefix_base}_evcode", "qualifying_event_code"),
-                (f"idx_{idx_prefix_base}_evvers", "qualifying_event_icd_version")
-            ]
-            if event_source_type_str == MODE_PROCEDURE_KEY:
-                indexes_to_create.append((f"idx_{idx_prefix_base}_pdxcode", "primary_diag_code"))
-
-            for index_name_str, column_name_str in indexes_to_create:
-                if len(index_name_str) > 63: index_name_str = index_name_str[:63]
-                index_ident = psql.Identifier(index_name_str)
-                column_ident = psql.Identifier(column_name_str)
-                cur.execute(psql.SQL("SELECT 1 FROM information_schema.columns WHERE table_schema = 'mimiciv_data' AND table_name = %s AND column_name = %s"),
-                            (self.target_table_name_str, column_name_str))
-                if cur.fetchone():
-                    create_index_sql = psql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} ({});").format(index_ident, target_table_ident, column_ident)
-                    self.log.emit(f"    创建索引 {index_name_str} on {column_name_str}...")
-                    cur.execute(create_index_sql)
-                else:
-                    self.log.emit(f"    跳过索引 {index_name_str}，列 {column_name_str} 在表 {self.target_table_name_str} 中不存在。")
-                if self.is_cancelled: raise InterruptedError("操作已取消")
-            self.log.emit("所有索引创建完毕。")
-            self.progress.emit(current_step, total_steps)
-
-            current_step += 1 
-            self.log.emit(f"步骤 {current_step}/{total_steps}: 正在提交更改并获取行数...")
+            self.log.emit(f"步骤 {current_step}/{total_steps}: 收集统计信息并提交更改...")
+            # 提交前只查询一次队列表实际存在的列，索引在提交后用独立连接并行构建
+            index_statements = plan_cohort_indexes(cur, self.target_table_name_str, event_source_type_str,
+                                                   self.essential_indexes_only)
+            cur.execute(build_cohort_analyze_sql(self.target_table_name_str))
             cur.execute(psql.SQL("DROP TABLE IF EXISTS {temp_table_ident};").format(temp_table_ident=first_icu_stays_temp_ident))
             cur.execute(psql.SQL("DROP TABLE IF EXISTS {temp_table_ident};").format(temp_table_ident=selected_event_ad_temp_ident))
             conn.commit()
             self.log.emit("更改已成功提交。")
+            self.progress.emit(current_step, total_steps)
+            if self.is_cancelled: raise CommittedInterruptedError("操作已取消")
+
+            current_step += 1 
+            self.log.emit(f"步骤 {current_step}/{total_steps}: 为表 {self.target_table_name_str} 创建索引并获取行数...")
+            build_indexes_after_commit(self, index_statements, journal)
+            journal.finish(JOB_OUTCOME_SUCCESS, pg_conn=conn)
 
             cur.execute(psql.SQL("SELECT COUNT(*) FROM {}").format(target_table_ident))
             count = cur.fetchone()[0]
             self.progress.emit(current_step, total_steps)
             self.finished.emit(self.target_table_name_str, count)
 
+        except CommittedInterruptedError:
+            self.log.emit(f"队列创建操作被用户取消。表 {self.target_table_name_str} 已提交，但部分索引尚未创建。")
+            if journal: journal.finish(JOB_OUTCOME_CANCELLED)
+            self.error.emit("操作已取消")
         except InterruptedError: 
             if conn: conn.rollback()
             self.log.emit("队列创建操作被用户取消。")
+            if journal: journal.finish(JOB_OUTCOME_CANCELLED)
             self.error.emit("操作已取消")
+        except QueryCanceledError as qc_err:
+            if conn: conn.rollback()
+            err_msg = describe_query_canceled(qc_err, self.is_cancelled)
+            self.log.emit(err_msg)
+            if journal: journal.finish(JOB_OUTCOME_CANCELLED if self.is_cancelled else JOB_OUTCOME_FAILED, err_msg)
+            self.error.emit(err_msg)
         except (Exception, psycopg2.Error) as error:
             if conn: conn.rollback()
             err_msg = f"创建队列数据表时出错: {error}\n{traceback.format_exc()}"
             self.log.emit(err_msg)
+            if journal: journal.finish(JOB_OUTCOME_FAILED, str(error))
+            self.error.emit(err_msg)
+        finally:
+            if conn:
+                self.log.emit("关闭数据库连接。")
+                conn.close()
+
+
+class BatchCohortCreationWorker(QObject):
+    """批量创建队列: 对事件表只扫描一次，共享临时表，逐个写出队列表，提交后并行建索引。"""
+    finished = Signal(list) # [(table_name, count)]
+    error = Signal(str)
+    progress = Signal(int, int) # current_step, total_steps
+    log = Signal(str)
+
+    def __init__(self, db_params, cohort_specs, source_mode_details, job_timeouts=None, tuning_profile=None,
+                 essential_indexes_only=False):
+        super().__init__()
+        self.db_params = db_params
+        self.cohort_specs = cohort_specs
+        self.source_mode_details = source_mode_details
+        self.job_timeouts = job_timeouts
+        self.tuning_profile = tuning_profile
+        self.essential_indexes_only = essential_indexes_only
+        self.is_cancelled = False
+        self.conn = None
+        self.index_builder = None
+
+    def cancel(self):
+        self.log.emit("批量队列创建操作被请求取消...")
+        self.is_cancelled = True
+        if cancel_backend_query(self.conn): self.log.emit("已请求服务器取消正在执行的语句。")
+        if self.index_builder and self.index_builder.cancel(): self.log.emit("已请求服务器取消正在创建的索引。")
+
+    def run(self):
+        conn = None
+        journal = None
+        try:
+            steps, err = build_batch_cohort_sql(self.cohort_specs, self.source_mode_details)
+            if err: raise ValueError(err)
+            source_type = self.source_mode_details["source_type"]
+            # SQL 步骤 + 统计信息/提交 + 并行建索引/计数
+            total_steps = len(steps) + 2
+            current_step = 0
+            self.log.emit(f"开始批量创建 {len(self.cohort_specs)} 个队列 (来源: {source_type})...")
+            self.progress.emit(current_step, total_steps)
+            conn = connect_database(self.db_params, connection_factory=JournaledConnection)
+            self.conn = conn
+            conn.autocommit = False
+            cur = conn.cursor()
+            journal = JobJournal("batch_cohort_creation", ", ".join(spec["table_name"] for spec in self.cohort_specs), source_type,
+                                 [json.dumps(self.cohort_specs, sort_keys=True, ensure_ascii=False, default=str)],
+                                 tuning_profile=self.tuning_profile)
+            journal.attach(conn)
+            apply_job_timeouts(cur, self.job_timeouts)
+            apply_session_tuning(cur, self.tuning_profile)
+            self.log.emit(f"数据库已连接。会话调优: {describe_tuning_profile(self.tuning_profile) or '服务器默认'}")
+
+            for description, sql_obj, params in steps:
+                current_step += 1
+                self.log.emit(f"步骤 {current_step}/{total_steps}: {description}...")
+                step_start_time = time.time()
+                cur.execute(sql_obj, params)
+                self.log.emit(f"    完成，用时 {time.time() - step_start_time:.1f} 秒。")
+                self.progress.emit(current_step, total_steps)
+                if self.is_cancelled: raise InterruptedError("操作已取消")
+
+            current_step += 1
+            self.log.emit(f"步骤 {current_step}/{total_steps}: 收集统计信息并提交更改...")
+            index_statements = []
+            for spec in self.cohort_specs:
+                index_statements.extend(plan_cohort_indexes(cur, spec["table_name"], source_type, self.essential_indexes_only))
+                cur.execute(build_cohort_analyze_sql(spec["table_name"]))
+            cur.execute(build_batch_cleanup_sql())
+            conn.commit()
+            self.log.emit("更改已成功提交。")
+            self.progress.emit(current_step, total_steps)
+            if self.is_cancelled: raise CommittedInterruptedError("操作已取消")
+
+            current_step += 1
+            self.log.emit(f"步骤 {current_step}/{total_steps}: 为 {len(self.cohort_specs)} 个队列表创建索引并获取行数...")
+            build_indexes_after_commit(self, index_statements, journal)
+            journal.finish(JOB_OUTCOME_SUCCESS, pg_conn=conn)
+            results = []
+            for spec in self.cohort_specs:
+                cur.execute(psql.SQL("SELECT COUNT(*) FROM {}").format(psql.Identifier('mimiciv_data', spec["table_name"])))
+                results.append((spec["table_name"], cur.fetchone()[0]))
+            self.progress.emit(current_step, total_steps)
+            self.finished.emit(results)
+
+        except CommittedInterruptedError:
+            self.log.emit("批量队列创建操作被用户取消。队列表已提交，但部分索引尚未创建。")
+            if journal: journal.finish(JOB_OUTCOME_CANCELLED)
+            self.error.emit("操作已取消")
+        except InterruptedError:
+            if conn: conn.rollback()
+            self.log.emit("批量队列创建操作被用户取消。")
+            if journal: journal.finish(JOB_OUTCOME_CANCELLED)
+            self.error.emit("操作已取消")
+        except QueryCanceledError as qc_err:
+            if conn: conn.rollback()
+            err_msg = describe_query_canceled(qc_err, self.is_cancelled)
+            self.log.emit(err_msg)
+            if journal: journal.finish(JOB_OUTCOME_CANCELLED if self.is_cancelled else JOB_OUTCOME_FAILED, err_msg)
+            self.error.emit(err_msg)
+        except (Exception, psycopg2.Error) as error:
+            if conn: conn.rollback()
+            err_msg = f"批量创建队列时出错: {error}\n{traceback.format_exc()}"
+            self.log.emit(err_msg)
+            if journal: journal.finish(JOB_OUTCOME_FAILED, str(error))
             self.error.emit(err_msg)
         finally:
             if conn:
@@ -286,15 +428,78 @@ class CohortCreationWorker(QObject):
                 conn.close()
 
 
+class CohortSizeEstimateWorker(QObject):
+    """队列规模估计: 先用 EXPLAIN 给出匹配事件行数的估计，再在语句超时内精确计数患者数/入院数。"""
+    estimate_ready = Signal(int, int) # generation, 估计的匹配事件行数
+    finished = Signal(int, dict) # generation, {"patients", "admissions", "event_rows"}
+    error = Signal(int, str) # generation, 错误信息
+
+    def __init__(self, db_params, generation, condition_sql, condition_params, source_mode_details):
+        super().__init__()
+        self.db_params = db_params
+        self.generation = generation
+        self.condition_sql = condition_sql
+        self.condition_params = condition_params
+        self.source_mode_details = source_mode_details
+        self.is_cancelled = False
+        self.conn = None
+
+    def cancel(self):
+        self.is_cancelled = True
+        cancel_backend_query(self.conn)
+
+    def run(self):
+        conn = None
+        try:
+            conn = connect_database(self.db_params)
+            self.conn = conn
+            cur = conn.cursor()
+            cur.execute(build_cohort_size_explain_sql(self.condition_sql, self.source_mode_details), self.condition_params)
+            estimated_rows = parse_explain_row_estimate(cur.fetchone()[0])
+            if estimated_rows is not None:
+                self.estimate_ready.emit(self.generation, estimated_rows)
+            # SET LOCAL 只在当前事务内生效，避免精确计数长时间占用连接
+            cur.execute("SET LOCAL statement_timeout = %s", (COHORT_SIZE_COUNT_TIMEOUT_MS,))
+            apply_session_tuning(cur, PREVIEW_TUNING_PROFILE, transaction_local=True)
+            cur.execute(build_cohort_size_count_sql(self.condition_sql, self.source_mode_details), self.condition_params)
+            patients, admissions, event_rows = cur.fetchone()
+            conn.rollback()
+            self.finished.emit(self.generation, {"patients": patients, "admissions": admissions, "event_rows": event_rows})
+        except QueryCanceledError:
+            self.error.emit(self.generation, "已取消" if self.is_cancelled else "精确计数超时")
+        except (Exception, psycopg2.Error) as error:
+            self.error.emit(self.generation, str(error))
+        finally:
+            if conn: conn.close()
+
+
 class QueryCohortTab(QWidget):
-    def __init__(self, get_db_params_func, parent=None):
+    JOB_OWNER = "查找与创建队列"
+
+    def __init__(self, get_db_params_func, get_job_timeouts_func=None, get_tuning_profile_func=None, job_scheduler=None,
+                 parent=None):
         super().__init__(parent)
         self.get_db_params = get_db_params_func
+        self.get_job_timeouts = get_job_timeouts_func or (lambda: None)
+        self.get_tuning_profile = get_tuning_profile_func or (lambda: None)
         self.last_query_condition_template = None
         self.last_query_params = None
-        self.cohort_worker_thread = None
-        self.cohort_worker = None
+        self.job_scheduler = job_scheduler or JobScheduler(self)
+        self.current_job_id = None # 进度条显示最近提交的任务
         self.current_mode_key = MODE_DISEASE_KEY 
+        self.last_query_codes = None # 按代码列表筛选时，最近一次查询使用的 {ICD 版本: 代码列表}
+        self.icd_prefix_indexes = {} # 字典表 -> IcdPrefixIndex (首次使用时从数据库载入)
+        self.icd_version_map = {} # 由 GEM 文件加载的 ICD-9 <-> ICD-10 对应关系
+        self.expanded_codes = {} # 当前代码前缀/章节展开得到的 {ICD 版本: 代码列表}
+        self.batch_cohort_specs = [] # 批量创建列表: [{"name", "table_name", "condition_sql", "condition_params", "admission_type", "source_type"}]
+        self.size_estimate_thread = None
+        self.size_estimate_worker = None
+        self.size_estimate_generation = 0 # 每次条件变化 +1，旧结果按编号丢弃
+        self.size_estimate_pending = False # 估计进行中条件又变化时，结束后重新估计
+        self.size_estimate_timer = QTimer(self)
+        self.size_estimate_timer.setSingleShot(True)
+        self.size_estimate_timer.setInterval(COHORT_SIZE_ESTIMATE_DEBOUNCE_MS)
+        self.size_estimate_timer.timeout.connect(self.start_cohort_size_estimate)
         self.init_ui()
         
 
@@ -328,6 +533,7 @@ class QueryCohortTab(QWidget):
         
         self.condition_group = ConditionGroupWidget(is_root=True) 
         self.condition_group.condition_changed.connect(self.update_button_states)
+        self.condition_group.condition_changed.connect(self.schedule_cohort_size_estimate)
         
         cg_scroll_area = QScrollArea()
         cg_scroll_area.setWidgetResizable(True)
@@ -335,6 +541,41 @@ class QueryCohortTab(QWidget):
         cg_scroll_area.setMinimumHeight(200) 
         controls_and_preview_layout.addWidget(cg_scroll_area)
 
+        code_group = QGroupBox("按 ICD 代码前缀/章节筛选")
+        code_group_layout = QVBoxLayout(code_group)
+        self.cb_use_code_selection = QCheckBox("使用代码列表筛选 (代替上方条件组，建队列时以 icd_code = ANY(...) 直接作用于事件表)")
+        self.cb_use_code_selection.toggled.connect(self._on_code_selection_mode_toggled)
+        code_group_layout.addWidget(self.cb_use_code_selection)
+        code_input_layout = QHBoxLayout()
+        self.code_prefix_input = QLineEdit()
+        self.code_prefix_input.setPlaceholderText("代码前缀或区间，如 I21*, I50.*, 410.x, I20-I25")
+        self.code_prefix_input.textChanged.connect(self._on_code_selection_changed)
+        code_input_layout.addWidget(self.code_prefix_input, 2)
+        self.code_chapter_combo = QComboBox()
+        self.code_chapter_combo.currentIndexChanged.connect(self._on_code_selection_changed)
+        code_input_layout.addWidget(self.code_chapter_combo, 2)
+        self.code_version_combo = QComboBox()
+        self.code_version_combo.addItem("全部版本", None)
+        for version in ICD_VERSIONS:
+            self.code_version_combo.addItem(f"仅 ICD-{version}", version)
+        self.code_version_combo.currentIndexChanged.connect(self._on_code_selection_changed)
+        code_input_layout.addWidget(self.code_version_combo)
+        code_group_layout.addLayout(code_input_layout)
+        code_map_layout = QHBoxLayout()
+        self.cb_include_mapped_codes = QCheckBox("同时包含 ICD-9/ICD-10 对应代码")
+        self.cb_include_mapped_codes.toggled.connect(self._on_code_selection_changed)
+        code_map_layout.addWidget(self.cb_include_mapped_codes)
+        self.load_gem_btn = QPushButton("加载 GEM 映射文件...")
+        self.load_gem_btn.clicked.connect(self.load_gem_files)
+        code_map_layout.addWidget(self.load_gem_btn)
+        code_map_layout.addStretch()
+        code_group_layout.addLayout(code_map_layout)
+        self.code_selection_label = QLabel("输入代码前缀或选择章节后即时展开为代码列表。")
+        self.code_selection_label.setWordWrap(True)
+        code_group_layout.addWidget(self.code_selection_label)
+        self._set_code_selection_inputs_enabled(False)
+        controls_and_preview_layout.addWidget(code_group)
+
         cohort_type_layout = QHBoxLayout()
         self.admission_type_label = QLabel("选择入院类型:")
         cohort_type_layout.addWidget(self.admission_type_label)
@@ -342,6 +583,14 @@ class QueryCohortTab(QWidget):
         cohort_type_layout.addWidget(self.admission_type_combo); cohort_type_layout.addStretch()
         controls_and_preview_layout.addLayout(cohort_type_layout)
 
+        self.cohort_size_label = QLabel("队列规模估计: (输入筛选条件后自动估计)")
+        self.cohort_size_label.setWordWrap(True)
+        controls_and_preview_layout.addWidget(self.cohort_size_label)
+
+        self.cb_essential_indexes_only = QCheckBox("仅创建后续提取使用的索引 (hadm_id, stay_id)，缩短建表时间")
+        self.cb_essential_indexes_only.setToolTip("队列表提交后并行创建索引；不勾选时还为 subject_id、入院/入ICU时间、事件代码等列建索引。")
+        controls_and_preview_layout.addWidget(self.cb_essential_indexes_only)
+
         btn_layout = QHBoxLayout()
         self.query_btn = QPushButton("查询ICD")
         self.query_btn.clicked.connect(self.execute_query); self.query_btn.setEnabled(False)
@@ -354,12 +603,38 @@ class QueryCohortTab(QWidget):
         btn_layout.addWidget(self.create_table_btn)
         controls_and_preview_layout.addLayout(btn_layout)
 
+        batch_group = QGroupBox("批量创建队列 (对事件表只扫描一次)")
+        batch_layout = QVBoxLayout(batch_group)
+        self.batch_list_widget = QListWidget(); self.batch_list_widget.setMaximumHeight(90)
+        batch_layout.addWidget(self.batch_list_widget)
+        batch_btn_layout = QHBoxLayout()
+        self.add_to_batch_btn = QPushButton("将当前条件加入批量列表")
+        self.add_to_batch_btn.clicked.connect(self.add_current_condition_to_batch)
+        batch_btn_layout.addWidget(self.add_to_batch_btn)
+        self.remove_from_batch_btn = QPushButton("移除选中")
+        self.remove_from_batch_btn.clicked.connect(self.remove_selected_from_batch)
+        batch_btn_layout.addWidget(self.remove_from_batch_btn)
+        self.load_batch_btn = QPushButton("导入列表...")
+        self.load_batch_btn.clicked.connect(self.load_batch_list)
+        batch_btn_layout.addWidget(self.load_batch_btn)
+        self.save_batch_btn = QPushButton("导出列表...")
+        self.save_batch_btn.clicked.connect(self.save_batch_list)
+        batch_btn_layout.addWidget(self.save_batch_btn)
+        self.create_batch_btn = QPushButton("批量创建队列表")
+        self.create_batch_btn.clicked.connect(self.create_batch_cohort_tables)
+        batch_btn_layout.addWidget(self.create_batch_btn)
+        batch_layout.addLayout(batch_btn_layout)
+        controls_and_preview_layout.addWidget(batch_group)
+
         self.cohort_creation_status_group = QGroupBox("队列创建状态")
         cohort_status_layout = QVBoxLayout(self.cohort_creation_status_group)
         self.cohort_creation_progress = QProgressBar(); self.cohort_creation_progress.setRange(0, 6); self.cohort_creation_progress.setValue(0)
         cohort_status_layout.addWidget(self.cohort_creation_progress)
         self.cohort_creation_log = QTextEdit(); self.cohort_creation_log.setReadOnly(True); self.cohort_creation_log.setMaximumHeight(100)
         cohort_status_layout.addWidget(self.cohort_creation_log)
+        self.cancel_cohort_creation_btn = QPushButton("取消创建")
+        self.cancel_cohort_creation_btn.clicked.connect(self.cancel_cohort_creation)
+        cohort_status_layout.addWidget(self.cancel_cohort_creation_btn)
         self.cohort_creation_status_group.setVisible(False)
         controls_and_preview_layout.addWidget(self.cohort_creation_status_group)
 
@@ -380,7 +655,144 @@ class QueryCohortTab(QWidget):
         
 
     def on_db_connected(self):
+        self.icd_prefix_indexes.clear() # 可能连接到了另一个数据库
+        self._load_condition_field_types()
+        self._on_code_selection_changed()
         self.update_button_states()
+        self.schedule_cohort_size_estimate()
+
+    def _load_condition_field_types(self):
+        # 按字典表的真实列类型编译条件 (文本列不再 CAST，前缀搜索可走索引)；未连接时为空，沿用按列名推测
+        if hasattr(self, 'condition_group'):
+            self.condition_group.set_field_types(get_cached_column_types(self.get_db_params(), getattr(self, 'dict_table_for_query', None)))
+
+    # --- 按 ICD 代码前缀/章节筛选 ---
+    def _populate_code_chapters(self):
+        chapters = DIAGNOSIS_CHAPTERS if self.current_mode_key == MODE_DISEASE_KEY else PROCEDURE_CHAPTERS
+        self.code_chapter_combo.blockSignals(True)
+        self.code_chapter_combo.clear()
+        self.code_chapter_combo.addItem("(不按章节)", None)
+        for version, start, end, title in chapters:
+            code_range = start if start == end else f"{start}-{end}"
+            self.code_chapter_combo.addItem(f"ICD-{version} {code_range} {title}", (version, start, end))
+        self.code_chapter_combo.blockSignals(False)
+        self.code_prefix_input.blockSignals(True)
+        self.code_prefix_input.clear()
+        self.code_prefix_input.blockSignals(False)
+        self._on_code_selection_changed()
+
+    def _set_code_selection_inputs_enabled(self, enabled):
+        for widget in (self.code_prefix_input, self.code_chapter_combo, self.code_version_combo,
+                       self.cb_include_mapped_codes, self.load_gem_btn):
+            widget.setEnabled(enabled)
+
+    def _is_code_selection_active(self):
+        return hasattr(self, 'cb_use_code_selection') and self.cb_use_code_selection.isChecked()
+
+    def _has_valid_condition(self):
+        if self._is_code_selection_active():
+            return bool(self.expanded_codes)
+        return self.condition_group.has_valid_input()
+
+    def _current_condition(self, table_alias=None):
+        """
+        当前筛选条件 (SQL 模板, 参数)。代码列表模式下条件作用于 table_alias 指定的表:
+        建队列与规模估计时为事件表 "e"，在字典表上查询/打标签时为 "dd"；条件组模式下条件始终作用于字典列。
+        """
+        if self._is_code_selection_active():
+            return build_code_list_condition(self.expanded_codes, table_alias)
+        return self.condition_group.get_condition()
+
+    @Slot(bool)
+    def _on_code_selection_mode_toggled(self, checked):
+        self.condition_group.setEnabled(not checked)
+        self._set_code_selection_inputs_enabled(checked)
+        self.last_query_condition_template = None
+        self.last_query_params = None
+        self.last_query_codes = None
+        self._on_code_selection_changed()
+
+    def _get_icd_prefix_index(self):
+        """当前字典表的代码前缀索引 (每个字典表只从数据库载入一次)；未连接时返回 None。"""
+        index = self.icd_prefix_indexes.get(self.dict_table_for_query)
+        if index is not None: return index
+        db_params = self.get_db_params()
+        if not db_params: return None
+        conn = None
+        try:
+            conn = connect_database(db_params)
+            index = load_icd_prefix_index(conn.cursor(), self.dict_table_for_query,
+                                          self.dict_code_col_for_query, self.dict_title_col_for_query)
+        except DATABASE_ERRORS as e:
+            self.code_selection_label.setText(f"载入 ICD 代码字典失败: {e}")
+            return None
+        finally:
+            if conn: conn.close()
+        self.icd_prefix_indexes[self.dict_table_for_query] = index
+        return index
+
+    def _on_code_selection_changed(self, *args):
+        if not hasattr(self, 'code_selection_label'): return
+        self.expanded_codes = {}
+        if self._is_code_selection_active():
+            self.expanded_codes = self._expand_code_selection()
+        self.update_button_states()
+        self.schedule_cohort_size_estimate()
+
+    def _expand_code_selection(self):
+        try:
+            selections = parse_icd_selection_text(self.code_prefix_input.text())
+        except ValueError as e:
+            self.code_selection_label.setText(str(e)); return {}
+        version = self.code_version_combo.currentData()
+        versions = [version] if version else None
+        chapter = self.code_chapter_combo.currentData()
+        if not selections and not chapter:
+            self.code_selection_label.setText("输入代码前缀或选择章节后即时展开为代码列表。"); return {}
+        index = self._get_icd_prefix_index()
+        if index is None:
+            if self.get_db_params(): return {} # 载入失败，错误信息已显示
+            self.code_selection_label.setText("连接数据库后才能展开代码 (需要载入 ICD 代码字典)。"); return {}
+        codes_by_version = index.expand(selections, versions) if selections else {}
+        if chapter and (not version or chapter[0] == version):
+            chapter_version, start, end = chapter
+            codes_by_version.setdefault(chapter_version, [])
+            codes_by_version[chapter_version] = sorted(set(codes_by_version[chapter_version]) |
+                                                       set(index.codes_in_range(chapter_version, start, end)))
+        codes_by_version = {v: codes for v, codes in codes_by_version.items() if codes}
+        if self.cb_include_mapped_codes.isChecked() and self.icd_version_map:
+            codes_by_version = add_mapped_codes(codes_by_version, self.icd_version_map)
+        if not codes_by_version:
+            self.code_selection_label.setText("没有匹配的代码。"); return {}
+        summary = "，".join(f"ICD-{v}: {len(codes)} 个 ({', '.join(codes[:5])}{' ...' if len(codes) > 5 else ''})"
+                           for v, codes in sorted(codes_by_version.items()))
+        mapping_note = ""
+        if self.cb_include_mapped_codes.isChecked() and not self.icd_version_map:
+            mapping_note = " (尚未加载 GEM 映射文件，未包含对应代码)"
+        self.code_selection_label.setText(f"已展开 {summary}{mapping_note}")
+        return codes_by_version
+
+    def load_gem_files(self):
+        file_paths, _ = QFileDialog.getOpenFileNames(self, "加载 GEM 映射文件 (如 2018_I9gem.txt, 2018_I10gem.txt)", "",
+                                                     "文本文件 (*.txt);;所有文件 (*)")
+        if not file_paths: return
+        pairs = []
+        for file_path in file_paths:
+            source_version = gem_source_version(file_path)
+            if source_version is None:
+                QMessageBox.warning(self, "无法识别的映射文件",
+                                    f"无法从文件名判断映射方向: {file_path}\n文件名应包含 I9gem/I10gem (诊断) 或 i9pcs/pcsi9 (操作)。")
+                continue
+            try:
+                with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                    pairs.extend(parse_gem_lines(f, source_version))
+            except OSError as e:
+                QMessageBox.critical(self, "读取失败", f"无法读取映射文件 {file_path}: {e}")
+        if not pairs: return
+        for source, targets in build_version_map(pairs).items():
+            self.icd_version_map.setdefault(source, set()).update(targets)
+        self.load_gem_btn.setText(f"加载 GEM 映射文件... (已载入 {len(self.icd_version_map)} 个代码)")
+        self._on_code_selection_changed()
 
     # --- 新的槽函数 ---
     @Slot(QAbstractButton, bool)
@@ -401,6 +813,7 @@ class QueryCohortTab(QWidget):
         self.sql_preview.clear()
         self.last_query_condition_template = None
         self.last_query_params = None
+        self.last_query_codes = None
         self.table_content_label.setText("当前表格内容: ICD/Procedure代码查询结果")
 
         current_admission_type_key = None
@@ -438,7 +851,11 @@ class QueryCohortTab(QWidget):
 
         if hasattr(self, 'condition_group'):
             self.condition_group.set_available_search_fields(available_fields_for_cg)
+            self._load_condition_field_types()
             self.condition_group.clear_all() 
+        if hasattr(self, 'code_chapter_combo'):
+            self._populate_code_chapters()
+        self.schedule_cohort_size_estimate()
 
         if current_admission_type_key:
             idx = self.admission_type_combo.findData(current_admission_type_key)
@@ -448,29 +865,29 @@ class QueryCohortTab(QWidget):
         
         self.update_button_states() 
 
-    def prepare_for_cohort_creation(self, starting=True):
-        # ... (此方法保持不变) ...
-        self.cohort_creation_status_group.setVisible(starting)
+    def prepare_for_cohort_creation(self, starting=True, finished_job_id=None):
+        # 创建任务在任务队列中执行，条件编辑区保持可用，可继续提交其他队列
+        remaining = [j for j in self.job_scheduler.active_job_ids(self.JOB_OWNER) if j != finished_job_id]
+        self.cohort_creation_status_group.setVisible(starting or bool(remaining))
         if starting:
             self.cohort_creation_progress.setValue(0)
-            self.cohort_creation_log.clear()
-            self.update_cohort_creation_log("开始创建队列...")
-        
-        is_enabled = not starting
-        self.condition_group.setEnabled(is_enabled)
-        self.admission_type_combo.setEnabled(is_enabled)
-        self.rb_mode_disease.setEnabled(is_enabled)
-        self.rb_mode_procedure.setEnabled(is_enabled)
-        
-        if not starting: 
-            self.cohort_worker = None
-            self.cohort_worker_thread = None
-        
+            if not remaining:
+                self.cohort_creation_log.clear()
+            self.update_cohort_creation_log("提交队列创建任务...")
+        self.cancel_cohort_creation_btn.setEnabled(starting or bool(remaining))
         self.update_button_states()
 
 
-    def update_cohort_creation_progress(self, value, max_value):
-        # ... (此方法保持不变) ...
+    def cancel_cohort_creation(self):
+        job_ids = self.job_scheduler.active_job_ids(self.JOB_OWNER)
+        if job_ids:
+            self.cancel_cohort_creation_btn.setEnabled(False)
+            for job_id in job_ids:
+                self.job_scheduler.cancel(job_id)
+
+    def update_cohort_creation_progress(self, job_id, value, max_value):
+        if job_id != self.current_job_id:
+            return
         if self.cohort_creation_progress.maximum() != max_value: self.cohort_creation_progress.setMaximum(max_value)
         self.cohort_creation_progress.setValue(value)
 
@@ -480,7 +897,7 @@ class QueryCohortTab(QWidget):
 
     def _can_create_table_check(self):
         # ... (此方法保持不变) ...
-        return (self.condition_group.has_valid_input() and
+        return (self._has_valid_condition() and
                 self.last_query_condition_template and 
                 self.last_query_condition_template.strip() and 
                 self.last_query_condition_template.lower() != "true" and 
@@ -490,16 +907,20 @@ class QueryCohortTab(QWidget):
     def update_button_states(self):
         # ... (此方法保持不变) ...
         db_connected = bool(self.get_db_params())
-        has_valid_conditions = self.condition_group.has_valid_input()
-        is_worker_running = self.cohort_worker_thread is not None and self.cohort_worker_thread.isRunning()
-
-        self.query_btn.setEnabled(db_connected and has_valid_conditions and not is_worker_running)
-        self.preview_btn.setEnabled(db_connected and has_valid_conditions and not is_worker_running)
+        has_valid_conditions = self._has_valid_condition()
+        self.query_btn.setEnabled(db_connected and has_valid_conditions)
+        self.preview_btn.setEnabled(db_connected and has_valid_conditions)
         
-        can_create = db_connected and self._can_create_table_check() and not is_worker_running
+        can_create = db_connected and self._can_create_table_check()
         self.create_table_btn.setEnabled(can_create)
-
-        if not has_valid_conditions and not is_worker_running:
+        if hasattr(self, 'create_batch_btn'):
+            self.add_to_batch_btn.setEnabled(self._can_create_table_check())
+            self.remove_from_batch_btn.setEnabled(bool(self.batch_cohort_specs))
+            self.save_batch_btn.setEnabled(bool(self.batch_cohort_specs))
+            self.load_batch_btn.setEnabled(True)
+            self.create_batch_btn.setEnabled(db_connected and bool(self.batch_cohort_specs))
+
+        if not has_valid_conditions:
             self.sql_preview.setPlaceholderText("在此处将显示生成的SQL语句预览...")
             if not has_valid_conditions:
                  self.create_table_btn.setEnabled(False)
@@ -507,8 +928,8 @@ class QueryCohortTab(QWidget):
 
     def _build_query_parts(self):
         # print(f"DEBUG: _build_query_parts - dict_table_for_query = {self.dict_table_for_query}") # 添加调试打印
-        condition_template, params = self.condition_group.get_condition()
-        base_query = psql.SQL("SELECT {code_col}, {title_col} FROM {dict_table}").format(
+        condition_template, params = self._current_condition("dd")
+        base_query = psql.SQL("SELECT {code_col}, {title_col} FROM {dict_table} dd").format(
             code_col=psql.Identifier(self.dict_code_col_for_query),
             title_col=psql.Identifier(self.dict_title_col_for_query),
             dict_table=psql.SQL(self.dict_table_for_query) 
@@ -542,8 +963,8 @@ class QueryCohortTab(QWidget):
 
         temp_conn_for_preview = None
         try:
-            temp_conn_for_preview = psycopg2.connect(**db_params)
-            query_template_for_mogrify = query_obj.as_string(temp_conn_for_preview) 
+            temp_conn_for_preview = connect_database(db_params)
+            query_template_for_mogrify = render_sql(query_obj) 
             if params:
                 preview_sql_filled = temp_conn_for_preview.cursor().mogrify(query_template_for_mogrify, params).decode(temp_conn_for_preview.encoding or 'utf-8')
                 self.sql_preview.setText(f"-- SQL Preview ({query_type_str} 查询, 带参数预览):\n{preview_sql_filled}\n\n-- Note: Actual execution uses server-side parameter binding.")
@@ -569,8 +990,10 @@ class QueryCohortTab(QWidget):
         
         query_obj, params = self._build_query_parts()
         
-        self.last_query_condition_template, self.last_query_params = self.condition_group.get_condition()
-        if not self.last_query_condition_template and self.condition_group.has_valid_input():
+        # 代码列表模式下建队列的条件直接作用于事件表 (e.icd_code = ANY(...))
+        self.last_query_condition_template, self.last_query_params = self._current_condition("e")
+        self.last_query_codes = dict(self.expanded_codes) if self._is_code_selection_active() else None
+        if not self.last_query_condition_template and self._has_valid_condition():
              pass 
 
         query_type_str = "疾病ICD" if self.current_mode_key == MODE_DISEASE_KEY else "手术/操作ICD"
@@ -579,7 +1002,7 @@ class QueryCohortTab(QWidget):
         
         conn = None
         try:
-            conn = psycopg2.connect(**db_params)
+            conn = connect_database(db_params)
             cur = conn.cursor()
             cur.execute(query_obj, params)
             columns = [desc[0] for desc in cur.description]; rows = cur.fetchall()
@@ -597,20 +1020,21 @@ class QueryCohortTab(QWidget):
             QMessageBox.critical(self, "查询失败", f"无法执行 {query_type_str} 查询: {error}\n{traceback.format_exc()}")
             self.last_query_condition_template = None 
             self.last_query_params = None
+            self.last_query_codes = None
         finally:
             if conn: conn.close()
             self.update_button_states() 
 
-    def _get_source_mode_details(self):
-        # ... (此方法保持不变) ...
-        if self.current_mode_key == MODE_DISEASE_KEY:
+    def _get_source_mode_details(self, mode_key=None):
+        mode_key = mode_key or self.current_mode_key
+        if mode_key == MODE_DISEASE_KEY:
             return {
                 "source_type": MODE_DISEASE_KEY, "event_table": "mimiciv_hosp.diagnoses_icd",
                 "dictionary_table": "mimiciv_hosp.d_icd_diagnoses", "event_icd_col": "icd_code",
                 "dict_icd_col": "icd_code", "dict_title_col": "long_title",
                 "event_seq_num_col": "seq_num", "event_time_col": None
             }
-        elif self.current_mode_key == MODE_PROCEDURE_KEY:
+        elif mode_key == MODE_PROCEDURE_KEY:
             return {
                 "source_type": MODE_PROCEDURE_KEY, "event_table": "mimiciv_hosp.procedures_icd",
                 "dictionary_table": "mimiciv_hosp.d_icd_procedures", "event_icd_col": "icd_code",
@@ -619,6 +1043,71 @@ class QueryCohortTab(QWidget):
             }
         return None
 
+    def schedule_cohort_size_estimate(self):
+        """条件变化后防抖: 停止输入 COHORT_SIZE_ESTIMATE_DEBOUNCE_MS 毫秒后才估计。"""
+        self.size_estimate_generation += 1
+        if not hasattr(self, 'cohort_size_label'): return
+        if not self.get_db_params() or not self._has_valid_condition():
+            self.size_estimate_timer.stop()
+            self.cohort_size_label.setText("队列规模估计: (输入筛选条件后自动估计)")
+            return
+        self.cohort_size_label.setText("队列规模估计: 等待条件输入完成...")
+        self.size_estimate_timer.start()
+
+    def start_cohort_size_estimate(self):
+        if self.size_estimate_thread is not None and self.size_estimate_thread.isRunning():
+            # 正在估计的是旧条件: 在服务端取消，结束后按最新条件重新估计
+            self.size_estimate_pending = True
+            if self.size_estimate_worker: self.size_estimate_worker.cancel()
+            return
+        db_params = self.get_db_params()
+        if not db_params or not self._has_valid_condition(): return
+        condition_sql, condition_params = self._current_condition("e")
+        if not condition_sql or not condition_sql.strip() or condition_sql.strip().lower() in ("true", "1=1"): return
+        self.cohort_size_label.setText("队列规模估计: 正在估计...")
+        self.size_estimate_pending = False
+        self.size_estimate_thread = QThread()
+        self.size_estimate_worker = CohortSizeEstimateWorker(db_params, self.size_estimate_generation, condition_sql,
+                                                             condition_params, self._get_source_mode_details())
+        self.size_estimate_worker.moveToThread(self.size_estimate_thread)
+        self.size_estimate_thread.started.connect(self.size_estimate_worker.run)
+        self.size_estimate_worker.estimate_ready.connect(self.on_cohort_size_estimate_ready)
+        self.size_estimate_worker.finished.connect(self.on_cohort_size_count_finished)
+        self.size_estimate_worker.error.connect(self.on_cohort_size_estimate_error)
+        self.size_estimate_worker.finished.connect(self.size_estimate_thread.quit)
+        self.size_estimate_worker.error.connect(self.size_estimate_thread.quit)
+        self.size_estimate_thread.finished.connect(self._on_cohort_size_thread_finished)
+        self.size_estimate_thread.start()
+
+    def _on_cohort_size_thread_finished(self):
+        if self.size_estimate_worker: self.size_estimate_worker.deleteLater()
+        if self.size_estimate_thread: self.size_estimate_thread.deleteLater()
+        self.size_estimate_worker = None
+        self.size_estimate_thread = None
+        if self.size_estimate_pending:
+            self.start_cohort_size_estimate()
+
+    @Slot(int, int)
+    def on_cohort_size_estimate_ready(self, generation, estimated_rows):
+        if generation != self.size_estimate_generation: return
+        self.cohort_size_label.setText(f"队列规模估计: 约 {estimated_rows} 条匹配事件 (EXPLAIN 估计)，正在精确计数...")
+
+    @Slot(int, dict)
+    def on_cohort_size_count_finished(self, generation, counts):
+        if generation != self.size_estimate_generation: return
+        self.cohort_size_label.setText(
+            f"队列规模: 首次事件入院 {counts['patients']} 名患者 / {counts['patients']} 次入院；"
+            f"所有事件入院 {counts['patients']} 名患者 / {counts['admissions']} 次入院 (匹配事件 {counts['event_rows']} 条)")
+
+    @Slot(int, str)
+    def on_cohort_size_estimate_error(self, generation, error_message):
+        if generation != self.size_estimate_generation: return
+        previous_text = self.cohort_size_label.text()
+        if "EXPLAIN 估计" in previous_text:
+            self.cohort_size_label.setText(previous_text.replace("正在精确计数...", f"精确计数未完成 ({error_message})"))
+        else:
+            self.cohort_size_label.setText(f"队列规模估计失败: {error_message}")
+
     def _generate_cohort_creation_sql_preview(self, target_table_name_str,
                                              condition_sql_template_str, condition_params_list,
                                              admission_cohort_type, source_mode_details):
@@ -634,7 +1123,7 @@ class QueryCohortTab(QWidget):
         event_seq_num_col_ident = psql.Identifier(event_seq_num_col); event_time_col_ident = psql.Identifier(event_time_col) if event_time_col else None
         conn = None
         try:
-            conn = psycopg2.connect(**db_params); cur = conn.cursor()
+            conn = connect_database(db_params); cur = conn.cursor()
             target_ident = psql.Identifier('mimiciv_data', target_table_name_str)
             selected_event_ad_temp_ident = psql.Identifier('selected_event_ad_temp_cohort_q')
             first_icu_stays_temp_ident = psql.Identifier('first_icu_stays_temp_cohort_q')
@@ -649,9 +1138,9 @@ class QueryCohortTab(QWidget):
             elif admission_cohort_type == COHORT_TYPE_ALL_EVENTS_KEY:
                 create_event_temp_sql_obj = psql.SQL("DROP TABLE IF EXISTS {temp_table_ident}; CREATE TEMPORARY TABLE {temp_table_ident} AS ({base_select_preview});").format(temp_table_ident=selected_event_ad_temp_ident, base_select_preview=base_event_select_sql_preview)
             else: return False, f"-- 未知的入院类型: {admission_cohort_type} --"
-            readable_sql1 = cur.mogrify(create_event_temp_sql_obj.as_string(conn), condition_params_list).decode(conn.encoding or 'utf-8')
+            readable_sql1 = cur.mogrify(render_sql(create_event_temp_sql_obj), condition_params_list).decode(conn.encoding or 'utf-8')
             create_first_icu_sql_obj = psql.SQL("DROP TABLE IF EXISTS {temp_table_ident}; CREATE TEMPORARY TABLE {temp_table_ident} AS (SELECT * FROM (SELECT icu.subject_id, icu.hadm_id, icu.stay_id, icu.intime AS icu_intime, icu.outtime AS icu_outtime, EXTRACT(EPOCH FROM (icu.outtime - icu.intime)) / 3600.0 AS los_icu_hours, ROW_NUMBER() OVER (PARTITION BY icu.hadm_id ORDER BY icu.intime ASC, icu.stay_id ASC) AS icu_stay_rank_in_admission FROM mimiciv_icu.icustays icu WHERE EXISTS (SELECT 1 FROM {selected_event_temp_table} seat WHERE seat.hadm_id = icu.hadm_id)) sub WHERE icu_stay_rank_in_admission = 1);").format(temp_table_ident=first_icu_stays_temp_ident, selected_event_temp_table=selected_event_ad_temp_ident)
-            readable_sql2 = create_first_icu_sql_obj.as_string(conn)
+            readable_sql2 = render_sql(create_first_icu_sql_obj)
             target_select_list_preview = [ psql.SQL("evt_ad.subject_id"), psql.SQL("evt_ad.hadm_id"), psql.SQL("evt_ad.admittime"), psql.SQL("adm.dischtime"), psql.SQL("icu.stay_id"), psql.SQL("icu.icu_intime"), psql.SQL("icu.icu_outtime"), psql.SQL("icu.los_icu_hours"), psql.SQL("evt_ad.qualifying_event_code"), psql.SQL("evt_ad.qualifying_event_icd_version"), psql.SQL("CAST({source_literal} AS VARCHAR(20)) AS {col_alias}").format(source_literal=psql.Literal(event_source_type_str), col_alias=psql.Identifier("qualifying_event_source")), psql.SQL("evt_ad.qualifying_event_title"), psql.SQL("evt_ad.qualifying_event_seq_num")]
             if event_time_col_ident: target_select_list_preview.append(psql.SQL("evt_ad.qualifying_event_time"))
             main_diag_join_sql_preview = psql.SQL("")
@@ -659,7 +1148,7 @@ class QueryCohortTab(QWidget):
                 target_select_list_preview.extend([ psql.SQL("primary_dx.icd_code AS primary_diag_code"), psql.SQL("primary_dx.icd_version AS primary_diag_icd_version"), psql.SQL("primary_d_dx.long_title AS primary_diag_title")])
                 main_diag_join_sql_preview = psql.SQL(" LEFT JOIN ( SELECT dx.hadm_id, dx.icd_code, dx.icd_version, dx.seq_num FROM mimiciv_hosp.diagnoses_icd dx WHERE dx.seq_num = 1 ) primary_dx ON evt_ad.hadm_id = primary_dx.hadm_id LEFT JOIN mimiciv_hosp.d_icd_diagnoses primary_d_dx ON primary_dx.icd_code = primary_d_dx.icd_code AND primary_dx.icd_version = primary_d_dx.icd_version ")
             create_target_sql_obj = psql.SQL("DROP TABLE IF EXISTS {target_ident}; CREATE TABLE {target_ident} AS (SELECT {select_cols} FROM {event_ad_temp_table} evt_ad JOIN mimiciv_hosp.admissions adm ON evt_ad.hadm_id = adm.hadm_id LEFT JOIN {icu_temp_table} icu ON evt_ad.hadm_id = icu.hadm_id {main_diag_join});").format(target_ident=target_ident, select_cols=psql.SQL(', ').join(target_select_list_preview), event_ad_temp_table=selected_event_ad_temp_ident, icu_temp_table=first_icu_stays_temp_ident, main_diag_join=main_diag_join_sql_preview)
-            readable_sql3 = create_target_sql_obj.as_string(conn)
+            readable_sql3 = render_sql(create_target_sql_obj)
             index_preview_str = f"-- Followed by CREATE INDEX statements on {target_table_name_str}...\n"; schema_sql_str = "CREATE SCHEMA IF NOT EXISTS mimiciv_data;\n"
             full_preview = (f"-- ===== Cohort Creation SQL Preview =====\n\n-- Cohort Source: {source_mode_details['source_type']}\n-- Admission Type: {self.admission_type_combo.currentText()}\n-- Target Table: {target_table_name_str}\n\n-- Step 0: Ensure schema exists --\n{schema_sql_str}\n-- Step 1: Create temporary table for selected event admissions --\n{readable_sql1}\n\n-- Step 2: Create temporary table for first ICU stays --\n{readable_sql2}\n\n-- Step 3: Create final cohort table '{target_table_name_str}' --\n{readable_sql3}\n\n-- Step 4: Create indexes --\n{index_preview_str}\n-- Step 5: Clean up --\n-- ===================================== --")
             return True, full_preview
@@ -670,25 +1159,14 @@ class QueryCohortTab(QWidget):
 
     def create_cohort_table_with_preview(self): 
         # ... (此方法保持不变) ...
-        if not self.last_query_condition_template or not self.condition_group.has_valid_input() or self.last_query_condition_template.strip() == "" or self.last_query_condition_template.lower() == "true" or self.last_query_condition_template == "1=1":
+        if not self.last_query_condition_template or not self._has_valid_condition() or self.last_query_condition_template.strip() == "" or self.last_query_condition_template.lower() == "true" or self.last_query_condition_template == "1=1":
             QMessageBox.warning(self, "缺少有效查询条件", "请先通过“查询ICD”或“预览查询SQL”生成一个有效的、非空的查询条件。")
             self.sql_preview.setText("-- 无法创建队列：缺少有效的、具体的查询条件。")
             return
         
-        raw_cohort_identifier, ok = self.get_cohort_identifier_name()
-        if not ok or not raw_cohort_identifier:
-            self.sql_preview.setText("-- 队列创建已取消：未提供队列标识符。"); return
-        
-        cleaned_identifier = re.sub(r'[^a-z0-9_]+', '_', raw_cohort_identifier.lower()).strip('_')
-        if not cleaned_identifier or not re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', cleaned_identifier):
-            QMessageBox.warning(self, "名称格式错误", f"队列标识符 '{raw_cohort_identifier}' -> '{cleaned_identifier}' 不符合规则。"); self.sql_preview.setText(f"-- 队列创建失败：标识符 '{cleaned_identifier}' 格式错误。"); return
-        
         selected_admission_type_key = self.admission_type_combo.currentData()
-        table_prefix = "first_" if selected_admission_type_key == COHORT_TYPE_FIRST_EVENT_KEY else "all_"
-        source_prefix = "dis_" if self.current_mode_key == MODE_DISEASE_KEY else "proc_"
-        target_table_name_str = f"{table_prefix}{source_prefix}{cleaned_identifier}_admissions"
-        if len(target_table_name_str) > 63:
-             QMessageBox.warning(self, "名称过长", f"生成的表名 '{target_table_name_str}' 过长。请缩短队列标识符。"); self.sql_preview.setText(f"-- 队列创建失败：表名 '{target_table_name_str}' 过长。"); return
+        target_table_name_str = self._ask_target_table_name(selected_admission_type_key)
+        if not target_table_name_str: return
         
         db_params = self.get_db_params()
         if not db_params: QMessageBox.warning(self, "未连接", "请先连接数据库"); self.sql_preview.setText("-- 队列创建失败：数据库未连接。"); return
@@ -717,41 +1195,35 @@ class QueryCohortTab(QWidget):
             return
         
         self.prepare_for_cohort_creation(True)
-        self.cohort_worker = CohortCreationWorker(db_params, target_table_name_str, 
-                                                self.last_query_condition_template, self.last_query_params, 
-                                                selected_admission_type_key, current_source_mode_details)
-        self.cohort_worker_thread = QThread()
-        self.cohort_worker.moveToThread(self.cohort_worker_thread)
-        self.cohort_worker_thread.started.connect(self.cohort_worker.run)
-        self.cohort_worker.finished.connect(self.on_cohort_creation_finished)
-        self.cohort_worker.error.connect(self.on_cohort_creation_error)
-        self.cohort_worker.progress.connect(self.update_cohort_creation_progress)
-        self.cohort_worker.log.connect(self.update_cohort_creation_log)
-        
-        self.cohort_worker.finished.connect(self.cohort_worker_thread.quit)
-        self.cohort_worker.error.connect(self.cohort_worker_thread.quit)
-        self.cohort_worker_thread.finished.connect(self.cohort_worker_thread.deleteLater)
-        self.cohort_worker.finished.connect(lambda: setattr(self, 'cohort_worker', None)) 
-        self.cohort_worker.error.connect(lambda: setattr(self, 'cohort_worker', None)) 
-        self.cohort_worker_thread.start()
-
-    @Slot(str, int)
-    def on_cohort_creation_finished(self, table_name, count):
-        # ... (此方法保持不变) ...
-        self.update_cohort_creation_log(f"队列数据表 {table_name} 创建成功，包含 {count} 条记录。")
+        worker = CohortCreationWorker(db_params, target_table_name_str,
+                                      self.last_query_condition_template, self.last_query_params,
+                                      selected_admission_type_key, current_source_mode_details,
+                                      self.get_job_timeouts(), self.get_tuning_profile(),
+                                      essential_indexes_only=self.cb_essential_indexes_only.isChecked())
+        self._submit_cohort_job(worker, target_table_name_str, db_params, "cohort_creation", [target_table_name_str],
+                                self.on_cohort_creation_finished)
+
+    def _submit_cohort_job(self, worker, title, db_params, job_type, table_names, on_finished):
+        self.current_job_id = self.job_scheduler.submit(
+            worker, title, self.JOB_OWNER, db_params, job_type,
+            exclusive_keys=[f"mimiciv_data.{name}" for name in table_names],
+            on_finished=on_finished, on_error=self.on_cohort_creation_error,
+            on_progress=self.update_cohort_creation_progress,
+            on_log=lambda j, message: self.update_cohort_creation_log(f"[任务 {j}] {message}"))
+
+    def on_cohort_creation_finished(self, job_id, table_name, count):
+        self.update_cohort_creation_log(f"[任务 {job_id}] 队列数据表 {table_name} 创建成功，包含 {count} 条记录。")
+        self.prepare_for_cohort_creation(False, job_id)
         QMessageBox.information(self, "创建成功", f"队列数据表 {table_name} 创建成功，包含 {count} 条记录。")
-        self.prepare_for_cohort_creation(False)
         self.preview_created_cohort_table('mimiciv_data', table_name)
 
-    @Slot(str)
-    def on_cohort_creation_error(self, error_message):
-        # ... (此方法保持不变) ...
-        self.update_cohort_creation_log(f"队列创建失败: {error_message}")
+    def on_cohort_creation_error(self, job_id, error_message):
+        self.update_cohort_creation_log(f"[任务 {job_id}] 队列创建失败: {error_message}")
+        self.prepare_for_cohort_creation(False, job_id)
         if "操作已取消" not in error_message:
             QMessageBox.critical(self, "创建失败", f"无法创建队列数据表: {error_message}")
         else: 
             QMessageBox.information(self, "操作取消", "队列创建操作已取消。")
-        self.prepare_for_cohort_creation(False)
 
     def preview_created_cohort_table(self, schema_name, table_name): 
         # ... (此方法保持不变) ...
@@ -759,11 +1231,11 @@ class QueryCohortTab(QWidget):
         if not db_params: QMessageBox.warning(self, "预览失败", "数据库未连接。"); return
         conn = None
         try:
-            conn = psycopg2.connect(**db_params)
+            conn = connect_database(db_params)
             cur = conn.cursor()
             table_identifier = psql.Identifier(schema_name, table_name)
             preview_query = psql.SQL("SELECT * FROM {} ORDER BY subject_id, hadm_id LIMIT 100;").format(table_identifier)
-            self.sql_preview.append(f"\n-- 队列表预览SQL:\n{preview_query.as_string(conn)}")
+            self.sql_preview.append(f"\n-- 队列表预览SQL:\n{render_sql(preview_query)}")
             cur.execute(preview_query)
             columns = [desc[0] for desc in cur.description]; rows = cur.fetchall()
             self.result_table.setRowCount(0); self.result_table.setColumnCount(len(columns))
@@ -782,6 +1254,115 @@ class QueryCohortTab(QWidget):
             if conn: conn.close()
 
 
+    def _ask_target_table_name(self, admission_type_key):
+        """询问队列标识符并生成目标表名 (first_/all_ + dis_/proc_ + 标识符 + _admissions)；取消或无效时返回 None。"""
+        raw_cohort_identifier, ok = self.get_cohort_identifier_name()
+        if not ok or not raw_cohort_identifier:
+            self.sql_preview.setText("-- 队列创建已取消：未提供队列标识符。"); return None
+        
+        cleaned_identifier = re.sub(r'[^a-z0-9_]+', '_', raw_cohort_identifier.lower()).strip('_')
+        if not cleaned_identifier or not re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', cleaned_identifier):
+            QMessageBox.warning(self, "名称格式错误", f"队列标识符 '{raw_cohort_identifier}' -> '{cleaned_identifier}' 不符合规则。"); self.sql_preview.setText(f"-- 队列创建失败：标识符 '{cleaned_identifier}' 格式错误。"); return None
+        
+        table_prefix = "first_" if admission_type_key == COHORT_TYPE_FIRST_EVENT_KEY else "all_"
+        source_prefix = "dis_" if self.current_mode_key == MODE_DISEASE_KEY else "proc_"
+        target_table_name_str = f"{table_prefix}{source_prefix}{cleaned_identifier}_admissions"
+        if len(target_table_name_str) > 63:
+             QMessageBox.warning(self, "名称过长", f"生成的表名 '{target_table_name_str}' 过长。请缩短队列标识符。"); self.sql_preview.setText(f"-- 队列创建失败：表名 '{target_table_name_str}' 过长。"); return None
+        return target_table_name_str
+
+    # --- 批量创建 ---
+    def _refresh_batch_list_widget(self):
+        self.batch_list_widget.clear()
+        for spec in self.batch_cohort_specs:
+            source_text = "疾病" if spec["source_type"] == MODE_DISEASE_KEY else "手术/操作"
+            type_text = "首次" if spec["admission_type"] == COHORT_TYPE_FIRST_EVENT_KEY else "所有"
+            self.batch_list_widget.addItem(f"{spec['table_name']}  [{source_text}, {type_text}]  {spec['condition_sql']}")
+        self.update_button_states()
+
+    def add_current_condition_to_batch(self):
+        if not self._can_create_table_check():
+            QMessageBox.warning(self, "缺少有效查询条件", "请先通过“查询ICD”生成一个有效的、非空的查询条件。"); return
+        if self.batch_cohort_specs and self.batch_cohort_specs[0]["source_type"] != self.current_mode_key:
+            QMessageBox.warning(self, "来源不一致", "批量列表中的队列必须来自同一种筛选模式 (疾病或手术/操作)，才能共用一次扫描。"); return
+        admission_type_key = self.admission_type_combo.currentData()
+        target_table_name_str = self._ask_target_table_name(admission_type_key)
+        if not target_table_name_str: return
+        if any(spec["table_name"] == target_table_name_str for spec in self.batch_cohort_specs):
+            QMessageBox.warning(self, "名称重复", f"批量列表中已有表 '{target_table_name_str}'。"); return
+        condition_sql, condition_params = self.last_query_condition_template, list(self.last_query_params or [])
+        if self.last_query_codes:
+            # 批量创建时条件用于在字典表 (dd) 上为代码打标签
+            condition_sql, condition_params = build_code_list_condition(self.last_query_codes, "dd")
+        self.batch_cohort_specs.append({
+            "table_name": target_table_name_str,
+            "condition_sql": condition_sql,
+            "condition_params": condition_params,
+            "admission_type": admission_type_key,
+            "source_type": self.current_mode_key,
+        })
+        self._refresh_batch_list_widget()
+
+    def remove_selected_from_batch(self):
+        rows = sorted({self.batch_list_widget.row(item) for item in self.batch_list_widget.selectedItems()}, reverse=True)
+        for row in rows:
+            del self.batch_cohort_specs[row]
+        self._refresh_batch_list_widget()
+
+    def save_batch_list(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "导出批量队列列表", "cohort_batch.json", "JSON 文件 (*.json)")
+        if not file_path: return
+        try:
+            with open(file_path, "w", encoding="utf-8") as f:
+                json.dump(self.batch_cohort_specs, f, ensure_ascii=False, indent=2)
+        except (OSError, TypeError) as e:
+            QMessageBox.critical(self, "导出失败", f"无法写入文件: {e}")
+
+    def load_batch_list(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "导入批量队列列表", "", "JSON 文件 (*.json)")
+        if not file_path: return
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                loaded_specs = json.load(f)
+            required_keys = {"table_name", "condition_sql", "condition_params", "admission_type", "source_type"}
+            if not isinstance(loaded_specs, list) or not all(isinstance(spec, dict) and required_keys <= set(spec) for spec in loaded_specs):
+                raise ValueError("文件格式不正确，应为包含 " + ", ".join(sorted(required_keys)) + " 的对象列表。")
+            if len({spec["source_type"] for spec in loaded_specs}) > 1:
+                raise ValueError("列表中的队列必须来自同一种筛选模式。")
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "导入失败", f"无法读取批量列表: {e}"); return
+        self.batch_cohort_specs = loaded_specs
+        self._refresh_batch_list_widget()
+
+    def create_batch_cohort_tables(self):
+        db_params = self.get_db_params()
+        if not db_params: QMessageBox.warning(self, "未连接", "请先连接数据库"); return
+        if not self.batch_cohort_specs: return
+        source_mode_details = self._get_source_mode_details(self.batch_cohort_specs[0]["source_type"])
+        steps, err = build_batch_cohort_sql(self.batch_cohort_specs, source_mode_details)
+        if err:
+            QMessageBox.warning(self, "批量列表无效", err); return
+        table_names = "\n".join(spec["table_name"] for spec in self.batch_cohort_specs)
+        reply = QMessageBox.question(self, '确认批量创建队列',
+                                     f"将对事件表只扫描一次，创建以下 {len(self.batch_cohort_specs)} 个队列数据表 (已存在的同名表会被替换):\n{table_names}\n\n确定要继续吗?",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                                     QMessageBox.StandardButton.No)
+        if reply == QMessageBox.StandardButton.No: return
+
+        self.prepare_for_cohort_creation(True)
+        specs = [dict(spec) for spec in self.batch_cohort_specs]
+        worker = BatchCohortCreationWorker(db_params, specs, source_mode_details, self.get_job_timeouts(),
+                                           self.get_tuning_profile(),
+                                           essential_indexes_only=self.cb_essential_indexes_only.isChecked())
+        self._submit_cohort_job(worker, f"批量创建 {len(specs)} 个队列", db_params, "batch_cohort_creation",
+                                [spec["table_name"] for spec in specs], self.on_batch_cohort_creation_finished)
+
+    def on_batch_cohort_creation_finished(self, job_id, results):
+        summary = "\n".join(f"{table_name}: {count} 条记录" for table_name, count in results)
+        self.update_cohort_creation_log(f"[任务 {job_id}] 批量创建完成:\n{summary}")
+        self.prepare_for_cohort_creation(False, job_id)
+        QMessageBox.information(self, "批量创建成功", f"已创建 {len(results)} 个队列数据表:\n{summary}")
+
     def get_cohort_identifier_name(self): 
         # ... (此方法保持不变) ...
         dialog = QDialog(self); dialog.setWindowTitle("输入队列基础标识符")
@@ -796,10 +1377,13 @@ class QueryCohortTab(QWidget):
 
     def closeEvent(self, event): 
         # ... (此方法保持不变) ...
-        if self.cohort_worker_thread and self.cohort_worker_thread.isRunning():
-            if self.cohort_worker: self.cohort_worker.cancel()
-            self.cohort_worker_thread.quit()
-            if not self.cohort_worker_thread.wait(1000): print("Warning: Cohort creation thread did not quit in time.")
+        # 队列创建任务由任务队列 (JobScheduler.shutdown) 统一停止；规模估计是交互式查询，仍由本页自行管理
+        self.size_estimate_timer.stop()
+        if self.size_estimate_thread and self.size_estimate_thread.isRunning():
+            self.size_estimate_pending = False
+            if self.size_estimate_worker: self.size_estimate_worker.cancel()
+            self.size_estimate_thread.quit()
+            self.size_estimate_thread.wait(1000)
         super().closeEvent(event)
 
 # --- END OF FILE tab_query_cohort.py ---
\ No newline at end of file
@@ -4,11 +4,10 @@ from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton, Q
                           QTextEdit, QComboBox, QGroupBox,
                           QRadioButton, QButtonGroup, QStackedWidget,
                           QLineEdit, QProgressBar, QAbstractItemView, QApplication,
-                          QScrollArea,QSizePolicy)
-from PySide6.QtCore import Qt, Signal, Slot, QObject, QThread, QTimer
+                          QScrollArea,QSizePolicy, QCheckBox, QSpinBox)
+from PySide6.QtCore import Qt, Signal, Slot, QObject, QTimer
 from typing import Optional
 
-import psycopg2
 import psycopg2.sql as pgsql
 import re
 import pandas as pd
@@ -23,61 +22,135 @@ from source_panels.medication_panel import MedicationConfigPanel
 from source_panels.procedure_panel import ProcedureConfigPanel
 from source_panels.diagnosis_panel import DiagnosisConfigPanel
 from sql_logic.sql_builder_special import build_special_data_sql
+from sql_logic.time_window import time_window_name_code
+from sql_logic.feature_store import STORAGE_MODE_WIDE, STORAGE_MODE_NARROW
+from sql_logic.sql_render import render_sql, quote_literal
+from sql_logic.chunked_update import run_chunked_job
+from sql_logic.column_provenance import check_stale_features, record_provenance, compute_feature_config_hash
+from sql_logic.job_history import (JobJournal, JournaledConnection, JOB_OUTCOME_SUCCESS,
+                                   JOB_OUTCOME_CANCELLED, JOB_OUTCOME_FAILED)
+from sql_logic.db_backend import connect_database, backend_of, BACKEND_DUCKDB, DATABASE_ERRORS
+from sql_logic.job_control import (apply_job_timeouts, apply_session_tuning, describe_tuning_profile, cancel_backend_query,
+                                   describe_query_canceled, QueryCanceledError)
+from sql_logic.replica_router import ReplicaRouter
+from ui_components.job_scheduler import JobScheduler
 from utils import sanitize_name_part, validate_column_name
-from app_config import SQL_BUILDER_DUMMY_DB_FOR_AS_STRING
+from app_config import TIME_BINNING_ANCHORS, TIME_BINNING_LAYOUTS, DEFAULT_UPDATE_CHUNK_SIZE, PREVIEW_TUNING_PROFILE
 
 class MergeSQLWorker(QObject):
     finished = Signal()
     error = Signal(str)
     progress = Signal(int, int)
     log = Signal(str)
-    def __init__(self, db_params, execution_steps, target_table_name, new_cols_description_str):
+    def __init__(self, db_params, execution_steps, target_table_name, new_cols_description_str, job_timeouts=None, chunk_size=None,
+                 provenance_columns=None, skip_if_fresh=False, replica_settings=None, tuning_profile=None):
         super().__init__()
         self.db_params = db_params
         self.execution_steps = execution_steps
         self.target_table_name = target_table_name
         self.new_cols_description_str = new_cols_description_str
+        self.job_timeouts = job_timeouts
+        self.chunk_size = chunk_size # None: 整个任务一个事务；否则 UPDATE 按 hadm_id 分块提交
+        self.provenance_columns = provenance_columns # 写入队列表的列；None 表示不记录来源 (如时间分箱输出新表)
+        self.skip_if_fresh = skip_if_fresh
+        self.replica_settings = replica_settings # 只读副本: 临时表的只读计算可路由到副本
+        self.tuning_profile = tuning_profile # 会话调优配置 (work_mem、并行、JIT)，整个任务连接使用
         self.is_cancelled = False
         self.current_sql_for_debug = ""
-    def cancel(self): self.log.emit("合并操作被请求取消..."); self.is_cancelled = True
+        self.conn = None
+        self.router = None
+    def cancel(self):
+        self.log.emit("合并操作被请求取消..."); self.is_cancelled = True
+        if cancel_backend_query(self.conn): self.log.emit("已请求服务器取消正在执行的语句。")
+        if self.router and self.router.cancel(): self.log.emit("已请求只读副本取消正在执行的语句。")
     def run(self):
         conn_merge = None
+        journal = None
         total_actual_steps = len(self.execution_steps)
         current_step_num = 0
         self.log.emit(f"开始为表 '{self.target_table_name}' 添加/更新列 (基于: {self.new_cols_description_str})，共 {total_actual_steps} 个数据库步骤...")
         self.progress.emit(current_step_num, total_actual_steps)
         try:
-            self.log.emit("连接数据库..."); conn_merge = psycopg2.connect(**self.db_params); conn_merge.autocommit = False; cur = conn_merge.cursor(); self.log.emit("数据库已连接。")
+            self.log.emit("连接数据库..."); conn_merge = connect_database(self.db_params, connection_factory=JournaledConnection); self.conn = conn_merge; conn_merge.autocommit = False; cur = conn_merge.cursor()
+            statement_texts = [cur.mogrify(sql_obj_or_str, params_for_step if params_for_step else None).decode('utf-8')
+                               for sql_obj_or_str, params_for_step in self.execution_steps]
+            journal = JobJournal("special_data_merge", self.target_table_name, self.new_cols_description_str, statement_texts,
+                                 tuning_profile=self.tuning_profile)
+            journal.attach(conn_merge)
+            apply_job_timeouts(cur, self.job_timeouts); self.log.emit("数据库已连接。")
+            # 会话级设置: 不受来源检查与分块执行中间提交的影响，连接关闭即失效
+            apply_session_tuning(cur, self.tuning_profile)
+            if self.tuning_profile: self.log.emit(f"会话调优: {describe_tuning_profile(self.tuning_profile)}")
+            self.router = ReplicaRouter.from_settings(self.replica_settings, f"mimiciv_data.{self.target_table_name}",
+                                                      self.job_timeouts, self.log.emit, self.tuning_profile)
+            config_hash = compute_feature_config_hash(statement_texts)
+            cohort_version = None
+            if self.provenance_columns:
+                cohort_version, stale = check_stale_features(conn_merge, 'mimiciv_data', self.target_table_name,
+                                                             [(self.new_cols_description_str, self.provenance_columns, config_hash)])
+                if self.skip_if_fresh and not stale:
+                    self.log.emit(f"列 {', '.join(self.provenance_columns)} 已由相同配置在当前队列行集上计算过，跳过重新计算。")
+                    self.progress.emit(total_actual_steps, total_actual_steps)
+                    journal.finish(JOB_OUTCOME_SUCCESS)
+                    self.finished.emit()
+                    return
+            if self.chunk_size:
+                run_chunked_job(conn_merge, statement_texts, 'mimiciv_data', self.target_table_name, self.chunk_size,
+                                self.log.emit, self.progress.emit, lambda: self.is_cancelled, self.router)
+                if cohort_version:
+                    record_provenance(cur, 'mimiciv_data', self.target_table_name, self.provenance_columns,
+                                      self.new_cols_description_str, config_hash, cohort_version)
+                    conn_merge.commit()
+                journal.finish(JOB_OUTCOME_SUCCESS, pg_conn=conn_merge)
+                self.finished.emit()
+                return
             for i, (sql_obj_or_str, params_for_step) in enumerate(self.execution_steps):
                 current_step_num += 1; step_description = f"执行数据库步骤 {current_step_num}/{total_actual_steps}"
                 sql_str_for_log_peek = ""; self.current_sql_for_debug = ""
                 if isinstance(sql_obj_or_str, (pgsql.Composed, pgsql.SQL)):
-                    try: self.current_sql_for_debug = sql_obj_or_str.as_string(conn_merge.cursor()); sql_str_for_log_peek = self.current_sql_for_debug[:200].split('\n')[0]
+                    try: self.current_sql_for_debug = render_sql(sql_obj_or_str); sql_str_for_log_peek = self.current_sql_for_debug[:200].split('\n')[0]
                     except Exception as e_as_string: self.log.emit(f"DEBUG: Error getting SQL as_string: {e_as_string}"); sql_str_for_log_peek = str(sql_obj_or_str)[:100].split('\n')[0]; self.current_sql_for_debug = str(sql_obj_or_str)
                 else: self.current_sql_for_debug = sql_obj_or_str; sql_str_for_log_peek = sql_obj_or_str[:100].split('\n')[0]
                 if "ALTER TABLE" in sql_str_for_log_peek.upper(): step_description += " (ALTER)"
                 elif "CREATE TEMPORARY TABLE" in sql_str_for_log_peek.upper(): step_description += " (CREATE TEMP)"
                 elif "UPDATE" in sql_str_for_log_peek.upper(): step_description += " (UPDATE)"
                 elif "DROP TABLE" in sql_str_for_log_peek.upper(): step_description += " (DROP TEMP)"
+                elif sql_str_for_log_peek.upper().startswith("ANALYZE"): step_description += " (ANALYZE)"
                 self.log.emit(f"{step_description}: {sql_str_for_log_peek}...");
                 if self.is_cancelled: raise InterruptedError("操作在执行步骤前被取消。")
-                start_time = time.time(); cur.execute(sql_obj_or_str, params_for_step if params_for_step else None); end_time = time.time()
+                start_time = time.time()
+                if not (self.router and self.router.try_materialize(cur, sql_obj_or_str, params_for_step if params_for_step else None)):
+                    cur.execute(sql_obj_or_str, params_for_step if params_for_step else None)
+                end_time = time.time()
                 self.log.emit(f"步骤 {current_step_num} 执行成功 (耗时: {end_time - start_time:.2f} 秒)。"); self.progress.emit(current_step_num, total_actual_steps)
             if self.is_cancelled: raise InterruptedError("操作在提交前被取消，正在回滚...")
+            if cohort_version:
+                record_provenance(cur, 'mimiciv_data', self.target_table_name, self.provenance_columns,
+                                  self.new_cols_description_str, config_hash, cohort_version)
             self.log.emit("所有数据库步骤完成，正在提交事务..."); start_commit_time = time.time(); conn_merge.commit(); end_commit_time = time.time(); self.log.emit(f"事务提交成功 (耗时: {end_commit_time - start_commit_time:.2f} 秒)。")
+            journal.finish(JOB_OUTCOME_SUCCESS, pg_conn=conn_merge)
             self.finished.emit()
         except InterruptedError as ie:
             if conn_merge and not conn_merge.closed: conn_merge.rollback()
+            if journal: journal.finish(JOB_OUTCOME_CANCELLED)
             self.log.emit(f"操作已取消: {str(ie)}"); self.error.emit("操作已取消")
-        except psycopg2.Error as db_err:
+        except QueryCanceledError as qc_err:
+            if conn_merge and not conn_merge.closed: conn_merge.rollback()
+            err_msg = describe_query_canceled(qc_err, self.is_cancelled)
+            if journal: journal.finish(JOB_OUTCOME_CANCELLED if self.is_cancelled else JOB_OUTCOME_FAILED, err_msg)
+            self.log.emit(f"{err_msg}\n相关SQL (完整): {self.current_sql_for_debug}"); self.error.emit(err_msg)
+        except DATABASE_ERRORS as db_err:
             if conn_merge and not conn_merge.closed: conn_merge.rollback()
             err_msg = f"数据库错误: {db_err}\n相关SQL (完整): {self.current_sql_for_debug}"
+            if journal: journal.finish(JOB_OUTCOME_FAILED, str(db_err))
             self.log.emit(err_msg); self.log.emit(f"Traceback: {traceback.format_exc()}"); self.error.emit(err_msg)
         except Exception as e:
             if conn_merge and not conn_merge.closed: conn_merge.rollback()
             err_msg = f"发生意外错误: {e}\n相关SQL (完整): {self.current_sql_for_debug}"
+            if journal: journal.finish(JOB_OUTCOME_FAILED, str(e))
             self.log.emit(err_msg); self.log.emit(f"Traceback: {traceback.format_exc()}"); self.error.emit(err_msg)
         finally:
+            if self.router: self.router.close()
             if conn_merge and not conn_merge.closed: self.log.emit("关闭数据库连接。"); conn_merge.close()
 
 
@@ -87,12 +160,19 @@ class SpecialDataMasterTab(QWidget):
     SOURCE_LABEVENTS = 1; SOURCE_MEDICATIONS = 2; SOURCE_PROCEDURES = 3
     SOURCE_DIAGNOSES = 4; SOURCE_CHARTEVENTS = 5
 
-    def __init__(self, get_db_params_func, parent=None):
+    JOB_OWNER = "添加专项数据"
+
+    def __init__(self, get_db_params_func, get_job_timeouts_func=None, get_replica_settings_func=None,
+                 get_tuning_profile_func=None, job_scheduler=None, parent=None):
         super().__init__(parent)
         self.get_db_params = get_db_params_func
+        self.get_job_timeouts = get_job_timeouts_func or (lambda: None)
+        self.get_replica_settings = get_replica_settings_func or (lambda: None)
+        self.get_tuning_profile = get_tuning_profile_func or (lambda: None)
         self.selected_cohort_table = None
-        self.worker_thread = None
-        self.merge_worker = None
+        self.job_scheduler = job_scheduler or JobScheduler(self)
+        self.current_job_id = None # 进度条显示最近提交的任务
+        self.job_contexts = {} # job_id -> {"cohort_table", "output_table", "description"}
         self.config_panels: dict[int, BaseSourceConfigPanel] = {}
         self.user_manually_edited_col_name = False
         self.init_ui()
@@ -150,6 +230,30 @@ class SpecialDataMasterTab(QWidget):
         self.new_column_name_input.editingFinished.connect(self._on_new_column_name_editing_finished)
         column_name_layout.addWidget(self.new_column_name_input, 1)
         content_layout.addWidget(column_name_group)
+        binning_group = QGroupBox("4. 输出方式 (可选)")
+        binning_layout = QGridLayout(binning_group)
+        self.cb_time_binning = QCheckBox("按固定时间分箱输出到新表 (不修改队列表，仅数值来源)")
+        self.cb_time_binning.toggled.connect(self._on_time_binning_toggled)
+        binning_layout.addWidget(self.cb_time_binning, 0, 0, 1, 4)
+        binning_layout.addWidget(QLabel("锚点:"), 1, 0)
+        self.bin_anchor_combo = QComboBox()
+        for display, key in TIME_BINNING_ANCHORS: self.bin_anchor_combo.addItem(display, key)
+        binning_layout.addWidget(self.bin_anchor_combo, 1, 1)
+        binning_layout.addWidget(QLabel("分箱宽度 (分钟):"), 1, 2)
+        self.bin_width_spin = QSpinBox(); self.bin_width_spin.setRange(1, 1440); self.bin_width_spin.setValue(60)
+        binning_layout.addWidget(self.bin_width_spin, 1, 3)
+        binning_layout.addWidget(QLabel("窗口开始 (小时):"), 2, 0)
+        self.bin_window_start_spin = QSpinBox(); self.bin_window_start_spin.setRange(-720, 720); self.bin_window_start_spin.setValue(0)
+        binning_layout.addWidget(self.bin_window_start_spin, 2, 1)
+        binning_layout.addWidget(QLabel("窗口结束 (小时):"), 2, 2)
+        self.bin_window_end_spin = QSpinBox(); self.bin_window_end_spin.setRange(-720, 720); self.bin_window_end_spin.setValue(48)
+        binning_layout.addWidget(self.bin_window_end_spin, 2, 3)
+        binning_layout.addWidget(QLabel("输出布局:"), 3, 0)
+        self.bin_layout_combo = QComboBox()
+        for display, key in TIME_BINNING_LAYOUTS: self.bin_layout_combo.addItem(display, key)
+        binning_layout.addWidget(self.bin_layout_combo, 3, 1, 1, 3)
+        self._on_time_binning_toggled(False)
+        content_layout.addWidget(binning_group)
         self.execution_status_group = QGroupBox("合并执行状态")
         execution_status_layout = QVBoxLayout(self.execution_status_group)
         self.execution_progress = QProgressBar(); self.execution_progress.setRange(0,4); self.execution_progress.setValue(0)
@@ -158,6 +262,26 @@ class SpecialDataMasterTab(QWidget):
         execution_status_layout.addWidget(self.execution_log)
         self.execution_status_group.setVisible(False)
         content_layout.addWidget(self.execution_status_group)
+        chunk_layout = QHBoxLayout()
+        self.cb_chunked_update = QCheckBox("分块执行 UPDATE (按 hadm_id 分块提交，中断后再次执行可从断点继续)")
+        chunk_layout.addWidget(self.cb_chunked_update)
+        chunk_layout.addWidget(QLabel("每块 hadm_id 数:"))
+        self.chunk_size_spin = QSpinBox(); self.chunk_size_spin.setRange(100, 1000000); self.chunk_size_spin.setSingleStep(1000)
+        self.chunk_size_spin.setValue(DEFAULT_UPDATE_CHUNK_SIZE)
+        chunk_layout.addWidget(self.chunk_size_spin); chunk_layout.addStretch()
+        content_layout.addLayout(chunk_layout)
+        self.cb_skip_fresh = QCheckBox("跳过已是最新的列 (配置与队列行集均未变化时不重新计算)")
+        self.cb_skip_fresh.setChecked(True)
+        content_layout.addWidget(self.cb_skip_fresh)
+        storage_layout = QHBoxLayout()
+        storage_layout.addWidget(QLabel("结果存储方式:"))
+        self.storage_mode_combo = QComboBox()
+        self.storage_mode_combo.addItem("宽表: 作为新列添加到队列表", STORAGE_MODE_WIDE)
+        self.storage_mode_combo.addItem("窄表: 追加写入特征库 feature_store (导出时转为宽表)", STORAGE_MODE_NARROW)
+        self.storage_mode_combo.currentIndexChanged.connect(self._update_write_options_state)
+        storage_layout.addWidget(self.storage_mode_combo); storage_layout.addStretch()
+        content_layout.addLayout(storage_layout)
+        self._update_write_options_state()
         action_layout = QHBoxLayout()
         self.preview_merge_btn = QPushButton("预览待合并数据"); self.preview_merge_btn.clicked.connect(self.preview_merge_data); self.preview_merge_btn.setEnabled(False)
         action_layout.addWidget(self.preview_merge_btn)
@@ -194,6 +318,35 @@ class SpecialDataMasterTab(QWidget):
             self.config_panel_stack.addWidget(panel)
             self.config_panels[source_id] = panel
 
+    @Slot(bool)
+    def _on_time_binning_toggled(self, checked):
+        for w in (self.bin_anchor_combo, self.bin_width_spin, self.bin_window_start_spin,
+                  self.bin_window_end_spin, self.bin_layout_combo):
+            w.setEnabled(checked)
+        if hasattr(self, 'storage_mode_combo'):
+            self._update_write_options_state()
+
+    def _update_write_options_state(self, index=None):
+        # 分块 UPDATE 与跳过未过期列只适用于宽表模式 (分箱模式整表重建输出表，窄表模式追加写入特征库)
+        in_place_update = self.storage_mode_combo.currentData() != STORAGE_MODE_NARROW and not self.cb_time_binning.isChecked()
+        for widget in (self.cb_chunked_update, self.chunk_size_spin, self.cb_skip_fresh):
+            widget.setEnabled(in_place_update)
+
+    def _is_time_binning_active(self, active_panel=None) -> bool:
+        # 分箱只适用于数值聚合类面板 (有 value_agg_widget 的面板)
+        if active_panel is None:
+            active_panel = self.config_panels.get(self.source_selection_group.checkedId())
+        return self.cb_time_binning.isChecked() and hasattr(active_panel, 'value_agg_widget')
+
+    def _get_time_binning_config(self) -> dict:
+        return {
+            "anchor_column": self.bin_anchor_combo.currentData(),
+            "bin_width_minutes": self.bin_width_spin.value(),
+            "window_start_hours": self.bin_window_start_spin.value(),
+            "window_end_hours": self.bin_window_end_spin.value(),
+            "layout": self.bin_layout_combo.currentData(),
+        }
+
     def _update_active_panel(self, force_col_name_update=False):
         current_id = self.source_selection_group.checkedId()
         active_panel = self.config_panels.get(current_id)
@@ -201,6 +354,8 @@ class SpecialDataMasterTab(QWidget):
             self.config_panel_stack.setCurrentWidget(active_panel)
             if hasattr(active_panel, 'populate_panel_if_needed'):
                 active_panel.populate_panel_if_needed()
+            if hasattr(active_panel, 'load_condition_field_types'):
+                active_panel.load_condition_field_types()
             QTimer.singleShot(0, lambda: self._finish_update_active_panel(active_panel, force_col_name_update))
         else:
             self.search_field_hint_label.setText("请选择一个数据来源。")
@@ -282,7 +437,11 @@ class SpecialDataMasterTab(QWidget):
         parts.append(item_name_part)
         time_code = ""
         time_window_text_from_config = panel_config.get("time_window_text")
-        if time_window_text_from_config:
+        if len(panel_config.get("time_windows") or []) > 1:
+            pass # 多窗口提取时，窗口代码由 builder 追加到每一列的末尾
+        elif panel_config.get("time_window_spec"):
+            time_code = time_window_name_code(panel_config["time_window_spec"])
+        elif time_window_text_from_config:
             time_map = {
                 "ICU入住后24小时": "icu24h", "ICU入住后48小时": "icu48h",
                 "整个ICU期间": "icuall", "整个住院期间": "hospall",
@@ -349,39 +508,41 @@ class SpecialDataMasterTab(QWidget):
         if not panel_config_dict:
             panel_name = active_panel.__class__.__name__
             return None, f"来自 {panel_name} 的配置不完整或无效，无法构建查询。", [], []
+        if self._is_time_binning_active(active_panel):
+            panel_config_dict = dict(panel_config_dict, time_binning=self._get_time_binning_config())
+        elif backend_of(self.get_db_params()) == BACKEND_DUCKDB and (panel_config_dict.get("aggregation_methods") or {}).get("TIMESERIES_JSON"):
+            # JSONB_AGG 的有序聚合在 DuckDB 中没有等价物 (见 sql_logic/db_backend.py)
+            return None, "本地 DuckDB 后端不支持 TIMESERIES_JSON 聚合，请改用 TIMESERIES_ARRAY。", [], []
         try:
             return build_special_data_sql(
                 target_cohort_table_name=f"mimiciv_data.{self.selected_cohort_table}",
                 base_new_column_name=base_new_col_name,
                 panel_specific_config=panel_config_dict,
                 for_execution=for_execution,
-                preview_limit=preview_limit
+                preview_limit=preview_limit,
+                storage_mode=self.storage_mode_combo.currentData()
             )
         except Exception as e:
             error_msg = f"构建SQL时发生内部错误: {str(e)}\n详细信息:\n{traceback.format_exc()}"
             return None, error_msg, [], []
 
-    def prepare_for_long_operation(self, starting=True):
-        is_enabled = not starting
+    def prepare_for_long_operation(self, starting=True, finished_job_id=None):
+        # 任务在任务队列中执行，配置区保持可用，可继续为其他队列表/特征提交任务
         if starting:
             self.execution_status_group.setVisible(True)
             self.execution_progress.setValue(0)
-            self.execution_log.clear()
-            self.update_execution_log("开始执行合并操作...")
-        self.table_combo.setEnabled(is_enabled)
-        self.refresh_btn.setEnabled(is_enabled and bool(self.get_db_params()))
-        for rb_button in self.source_selection_group.buttons():
-            rb_button.setEnabled(is_enabled)
-        active_panel = self.config_panels.get(self.source_selection_group.checkedId())
-        if active_panel: active_panel.setEnabled(is_enabled)
-        self.new_column_name_input.setEnabled(is_enabled)
-        self.cancel_merge_btn.setEnabled(starting)
-        if not starting: self.update_master_action_buttons_state()
+            if not self.job_scheduler.active_job_ids(self.JOB_OWNER):
+                self.execution_log.clear()
+            self.update_execution_log("提交合并任务...")
+            self.cancel_merge_btn.setEnabled(True)
         else:
-            self.preview_merge_btn.setEnabled(False)
-            self.execute_merge_btn.setEnabled(False)
+            remaining = [j for j in self.job_scheduler.active_job_ids(self.JOB_OWNER) if j != finished_job_id]
+            self.cancel_merge_btn.setEnabled(bool(remaining))
+            self.update_master_action_buttons_state()
 
-    def update_execution_progress(self, value, max_value=None):
+    def update_execution_progress(self, job_id, value, max_value=None):
+        if job_id != self.current_job_id:
+            return
         if max_value is not None and self.execution_progress.maximum() != max_value:
             self.execution_progress.setMaximum(max_value)
         self.execution_progress.setValue(value)
@@ -394,6 +555,9 @@ class SpecialDataMasterTab(QWidget):
     def on_db_connected(self):
         self.refresh_btn.setEnabled(True)
         self.refresh_cohort_tables()
+        active_panel = self.config_panels.get(self.source_selection_group.checkedId())
+        if active_panel and hasattr(active_panel, 'load_condition_field_types'):
+            active_panel.load_condition_field_types()
 
     def refresh_cohort_tables(self):
         db_params = self.get_db_params()
@@ -408,7 +572,7 @@ class SpecialDataMasterTab(QWidget):
             self.on_cohort_table_selected(self.table_combo.currentIndex())
             return
         try:
-            conn = psycopg2.connect(**db_params)
+            conn = connect_database(db_params)
             cur = conn.cursor()
             cur.execute(pgsql.SQL("SELECT table_name FROM information_schema.tables WHERE table_schema = 'mimiciv_data' AND (table_name LIKE 'first_%_admissions' OR table_name LIKE 'all_%_admissions' OR table_name LIKE 'cohort_%') ORDER BY table_name"))
             tables = [r[0] for r in cur.fetchall()]
@@ -461,9 +625,20 @@ class SpecialDataMasterTab(QWidget):
         if not column_details_for_dialog:
             QMessageBox.warning(self, "无法继续", "未能生成列详情以供确认。")
             return
-        column_preview_message = f"确定要向表 '{self.selected_cohort_table}' 中添加/更新以下列吗？\n" + \
-                                 "\n".join([f" - {name} (类型: {type_str})" for name, type_str in column_details_for_dialog]) + \
-                                 "\n\n此操作将直接修改数据库表。"
+        column_lines = "\n".join([f" - {name} (类型: {type_str})" for name, type_str in column_details_for_dialog])
+        if self._is_time_binning_active():
+            # 分箱模式: 第三个返回值为输出表名
+            output_table_full_name = new_cols_desc_for_worker
+            column_preview_message = f"确定要基于队列表 '{self.selected_cohort_table}' 创建时间分箱表 '{new_cols_desc_for_worker}' 吗？\n" + \
+                                     column_lines + "\n\n若该表已存在将被替换。"
+        elif self.storage_mode_combo.currentData() == STORAGE_MODE_NARROW:
+            output_table_full_name = None
+            column_preview_message = f"确定要为队列表 '{self.selected_cohort_table}' 计算以下特征并追加写入特征库 feature_store 吗？\n" + \
+                                     column_lines + "\n\n队列表本身不会被修改，导出时可合并为宽表。"
+        else:
+            output_table_full_name = None
+            column_preview_message = f"确定要向表 '{self.selected_cohort_table}' 中添加/更新以下列吗？\n" + \
+                                     column_lines + "\n\n此操作将直接修改数据库表。"
         if QMessageBox.question(self, '确认操作', column_preview_message,
                                 QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
                                 QMessageBox.StandardButton.No) == QMessageBox.StandardButton.No:
@@ -476,7 +651,7 @@ class SpecialDataMasterTab(QWidget):
         self.sql_preview.append(f"-- 准备为表 {self.selected_cohort_table} 添加/更新列 ({new_cols_desc_for_worker}) --\n")
         temp_conn_for_display = None; readable_sql_steps = []
         try:
-            if db_params: temp_conn_for_display = psycopg2.connect(**db_params)
+            if db_params: temp_conn_for_display = connect_database(db_params)
             for i, (sql_obj_or_str, params_for_step) in enumerate(execution_steps_list):
                 step_header = f"\n-- 执行步骤 {i+1} --"
                 try:
@@ -494,20 +669,22 @@ class SpecialDataMasterTab(QWidget):
                 temp_conn_for_display.close()
         QApplication.processEvents()
         self.prepare_for_long_operation(True)
-        self.merge_worker = MergeSQLWorker(db_params, execution_steps_list, self.selected_cohort_table, new_cols_desc_for_worker)
-        self.worker_thread = QThread()
-        self.merge_worker.moveToThread(self.worker_thread)
-        self.worker_thread.started.connect(self.merge_worker.run)
-        self.merge_worker.finished.connect(self.on_merge_worker_finished_actions)
-        self.merge_worker.error.connect(self.on_merge_error_actions)
-        self.merge_worker.progress.connect(self.update_execution_progress)
-        self.merge_worker.log.connect(self.update_execution_log)
-        self.merge_worker.finished.connect(self.worker_thread.quit)
-        self.merge_worker.error.connect(self.worker_thread.quit)
-        self.worker_thread.finished.connect(self.trigger_preview_after_thread_finish)
-        self.worker_thread.finished.connect(self.worker_thread.deleteLater)
-        self.worker_thread.finished.connect(lambda: setattr(self, 'merge_worker', None))
-        self.worker_thread.start()
+        # 时间分箱模式写新表、窄表模式追加写入特征库，没有 UPDATE 可拆分，也不做列来源记录
+        is_narrow = self.storage_mode_combo.currentData() == STORAGE_MODE_NARROW
+        chunk_size = self.chunk_size_spin.value() if self.cb_chunked_update.isEnabled() and self.cb_chunked_update.isChecked() else None
+        provenance_columns = None if self._is_time_binning_active() or is_narrow else [name for name, _ in column_details_for_dialog]
+        worker = MergeSQLWorker(db_params, execution_steps_list, self.selected_cohort_table, new_cols_desc_for_worker,
+                                           self.get_job_timeouts(), chunk_size, provenance_columns, self.cb_skip_fresh.isChecked(),
+                                           self.get_replica_settings(), self.get_tuning_profile())
+        exclusive_keys = [f"mimiciv_data.{self.selected_cohort_table}"] + ([output_table_full_name] if output_table_full_name else [])
+        job_id = self.job_scheduler.submit(
+            worker, f"{self.selected_cohort_table}: {new_cols_desc_for_worker}", self.JOB_OWNER, db_params,
+            "special_data_merge", exclusive_keys=exclusive_keys,
+            on_finished=self.on_merge_worker_finished_actions, on_error=self.on_merge_error_actions,
+            on_progress=self.update_execution_progress, on_log=lambda j, message: self.update_execution_log(f"[任务 {j}] {message}"))
+        self.current_job_id = job_id
+        self.job_contexts[job_id] = {"cohort_table": self.selected_cohort_table, "output_table": output_table_full_name,
+                                     "description": new_cols_desc_for_worker}
 
     def preview_merge_data(self):
         if not self._are_configs_valid_for_action():
@@ -519,8 +696,10 @@ class SpecialDataMasterTab(QWidget):
             return
         conn_for_preview = None
         try:
-            conn_for_preview = psycopg2.connect(**db_params)
+            conn_for_preview = connect_database(db_params)
             conn_for_preview.autocommit = True
+            with conn_for_preview.cursor() as tuning_cur:
+                apply_session_tuning(tuning_cur, PREVIEW_TUNING_PROFILE) # 预览连接用完即关闭，按会话设置
             preview_sql_obj, error_msg, params_list, _ = self._build_merge_query(preview_limit=100, for_execution=False)
 
             if error_msg:
@@ -536,15 +715,9 @@ class SpecialDataMasterTab(QWidget):
             readable_sql_for_display = self._get_readable_sql_with_conn(preview_sql_obj, params_list, conn_for_preview)
             self.sql_preview.setText(f"-- Preview Query (Display Only):\n{readable_sql_for_display}")
             QApplication.processEvents()
-            sql_string_for_pandas = preview_sql_obj.as_string(conn_for_preview.cursor())
-
-            final_params_tuple_for_pandas = None
-            if params_list:
-                if len(params_list) == 1:
-                    final_params_tuple_for_pandas = (params_list[0],)
-                # No explicit 'else if len(params_list) > 1:' because build_special_data_sql for preview
-                # should only return a list with one item (or an empty list if no params).
-                # If it's empty, final_params_tuple_for_pandas remains None.
+            sql_string_for_pandas = render_sql(preview_sql_obj)
+
+            final_params_tuple_for_pandas = tuple(params_list) if params_list else None
             
             print(f"DEBUG: SQL for pandas: {sql_string_for_pandas}")
             print(f"DEBUG: Params for pandas: {final_params_tuple_for_pandas}")
@@ -581,78 +754,64 @@ class SpecialDataMasterTab(QWidget):
 
     def _get_readable_sql_with_conn(self, sql_obj_or_str, params_list, conn):
         if not conn or conn.closed:
-            dummy_conn_for_string = None
-            try:
-                dummy_conn_for_string = psycopg2.connect(SQL_BUILDER_DUMMY_DB_FOR_AS_STRING)
-                sql_template = sql_obj_or_str.as_string(dummy_conn_for_string.cursor()) if hasattr(sql_obj_or_str, 'as_string') else str(sql_obj_or_str)
-            except Exception:
-                sql_template = str(sql_obj_or_str)
-            finally:
-                if dummy_conn_for_string: dummy_conn_for_string.close()
-            try:
-                if params_list and '%s' in sql_template:
-                    # This display formatting for params_list might need refinement if params_list contains tuples for IN clauses
-                    # For now, it directly uses the elements.
-                    # Ensure all elements in params_list are suitable for direct string formatting into the SQL template.
-                    # If params_list = [('a', 'b')], then sql_template % (('a','b'),) would be needed.
-                    # The current logic `sql_template % tuple(display_params)` assumes params_list maps 1:1 to %s.
-                    # If params_list = [('a','b')] and sql_template is "IN %s", then tuple(display_params) becomes (("('a'", "'b'") ,)
-                    # which is incorrect for "IN %s". psycopg2 handles IN %s with a single tuple param.
-                    # For display with mogrify (below), this is handled correctly by psycopg2.
-                    # For this fallback, it's tricky.
-                    
-                    # Simplification for fallback display: show template and params separately if complex.
-                    if len(params_list) == 1 and isinstance(params_list[0], tuple): # Likely for IN clause
-                         return f"{sql_template} -- Params (for IN clause): {params_list}"
-                    else:
-                         formatted_params = tuple(f"'{str(p).replace('%', '%%')}'" if isinstance(p, str) else str(p) for p in params_list)
-                         return sql_template % formatted_params
-
+            # 无连接时在本地渲染 (sql_logic/sql_render.py)，参数按字面量代入，仅用于显示
+            sql_template = render_sql(sql_obj_or_str)
+            if not params_list or '%s' not in sql_template:
                 return f"{sql_template} -- Params: {params_list if params_list else 'None'}"
-            except TypeError:
+            try:
+                return sql_template % tuple(quote_literal(p) for p in params_list)
+            except (TypeError, ValueError):
                 return f"{sql_template} -- Params (display formatting error): {params_list}"
         try:
             with conn.cursor() as cur:
-                sql_string_template = sql_obj_or_str.as_string(cur) if hasattr(sql_obj_or_str, 'as_string') else str(sql_obj_or_str)
+                sql_string_template = render_sql(sql_obj_or_str) if hasattr(sql_obj_or_str, 'as_string') else str(sql_obj_or_str)
                 return cur.mogrify(sql_string_template, params_list if params_list else None).decode(conn.encoding or 'utf-8')
         except Exception as e_mogrify:
             base_sql_str = str(sql_obj_or_str)
             return f"{base_sql_str}\n-- PARAMETERS (mogrify failed with conn): {params_list}"
 
     def cancel_merge(self):
-        if self.merge_worker:
-            self.update_execution_log("正在请求取消合并操作...")
-            self.merge_worker.cancel()
+        job_ids = self.job_scheduler.active_job_ids(self.JOB_OWNER)
+        if job_ids:
+            self.update_execution_log(f"正在请求取消本页的 {len(job_ids)} 个合并任务...")
+            for job_id in job_ids:
+                self.job_scheduler.cancel(job_id)
             self.cancel_merge_btn.setEnabled(False)
 
-    @Slot()
-    def on_merge_worker_finished_actions(self):
-        desc_for_log = self.merge_worker.new_cols_description_str if self.merge_worker else self.new_column_name_input.text()
-        self.update_execution_log(f"成功向表 {self.selected_cohort_table} 添加/更新与 '{desc_for_log}' 相关的列。")
-        QMessageBox.information(self, "合并成功", f"已成功向表 {self.selected_cohort_table} 添加/更新与 '{desc_for_log}' 相关的列。")
-        self.prepare_for_long_operation(False)
-
-    @Slot()
-    def trigger_preview_after_thread_finish(self):
-        if self.selected_cohort_table:
-            self.request_preview_signal.emit('mimiciv_data', self.selected_cohort_table)
-
-    @Slot(str)
-    def on_merge_error_actions(self, error_message):
-        self.update_execution_log(f"合并失败: {error_message}")
+    def on_merge_worker_finished_actions(self, job_id):
+        context = self.job_contexts.pop(job_id, {})
+        output_table_full_name = context.get("output_table")
+        cohort_table = context.get("cohort_table", self.selected_cohort_table)
+        self.prepare_for_long_operation(False, job_id)
+        if output_table_full_name:
+            self.update_execution_log(f"[任务 {job_id}] 成功创建时间分箱表 {output_table_full_name}。")
+            QMessageBox.information(self, "创建成功", f"已成功创建时间分箱表 {output_table_full_name}。")
+        else:
+            desc_for_log = context.get("description", self.new_column_name_input.text())
+            self.update_execution_log(f"[任务 {job_id}] 成功向表 {cohort_table} 添加/更新与 '{desc_for_log}' 相关的列。")
+            QMessageBox.information(self, "合并成功", f"已成功向表 {cohort_table} 添加/更新与 '{desc_for_log}' 相关的列。")
+        self.trigger_preview_after_job(output_table_full_name, cohort_table)
+
+    def trigger_preview_after_job(self, output_table_full_name, cohort_table):
+        if output_table_full_name:
+            schema_name, table_name = output_table_full_name.split('.', 1)
+            self.request_preview_signal.emit(schema_name, table_name)
+        elif cohort_table:
+            self.request_preview_signal.emit('mimiciv_data', cohort_table)
+
+    def on_merge_error_actions(self, job_id, error_message):
+        context = self.job_contexts.pop(job_id, {})
+        self.update_execution_log(f"[任务 {job_id}] 合并失败: {error_message}")
+        self.prepare_for_long_operation(False, job_id)
         if "操作已取消" not in error_message:
             QMessageBox.critical(self, "合并失败", f"执行合并SQL失败: {error_message}")
         else:
             QMessageBox.information(self, "操作取消", "数据合并操作已取消。")
-        self.prepare_for_long_operation(False)
+        # 失败时分箱表可能不存在，回退为预览队列表
+        self.trigger_preview_after_job(None, context.get("cohort_table", self.selected_cohort_table))
 
     def closeEvent(self, event):
-        if self.worker_thread and self.worker_thread.isRunning():
-             self.update_execution_log("正在尝试停止合并操作...")
-             if self.merge_worker: self.merge_worker.cancel()
-             self.worker_thread.quit()
-             if not self.worker_thread.wait(1500):
-                 self.update_execution_log("合并线程未能及时停止。")
+        # 运行中的合并任务由任务队列 (JobScheduler.shutdown) 统一停止
         for panel in self.config_panels.values():
             if hasattr(panel, '_close_panel_db') and callable(panel._close_panel_db):
                 panel._close_panel_db()
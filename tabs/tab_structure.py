@@ -3,8 +3,9 @@
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QPushButton, QTreeWidget,
                                QTreeWidgetItem, QMessageBox, QMenu, QApplication)
 from PySide6.QtCore import Qt, Slot, Signal # Added Signal
-import psycopg2
 from psycopg2 import sql as psql
+from sql_logic.db_backend import connect_database
+from sql_logic.sql_render import render_sql
 
 class StructureTab(QWidget):
     request_table_preview_signal = Signal(str, str) # schema_name, table_name
@@ -42,7 +43,7 @@ class StructureTab(QWidget):
 
         QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
         try:
-            conn = psycopg2.connect(**db_params)
+            conn = connect_database(db_params)
             cur = conn.cursor()
             cur.execute("""
                 SELECT schema_name
@@ -138,11 +139,11 @@ class StructureTab(QWidget):
         QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
         conn = None
         try:
-            conn = psycopg2.connect(**db_params)
+            conn = connect_database(db_params)
             cur = conn.cursor()
             table_identifier = psql.Identifier(schema_name, table_name)
             drop_sql = psql.SQL("DROP TABLE IF EXISTS {} CASCADE;").format(table_identifier)
-            print(f"Executing: {drop_sql.as_string(conn)}")
+            print(f"Executing: {render_sql(drop_sql)}")
             cur.execute(drop_sql)
             conn.commit()
             QMessageBox.information(self, "删除成功", f"表 '{schema_name}.{table_name}' 已成功删除。")
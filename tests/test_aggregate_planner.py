@@ -0,0 +1,51 @@
+# --- START OF FILE tests/test_aggregate_planner.py ---
+import unittest
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from sql_logic.aggregate_planner import plan_aggregate_expressions
+from app_config import SQL_AGGREGATES
+
+
+class TestAggregatePlanner(unittest.TestCase):
+
+    def _plan(self, keys):
+        return plan_aggregate_expressions([(k, SQL_AGGREGATES[k]) for k in keys])
+
+    def test_percentiles_share_one_sort(self):
+        inner, finals = self._plan(["MEDIAN", "P25", "P75", "IQR"])
+        percentile_items = [t for _, t in inner if "PERCENTILE_CONT" in t]
+        self.assertEqual(len(percentile_items), 1)
+        self.assertIn("ARRAY[0.25, 0.5, 0.75]", percentile_items[0])
+        self.assertEqual(finals, ["_pcts[2]", "_pcts[1]", "_pcts[3]", "_pcts[3] - _pcts[1]"])
+
+    def test_iqr_alone_only_needs_quartiles(self):
+        inner, finals = self._plan(["IQR"])
+        self.assertIn("ARRAY[0.25, 0.75]", inner[0][1])
+        self.assertEqual(finals, ["_pcts[2] - _pcts[1]"])
+
+    def test_first_and_last_share_one_ordered_array(self):
+        inner, finals = self._plan(["FIRST_VALUE", "LAST_VALUE", "MEAN"])
+        array_items = [t for _, t in inner if "ARRAY_AGG" in t]
+        self.assertEqual(len(array_items), 1)
+        self.assertEqual(finals[0], "_ordered_vals[1]")
+        self.assertEqual(finals[1], "_ordered_vals[GREATEST(_n_timed, 1)]")
+        # 其他方法原样保留
+        self.assertIn(("_agg2", "AVG({val_col})"), inner)
+        self.assertEqual(finals[2], "_agg2")
+
+    def test_passthrough_templates(self):
+        inner, finals = plan_aggregate_expressions([("exists", "TRUE"), ("countevt", "COUNT(*)")])
+        self.assertEqual(inner, [("_agg0", "TRUE"), ("_agg1", "COUNT(*)")])
+        self.assertEqual(finals, ["_agg0", "_agg1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# --- END OF FILE tests/test_aggregate_planner.py ---
@@ -0,0 +1,70 @@
+# --- START OF FILE tests/test_chunked_update.py ---
+import unittest
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from sql_logic.chunked_update import (parse_chunkable_update, add_key_range_to_update, chunk_ranges,
+                                      plan_chunked_job, pending_units, compute_job_key,
+                                      STATEMENT_KIND_UPDATE, STATEMENT_KIND_SESSION, STATEMENT_KIND_DURABLE)
+
+MERGE_STEPS = [
+    'ALTER TABLE "mimiciv_data"."first_sepsis" ADD COLUMN IF NOT EXISTS "hr_mean" NUMERIC;',
+    'CREATE TEMPORARY TABLE "temp_merge_data_hr_12345" AS (SELECT 1 AS hadm_id_cohort);',
+    'UPDATE "mimiciv_data"."first_sepsis" "tgt" SET "hr_mean" = "md"."hr_mean" FROM "temp_merge_data_hr_12345" "md" '
+    'WHERE "tgt".hadm_id = "md"."hadm_id_cohort";',
+    'DROP TABLE IF EXISTS "temp_merge_data_hr_12345";',
+]
+
+
+class TestChunkedUpdate(unittest.TestCase):
+
+    def test_key_range_wraps_existing_where(self):
+        sql_text = ("UPDATE mimiciv_data.t af SET x = i.x -- 注释; 不是语句结尾\n"
+                    "FROM src i WHERE af.a = i.a OR af.b = i.b; -- trailing")
+        parsed = parse_chunkable_update(sql_text)
+        self.assertEqual(parsed["key_ref"], "af")
+        chunked = add_key_range_to_update(sql_text, parsed, "hadm_id", 100, 200)
+        self.assertTrue(chunked.endswith(') AND af."hadm_id" >= 100 AND af."hadm_id" < 200;'))
+        self.assertIn("WHERE (\n", chunked)
+        self.assertNotIn("trailing", chunked)
+
+    def test_key_range_without_where_and_subquery_where(self):
+        sql_text = "UPDATE t af SET w = (SELECT avg(x.w) FROM x WHERE af.stay_id = x.stay_id)"
+        parsed = parse_chunkable_update(sql_text)
+        self.assertIsNone(parsed["where_pos"])
+        chunked = add_key_range_to_update(sql_text, parsed, "hadm_id", None, 5)
+        self.assertTrue(chunked.endswith('\nWHERE (af."hadm_id" < 5 OR af."hadm_id" IS NULL);'))
+
+    def test_cte_update_not_chunked(self):
+        self.assertIsNone(parse_chunkable_update("WITH a AS (SELECT 1 AS id) UPDATE t SET x = 1 FROM a WHERE t.id = a.id;"))
+
+    def test_chunk_ranges(self):
+        self.assertEqual(chunk_ranges([]), [(None, None)])
+        self.assertEqual(chunk_ranges([10, 20, 30]), [(None, 20), (20, 30), (30, None)])
+
+    def test_plan_and_resume(self):
+        plan = plan_chunked_job(MERGE_STEPS)
+        self.assertEqual([step["kind"] for step in plan],
+                         [STATEMENT_KIND_DURABLE, STATEMENT_KIND_SESSION, STATEMENT_KIND_UPDATE, STATEMENT_KIND_SESSION])
+        ranges = [(None, 5), (5, None)]
+        self.assertEqual(pending_units(plan, ranges, set()), [(0, -1), (1, -1), (2, 0), (2, 1)])
+        # 续做: ALTER 与第一块已完成，临时表需要在新连接上重建
+        self.assertEqual(pending_units(plan, ranges, {(0, -1), (2, 0)}), [(1, -1), (2, 1)])
+        self.assertEqual(pending_units(plan, ranges, {(0, -1), (2, 0), (2, 1)}), [])
+
+    def test_job_key_ignores_temp_table_names(self):
+        renamed = [text.replace("12345", "67890") for text in MERGE_STEPS]
+        self.assertEqual(compute_job_key("mimiciv_data.first_sepsis", MERGE_STEPS, 5000),
+                         compute_job_key("mimiciv_data.first_sepsis", renamed, 5000))
+        self.assertNotEqual(compute_job_key("mimiciv_data.first_sepsis", MERGE_STEPS, 5000),
+                            compute_job_key("mimiciv_data.first_sepsis", MERGE_STEPS, 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
+# --- END OF FILE tests/test_chunked_update.py ---
@@ -0,0 +1,47 @@
+# --- START OF FILE tests/test_column_provenance.py ---
+import unittest
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import psycopg2.sql as pgsql
+from sql_logic.column_provenance import (find_stale_features, compute_feature_config_hash,
+                                         build_cohort_version_sql, build_provenance_upsert_sql)
+
+
+class TestColumnProvenance(unittest.TestCase):
+
+    def test_find_stale_features(self):
+        recorded = {"lactate_max": ("h1", "v1"), "lactate_min": ("h1", "v1"), "age": ("h2", "v0")}
+        features = [
+            ("乳酸", ["lactate_max", "lactate_min"], "h1"),  # 已是最新
+            ("年龄", ["age"], "h2"),                         # 队列行集已变化
+            ("肌酐", ["creatinine_max"], "h3"),              # 从未计算
+            ("乳酸新配置", ["lactate_max"], "h9"),           # 配置已变化
+        ]
+        self.assertEqual(find_stale_features(features, recorded, "v1"), ["年龄", "肌酐", "乳酸新配置"])
+        # 没有列的特征总是视为过期
+        self.assertEqual(find_stale_features([("空", [], "h1")], recorded, "v1"), ["空"])
+
+    def test_config_hash_stable_across_temp_table_names(self):
+        first = compute_feature_config_hash(["CREATE TEMP TABLE temp_vals_ab12cd AS SELECT 1", "UPDATE t SET c = 1"])
+        second = compute_feature_config_hash(["CREATE TEMP TABLE temp_vals_ef34ab AS SELECT 1", "UPDATE t SET c = 1"])
+        changed = compute_feature_config_hash(["CREATE TEMP TABLE temp_vals_ab12cd AS SELECT 1", "UPDATE t SET c = 2"])
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, changed)
+
+    def test_sql_builders(self):
+        version_sql = build_cohort_version_sql("mimiciv_data", "first_icu_stays")
+        self.assertIsInstance(version_sql, pgsql.Composed)
+        self.assertIn(pgsql.Identifier("mimiciv_data", "first_icu_stays"), version_sql.seq)
+        upsert_sql = build_provenance_upsert_sql()
+        self.assertTrue(any(isinstance(part, pgsql.SQL) and "ON CONFLICT" in part.string for part in upsert_sql.seq))
+
+if __name__ == '__main__':
+    unittest.main()
+
+# --- END OF FILE tests/test_column_provenance.py ---
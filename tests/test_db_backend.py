@@ -0,0 +1,231 @@
+# --- START OF FILE tests/test_db_backend.py ---
+import unittest
+import sys
+import os
+import tempfile
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import psycopg2.sql as pgsql
+from sql_logic.db_backend import (split_sql_statements, prepare_statements, to_duckdb_placeholders, inline_sql_params,
+                                  split_alter_table_actions, translate_for_duckdb, connect_database, stream_query_to_csv,
+                                  stream_query_to_parquet, is_duckdb_available, duckdb, pyarrow)
+from sql_logic.sql_builder_special import build_special_data_sql
+from sql_logic.feature_store import STORAGE_MODE_NARROW
+
+
+class TestStatementHelpers(unittest.TestCase):
+
+    def test_split_ignores_semicolons_in_literals_and_comments(self):
+        script = ("-- 注释; 不拆分\nCREATE TABLE t AS SELECT 'a;b' AS x, \"c;d\" AS y;\n"
+                  "UPDATE t SET x = 'it''s; fine';\n-- 结尾注释\n")
+        statements = split_sql_statements(script)
+        self.assertEqual(len(statements), 2)
+        self.assertIn("'a;b'", statements[0])
+        self.assertTrue(statements[1].startswith("UPDATE t SET x = 'it''s; fine'"))
+
+    def test_params_distributed_per_statement(self):
+        prepared = prepare_statements("DELETE FROM t WHERE a = %s; INSERT INTO t VALUES (%s, %s)", [1, 2, 3])
+        self.assertEqual(prepared, [("DELETE FROM t WHERE a = %s", [1]), ("INSERT INTO t VALUES (%s, %s)", [2, 3])])
+        self.assertEqual(to_duckdb_placeholders("x ILIKE %s AND y LIKE 'a%%'"), "x ILIKE ? AND y LIKE 'a%'")
+        self.assertEqual(prepare_statements("SELECT '100%'", None), [("SELECT '100%'", None)])
+        with self.assertRaises(ValueError):
+            prepare_statements("SELECT %s", [1, 2])
+
+    def test_inline_params_and_alter_split(self):
+        self.assertEqual(inline_sql_params("SELECT %s, %s, '%%'", ["o'k", 5]), "SELECT 'o''k', 5, '%'")
+        self.assertEqual(split_alter_table_actions('ALTER TABLE "s"."t" ADD COLUMN IF NOT EXISTS "a" NUMERIC(10, 2), '
+                                                   'ADD COLUMN IF NOT EXISTS "b" TEXT'),
+                         ['ALTER TABLE "s"."t" ADD COLUMN IF NOT EXISTS "a" NUMERIC(10, 2)',
+                          'ALTER TABLE "s"."t" ADD COLUMN IF NOT EXISTS "b" TEXT'])
+        self.assertEqual(split_alter_table_actions("ALTER TABLE t ADD COLUMN a INT"), ["ALTER TABLE t ADD COLUMN a INT"])
+
+    def test_translate_postgres_only_constructs(self):
+        self.assertEqual(translate_for_duckdb("SELECT date_bin('1 hour'::interval, t, o), to_jsonb(x)::jsonb, 'date_bin(' "
+                                              "FROM \"jsonb\" WHERE a_jsonb = 1"),
+                         "SELECT time_bucket('1 hour'::interval, t, o), to_json(x)::JSON, 'date_bin(' "
+                         "FROM \"jsonb\" WHERE a_jsonb = 1")
+        self.assertEqual(translate_for_duckdb("CREATE TABLE t (v JSONB, w JSONB_AGG_NOT_A_TYPE)"),
+                         "CREATE TABLE t (v JSON, w JSONB_AGG_NOT_A_TYPE)")
+
+
+class _FakeNamedCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.description = None
+        self.fetch_sizes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql_text, params=None):
+        self.sql_text = sql_text
+
+    def fetchmany(self, size):
+        self.description = [("hadm_id",), ("note",)]  # 与 psycopg2 命名游标相同: FETCH 之后才有列信息
+        self.fetch_sizes.append(size)
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+class _FakePgConnection:
+    def __init__(self, rows):
+        self.named_cursor = _FakeNamedCursor(rows)
+        self.cursor_names = []
+
+    def cursor(self, name=None):
+        self.cursor_names.append(name)
+        return self.named_cursor
+
+
+class TestStreamQueryToCsv(unittest.TestCase):
+
+    def test_postgres_uses_named_cursor_in_batches(self):
+        conn = _FakePgConnection([(100 + i, f"n{i}") for i in range(5)])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "out.csv")
+            self.assertEqual(stream_query_to_csv(conn, pgsql.SQL("SELECT 1"), file_path, fetch_rows=2, cursor_name="exp"), 5)
+            with open(file_path, encoding="utf-8-sig") as f:
+                lines = f.read().splitlines()
+        self.assertEqual(conn.cursor_names, ["exp"])
+        self.assertEqual(conn.named_cursor.fetch_sizes, [2, 2, 2, 2])
+        self.assertEqual(lines[0], "hadm_id,note")
+        self.assertEqual(lines[1:3], ["100,n0", "101,n1"])
+        self.assertEqual(len(lines), 6)
+
+    def test_empty_result_still_writes_header(self):
+        conn = _FakePgConnection([])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "out.csv")
+            self.assertEqual(stream_query_to_csv(conn, "SELECT 1", file_path), 0)
+            with open(file_path, encoding="utf-8-sig") as f:
+                self.assertEqual(f.read().splitlines(), ["hadm_id,note"])
+
+
+@unittest.skipUnless(pyarrow is not None, "pyarrow 未安装")
+class TestStreamQueryToParquet(unittest.TestCase):
+
+    def test_batches_written_as_row_groups_of_one_file(self):
+        rows = [(100, None), (101, None), (102, "late"), (103, "x"), (104, None)]
+        conn = _FakePgConnection(rows)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "out.parquet")
+            self.assertEqual(stream_query_to_parquet(conn, "SELECT 1", file_path, fetch_rows=2, cursor_name="exp"), 5)
+            parquet_file = pyarrow.parquet.ParquetFile(file_path)
+            self.assertEqual(parquet_file.metadata.num_row_groups, 3)
+            table = parquet_file.read()
+        self.assertEqual(conn.cursor_names, ["exp"])
+        self.assertEqual(table.column("hadm_id").to_pylist(), [100, 101, 102, 103, 104])
+        # 第一批全为 NULL 的列按文本列写出，之后批次的值不丢失
+        self.assertEqual(table.column("note").to_pylist(), [None, None, "late", "x", None])
+
+
+@unittest.skipUnless(is_duckdb_available(), "duckdb 未安装")
+class TestDuckDBBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        data_dir = self.temp_dir.name
+        os.makedirs(os.path.join(data_dir, "hosp"))
+        os.makedirs(os.path.join(data_dir, "icu"))
+        writer = duckdb.connect()
+        writer.execute(f"COPY (SELECT i AS subject_id, 100 + i % 3 AS hadm_id, 50000 + i % 2 AS itemid, i * 1.5 AS valuenum, "
+                       f"i % 2 AS part_bucket FROM range(20) t(i)) TO '{data_dir}/hosp/labevents' "
+                       f"(FORMAT PARQUET, PARTITION_BY part_bucket)")
+        writer.execute(f"COPY (SELECT 1 + i % 2 AS subject_id, 100 + i % 2 AS hadm_id, 200 + i % 2 AS stay_id, 220045 AS itemid, "
+                       f"i * 1.0 AS valuenum, TIMESTAMP '2150-01-01 00:00:00' + i * INTERVAL 25 MINUTE AS charttime, "
+                       f"TIMESTAMP '2150-01-01 00:00:00' + i * INTERVAL 25 MINUTE AS storetime FROM range(20) t(i)) "
+                       f"TO '{data_dir}/icu/chartevents.parquet' (FORMAT PARQUET)")
+        writer.execute(f"COPY (SELECT * FROM (VALUES ('I210', 10, 'Acute MI'), ('4100', 9, 'AMI')) v(icd_code, icd_version, long_title)) "
+                       f"TO '{data_dir}/hosp/d_icd_diagnoses.csv.gz' (HEADER, COMPRESSION gzip)")
+        writer.close()
+        self.conn = connect_database({"backend": "duckdb", "local_data_dir": data_dir,
+                                      "database_path": os.path.join(data_dir, "local.duckdb"), "threads": 2})
+
+    def tearDown(self):
+        self.conn.close()
+        self.temp_dir.cleanup()
+
+    def test_views_and_psycopg2_style_execution(self):
+        cur = self.conn.cursor()
+        cur.execute(pgsql.SQL("SELECT COUNT(*), MAX(valuenum) FROM {} WHERE itemid = %s").format(
+            pgsql.Identifier("mimiciv_hosp", "labevents")), (50001,))
+        self.assertEqual(cur.fetchone()[0], 10)
+        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s",
+                    ("mimiciv_hosp", "labevents"))
+        self.assertNotIn("part_bucket", [row[0] for row in cur.fetchall()])
+
+        cur.execute("SET statement_timeout = 1000; CREATE TABLE mimiciv_data.c AS SELECT * FROM mimiciv_hosp.d_icd_diagnoses "
+                    "WHERE icd_code = ANY(%s::bpchar[]); CREATE INDEX c_idx ON mimiciv_data.c (icd_code); ANALYZE mimiciv_data.c;",
+                    (["I210"],))
+        cur.execute("ALTER TABLE mimiciv_data.c ADD COLUMN IF NOT EXISTS n INTEGER, ADD COLUMN IF NOT EXISTS note TEXT")
+        cur.execute("UPDATE mimiciv_data.c SET n = %s, note = %s", (1, "50%"))
+        self.assertEqual(cur.rowcount, 1)
+        self.conn.commit()
+
+        cur.execute("DELETE FROM mimiciv_data.c")
+        self.conn.rollback()
+        cur.execute("SELECT icd_code, n, note FROM mimiciv_data.c")
+        self.assertEqual(cur.fetchall(), [("I210", 1, "50%")])
+        self.assertEqual(cur.mogrify("SELECT %s", ["x"]), b"SELECT 'x'")
+
+    def test_stream_query_to_csv_locally(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "labs.csv")
+            count = stream_query_to_csv(self.conn, "SELECT subject_id, itemid FROM mimiciv_hosp.labevents "
+                                                   "WHERE subject_id < 7 ORDER BY subject_id", file_path, fetch_rows=3)
+            with open(file_path, encoding="utf-8-sig") as f:
+                lines = f.read().splitlines()
+        self.assertEqual(count, 7)
+        self.assertEqual(lines[0], "subject_id,itemid")
+        self.assertEqual(lines[1], "0,50000")
+        self.assertEqual(len(lines), 8)
+
+    def _run_special_plan(self, column_name, storage_mode="wide", time_binning=None):
+        cur = self.conn.cursor()
+        cur.execute("CREATE TABLE IF NOT EXISTS mimiciv_data.coh AS SELECT DISTINCT subject_id, hadm_id, stay_id, "
+                    "TIMESTAMP '2150-01-01 00:00:00' AS icu_intime, TIMESTAMP '2150-01-02 00:00:00' AS icu_outtime "
+                    "FROM mimiciv_icu.chartevents")
+        panel_config = {"source_event_table": "mimiciv_icu.chartevents", "item_id_column_in_event_table": "itemid",
+                        "value_column_to_extract": "valuenum", "time_column_in_event_table": "charttime",
+                        "selected_item_ids": [220045], "event_outputs": None, "time_window_text": "整个ICU期间",
+                        "aggregation_methods": {"MEAN": True, "MAX": True, "TIMESERIES_ARRAY": True},
+                        "cte_join_on_cohort_override": None}
+        if time_binning:
+            panel_config["time_binning"] = time_binning
+            panel_config["aggregation_methods"] = {"MEAN": True}
+        steps, kind, output, _ = build_special_data_sql("mimiciv_data.coh", column_name, panel_config,
+                                                        for_execution=True, storage_mode=storage_mode)
+        self.assertEqual(kind, "execution_list")
+        for sql_obj, params in steps:
+            cur.execute(sql_obj, params)
+        self.conn.commit()
+        return cur, output
+
+    def test_special_data_plans_run_locally(self):
+        # 宽表: ALTER + UPDATE 队列表
+        cur, _ = self._run_special_plan("hr")
+        cur.execute("SELECT hadm_id, hr_mean, hr_max FROM mimiciv_data.coh ORDER BY hadm_id")
+        self.assertEqual([(h, float(m), float(x)) for h, m, x in cur.fetchall()], [(100, 9.0, 18.0), (101, 10.0, 19.0)])
+        # 窄表特征库: JSONB 列与 to_jsonb 改写为 JSON
+        cur, _ = self._run_special_plan("hrn", storage_mode=STORAGE_MODE_NARROW)
+        cur.execute("SELECT feature_name, COUNT(*), MAX(num_value) FROM mimiciv_data.feature_store GROUP BY feature_name "
+                    "ORDER BY feature_name")
+        rows = cur.fetchall()
+        self.assertIn(("hrn_max", 2, 19.0), rows)
+        self.assertEqual(len(rows), 4) # mean, max, 时间序列数组的值与时间两列
+        # 时间分箱: date_bin 改写为 time_bucket，按锚点对齐的 60 分钟箱
+        cur, output_table = self._run_special_plan("hrb", time_binning={
+            "bin_width_minutes": 60, "window_start_hours": 0, "window_end_hours": 4, "anchor_column": "icu_intime",
+            "layout": "long"})
+        cur.execute(f"SELECT bin_index, hrb_mean FROM {output_table} WHERE hadm_id = 100 ORDER BY bin_index")
+        # hadm 100 的事件在第 0, 50, 100, 150, 200 分钟 (值 0, 2, 4, 6, 8)
+        self.assertEqual([(i, float(m)) for i, m in cur.fetchall()], [(0, 1.0), (1, 4.0), (2, 6.0), (3, 8.0)])
+
+# --- END OF FILE tests/test_db_backend.py ---
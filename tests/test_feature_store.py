@@ -0,0 +1,91 @@
+# --- START OF FILE tests/test_feature_store.py ---
+import unittest
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import psycopg2.sql as pgsql
+from sql_logic.feature_store import (value_slot_for_type, catalog_value_slots, build_feature_store_insert_sql,
+                                     build_feature_pivot_sql, STORAGE_MODE_NARROW,
+                                     VALUE_SLOT_NUM, VALUE_SLOT_TEXT, VALUE_SLOT_JSON)
+from sql_logic.sql_builder_special import build_special_data_sql
+
+
+def _flatten(composable):
+    """Composed -> 叶子节点列表 (SQL/Identifier/Literal)，无需数据库连接即可检查生成的 SQL。"""
+    if isinstance(composable, pgsql.Composed):
+        return [leaf for part in composable.seq for leaf in _flatten(part)]
+    return [composable]
+
+
+def _sql_text(composable):
+    return "".join(leaf.string for leaf in _flatten(composable) if isinstance(leaf, pgsql.SQL))
+
+
+def _literals(composable):
+    return [leaf.wrapped for leaf in _flatten(composable) if isinstance(leaf, pgsql.Literal)]
+
+
+class TestFeatureStore(unittest.TestCase):
+
+    def test_value_slot_for_type(self):
+        self.assertEqual(value_slot_for_type("NUMERIC"), VALUE_SLOT_NUM)
+        self.assertEqual(value_slot_for_type("smallint"), VALUE_SLOT_NUM)
+        self.assertEqual(value_slot_for_type("BOOLEAN"), VALUE_SLOT_NUM)
+        self.assertEqual(value_slot_for_type("CHARACTER(100)"), VALUE_SLOT_TEXT)
+        self.assertEqual(value_slot_for_type("interval"), VALUE_SLOT_TEXT)
+        self.assertEqual(value_slot_for_type("DOUBLE PRECISION[]"), VALUE_SLOT_JSON)
+        self.assertEqual(value_slot_for_type("JSONB"), VALUE_SLOT_JSON)
+        self.assertEqual(catalog_value_slots([("a", True, False), ("b", False, True), ("c", False, False)]),
+                         [("a", VALUE_SLOT_NUM), ("b", VALUE_SLOT_TEXT), ("c", VALUE_SLOT_JSON)])
+
+    def test_insert_unpivots_columns(self):
+        insert_sql = build_feature_store_insert_sql("mimiciv_data.cohort_x", pgsql.Identifier("tmp"), "hadm_id",
+                                                    [("lactate_max", "NUMERIC"), ("flag", "BOOLEAN"), ("race", "TEXT")])
+        text = _sql_text(insert_sql)
+        self.assertTrue(text.startswith("INSERT INTO"))
+        self.assertIn("CROSS JOIN LATERAL (VALUES", text)
+        self.assertIn("::int::double precision", text)
+        self.assertEqual(_literals(insert_sql)[:4], ["mimiciv_data.cohort_x", "lactate_max", "flag", "race"])
+
+    def test_pivot_skips_existing_columns(self):
+        pivot_sql = build_feature_pivot_sql("mimiciv_data", "cohort_x",
+                                            [("age", VALUE_SLOT_NUM), ("lactate_max", VALUE_SLOT_NUM)],
+                                            exclude_names=["age", "hadm_id"], limit=10)
+        self.assertIn("FILTER (WHERE fs.feature_name = ", _sql_text(pivot_sql))
+        self.assertIn("lactate_max", _literals(pivot_sql))
+        self.assertNotIn("age", _literals(pivot_sql))
+        self.assertEqual(_literals(pivot_sql)[-1], 10)
+        plain_sql = build_feature_pivot_sql("mimiciv_data", "cohort_x", [("age", VALUE_SLOT_NUM)], exclude_names=["age"])
+        self.assertEqual(_sql_text(plain_sql), "SELECT * FROM ")
+
+    def test_special_data_narrow_mode(self):
+        panel_config = {
+            "source_event_table": "mimiciv_hosp.labevents",
+            "item_id_column_in_event_table": "itemid",
+            "value_column_to_extract": "valuenum",
+            "time_column_in_event_table": "charttime",
+            "selected_item_ids": ["50813"],
+            "aggregation_methods": {"MAX": True, "MEAN": True},
+            "event_outputs": None,
+            "time_window_text": "整个住院期间",
+            "cte_join_on_cohort_override": None
+        }
+        exec_steps, exec_type, _, gen_cols = build_special_data_sql(
+            "mimiciv_data.test_cohort", "lactate", panel_config, for_execution=True, storage_mode=STORAGE_MODE_NARROW)
+        self.assertEqual(exec_type, "execution_list")
+        self.assertEqual(len(exec_steps), 5)
+        step_texts = [_sql_text(sql_obj) for sql_obj, _ in exec_steps]
+        self.assertTrue(all("ALTER TABLE" not in t and not t.startswith("UPDATE") for t in step_texts))
+        self.assertTrue(step_texts[2].startswith("ANALYZE"))
+        self.assertTrue(step_texts[3].startswith("INSERT INTO"))
+        self.assertEqual(set(_literals(exec_steps[3][0])[1:]), {name for name, _ in gen_cols})
+
+if __name__ == '__main__':
+    unittest.main()
+
+# --- END OF FILE tests/test_feature_store.py ---
@@ -0,0 +1,82 @@
+# --- START OF FILE tests/test_icd_hierarchy.py ---
+import unittest
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from sql_logic.icd_hierarchy import (IcdPrefixIndex, parse_icd_selection_text, normalize_icd_code, gem_source_version,
+                                     parse_gem_lines, build_version_map, add_mapped_codes, build_code_list_condition)
+from sql_logic.sql_builder_cohort import build_batch_cohort_sql, build_cohort_size_count_sql
+from sql_logic.sql_render import render_sql
+
+DICTIONARY_ROWS = [
+    ("I2101  ", 10, "STEMI of LAD"), ("I214   ", 10, "NSTEMI"), ("I219", 10, "AMI, unspecified"),
+    ("I2510", 10, "ASHD"), ("I509", 10, "Heart failure"), ("J189", 10, "Pneumonia"),
+    ("41001", 9, "AMI anterolateral, initial"), ("4109", 9, "AMI NOS"), ("4280", 9, "CHF NOS"),
+]
+
+DISEASE_SOURCE = {
+    "source_type": "disease", "event_table": "mimiciv_hosp.diagnoses_icd",
+    "dictionary_table": "mimiciv_hosp.d_icd_diagnoses", "event_icd_col": "icd_code",
+    "dict_icd_col": "icd_code", "dict_title_col": "long_title",
+    "event_seq_num_col": "seq_num", "event_time_col": None
+}
+
+
+class TestIcdHierarchy(unittest.TestCase):
+
+    def test_parse_and_expand_prefixes(self):
+        self.assertEqual(normalize_icd_code(" i21.4 "), "I214")
+        self.assertEqual(normalize_icd_code("410.x"), "410")
+        self.assertEqual(parse_icd_selection_text("I21*, I50.*; 410.x I20-I25"),
+                         [("I21", "I21"), ("I50", "I50"), ("410", "410"), ("I20", "I25")])
+        with self.assertRaises(ValueError):
+            parse_icd_selection_text("I25-I20")
+
+        index = IcdPrefixIndex(DICTIONARY_ROWS)
+        self.assertEqual(len(index), len(DICTIONARY_ROWS))
+        self.assertEqual(index.title(10, "I214"), "NSTEMI")  # CHAR(7) 的尾随空格被去掉
+        self.assertEqual(index.expand(parse_icd_selection_text("I21*, 410.x")),
+                         {9: ["41001", "4109"], 10: ["I2101", "I214", "I219"]})
+        self.assertEqual(index.expand(parse_icd_selection_text("I20-I25"), versions=[10]), {10: ["I2101", "I214", "I219", "I2510"]})
+        # 章节区间按结束代码的前缀包含
+        self.assertEqual(index.codes_in_range(10, "I00", "I99"), ["I2101", "I214", "I219", "I2510", "I509"])
+        self.assertEqual(index.expand(parse_icd_selection_text("Z99")), {})
+
+    def test_gem_mapping(self):
+        self.assertEqual(gem_source_version("/data/2018_I9gem.txt"), 9)
+        self.assertEqual(gem_source_version("2018_I10gem.txt"), 10)
+        self.assertIsNone(gem_source_version("mapping.txt"))
+        forward = parse_gem_lines(["41001 I2109 00000", "7999  NoDx  11000", ""], 9)
+        backward = parse_gem_lines(["I214  41071 10000"], 10)
+        self.assertEqual(forward, [((9, "41001"), (10, "I2109"))])
+        version_map = build_version_map(forward + backward)
+        self.assertEqual(add_mapped_codes({10: ["I214"], 9: ["41001"]}, version_map),
+                         {9: ["41001", "41071"], 10: ["I2109", "I214"]})
+
+    def test_code_list_condition_in_cohort_sql(self):
+        condition_sql, params = build_code_list_condition({10: ["I214", "I219"], 9: ["4109"]}, "e")
+        self.assertEqual(condition_sql,
+                         '(("e"."icd_version" = 9 AND "e"."icd_code" = ANY(%s::bpchar[])) OR '
+                         '("e"."icd_version" = 10 AND "e"."icd_code" = ANY(%s::bpchar[])))')
+        self.assertEqual(params, [["4109"], ["I214", "I219"]])
+        self.assertEqual(build_code_list_condition({10: []}), ("", []))
+        count_sql = render_sql(build_cohort_size_count_sql(condition_sql, DISEASE_SOURCE))
+        self.assertIn('WHERE ((("e"."icd_version" = 9', count_sql)
+        # 批量创建时条件作用于字典表别名 dd
+        dd_condition, dd_params = build_code_list_condition({10: ["I214"]}, "dd")
+        steps, err = build_batch_cohort_sql([{"table_name": "first_dis_ami_admissions", "condition_sql": dd_condition,
+                                              "condition_params": dd_params, "admission_type": "first_event_admission"}],
+                                            DISEASE_SOURCE)
+        self.assertIsNone(err)
+        self.assertIn('"dd"."icd_code" = ANY(%s::bpchar[])', render_sql(steps[1][1]))
+        self.assertEqual(steps[1][2], [["I214"]])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# --- END OF FILE tests/test_icd_hierarchy.py ---
@@ -0,0 +1,69 @@
+# --- START OF FILE tests/test_job_control.py ---
+import unittest
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from sql_logic.job_control import (build_job_timeout_statements, cancel_backend_query,
+                                   describe_query_canceled, default_job_timeouts,
+                                   build_session_tuning_statements, describe_tuning_profile)
+
+
+class _FakeConnection:
+    def __init__(self, closed=0):
+        self.closed = closed
+        self.cancel_calls = 0
+
+    def cancel(self):
+        self.cancel_calls += 1
+
+
+class TestJobControl(unittest.TestCase):
+
+    def test_timeout_statements(self):
+        statements = build_job_timeout_statements({"statement_timeout_ms": 600000, "lock_timeout_ms": -5})
+        self.assertEqual(statements, [("SET statement_timeout = %s", (600000,)), ("SET lock_timeout = %s", (0,))])
+        # 未提供的设置使用默认值
+        defaults = default_job_timeouts()
+        statements = build_job_timeout_statements(None)
+        self.assertEqual([params[0] for _, params in statements],
+                         [defaults["statement_timeout_ms"], defaults["lock_timeout_ms"]])
+
+    def test_cancel_backend_query(self):
+        self.assertFalse(cancel_backend_query(None))
+        closed_conn = _FakeConnection(closed=1)
+        self.assertFalse(cancel_backend_query(closed_conn))
+        self.assertEqual(closed_conn.cancel_calls, 0)
+        open_conn = _FakeConnection()
+        self.assertTrue(cancel_backend_query(open_conn))
+        self.assertEqual(open_conn.cancel_calls, 1)
+
+    def test_describe_query_canceled(self):
+        self.assertEqual(describe_query_canceled(Exception("x"), True), "操作已取消")
+        self.assertIn("statement_timeout", describe_query_canceled(Exception("x"), False))
+
+    def test_session_tuning_statements(self):
+        statements = dict(build_session_tuning_statements("bulk_extraction"))
+        self.assertEqual(statements["SET work_mem = %s"], ("256MB",))
+        self.assertEqual(statements["SET max_parallel_workers_per_gather = %s"], ("4",))
+        self.assertIn("SET temp_buffers = %s", statements)
+        # 事务级设置不包含只能在会话开始时修改的 temp_buffers
+        local_statements = [stmt for stmt, _ in build_session_tuning_statements("bulk_extraction", transaction_local=True)]
+        self.assertTrue(all(stmt.startswith("SET LOCAL ") for stmt in local_statements))
+        self.assertNotIn("SET LOCAL temp_buffers = %s", local_statements)
+        self.assertEqual(build_session_tuning_statements("server_default"), [])
+        self.assertEqual(build_session_tuning_statements(None), [])
+        self.assertEqual(build_session_tuning_statements("no_such_profile"), [])
+
+    def test_describe_tuning_profile(self):
+        self.assertIn("maintenance_work_mem=1GB", describe_tuning_profile("index_build"))
+        self.assertEqual(describe_tuning_profile(None), "")
+
+
+if __name__ == '__main__':
+    unittest.main()
+# --- END OF FILE tests/test_job_control.py ---
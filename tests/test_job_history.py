@@ -0,0 +1,88 @@
+# --- START OF FILE tests/test_job_history.py ---
+import unittest
+import sys
+import os
+import tempfile
+import sqlite3
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from sql_logic.job_history import (JobJournal, compute_config_hash, statement_label, list_jobs,
+                                   get_job_statements, compare_job_statements,
+                                   summarize_durations_by_description,
+                                   JOB_OUTCOME_SUCCESS, JOB_OUTCOME_FAILED)
+
+
+class TestJobHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "history.sqlite3")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _run_job(self, durations, outcome=JOB_OUTCOME_SUCCESS, description="乳酸"):
+        journal = JobJournal("special_data_merge", "mimiciv_data.first_icu_stays", description,
+                             ["SELECT 1"], db_path=self.db_path)
+        journal.record_statement("SET statement_timeout = 0", 0.0, -1)  # 会话设置不记录
+        for i, duration in enumerate(durations):
+            journal.record_statement(f"-- 步骤 {i}\nUPDATE t SET c = {i}", duration, 10)
+        journal.finish(outcome)
+        journal.finish(JOB_OUTCOME_FAILED)  # 只记录第一次的结果
+        return journal.job_id
+
+    def test_config_hash_ignores_temp_table_suffix(self):
+        self.assertEqual(compute_config_hash(["CREATE TEMP TABLE temp_lab_1a2b3c AS SELECT 1"]),
+                         compute_config_hash(["CREATE TEMP TABLE temp_lab_9f8e7d AS SELECT 1"]))
+        self.assertNotEqual(compute_config_hash(["SELECT 1"]), compute_config_hash(["SELECT 2"]))
+
+    def test_statement_label_skips_comments(self):
+        self.assertEqual(statement_label("-- 说明\n\n  UPDATE t SET c = 1\nWHERE x"), "UPDATE t SET c = 1")
+
+    def test_journal_records_and_compares(self):
+        job_a = self._run_job([1.0, 2.0])
+        job_b = self._run_job([1.5, 1.0, 0.5])
+        statements = get_job_statements(job_a, db_path=self.db_path)
+        self.assertEqual([s[0] for s in statements], [1, 2])
+        self.assertEqual(statements[0][1], "UPDATE t SET c = 0")
+        jobs = list_jobs(db_path=self.db_path)
+        self.assertEqual([j[0] for j in jobs], [job_b, job_a])
+        self.assertTrue(all(j[7] == JOB_OUTCOME_SUCCESS for j in jobs))
+
+        comparison = compare_job_statements(job_a, job_b, db_path=self.db_path)
+        self.assertEqual(len(comparison), 3)
+        self.assertAlmostEqual(comparison[0]["delta_s"], 0.5)
+        self.assertAlmostEqual(comparison[1]["ratio"], 0.5)
+        self.assertIsNone(comparison[2]["duration_a"])
+
+    def test_summary_only_counts_successful_jobs(self):
+        self._run_job([1.0], description="乳酸")
+        self._run_job([1.0], description="乳酸")
+        self._run_job([1.0], outcome=JOB_OUTCOME_FAILED, description="肌酐")
+        summary = summarize_durations_by_description(db_path=self.db_path)
+        self.assertEqual([(row[1], row[2]) for row in summary], [("乳酸", 2)])
+
+    def test_records_tuning_profile_and_upgrades_old_database(self):
+        # 旧版本的历史库没有 tuning_profile 列
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE jobs (job_id INTEGER PRIMARY KEY AUTOINCREMENT, job_type TEXT NOT NULL, cohort_table TEXT, "
+                     "description TEXT, config_hash TEXT, started_at REAL NOT NULL, finished_at REAL, duration_s REAL, "
+                     "outcome TEXT NOT NULL, error_message TEXT, blks_hit INTEGER, blks_read INTEGER, temp_bytes INTEGER, "
+                     "tup_inserted INTEGER, tup_updated INTEGER)")
+        conn.execute("INSERT INTO jobs (job_type, started_at, outcome) VALUES ('cohort_creation', 0, 'success')")
+        conn.commit(); conn.close()
+        journal = JobJournal("base_info_extraction", "c1", "乳酸", ["SELECT 1"], db_path=self.db_path,
+                             tuning_profile="bulk_extraction")
+        journal.finish(JOB_OUTCOME_SUCCESS)
+        new_job, old_job = list_jobs(db_path=self.db_path)
+        self.assertIn("work_mem=256MB", new_job[11])
+        self.assertIsNone(old_job[11])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# --- END OF FILE tests/test_job_history.py ---
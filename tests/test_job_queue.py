@@ -0,0 +1,82 @@
+# --- START OF FILE tests/test_job_queue.py ---
+import unittest
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from sql_logic.job_queue import (JobQueue, database_key_for, JOB_STATE_RUNNING, JOB_STATE_SUCCEEDED,
+                                 JOB_STATE_CANCELLED, JOB_PRIORITY_HIGH, JOB_PRIORITY_LOW)
+
+PG_A = database_key_for({"host": "db1", "port": "5432", "dbname": "mimiciv"})
+PG_B = database_key_for({"host": "db2", "port": "5432", "dbname": "mimiciv"})
+LOCAL = database_key_for({"backend": "duckdb", "database_path": "/data/local.duckdb"})
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def _start_all(self, queue):
+        started = queue.startable_job_ids()
+        for job_id in started:
+            queue.mark_started(job_id)
+        return started
+
+    def test_global_and_per_database_limits(self):
+        queue = JobQueue(max_concurrent=3, max_per_database=2)
+        a1, a2, a3 = (queue.submit(f"a{i}", "tab", PG_A) for i in range(3))
+        b1 = queue.submit("b1", "tab", PG_B)
+        b2 = queue.submit("b2", "tab", PG_B)
+        self.assertEqual(self._start_all(queue), [a1, a2, b1])
+        self.assertEqual(queue.startable_job_ids(), [])
+        queue.mark_finished(a1, JOB_STATE_SUCCEEDED)
+        self.assertEqual(self._start_all(queue), [a3])  # 全局名额只剩一个，按提交顺序
+        queue.mark_finished(b1, JOB_STATE_SUCCEEDED)
+        self.assertEqual(self._start_all(queue), [b2])
+        self.assertEqual(queue.get(b2)["state"], JOB_STATE_RUNNING)
+
+    def test_duckdb_file_runs_one_job_at_a_time(self):
+        queue = JobQueue(max_concurrent=4, max_per_database=3)
+        first = queue.submit("x", "tab", LOCAL)
+        queue.submit("y", "tab", LOCAL)
+        self.assertEqual(self._start_all(queue), [first])
+
+    def test_priority_and_same_table_ordering(self):
+        queue = JobQueue(max_concurrent=1, max_per_database=1)
+        blocker = queue.submit("running", "tab", PG_A)
+        self._start_all(queue)
+        create = queue.submit("create cohort", "tab", PG_A, exclusive_keys=["mimiciv_data.c1"])
+        extract = queue.submit("extract", "tab", PG_A, priority=JOB_PRIORITY_HIGH, exclusive_keys=["mimiciv_data.c1"])
+        other = queue.submit("other", "tab", PG_A, priority=JOB_PRIORITY_HIGH, exclusive_keys=["mimiciv_data.c2"])
+        low = queue.submit("low", "tab", PG_A, priority=JOB_PRIORITY_LOW)
+        self.assertEqual(queue.queue_position(low), 4)
+        queue.mark_finished(blocker, JOB_STATE_SUCCEEDED)
+        # 高优先级但与更早的任务写同一张表的任务不能越过它
+        self.assertEqual(self._start_all(queue), [other])
+        queue.mark_finished(other, JOB_STATE_SUCCEEDED)
+        self.assertEqual(self._start_all(queue), [create])
+        queue.mark_finished(create, JOB_STATE_SUCCEEDED)
+        self.assertEqual(self._start_all(queue), [extract])
+        queue.mark_finished(extract, JOB_STATE_SUCCEEDED)
+        self.assertEqual(self._start_all(queue), [low])
+
+    def test_cancel_queued_and_bookkeeping(self):
+        queue = JobQueue(max_concurrent=1, max_per_database=1)
+        running = queue.submit("a", "基础数据", PG_A, exclusive_keys=["t"])
+        self._start_all(queue)
+        queued = queue.submit("b", "专项数据", PG_A)
+        self.assertTrue(queue.set_priority(queued, JOB_PRIORITY_HIGH))
+        self.assertFalse(queue.set_priority(running, JOB_PRIORITY_HIGH))
+        queue.mark_finished(queued, JOB_STATE_CANCELLED)
+        self.assertEqual(queue.active_job_ids(), [running])
+        self.assertEqual(queue.active_job_ids("专项数据"), [])
+        queue.record_progress(running, 3, 10)
+        queue.append_log(running, "步骤 3 完成\n详细信息")
+        self.assertEqual(queue.get(running)["progress"], (3, 10))
+        self.assertEqual(queue.get(running)["message"], "步骤 3 完成")
+        self.assertEqual(queue.clear_finished(), [queued])
+        self.assertIsNone(queue.get(queued))
+
+# --- END OF FILE tests/test_job_queue.py ---
@@ -0,0 +1,219 @@
+# --- START OF FILE tests/test_parallel_index_build.py ---
+import unittest
+import sys
+import os
+import threading
+import time
+import importlib.util
+from unittest import mock
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import psycopg2
+from sql_logic.parallel_index_build import (ParallelIndexBuilder, CommittedInterruptedError, plan_cohort_indexes,
+                                             build_indexes_after_commit)
+
+
+class _FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql_text, params=None):
+        if sql_text.startswith("SET"):
+            if self.conn.server.fail_settings:
+                raise psycopg2.Error("permission denied to set parameter")
+            self.conn.settings.append(sql_text)
+            return
+        self.conn.server.run(self.conn, sql_text)
+
+
+class _FakeConnection:
+    def __init__(self, server):
+        self.server = server
+        self.autocommit = False
+        self.closed = 0
+        self.settings = []
+        self.cancel_event = threading.Event()
+
+    def cursor(self):
+        return _FakeCursor(self)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def close(self):
+        self.closed = 1
+
+
+class _FakeServer:
+    """记录同时执行的语句数；包含 "fail" 的语句报错，包含 "slow" 的语句一直执行到被取消。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.connections = []
+        self.executed = []
+        self.slow_started = threading.Event()
+        self.fail_settings = False
+
+    def connect(self, db_params):
+        conn = _FakeConnection(self)
+        with self.lock:
+            self.connections.append(conn)
+        return conn
+
+    def run(self, conn, sql_text):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.executed.append(sql_text)
+        try:
+            if "fail" in sql_text:
+                raise psycopg2.Error("column does not exist")
+            if "slow" in sql_text:
+                self.slow_started.set()
+                if conn.cancel_event.wait(5):
+                    raise psycopg2.extensions.QueryCanceledError("canceling statement due to user request")
+            time.sleep(0.02)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+def _statements(*names):
+    return [(name, f"CREATE INDEX IF NOT EXISTS {name} ON mimiciv_data.c1 (hadm_id);") for name in names]
+
+
+class TestParallelIndexBuilder(unittest.TestCase):
+
+    def test_results_in_order_and_parallelism_capped(self):
+        server = _FakeServer()
+        builder = ParallelIndexBuilder({}, parallelism=2, log=lambda msg: None, connect=server.connect)
+        results = builder.build(_statements("i1", "i2", "i3", "i4", "i5"))
+        self.assertEqual([r["index_name"] for r in results], ["i1", "i2", "i3", "i4", "i5"])
+        self.assertTrue(all(r["error"] is None for r in results))
+        self.assertLessEqual(server.max_running, 2)
+        self.assertEqual(len(server.connections), 2)
+        for conn in server.connections:
+            self.assertTrue(conn.autocommit)
+            self.assertTrue(conn.closed)
+            self.assertTrue(any("maintenance_work_mem" in setting for setting in conn.settings))
+        self.assertEqual(builder.build([]), [])
+
+    def test_failed_index_does_not_stop_others(self):
+        server = _FakeServer()
+        builder = ParallelIndexBuilder({}, parallelism=1, log=lambda msg: None, connect=server.connect)
+        results = builder.build(_statements("i1", "fail_idx", "i3"))
+        self.assertEqual([r["error"] is None for r in results], [True, False, True])
+        self.assertIn("column does not exist", results[1]["error"])
+
+    def test_cancel_stops_running_and_pending(self):
+        server = _FakeServer()
+        builder = ParallelIndexBuilder({}, parallelism=1, log=lambda msg: None, connect=server.connect)
+        output = []
+        thread = threading.Thread(target=lambda: output.extend(builder.build(_statements("slow_idx", "i2", "i3"))))
+        thread.start()
+        self.assertTrue(server.slow_started.wait(5))
+        self.assertTrue(builder.cancel())
+        thread.join(5)
+        self.assertEqual([r["index_name"] for r in output], ["slow_idx"])
+        self.assertEqual(output[0]["error"], "已取消")
+        self.assertEqual(len(server.executed), 1)
+
+    def test_connection_closed_when_session_setup_fails(self):
+        server = _FakeServer()
+        server.fail_settings = True
+        builder = ParallelIndexBuilder({}, parallelism=1, log=lambda msg: None, connect=server.connect)
+        results = builder.build(_statements("i1", "i2"))
+        self.assertTrue(all("permission denied" in r["error"] for r in results))
+        self.assertEqual(server.executed, [])
+        self.assertEqual(len(server.connections), 2)
+        self.assertTrue(all(conn.closed for conn in server.connections))
+        self.assertEqual(builder._conns, [])
+
+
+class _CatalogCursor:
+    def __init__(self, columns):
+        self.columns = columns
+        self.executed = []
+
+    def execute(self, sql_obj, params=None):
+        self.executed.append(params)
+
+    def fetchall(self):
+        return [(column,) for column in self.columns]
+
+
+class _Signal:
+    def __init__(self):
+        self.messages = []
+
+    def emit(self, message):
+        self.messages.append(message)
+
+
+class _Worker:
+    def __init__(self, db_params):
+        self.db_params = db_params
+        self.job_timeouts = None
+        self.is_cancelled = False
+        self.index_builder = None
+        self.log = _Signal()
+
+
+class _Journal:
+    def __init__(self):
+        self.statements = []
+
+    def record_statement(self, sql_text, duration_s, rows_affected):
+        self.statements.append(sql_text)
+
+
+class TestCohortIndexStep(unittest.TestCase):
+    """队列创建 worker 的建索引步骤 (提交前查列、提交后并行构建)，不依赖 GUI。"""
+
+    def test_plan_uses_one_catalog_query(self):
+        cursor = _CatalogCursor(["subject_id", "hadm_id", "stay_id", "admittime"])
+        names = [name for name, _ in plan_cohort_indexes(cursor, "first_sepsis_admissions", "disease")]
+        self.assertEqual(cursor.executed, [("first_sepsis_admissions",)])
+        self.assertEqual(len(names), 4)
+        essential = plan_cohort_indexes(_CatalogCursor(["subject_id", "hadm_id", "stay_id"]),
+                                        "first_sepsis_admissions", "disease", essential_only=True)
+        self.assertEqual(len(essential), 2)
+
+    def test_build_after_commit_records_statements(self):
+        server = _FakeServer()
+        worker, journal = _Worker({"host": "db"}), _Journal()
+        statements = plan_cohort_indexes(_CatalogCursor(["hadm_id", "stay_id", "missing_fail"]), "c1", "disease")
+        statements.append(("fail_idx", "CREATE INDEX fail_idx ON mimiciv_data.c1 (x);"))
+        with mock.patch("sql_logic.parallel_index_build.connect_database", server.connect):
+            build_indexes_after_commit(worker, statements, journal)
+        self.assertEqual(len(journal.statements), 3)
+        self.assertIsNotNone(worker.index_builder)
+        self.assertIn("fail_idx", worker.log.messages[-1])
+
+    def test_build_after_commit_cancelled_and_duckdb(self):
+        worker = _Worker({"host": "db"})
+        worker.is_cancelled = True
+        with self.assertRaises(CommittedInterruptedError):
+            build_indexes_after_commit(worker, _statements("i1"), _Journal())
+        local_worker = _Worker({"backend": "duckdb"})
+        build_indexes_after_commit(local_worker, _statements("i1"), _Journal())
+        self.assertIsNone(local_worker.index_builder)
+
+    @unittest.skipUnless(importlib.util.find_spec("PySide6"), "PySide6 未安装")
+    def test_cohort_tab_module_imports(self):
+        import tabs.tab_query_cohort as tab_module
+        self.assertIs(tab_module.build_indexes_after_commit, build_indexes_after_commit)
+
+# --- END OF FILE tests/test_parallel_index_build.py ---
@@ -0,0 +1,72 @@
+# --- START OF FILE tests/test_parquet_ingest.py ---
+import unittest
+import sys
+import os
+import tempfile
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from sql_logic.parquet_ingest import build_ingest_sql, output_path_for, run_ingestion, load_manifest
+from sql_logic.db_backend import connect_database, is_duckdb_available, duckdb
+
+
+class TestIngestSql(unittest.TestCase):
+
+    def test_partitioned_event_table(self):
+        sql_text = build_ingest_sql("/data/icu/chartevents.csv.gz", "/out/icu/chartevents",
+                                    ["subject_id", "stay_id", "itemid", "charttime", "valuenum", "value"], "chartevents")
+        self.assertIn("'valuenum': 'DOUBLE'", sql_text)
+        self.assertIn("'charttime': 'TIMESTAMP'", sql_text)
+        self.assertIn('"itemid" % 32 AS part_bucket', sql_text)
+        self.assertIn('ORDER BY "itemid", "subject_id", "stay_id", "charttime"', sql_text)
+        self.assertIn("PARTITION_BY (part_bucket)", sql_text)
+
+    def test_dictionary_table_single_file(self):
+        sql_text = build_ingest_sql("/data/hosp/d_icd_diagnoses.csv.gz", "/out/hosp/d_icd_diagnoses.parquet",
+                                    ["icd_code", "icd_version", "long_title"], "d_icd_diagnoses")
+        self.assertIn("'icd_code': 'VARCHAR'", sql_text)
+        self.assertNotIn("PARTITION_BY", sql_text)
+        self.assertTrue(output_path_for("/out", "hosp", "d_icd_diagnoses").endswith("d_icd_diagnoses.parquet"))
+
+
+@unittest.skipUnless(is_duckdb_available(), "duckdb 未安装")
+class TestRunIngestion(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_dir = os.path.join(self.temp_dir.name, "mimic")
+        self.output_dir = os.path.join(self.temp_dir.name, "parquet")
+        os.makedirs(os.path.join(self.source_dir, "hosp"))
+        os.makedirs(os.path.join(self.source_dir, "icu"))
+        writer = duckdb.connect()
+        writer.execute(f"COPY (SELECT i % 10 AS subject_id, 1000 + i % 10 AS stay_id, 220045 + i % 3 AS itemid, "
+                       f"TIMESTAMP '2150-01-01' + INTERVAL (i) MINUTE AS charttime, i * 0.5 AS valuenum FROM range(1000) t(i)) "
+                       f"TO '{self.source_dir}/icu/chartevents.csv.gz' (HEADER, COMPRESSION gzip)")
+        writer.execute(f"COPY (SELECT * FROM (VALUES ('0010', 9, 'Cholera')) v(icd_code, icd_version, long_title)) "
+                       f"TO '{self.source_dir}/hosp/d_icd_diagnoses.csv.gz' (HEADER, COMPRESSION gzip)")
+        writer.close()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_convert_then_skip_unchanged(self):
+        messages = []
+        results = run_ingestion(self.source_dir, self.output_dir, threads=2, log=messages.append)
+        self.assertEqual(results, {"icu/chartevents": "converted", "hosp/d_icd_diagnoses": "converted"})
+        self.assertEqual(load_manifest(self.output_dir)["icu/chartevents"]["rows"], 1000)
+
+        conn = connect_database({"backend": "duckdb", "local_data_dir": self.output_dir})
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM mimiciv_icu.chartevents WHERE itemid = %s", (220046,))
+        self.assertEqual(cur.fetchone()[0], 333)
+        cur.execute("SELECT icd_code FROM mimiciv_hosp.d_icd_diagnoses")
+        self.assertEqual(cur.fetchall(), [("0010",)])  # 代码列保持文本，前导零不丢失
+        conn.close()
+
+        results = run_ingestion(self.source_dir, self.output_dir, log=messages.append)
+        self.assertEqual(set(results.values()), {"skipped"})
+
+# --- END OF FILE tests/test_parquet_ingest.py ---
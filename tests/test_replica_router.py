@@ -0,0 +1,273 @@
+# --- START OF FILE tests/test_replica_router.py ---
+import unittest
+import sys
+import os
+from collections import namedtuple
+
+import psycopg2
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from sql_logic.replica_router import (parse_replica_endpoints, match_temp_table_materialization,
+                                      build_temp_table_definition_sql, build_consistency_signature_sql,
+                                      find_created_temp_tables, references_table, ReplicaRouter)
+
+_Column = namedtuple("_Column", ["name", "type_code"])
+
+
+class _FakeReplicaCursor:
+    def __init__(self):
+        self.executed = []
+        self.description = None
+
+    def execute(self, sql_text, params=None):
+        self.executed.append(sql_text)
+        if sql_text.startswith("SELECT * FROM"):
+            self.description = [_Column("stay_id", 23), _Column("weight", 701)]
+
+    def fetchall(self):
+        return [("integer",), ("double precision",)]
+
+    def copy_expert(self, sql_text, file):
+        self.executed.append(sql_text)
+        file.write(b"1\t70.5\n2\t82\n")
+
+
+class _FakeReplicaConnection:
+    closed = False
+
+    def __init__(self):
+        self.replica_cursor = _FakeReplicaCursor()
+
+    def cursor(self):
+        return self.replica_cursor
+
+    def close(self):
+        self.closed = True
+
+
+class _FakePrimaryCursor:
+    def __init__(self):
+        self.executed = []
+        self.copied = b""
+
+    def execute(self, sql_text, params=None):
+        self.executed.append(sql_text)
+
+    def copy_expert(self, sql_text, file):
+        self.executed.append(sql_text)
+        self.copied = file.read()
+
+
+class _FakeServerCursor:
+    """按语句应答的主库/副本游标: WAL 位置、回放位置、一致性签名与 CREATE TEMPORARY TABLE 的查询结果。"""
+
+    def __init__(self, server):
+        self.server = server
+        self.description = None
+        self._row = None
+
+    def execute(self, sql_text, params=None):
+        self.server.executed.append(sql_text)
+        if "replica_pending_write" in sql_text:
+            self._row = (self.server.pending_write,)
+        elif "replica_consistency_rows" in sql_text:
+            if self.server.signature_error:
+                raise self.server.signature_error
+            self._row = self.server.signature
+        elif "pg_current_wal_lsn" in sql_text:
+            self._row = ("0/3000060",)
+        elif "pg_is_in_recovery" in sql_text:
+            self._row = (self.server.in_recovery,)
+        elif "pg_last_wal_replay_lsn" in sql_text:
+            self._row = (self.server.replayed,)
+        elif sql_text.startswith("SELECT * FROM"):
+            self.description = [_Column("hadm_id", 23)]
+        elif "format_type" in sql_text:
+            self._row = None
+
+    def fetchone(self):
+        return self._row
+
+    def fetchall(self):
+        return [("integer",)]
+
+    def copy_expert(self, sql_text, file):
+        self.server.executed.append(sql_text)
+        if "TO STDOUT" in sql_text:
+            file.write(b"100\n101\n")
+
+
+class _FakeServer:
+    closed = False
+
+    def __init__(self, signature, in_recovery=False, replayed=True):
+        self.signature = signature
+        self.in_recovery = in_recovery
+        self.replayed = replayed
+        self.pending_write = False
+        self.signature_error = None
+        self.executed = []
+
+    def cursor(self):
+        return _FakeServerCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+def _router_for(replica, max_lag_wait_s=0):
+    router = ReplicaRouter([], max_lag_wait_s=max_lag_wait_s, consistency_table="mimiciv_data.c1", log=lambda message: None)
+    router.conn = replica
+    return router
+
+
+class TestReplicaHelpers(unittest.TestCase):
+
+    def test_parse_endpoints_inherits_primary_params(self):
+        primary = {"dbname": "mimiciv", "user": "postgres", "password": "pw", "host": "db0", "port": "5432"}
+        endpoints = parse_replica_endpoints("# 备库\nreplica1:5433\n\nhost=replica2 dbname=mimic_copy\n", primary)
+        self.assertEqual(len(endpoints), 2)
+        self.assertEqual((endpoints[0]["host"], endpoints[0]["port"], endpoints[0]["dbname"]), ("replica1", "5433", "mimiciv"))
+        self.assertEqual((endpoints[1]["host"], endpoints[1]["port"], endpoints[1]["dbname"]), ("replica2", "5432", "mimic_copy"))
+        self.assertEqual(parse_replica_endpoints("  \n# 无\n", primary), [])
+
+    def test_match_temp_table_materialization(self):
+        self.assertEqual(match_temp_table_materialization("CREATE TEMPORARY TABLE fe_temp AS (\nSELECT hadm_id FROM t\n);"),
+                         ("fe_temp", "SELECT hadm_id FROM t"))
+        matched = match_temp_table_materialization(
+            "-- 只读聚合\nCREATE TEMP TABLE w AS\nWITH r AS (SELECT 1 AS x)\nSELECT x FROM r;")
+        self.assertEqual(matched, ("w", "WITH r AS (SELECT 1 AS x)\nSELECT x FROM r"))
+        self.assertIsNone(match_temp_table_materialization("CREATE TABLE mimiciv_data.c AS SELECT 1"))
+        self.assertIsNone(match_temp_table_materialization("UPDATE t SET a = 1"))
+        self.assertIsNone(match_temp_table_materialization("CREATE TEMPORARY TABLE t AS TABLE other"))
+
+    def test_temp_table_definition(self):
+        self.assertEqual(build_temp_table_definition_sql("w", [("stay_id", "integer"), ("Weight", "numeric")]),
+                         'CREATE TEMPORARY TABLE w ("stay_id" integer, "Weight" numeric)')
+
+
+class TestTryMaterialize(unittest.TestCase):
+
+    def test_falls_back_without_usable_replica(self):
+        router = ReplicaRouter([], log=lambda message: None)
+        primary_cur = _FakePrimaryCursor()
+        self.assertFalse(router.try_materialize(primary_cur, "UPDATE t SET a = 1"))
+        self.assertFalse(router.try_materialize(primary_cur, "CREATE TEMPORARY TABLE w AS SELECT 1 AS x"))
+        self.assertIs(router.is_usable, False)
+        self.assertEqual(primary_cur.executed, [])
+        self.assertIsNone(ReplicaRouter.from_settings({"endpoints": []}))
+
+    def test_copies_replica_result_into_primary_temp_table(self):
+        router = ReplicaRouter([], log=lambda message: None)
+        router.conn = _FakeReplicaConnection()
+        router.is_usable = True
+        primary_cur = _FakePrimaryCursor()
+        self.assertTrue(router.try_materialize(primary_cur, "CREATE TEMPORARY TABLE w AS (SELECT stay_id, weight FROM v);"))
+        self.assertIn("COPY (SELECT stay_id, weight FROM v\n) TO STDOUT", router.conn.replica_cursor.executed)
+        self.assertEqual(primary_cur.executed, ['CREATE TEMPORARY TABLE w ("stay_id" integer, "weight" double precision)',
+                                                "COPY w FROM STDIN"])
+        self.assertEqual(primary_cur.copied, b"1\t70.5\n2\t82\n")
+
+
+class TestReplicaConsistency(unittest.TestCase):
+    STEP = "CREATE TEMPORARY TABLE w AS (SELECT hadm_id FROM mimiciv_hosp.labevents);"
+
+    def test_signature_covers_row_keys(self):
+        signature_sql = build_consistency_signature_sql("mimiciv_data.c1")
+        self.assertIn('FROM "mimiciv_data"."c1"', signature_sql)
+        self.assertIn('md5(COALESCE(string_agg(COALESCE("hadm_id"::text', signature_sql)
+        self.assertIn('ORDER BY "hadm_id", "stay_id"', signature_sql)
+
+    def test_independent_instance_with_same_count_but_different_keys_falls_back(self):
+        primary = _FakeServer((2, "aaa"))
+        router = _router_for(_FakeServer((2, "bbb")))
+        primary_cur = primary.cursor()
+        self.assertFalse(router.try_materialize(primary_cur, self.STEP))
+        self.assertIs(router.is_usable, False)
+        self.assertFalse(any("COPY" in sql for sql in primary.executed))
+        # 不一致后本任务不再尝试路由
+        executed_before = len(primary.executed)
+        self.assertFalse(router.try_materialize(primary_cur, self.STEP))
+        self.assertEqual(len(primary.executed), executed_before)
+
+    def test_signature_rechecked_before_every_step(self):
+        primary, replica = _FakeServer((2, "aaa")), _FakeServer((2, "aaa"))
+        router = _router_for(replica)
+        primary_cur = primary.cursor()
+        self.assertTrue(router.try_materialize(primary_cur, self.STEP))
+        self.assertIn("COPY w FROM STDIN", primary.executed)
+        # 任务中途主库的队列表发生变化 (如另一任务已提交)，副本还没有
+        primary.signature = (3, "ccc")
+        self.assertFalse(router.try_materialize(primary_cur, self.STEP))
+        self.assertEqual(sum("pg_current_wal_lsn" in sql for sql in primary.executed), 1)
+        self.assertEqual(sum("replica_consistency_rows" in sql for sql in primary.executed), 2)
+
+    def test_lagging_streaming_replica_falls_back(self):
+        primary = _FakeServer((2, "aaa"))
+        router = _router_for(_FakeServer((2, "aaa"), in_recovery=True, replayed=False))
+        self.assertFalse(router.try_materialize(primary.cursor(), self.STEP))
+        caught_up = _router_for(_FakeServer((2, "aaa"), in_recovery=True, replayed=True))
+        self.assertTrue(caught_up.try_materialize(primary.cursor(), self.STEP))
+
+    def test_uncommitted_write_on_consistency_table_is_not_routed(self):
+        primary, replica = _FakeServer((2, "aaa")), _FakeServer((2, "aaa"), in_recovery=True)
+        router = _router_for(replica)
+        primary_cur = primary.cursor()
+        # 宽表模式: 同一事务中已执行 ALTER TABLE ADD COLUMN，备库回放后签名查询会等待该表的排他锁
+        primary.pending_write = True
+        self.assertFalse(router.try_materialize(primary_cur, self.STEP))
+        self.assertEqual(replica.executed, [])
+        self.assertIsNone(router.is_usable)
+        # 提交后 (分块执行) 照常路由
+        primary.pending_write = False
+        self.assertTrue(router.try_materialize(primary_cur, self.STEP))
+
+    def test_replica_error_disables_routing_for_the_job(self):
+        primary, replica = _FakeServer((2, "aaa")), _FakeServer((2, "aaa"), in_recovery=True)
+        replica.signature_error = psycopg2.OperationalError("canceling statement due to lock timeout")
+        router = _router_for(replica)
+        primary_cur = primary.cursor()
+        self.assertFalse(router.try_materialize(primary_cur, self.STEP))
+        self.assertIs(router.is_usable, False)
+        replica_queries = len(replica.executed)
+        self.assertFalse(router.try_materialize(primary_cur, self.STEP))
+        self.assertEqual(len(replica.executed), replica_queries)
+
+
+class TestSessionTempTables(unittest.TestCase):
+    STEP = "CREATE TEMPORARY TABLE w AS (SELECT hadm_id FROM mimiciv_hosp.labevents);"
+
+    def test_find_and_reference_temp_tables(self):
+        self.assertEqual(find_created_temp_tables('CREATE TEMP TABLE IF NOT EXISTS Fe_A (x int);\nCREATE TEMPORARY TABLE "Mixed" AS SELECT 1'),
+                         ["fe_a", "Mixed"])
+        self.assertTrue(references_table("SELECT * FROM fe_a JOIN x USING (hadm_id)", "fe_a"))
+        self.assertTrue(references_table('SELECT * FROM "fe_a"', "fe_a"))
+        self.assertFalse(references_table("SELECT fe_a_max FROM fe_ab", "fe_a"))
+        self.assertTrue(references_table('SELECT * FROM "Mixed"', "Mixed"))
+        self.assertFalse(references_table("SELECT * FROM mixed", "Mixed"))
+
+    def test_query_on_job_temp_table_stays_on_primary(self):
+        primary, replica = _FakeServer((2, "aaa")), _FakeServer((2, "aaa"))
+        router = _router_for(replica)
+        primary_cur = primary.cursor()
+        self.assertTrue(router.try_materialize(primary_cur, self.STEP))
+        # 引用上一步 (已在主库建表) 的临时表 w，副本上没有
+        self.assertFalse(router.try_materialize(primary_cur, "CREATE TEMP TABLE w2 AS SELECT hadm_id, COUNT(*) FROM w GROUP BY hadm_id"))
+        # 在主库执行的 CREATE TEMP 也登记，之后引用它的查询同样不路由
+        self.assertFalse(router.try_materialize(primary_cur, "CREATE TEMP TABLE ids (hadm_id int)"))
+        self.assertFalse(router.try_materialize(primary_cur, "CREATE TEMP TABLE w3 AS SELECT * FROM ids"))
+        self.assertEqual(sum("TO STDOUT" in sql for sql in replica.executed), 1)
+        self.assertIs(router.is_usable, True)
+
+    def test_noted_stage_table_is_not_routed(self):
+        router = _router_for(_FakeServer((2, "aaa")))
+        router.note_session_temp_table("feature_stage_c1")
+        primary = _FakeServer((2, "aaa"))
+        self.assertFalse(router.try_materialize(primary.cursor(), "CREATE TEMP TABLE w AS SELECT hadm_id FROM feature_stage_c1"))
+        self.assertTrue(router.try_materialize(primary.cursor(), self.STEP))
+
+# --- END OF FILE tests/test_replica_router.py ---
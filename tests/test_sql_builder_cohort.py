@@ -0,0 +1,105 @@
+# --- START OF FILE tests/test_sql_builder_cohort.py ---
+import unittest
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import psycopg2.sql as pgsql
+from sql_logic.sql_render import render_sql
+from sql_logic.sql_builder_cohort import (build_batch_cohort_sql, build_cohort_index_statements, build_cohort_analyze_sql, cohort_index_name,
+                                          build_cohort_size_explain_sql, build_cohort_size_count_sql, parse_explain_row_estimate,
+                                          COHORT_TYPE_FIRST_EVENT_KEY, COHORT_TYPE_ALL_EVENTS_KEY, ESSENTIAL_COHORT_INDEX_COLUMNS,
+                                          BATCH_MATCHES_TEMP_TABLE, BATCH_SELECTED_TEMP_TABLE, BATCH_ICU_TEMP_TABLE)
+
+DISEASE_SOURCE = {
+    "source_type": "disease", "event_table": "mimiciv_hosp.diagnoses_icd",
+    "dictionary_table": "mimiciv_hosp.d_icd_diagnoses", "event_icd_col": "icd_code",
+    "dict_icd_col": "icd_code", "dict_title_col": "long_title",
+    "event_seq_num_col": "seq_num", "event_time_col": None
+}
+
+
+def _spec(name, condition, params, admission_type=COHORT_TYPE_FIRST_EVENT_KEY):
+    return {"table_name": name, "condition_sql": condition, "condition_params": params, "admission_type": admission_type}
+
+
+class TestSqlBuilderCohort(unittest.TestCase):
+
+    def test_batch_shares_one_scan(self):
+        specs = [
+            _spec("first_dis_sepsis_admissions", "long_title ILIKE %s", ["%sepsis%"]),
+            _spec("all_dis_ami_admissions", "long_title ILIKE %s OR long_title ILIKE %s", ["%infarction%", "%MI%"],
+                  COHORT_TYPE_ALL_EVENTS_KEY),
+        ]
+        steps, err = build_batch_cohort_sql(specs, DISEASE_SOURCE)
+        self.assertIsNone(err)
+        # schema + 打标签扫描 + 排名 + ICU + 每个队列一个目标表
+        self.assertEqual(len(steps), 4 + len(specs))
+        # 只有打标签的一步带参数，且参数按队列顺序拼接
+        self.assertEqual(steps[1][2], ["%sepsis%", "%infarction%", "%MI%"])
+        self.assertTrue(all(params is None for i, (_, _, params) in enumerate(steps) if i != 1))
+        # 事件表只出现在打标签这一步
+        event_ident = pgsql.Identifier("mimiciv_hosp", "diagnoses_icd")
+        self.assertIn(event_ident, steps[1][1].seq)
+        self.assertTrue(all(event_ident not in getattr(sql_obj, "seq", []) for i, (_, sql_obj, _) in enumerate(steps) if i != 1))
+
+    def test_staging_tables_are_analyzed(self):
+        steps, _ = build_batch_cohort_sql([_spec("first_dis_sepsis_admissions", "long_title ILIKE %s", ["%sepsis%"])],
+                                          DISEASE_SOURCE)
+        for step_index, temp_table in ((1, BATCH_MATCHES_TEMP_TABLE), (2, BATCH_SELECTED_TEMP_TABLE), (3, BATCH_ICU_TEMP_TABLE)):
+            self.assertIn(f'ANALYZE "{temp_table}"', render_sql(steps[step_index][1]))
+        self.assertEqual(render_sql(build_cohort_analyze_sql("first_dis_sepsis_admissions")),
+                         'ANALYZE "mimiciv_data"."first_dis_sepsis_admissions";')
+
+    def test_batch_validation(self):
+        _, err = build_batch_cohort_sql([], DISEASE_SOURCE)
+        self.assertIsNotNone(err)
+        dup = [_spec("t1", "long_title ILIKE %s", ["%a%"]), _spec("t1", "long_title ILIKE %s", ["%b%"])]
+        _, err = build_batch_cohort_sql(dup, DISEASE_SOURCE)
+        self.assertIsNotNone(err)
+        _, err = build_batch_cohort_sql([_spec("t1", "  ", [])], DISEASE_SOURCE)
+        self.assertIsNotNone(err)
+
+    def test_index_statements(self):
+        statements = build_cohort_index_statements("first_proc_cabg_admissions", "procedure")
+        names = [name for name, _ in statements]
+        self.assertEqual(len(names), 8) # 诊断 7 个 + 手术的 primary_diag_code
+        self.assertTrue(all(name.startswith("idx_first_proc_cabg_admissions_") for name in names))
+        essential = build_cohort_index_statements("first_proc_cabg_admissions", "procedure", ESSENTIAL_COHORT_INDEX_COLUMNS)
+        self.assertEqual([name.rsplit("_", 1)[1] for name, _ in essential], ["hadm", "stay"])
+        # 只为队列表中实际存在的列建索引
+        existing = build_cohort_index_statements("first_proc_cabg_admissions", "procedure", {"hadm_id", "subject_id", "other"})
+        self.assertEqual([name.rsplit("_", 1)[1] for name, _ in existing], ["sub", "hadm"])
+
+    def test_index_names_unique_across_similar_tables(self):
+        # 前缀相同 (截断后曾经相同) 的长表名，索引名仍然不同且不超过 63 字节
+        long_a = "first_sepsis_with_septic_shock_and_vasopressors_cohort_v1_admissions"
+        long_b = "first_sepsis_with_septic_shock_and_vasopressors_cohort_v2_admissions"
+        names = set()
+        for table_name in ("first_sepsis_v1_admissions", "first_sepsis_v2_admissions", long_a, long_b):
+            for name, _ in build_cohort_index_statements(table_name, "disease"):
+                self.assertLessEqual(len(name.encode("utf-8")), 63)
+                names.add(name)
+        self.assertEqual(len(names), 4 * 7)
+        self.assertEqual(cohort_index_name(long_a, "hadm"), cohort_index_name(long_a, "hadm"))
+
+    def test_cohort_size_sql(self):
+        explain_sql = build_cohort_size_explain_sql("long_title ILIKE %s", DISEASE_SOURCE)
+        count_sql = build_cohort_size_count_sql("long_title ILIKE %s", DISEASE_SOURCE)
+        self.assertTrue(explain_sql.seq[0].string.startswith("EXPLAIN (FORMAT JSON)"))
+        self.assertIn("COUNT(DISTINCT e.hadm_id)", count_sql.seq[0].string)
+        self.assertIn(pgsql.Identifier("mimiciv_hosp", "diagnoses_icd"), count_sql.seq[1].seq)
+
+    def test_parse_explain_row_estimate(self):
+        self.assertEqual(parse_explain_row_estimate([{"Plan": {"Node Type": "Hash Join", "Plan Rows": 1234}}]), 1234)
+        self.assertEqual(parse_explain_row_estimate('[{"Plan": {"Plan Rows": 7}}]'), 7)
+        self.assertIsNone(parse_explain_row_estimate([]))
+
+
+if __name__ == '__main__':
+    unittest.main()
+# --- END OF FILE tests/test_sql_builder_cohort.py ---
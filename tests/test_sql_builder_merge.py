@@ -0,0 +1,82 @@
+# --- START OF FILE tests/test_sql_builder_merge.py ---
+import unittest
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import psycopg2
+import psycopg2.sql as pgsql
+from sql_logic.sql_builder_merge import build_table_merge_sql
+from app_config import SQL_BUILDER_DUMMY_DB_FOR_AS_STRING
+
+
+class TestSqlBuilderMerge(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            self.dummy_conn = psycopg2.connect(SQL_BUILDER_DUMMY_DB_FOR_AS_STRING)
+        except psycopg2.Error:
+            self.dummy_conn = None
+
+    def tearDown(self):
+        if self.dummy_conn:
+            self.dummy_conn.close()
+
+    def test_suffixes_and_shared_key(self):
+        sql_obj, err, cols = build_table_merge_sql(
+            "mimiciv_data.first_sepsis_admissions", "mimiciv_data.lab_features",
+            left_keys=["hadm_id"], right_keys=["hadm_id"],
+            left_columns=["subject_id", "age", "los"], right_columns=["subject_id", "lactate_max"],
+            join_type="left"
+        )
+        self.assertIsNone(err)
+        self.assertIsInstance(sql_obj, pgsql.Composed)
+        # 同名合并键只保留一列，其余重叠列追加后缀 (与 pandas.merge 一致)
+        self.assertEqual(cols, ["subject_id_left", "age", "los", "hadm_id", "subject_id_right", "lactate_max"])
+        if self.dummy_conn:
+            sql_string = sql_obj.as_string(self.dummy_conn)
+            self.assertIn('LEFT JOIN "mimiciv_data"."lab_features" "r"', sql_string)
+            self.assertIn('"l"."hadm_id" = "r"."hadm_id"', sql_string)
+
+    def test_outer_join_coalesces_shared_key(self):
+        sql_obj, err, cols = build_table_merge_sql(
+            "mimiciv_data.a", "mimiciv_data.b", ["hadm_id"], ["hadm_id"], ["x"], ["y"], join_type="outer")
+        self.assertIsNone(err)
+        self.assertEqual(cols, ["x", "hadm_id", "y"])
+        if self.dummy_conn:
+            self.assertIn('COALESCE("l"."hadm_id", "r"."hadm_id")', sql_obj.as_string(self.dummy_conn))
+
+    def test_different_key_names_kept(self):
+        _, err, cols = build_table_merge_sql(
+            "mimiciv_data.a", "mimiciv_data.b", ["hadm_id"], ["hadm"], ["x"], ["y"], join_type="inner")
+        self.assertIsNone(err)
+        self.assertEqual(cols, ["x", "hadm_id", "y", "hadm"])
+
+    def test_materialize_target(self):
+        sql_obj, err, _ = build_table_merge_sql(
+            "mimiciv_data.a", "mimiciv_data.b", ["hadm_id"], ["hadm_id"], ["x"], ["y"],
+            target_table_name="mimiciv_data.merged_ab")
+        self.assertIsNone(err)
+        self.assertIsInstance(sql_obj, pgsql.Composed)
+        _, err, _ = build_table_merge_sql(
+            "mimiciv_data.a", "mimiciv_data.b", ["hadm_id"], ["hadm_id"], ["x"], ["y"],
+            target_table_name="merged_ab")
+        self.assertIsNotNone(err)
+
+    def test_invalid_inputs(self):
+        _, err, _ = build_table_merge_sql("a", "mimiciv_data.b", ["k"], ["k"], [], [])
+        self.assertIsNotNone(err)
+        _, err, _ = build_table_merge_sql("s.a", "s.b", ["k1", "k2"], ["k"], [], [])
+        self.assertIsNotNone(err)
+        _, err, _ = build_table_merge_sql("s.a", "s.b", ["k"], ["k"], [], [], join_type="cross")
+        self.assertIsNotNone(err)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# --- END OF FILE tests/test_sql_builder_merge.py ---
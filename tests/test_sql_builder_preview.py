@@ -0,0 +1,124 @@
+# --- START OF FILE tests/test_sql_builder_preview.py ---
+import unittest
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import psycopg2
+import psycopg2.sql as pgsql
+from sql_logic.sql_builder_preview import (
+    APPROX_ROW_COUNT_SQL, PRIMARY_KEY_COLUMNS_SQL, TABLE_EXISTS_SQL,
+    compute_sample_percent, build_sample_preview_sql, build_keyset_page_sql,
+    SAMPLE_METHOD_SYSTEM, SAMPLE_METHOD_BERNOULLI
+)
+from sql_logic.db_backend import DuckDBConnection, BACKEND_DUCKDB, is_duckdb_available, duckdb
+from sql_logic.sql_render import render_sql
+from app_config import SQL_BUILDER_DUMMY_DB_FOR_AS_STRING, PREVIEW_SAMPLE_MIN_PERCENT
+
+
+class TestSqlBuilderPreview(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            self.dummy_conn = psycopg2.connect(SQL_BUILDER_DUMMY_DB_FOR_AS_STRING)
+        except psycopg2.Error:
+            self.dummy_conn = None
+
+    def tearDown(self):
+        if self.dummy_conn:
+            self.dummy_conn.close()
+
+    def test_compute_sample_percent(self):
+        self.assertEqual(compute_sample_percent(None, 100), 100.0)
+        self.assertEqual(compute_sample_percent(-1, 100), 100.0)
+        self.assertEqual(compute_sample_percent(50, 100), 100.0) # 小表直接全量
+        self.assertAlmostEqual(compute_sample_percent(3_000_000, 100), 0.01)
+        self.assertEqual(compute_sample_percent(10**12, 100), PREVIEW_SAMPLE_MIN_PERCENT)
+
+    def test_sample_preview_sql(self):
+        query, err = build_sample_preview_sql("mimiciv_data", "cohort", 100, 0.5, SAMPLE_METHOD_BERNOULLI)
+        self.assertIsNone(err)
+        self.assertIsInstance(query, pgsql.Composed)
+        if self.dummy_conn:
+            self.assertIn("TABLESAMPLE BERNOULLI (0.5)", query.as_string(self.dummy_conn))
+        _, err = build_sample_preview_sql("mimiciv_data", "cohort", 100, 0.5, "RANDOM")
+        self.assertIsNotNone(err)
+
+    def test_sample_preview_sql_system_is_default(self):
+        query, err = build_sample_preview_sql("mimiciv_data", "cohort", 100, 0.25)
+        self.assertIsNone(err)
+        self.assertEqual(render_sql(query), 'SELECT * FROM "mimiciv_data"."cohort" TABLESAMPLE SYSTEM (0.25) LIMIT 100')
+        explicit, _ = build_sample_preview_sql("mimiciv_data", "cohort", 100, 0.25, SAMPLE_METHOD_SYSTEM)
+        self.assertEqual(render_sql(explicit), render_sql(query))
+        # 抽样比例达到 100% 时不再抽样
+        full_scan, _ = build_sample_preview_sql("mimiciv_data", "cohort", 100, 100, SAMPLE_METHOD_SYSTEM)
+        self.assertNotIn("TABLESAMPLE", render_sql(full_scan))
+
+    def test_keyset_first_and_next_page(self):
+        query, params = build_keyset_page_sql("mimiciv_data", "cohort", ["subject_id", "hadm_id"], None, 100)
+        self.assertEqual(params, [])
+        query, params = build_keyset_page_sql("mimiciv_data", "cohort", ["subject_id", "hadm_id"], (1, 2), 100)
+        self.assertEqual(params, [1, 2])
+        if self.dummy_conn:
+            self.assertIn('WHERE ("subject_id", "hadm_id") > (%s, %s)', query.as_string(self.dummy_conn))
+
+    def test_keyset_without_primary_key_uses_ctid(self):
+        query, params = build_keyset_page_sql("mimiciv_data", "cohort", [], ("(0,5)",), 50)
+        self.assertEqual(params, ["(0,5)"])
+        if self.dummy_conn:
+            sql_string = query.as_string(self.dummy_conn)
+            self.assertIn("ctid > %s::tid", sql_string)
+            self.assertIn("ORDER BY ctid", sql_string)
+
+
+
+@unittest.skipUnless(is_duckdb_available(), "duckdb 未安装")
+class TestPreviewQueriesOnDuckDB(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = DuckDBConnection(duckdb.connect(), ":memory:")
+        cur = self.conn.cursor()
+        cur.execute("CREATE SCHEMA mimiciv_data")
+        cur.execute("CREATE TABLE mimiciv_data.cohort AS SELECT i AS hadm_id, i % 7 AS los FROM range(5000) t(i)")
+        self.conn.commit()
+        self.cur = cur
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_catalog_queries(self):
+        self.cur.execute(TABLE_EXISTS_SQL, ("mimiciv_data", "cohort"))
+        self.assertTrue(self.cur.fetchone()[0])
+        self.cur.execute(TABLE_EXISTS_SQL, ("mimiciv_data", "feature_store"))
+        self.assertFalse(self.cur.fetchone()[0])
+        self.cur.execute(APPROX_ROW_COUNT_SQL, ("mimiciv_data", "cohort"))
+        self.assertEqual(self.cur.fetchone()[0], 5000)
+        self.cur.execute(PRIMARY_KEY_COLUMNS_SQL, ("mimiciv_data", "cohort"))
+        self.assertEqual(self.cur.fetchall(), [])
+
+    def test_sample_preview_runs(self):
+        for method in (SAMPLE_METHOD_SYSTEM, SAMPLE_METHOD_BERNOULLI):
+            query, err = build_sample_preview_sql("mimiciv_data", "cohort", 100, 50.0, method, BACKEND_DUCKDB)
+            self.assertIsNone(err)
+            self.assertIn(f"TABLESAMPLE 50.0 PERCENT ({method.lower()})", render_sql(query))
+            self.cur.execute(query)
+            self.assertLessEqual(len(self.cur.fetchall()), 100)
+
+    def test_keyset_pages_by_rowid(self):
+        query, params = build_keyset_page_sql("mimiciv_data", "cohort", [], None, 3, BACKEND_DUCKDB)
+        self.cur.execute(query, params or None)
+        first_page = self.cur.fetchall()
+        self.assertEqual([row[0] for row in first_page], [0, 1, 2])
+        query, params = build_keyset_page_sql("mimiciv_data", "cohort", [], (str(first_page[-1][0]),), 3, BACKEND_DUCKDB)
+        self.cur.execute(query, params)
+        self.assertEqual([row[1] for row in self.cur.fetchall()], [3, 4, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# --- END OF FILE tests/test_sql_builder_preview.py ---
@@ -9,7 +9,7 @@ project_root = os.path.dirname(current_dir)
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from sql_logic.sql_builder_special import build_special_data_sql
+from sql_logic.sql_builder_special import build_special_data_sql, _window_filtered_template, _build_dedup_clauses
 # 假设 utils.py 中的 validate_column_name 被 sql_builder_special 内部使用，不需要在这里直接测
 # from utils import validate_column_name 
 
@@ -80,7 +80,7 @@ class TestSqlBuilderSpecial(unittest.TestCase):
         )
         self.assertEqual(exec_type, "execution_list")
         self.assertIsNotNone(exec_steps)
-        self.assertEqual(len(exec_steps), 4) # ALTER, CREATE TEMP, UPDATE, DROP TEMP
+        self.assertEqual(len(exec_steps), 5) # ALTER, CREATE TEMP, ANALYZE, UPDATE, DROP TEMP
         self.assertEqual(exec_desc, base_col_name)
         self.assertEqual(exec_gen_cols[0][0], "hr_first")
 
@@ -92,6 +92,148 @@ class TestSqlBuilderSpecial(unittest.TestCase):
             self.assertIn("ALTER TABLE mimiciv_data.test_cohort ADD COLUMN IF NOT EXISTS hr_first NUMERIC", alter_sql_str)
             self.assertIn("CREATE TEMPORARY TABLE temp_merge_data_hr_", create_temp_sql_str) # 部分匹配临时表名
 
+    def test_build_timeseries_array_two_columns(self):
+        panel_config = {
+            "source_event_table": "mimiciv_hosp.labevents",
+            "item_id_column_in_event_table": "itemid",
+            "value_column_to_extract": "valuenum",
+            "time_column_in_event_table": "charttime",
+            "selected_item_ids": ["50813"],
+            "aggregation_methods": {"TIMESERIES_ARRAY": True},
+            "event_outputs": None,
+            "time_window_text": "整个住院期间",
+            "cte_join_on_cohort_override": None
+        }
+        exec_steps, exec_type, _, gen_cols = build_special_data_sql(
+            "mimiciv_data.test_cohort", "lactate", panel_config, for_execution=True)
+        self.assertEqual(exec_type, "execution_list")
+        self.assertEqual(gen_cols, [("lactate_timeseries_array_values", "DOUBLE PRECISION[]"),
+                                    ("lactate_timeseries_array_times", "TIMESTAMP[]")])
+        if self.dummy_conn:
+            alter_sql_str = exec_steps[0][0].as_string(self.dummy_conn)
+            self.assertIn('"lactate_timeseries_array_values" DOUBLE PRECISION[]', alter_sql_str)
+
+        panel_config["value_column_to_extract"] = "value"
+        _, err_msg, _, _ = build_special_data_sql("mimiciv_data.test_cohort", "lactate", panel_config)
+        self.assertIsNotNone(err_msg) # 数组输出仅支持数值列
+
+    def _binned_panel_config(self, **binning_overrides):
+        binning = {"bin_width_minutes": 60, "window_start_hours": 0, "window_end_hours": 48,
+                   "anchor_column": "icu_intime", "layout": "long"}
+        binning.update(binning_overrides)
+        return {
+            "source_event_table": "mimiciv_icu.chartevents",
+            "item_id_column_in_event_table": "itemid",
+            "value_column_to_extract": "valuenum",
+            "time_column_in_event_table": "charttime",
+            "selected_item_ids": ["220045", "220050"],
+            "aggregation_methods": {"MEAN": True, "MAX": True, "TIMESERIES_JSON": True},
+            "event_outputs": None,
+            "time_window_text": "整个ICU期间",
+            "cte_join_on_cohort_override": None,
+            "time_binning": binning,
+        }
+
+    def test_build_time_binned_long(self):
+        target_table = "mimiciv_data.test_cohort"
+        preview_sql, err_msg, params, gen_cols = build_special_data_sql(
+            target_table, "hr", self._binned_panel_config(), for_execution=False)
+        self.assertIsNone(err_msg)
+        self.assertIsInstance(preview_sql, pgsql.Composed)
+        self.assertEqual(params, [("220045", "220050")])
+        # TIMESERIES_JSON 在分箱模式下被跳过
+        self.assertEqual([c[0] for c in gen_cols], ["hr_mean", "hr_max"])
+
+        exec_steps, exec_type, out_table, _ = build_special_data_sql(
+            target_table, "hr", self._binned_panel_config(), for_execution=True)
+        self.assertEqual(exec_type, "execution_list")
+        self.assertEqual(out_table, "mimiciv_data.test_cohort_hr_bins")
+        self.assertEqual(len(exec_steps), 4) # DROP, CREATE TABLE AS, CREATE INDEX, ANALYZE
+        self.assertEqual(exec_steps[1][1], params)
+
+        if self.dummy_conn:
+            create_sql_str = exec_steps[1][0].as_string(self.dummy_conn)
+            self.assertIn("date_bin('60 minutes'::interval", create_sql_str)
+            self.assertIn("generate_series(0, 47)", create_sql_str)
+            self.assertIn('"evt"."charttime" >= ("cohort"."icu_intime" + \'0 hours\'::interval)', create_sql_str)
+
+    def test_build_time_binned_array_and_validation(self):
+        _, err_msg, _, gen_cols = build_special_data_sql(
+            "mimiciv_data.test_cohort", "hr", self._binned_panel_config(layout="array"), for_execution=False)
+        self.assertIsNone(err_msg)
+        self.assertEqual(gen_cols[0][1], "DOUBLE PRECISION[]")
+
+        _, err_msg, _, _ = build_special_data_sql(
+            "mimiciv_data.test_cohort", "hr", self._binned_panel_config(bin_width_minutes=50), for_execution=False)
+        self.assertIsNotNone(err_msg) # 48h 不能被 50 分钟整除
+
+        text_config = self._binned_panel_config()
+        text_config["value_column_to_extract"] = "value"
+        _, err_msg, _, _ = build_special_data_sql("mimiciv_data.test_cohort", "hr", text_config, for_execution=False)
+        self.assertIsNotNone(err_msg)
+
+    def test_build_multi_window_single_scan(self):
+        panel_config = {
+            "source_event_table": "mimiciv_icu.chartevents",
+            "item_id_column_in_event_table": "itemid",
+            "value_column_to_extract": "valuenum",
+            "time_column_in_event_table": "charttime",
+            "selected_item_ids": [220045],
+            "aggregation_methods": {"MEAN": True, "MEDIAN": True, "CV": True},
+            "time_window_text": "ICU入住后24小时",
+            "time_windows": ["ICU入住后24小时", "整个ICU期间"],
+        }
+        exec_steps, sql_type, _, gen_cols = build_special_data_sql(
+            "mimiciv_data.test_cohort", "hr", panel_config, for_execution=True)
+        self.assertEqual(sql_type, "execution_list")
+        self.assertEqual([c[0] for c in gen_cols], [
+            "hr_mean_icu24h", "hr_median_icu24h", "hr_cv_icu24h",
+            "hr_mean_icuall", "hr_median_icuall", "hr_cv_icuall"])
+        self.assertEqual(len(exec_steps), 5) # ALTER, CREATE TEMP, ANALYZE, UPDATE, DROP
+
+        if self.dummy_conn:
+            create_sql_str = exec_steps[1][0].as_string(self.dummy_conn)
+            self.assertEqual(create_sql_str.count("FROM mimiciv_icu.chartevents"), 1)
+            self.assertIn("GREATEST(", create_sql_str)
+            self.assertIn("FILTER (WHERE in_window_1)", create_sql_str)
+
+        panel_config["time_windows"] = ["ICU入住后24小时", "住院以前 (既往史)"]
+        _, err_msg, _, _ = build_special_data_sql("mimiciv_data.test_cohort", "hr", panel_config, for_execution=True)
+        self.assertIsNotNone(err_msg)
+
+    def test_dedup_strategies(self):
+        panel_config = {
+            "source_event_table": "mimiciv_icu.chartevents",
+            "item_id_column_in_event_table": "itemid",
+            "value_column_to_extract": "valuenum",
+            "time_column_in_event_table": "charttime",
+            "selected_item_ids": [220045, 220050],
+            "aggregation_methods": {"MEAN": True},
+            "time_window_text": "整个ICU期间",
+        }
+        for strategy in ("none", "exact", "latest_storetime"):
+            panel_config["dedup_strategy"] = strategy
+            _, err_msg, _, _ = build_special_data_sql("mimiciv_data.test_cohort", "hr", panel_config, for_execution=False)
+            self.assertIsNone(err_msg, strategy)
+
+        select_sql, order_sql, err = _build_dedup_clauses(
+            "latest_storetime", pgsql.Identifier("evt"), "stay_id", pgsql.Identifier("itemid"), pgsql.Identifier("charttime"), "storetime")
+        self.assertIsNone(err)
+        self.assertIn(pgsql.Identifier("storetime"), order_sql.seq)
+        self.assertEqual(_build_dedup_clauses("none", pgsql.Identifier("evt"), "stay_id", None, None, "storetime")[0], pgsql.SQL(""))
+
+        panel_config["dedup_strategy"] = "bogus"
+        _, err_msg, _, _ = build_special_data_sql("mimiciv_data.test_cohort", "hr", panel_config, for_execution=False)
+        self.assertIsNotNone(err_msg)
+
+    def test_window_filtered_template(self):
+        self.assertEqual(_window_filtered_template("AVG({val_col})", "in_window_0"),
+                         "AVG({val_col}) FILTER (WHERE in_window_0)")
+        self.assertEqual(_window_filtered_template("PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY {val_col})", "w"),
+                         "PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY {val_col}) FILTER (WHERE w)")
+        self.assertEqual(_window_filtered_template("MAX({val_col}) - MIN({val_col})", "w"),
+                         "MAX((CASE WHEN w THEN {val_col} END)) - MIN((CASE WHEN w THEN {val_col} END))")
+
     # 你可以为其他面板类型、不同的聚合方法、时间窗口、文本提取等添加更多的测试用例
     # def test_build_chartevents_value_last_text(self): ...
     # def test_build_medication_exists_prior(self): ...
@@ -0,0 +1,81 @@
+# --- START OF FILE tests/test_sql_render.py ---
+import unittest
+import sys
+import os
+import datetime
+import decimal
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import psycopg2.sql as pgsql
+from sql_logic.sql_render import render_sql, quote_identifier, quote_literal
+from sql_logic.condition_tree import make_keyword_node, make_group_node, build_condition_sql
+
+
+class TestSqlRender(unittest.TestCase):
+
+    def test_quote_identifier_and_literal(self):
+        self.assertEqual(quote_identifier('we"ird'), '"we""ird"')
+        self.assertEqual(quote_literal("O'Brien"), "'O''Brien'")
+        self.assertEqual(quote_literal("a\\b"), "E'a\\\\b'")
+        self.assertEqual(quote_literal(None), "NULL")
+        self.assertEqual(quote_literal(True), "true")
+        self.assertEqual(quote_literal(-2), " -2")
+        self.assertEqual(quote_literal(1.5), "1.5")
+        self.assertEqual(quote_literal(float("nan")), "'NaN'::float")
+        self.assertEqual(quote_literal((1, "x")), "(1, 'x')")
+        self.assertEqual(quote_literal(datetime.date(2020, 1, 2)), "'2020-01-02'::date")
+        with self.assertRaises(ValueError):
+            quote_literal("bad\x00")
+
+    def test_render_composed(self):
+        query = pgsql.SQL("SELECT {cols} FROM {table} WHERE {col} = {val} AND x = %s AND y = {ph}").format(
+            cols=pgsql.SQL(", ").join([pgsql.Identifier("a"), pgsql.Identifier("b")]),
+            table=pgsql.Identifier("mimiciv_data", "cohort"), col=pgsql.Identifier("c"),
+            val=pgsql.Literal("v'1"), ph=pgsql.Placeholder("name"))
+        self.assertEqual(render_sql(query),
+                         'SELECT "a", "b" FROM "mimiciv_data"."cohort" WHERE "c" = \'v\'\'1\' AND x = %s AND y = %(name)s')
+
+    def test_condition_tree(self):
+        tree = make_group_node("OR", [
+            make_keyword_node("long_title", "包含", " sepsis "),
+            make_keyword_node("long_title", "包含", ""),  # 空值被忽略
+            make_group_node("AND", [
+                make_keyword_node("itemid", "大于等于", "220000"),
+                make_keyword_node("label", "等于", "Heart Rate"),
+            ]),
+            make_group_node("AND", []),  # 空组被忽略
+        ])
+        sql_text, params = build_condition_sql(tree)
+        self.assertEqual(sql_text, 'CAST("long_title" AS TEXT) ILIKE %s OR ("itemid" >= %s AND CAST("label" AS TEXT) = %s)')
+        self.assertEqual(params, ["%sepsis%", 220000.0, "Heart Rate"])
+        self.assertEqual(build_condition_sql(make_group_node("AND", [])), ("", []))
+
+    def test_condition_tree_with_column_types(self):
+        column_types = {"icd_code": "character", "long_title": "text", "itemid": "integer",
+                        "lower_ref": "numeric", "chartdate": "date"}
+        tree = make_group_node("AND", [
+            make_keyword_node("icd_code", "等于", "I21"),
+            make_keyword_node("icd_code", "包含", "I21%"),
+            make_keyword_node("long_title", "排除", "sepsis"),
+            make_keyword_node("itemid", "等于", "220045"),
+            make_keyword_node("lower_ref", "大于", "1.5"),
+            make_keyword_node("chartdate", "小于", "2150-01-01"),
+            make_keyword_node("long_title", "等于", "a_b*"),
+        ])
+        sql_text, params = build_condition_sql(tree, column_types)
+        self.assertEqual(sql_text, '"icd_code" = %s AND "icd_code" LIKE %s AND "long_title" NOT ILIKE %s AND '
+                                   '"itemid" = %s AND "lower_ref" > %s AND "chartdate" < %s AND "long_title" LIKE %s')
+        self.assertEqual(params, ["I21", "I21%", "%sepsis%", 220045, decimal.Decimal("1.5"), "2150-01-01", "a\\_b%"])
+        self.assertIsInstance(params[3], int)
+        # 类型未知的列沿用旧规则；前缀搜索在非文本列上仍按前缀匹配
+        sql_text, params = build_condition_sql(make_group_node("AND", [make_keyword_node("code", "包含", "I21*")]), {})
+        self.assertEqual((sql_text, params), ('CAST("code" AS TEXT) ILIKE %s', ["I21%"]))
+
+if __name__ == '__main__':
+    unittest.main()
+
+# --- END OF FILE tests/test_sql_render.py ---
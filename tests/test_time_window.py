@@ -0,0 +1,47 @@
+# --- START OF FILE tests/test_time_window.py ---
+import unittest
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import psycopg2.sql as pgsql
+from sql_logic.time_window import (resolve_time_window_spec, validate_time_window_spec,
+                                   build_time_window_bounds, time_window_name_code)
+
+
+class TestTimeWindow(unittest.TestCase):
+
+    def test_resolve_preset_and_custom(self):
+        spec = resolve_time_window_spec("ICU入住后24小时")
+        self.assertEqual((spec["anchor"], spec["end_anchor"], spec["end_offset_hours"]), ("icu_intime", "icu_intime", 24))
+        self.assertEqual(time_window_name_code(spec), "icu24h")
+        self.assertIsNone(resolve_time_window_spec("住院以前 (既往史)")) # 非范围窗口由 builder 单独处理
+
+        custom = resolve_time_window_spec({"anchor": "icu_intime", "start_offset_hours": -6, "end_offset_hours": 72})
+        self.assertEqual(custom["end_anchor"], "icu_intime")
+        self.assertEqual(time_window_name_code(custom), "icu_m6h_72h")
+        self.assertTrue(validate_time_window_spec(custom)[0])
+
+    def test_validate_rejects_bad_windows(self):
+        self.assertFalse(validate_time_window_spec(resolve_time_window_spec(
+            {"anchor": "icu_intime", "start_offset_hours": 24, "end_offset_hours": 0}))[0])
+        self.assertFalse(validate_time_window_spec(resolve_time_window_spec(
+            {"anchor": "charttime; DROP TABLE x", "start_offset_hours": 0, "end_offset_hours": 1}))[0])
+
+    def test_bounds_are_anchor_plus_interval(self):
+        spec = resolve_time_window_spec({"anchor": "admittime", "start_offset_hours": -6,
+                                         "end_anchor": "dischtime", "end_offset_hours": 0})
+        start_sql, end_sql = build_time_window_bounds(spec, pgsql.Identifier("cohort"))
+        self.assertIsInstance(start_sql, pgsql.Composed)
+        self.assertIn(pgsql.Literal("-6 hours"), start_sql.seq)
+        self.assertIn(pgsql.Identifier("dischtime"), end_sql.seq)
+        self.assertEqual(time_window_name_code(spec), "adm_m6h_disch_0h")
+
+
+if __name__ == '__main__':
+    unittest.main()
+# --- END OF FILE tests/test_time_window.py ---
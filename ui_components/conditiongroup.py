@@ -1,8 +1,7 @@
 # --- START OF PROPOSED MODIFICATION FOR conditiongroup.py ---
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QComboBox, QLabel, QFrame, QGroupBox)
 from PySide6.QtCore import Qt, Signal
-import psycopg2 # 需要导入
-from psycopg2 import sql as pgsql # 确保 pgsql 被正确导入和使用
+from sql_logic.condition_tree import make_keyword_node, make_group_node, build_condition_sql
 import re # re is not used in this file from the provided snippet, but good to keep if other parts use it.
 
 class ConditionGroupWidget(QWidget):
@@ -14,6 +13,9 @@ class ConditionGroupWidget(QWidget):
         # self.search_field 不再是顶层属性，而是每行关键词自己的属性
         self._block_signals = False
         self._available_search_fields = [] # 存储 (db_col_name, display_name)
+        self._field_types = {} # 列名 -> information_schema 的 data_type，用于按真实类型编译条件
+        self._revision = 0
+        self._condition_cache = None # (修订号, SQL 文本, 参数)
         self.init_ui()
         if self.is_root: # 确保根节点有一个默认的关键词行
              self.add_keyword()
@@ -115,6 +117,16 @@ class ConditionGroupWidget(QWidget):
             self._emit_condition_changed()
 
 
+    def set_field_types(self, field_types: dict):
+        """设置可搜索字段的真实列类型 (空字典表示未知，退回按列名推测)。"""
+        field_types = dict(field_types or {})
+        if field_types == self._field_types:
+            return
+        self._field_types = field_types
+        for child_group in self.child_groups:
+            child_group.set_field_types(field_types)
+        self._emit_condition_changed()
+
     def add_keyword(self, field_db_name=None, keyword_type="包含", keyword_text=""): # 新增 field_db_name 参数
         kw_widget = QWidget()
         kw_layout = QHBoxLayout(kw_widget)
@@ -193,6 +205,7 @@ class ConditionGroupWidget(QWidget):
     def add_group(self, group_data=None): # group_data 是用于加载状态的
         group = ConditionGroupWidget(is_root=False, parent=self)
         group.set_available_search_fields(self._available_search_fields)
+        group.set_field_types(self._field_types)
         group.condition_changed.connect(self._emit_condition_changed)
         self.child_groups.append(group)
         self.items_layout.addWidget(group)
@@ -215,147 +228,25 @@ class ConditionGroupWidget(QWidget):
         self.deleteLater()
 
     def _emit_condition_changed(self):
+        # 子组的变化经由信号传到这里，父组的修订号随之递增；屏蔽信号期间的修改同样使缓存失效
+        self._revision += 1
         if not self._block_signals:
              self.condition_changed.emit()
 
-    def _build_sql_string_fallback(self, sql_object) -> str:
-        """
-        Internal helper to convert psycopg2.sql objects to string without a db context.
-        This is a simplified version and might not handle all edge cases (e.g., complex Literals).
-        """
-        parts = []
-        def to_list_recursive(obj_to_convert, out_list):
-            if isinstance(obj_to_convert, pgsql.Composed):
-                for sub_item_in_composed in obj_to_convert:
-                    to_list_recursive(sub_item_in_composed, out_list)
-            elif isinstance(obj_to_convert, pgsql.SQL):
-                out_list.append(obj_to_convert.string)
-            elif isinstance(obj_to_convert, pgsql.Identifier):
-                temp_quoted_list_for_identifier = []
-                for s_part_from_identifier in obj_to_convert.strings:
-                    escaped_s_part = s_part_from_identifier.replace('"', '""')
-                    temp_quoted_list_for_identifier.append(f'"{escaped_s_part}"')
-                out_list.append(".".join(temp_quoted_list_for_identifier))
-            elif isinstance(obj_to_convert, pgsql.Literal):
-                try:
-                    out_list.append(str(obj_to_convert))
-                except Exception:
-                    out_list.append(f"'LITERAL_CONVERSION_ERROR:{obj_to_convert!r}'")
-            elif isinstance(obj_to_convert, str):
-                 out_list.append(obj_to_convert)
-            else: # Unknown type, use its string representation
-                out_list.append(str(obj_to_convert))
-        
-        to_list_recursive(sql_object, parts)
-        return "".join(parts)
-
+    def get_condition_ast(self) -> dict:
+        """当前条件树的结构化表示 (见 sql_logic/condition_tree.py)。"""
+        children = [make_keyword_node(kw_data["field_combo"].currentData(), kw_data["type_combo"].currentText(),
+                                      kw_data["input"].text()) for kw_data in self.keywords]
+        children.extend(group.get_condition_ast() for group in self.child_groups)
+        return make_group_node(self.logic_combo.currentText(), children)
 
     def get_condition(self):
-        cond_parts = []
-        params = []
-        
-        for kw_data in self.keywords:
-            search_field_for_kw = kw_data["field_combo"].currentData() 
-            kw_text = kw_data["input"].text().strip()
-            kw_operator_text = kw_data["type_combo"].currentText()
-
-            if search_field_for_kw and kw_text: 
-                field_ident = pgsql.Identifier(search_field_for_kw)
-                
-                is_numeric_target_col = "id" in search_field_for_kw.lower() or \
-                                        "version" in search_field_for_kw.lower() or \
-                                        "count" in search_field_for_kw.lower() or \
-                                        "age" in search_field_for_kw.lower() or \
-                                        "num" in search_field_for_kw.lower()
-
-                sql_part = None
-                param_val = None
-
-                try:
-                    if kw_operator_text == "包含":
-                        sql_part = pgsql.SQL("CAST({fld} AS TEXT) ILIKE %s").format(fld=field_ident)
-                        param_val = f"%{kw_text}%"
-                    elif kw_operator_text == "排除":
-                        sql_part = pgsql.SQL("CAST({fld} AS TEXT) NOT ILIKE %s").format(fld=field_ident)
-                        param_val = f"%{kw_text}%"
-                    elif kw_operator_text in ["等于", "不等于", "大于", "小于", "大于等于", "小于等于"]:
-                        op_map = {"等于": "=", "不等于": "!=", "大于": ">", "小于": "<", "大于等于": ">=", "小于等于": "<="}
-                        sql_op_py_str = op_map[kw_operator_text] # Python string like "="
-                        
-                        can_be_numeric_val = False
-                        try:
-                            float_val_from_text = float(kw_text)
-                            can_be_numeric_val = True
-                        except ValueError:
-                            pass
-
-                        if is_numeric_target_col and can_be_numeric_val:
-                            param_val = float_val_from_text
-                            # Use named placeholders for clarity
-                            sql_part = pgsql.SQL("{identifier} {operator} %s").format(
-                                identifier=field_ident, 
-                                operator=pgsql.SQL(sql_op_py_str)
-                            )
-                        else: 
-                            param_val = kw_text
-                            sql_part = pgsql.SQL("CAST({identifier} AS TEXT) {operator} %s").format(
-                                identifier=field_ident,
-                                operator=pgsql.SQL(sql_op_py_str)
-                            )
-                    
-                    if sql_part and param_val is not None:
-                        cond_parts.append(sql_part)
-                        params.append(param_val)
-                except Exception as e:
-                    print(f"Error processing keyword condition ({search_field_for_kw} {kw_operator_text} {kw_text}): {e}")
-                    continue 
-
-        for group in self.child_groups:
-            group_sql_template, group_params = group.get_condition()
-            if group_sql_template:
-                cond_parts.append(pgsql.SQL("({})").format(pgsql.SQL(group_sql_template)))
-                params.extend(group_params)
-
-        if not cond_parts:
-            return "", []
-
-        logic_operator_sql = pgsql.SQL(f" {self.logic_combo.currentText()} ")
-        
-        full_sql_composed = None
-        if len(cond_parts) == 1:
-            full_sql_composed = cond_parts[0]
-        else:
-            composed_parts_with_ops = []
-            for i, part in enumerate(cond_parts):
-                composed_parts_with_ops.append(part)
-                if i < len(cond_parts) - 1:
-                    composed_parts_with_ops.append(logic_operator_sql)
-            full_sql_composed = pgsql.Composed(composed_parts_with_ops)
-        
-        dummy_conn = None
-        try:
-            dsn_ = ""
-            try:
-                dsn_ = psycopg2.connect("").dsn
-                parsed_dsn = psycopg2.extensions.parse_dsn(dsn_)
-                user = parsed_dsn.get('user')
-                dbname = parsed_dsn.get('dbname','postgres') 
-                dummy_conn_string = f"dbname='{dbname}' user='{user if user else ''}'" 
-            except Exception: 
-                dummy_conn_string = "dbname='postgres'" 
-
-            dummy_conn = psycopg2.connect(dummy_conn_string)
-            return full_sql_composed.as_string(dummy_conn), params
-        except psycopg2.Error:
-            try:
-                sql_string = self._build_sql_string_fallback(full_sql_composed)
-                return sql_string, params
-            except Exception as e_fallback:
-                print(f"Error in fallback SQL generation: {e_fallback}")
-                return f"-- Fallback SQL Generation Error: {e_fallback} --", params
-        finally:
-            if dummy_conn:
-                dummy_conn.close()
+        """(含 %s 占位符的条件 SQL 文本, 参数列表)。按树的修订号缓存，编译与渲染都不访问数据库。"""
+        if self._condition_cache is None or self._condition_cache[0] != self._revision:
+            sql_text, params = build_condition_sql(self.get_condition_ast(), self._field_types)
+            self._condition_cache = (self._revision, sql_text, params)
+        _, sql_text, params = self._condition_cache
+        return sql_text, list(params)
                 
     def has_valid_input(self): 
         for kw_data in self.keywords:
@@ -0,0 +1,179 @@
+# --- START OF FILE ui_components/job_scheduler.py ---
+from PySide6.QtCore import QObject, QThread, Signal, Slot
+
+from sql_logic.job_queue import (JobQueue, database_key_for, JOB_STATE_QUEUED, JOB_STATE_RUNNING,
+                                 JOB_STATE_SUCCEEDED, JOB_STATE_FAILED, JOB_STATE_CANCELLED, JOB_PRIORITY_NORMAL)
+
+CANCELLED_MESSAGE_MARKER = "操作已取消"
+
+
+class JobScheduler(QObject):
+    """
+    全部长任务 (队列创建、基础数据提取、专项数据合并) 的统一调度: 标签页提交工作对象，调度器按 JobQueue 的规则
+    排队、在各自的 QThread 中运行、汇总进度与日志，并统一处理取消与关闭。
+
+    工作对象需提供 run()、cancel() 以及信号 finished(...)、error(str)、progress(int, int)、log(str)。
+    提交时给出的回调总是在 GUI 线程中调用，第一个参数为任务编号: on_finished(job_id, *finished 的参数)、
+    on_error(job_id, 错误信息)、on_progress(job_id, 已完成, 总数)、on_log(job_id, 消息)。
+    """
+    job_added = Signal(int)
+    job_updated = Signal(int)       # 状态或进度变化
+    job_log = Signal(int, str)
+    jobs_removed = Signal(list)
+
+    # 工作线程 -> 调度器 (排队连接，在 GUI 线程中处理)
+    _worker_finished = Signal(int, object)
+    _worker_error = Signal(int, str)
+    _worker_progress = Signal(int, int, int)
+    _worker_log = Signal(int, str)
+    _thread_done = Signal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.queue = JobQueue()
+        self._workers = {}
+        self._threads = {}
+        self._callbacks = {}
+        self._outcomes = {}
+        self._cancel_requested = set()
+        self._worker_finished.connect(self._on_worker_finished)
+        self._worker_error.connect(self._on_worker_error)
+        self._worker_progress.connect(self._on_worker_progress)
+        self._worker_log.connect(self._on_worker_log)
+        self._thread_done.connect(self._on_thread_done)
+
+    def submit(self, worker, title, owner, db_params, job_type="", priority=JOB_PRIORITY_NORMAL, exclusive_keys=(),
+               on_finished=None, on_error=None, on_progress=None, on_log=None):
+        job_id = self.queue.submit(title, owner, database_key_for(db_params), priority, exclusive_keys, job_type)
+        self._workers[job_id] = worker
+        self._callbacks[job_id] = {"finished": on_finished, "error": on_error, "progress": on_progress, "log": on_log}
+        worker.finished.connect(lambda *args, j=job_id: self._worker_finished.emit(j, args))
+        worker.error.connect(lambda message, j=job_id: self._worker_error.emit(j, message))
+        worker.progress.connect(lambda done, total, j=job_id: self._worker_progress.emit(j, done, total))
+        worker.log.connect(lambda message, j=job_id: self._worker_log.emit(j, message))
+        self.job_added.emit(job_id)
+        self._dispatch()
+        if self.queue.get(job_id)["state"] == JOB_STATE_QUEUED:
+            self._on_worker_log(job_id, f"任务已加入队列 (第 {self.queue.queue_position(job_id)} 位)，等待空闲的执行位置...")
+        return job_id
+
+    def is_active(self, job_id):
+        job = self.queue.get(job_id)
+        return job is not None and job["state"] in (JOB_STATE_QUEUED, JOB_STATE_RUNNING)
+
+    def active_job_ids(self, owner=None):
+        return self.queue.active_job_ids(owner)
+
+    def set_limits(self, max_concurrent, max_per_database):
+        self.queue.set_limits(max_concurrent, max_per_database)
+        self._dispatch()
+
+    def set_priority(self, job_id, priority):
+        if self.queue.set_priority(job_id, priority):
+            self.job_updated.emit(job_id)
+            self._dispatch()
+
+    def cancel(self, job_id):
+        job = self.queue.get(job_id)
+        if job is None:
+            return
+        if job["state"] == JOB_STATE_QUEUED:
+            # 尚未启动: 直接移出队列，按取消结束通知提交方
+            self.queue.mark_finished(job_id, JOB_STATE_CANCELLED, "任务在排队时被取消")
+            worker = self._workers.pop(job_id, None)
+            callbacks = self._callbacks.pop(job_id, {})
+            if callbacks.get("error"):
+                callbacks["error"](job_id, f"{CANCELLED_MESSAGE_MARKER} (任务尚在排队，未开始执行)")
+            if worker is not None:
+                worker.deleteLater()
+            self.job_updated.emit(job_id)
+            self._dispatch()
+        elif job["state"] == JOB_STATE_RUNNING and job_id not in self._cancel_requested:
+            self._cancel_requested.add(job_id)
+            self._workers[job_id].cancel()
+
+    def clear_finished(self):
+        removed = self.queue.clear_finished()
+        if removed:
+            self.jobs_removed.emit(removed)
+
+    def shutdown(self, wait_ms=1500):
+        """关闭程序时调用: 丢弃排队的任务，取消运行中的任务并等待线程结束。"""
+        for job_id in self.queue.active_job_ids():
+            if self.queue.get(job_id)["state"] == JOB_STATE_QUEUED:
+                self.queue.mark_finished(job_id, JOB_STATE_CANCELLED)
+                self._callbacks.pop(job_id, None)
+                self._workers.pop(job_id, None)
+        for job_id, thread in list(self._threads.items()):
+            if thread.isRunning():
+                print(f"Attempting to stop job {job_id} on close...")
+                self._workers[job_id].cancel() # 同时在服务端取消正在执行的语句
+                thread.quit()
+                if not thread.wait(wait_ms):
+                    print(f"Warning: Job {job_id} thread did not quit in time.")
+
+    def _dispatch(self):
+        for job_id in self.queue.startable_job_ids():
+            worker = self._workers[job_id]
+            thread = QThread()
+            worker.moveToThread(thread)
+            thread.started.connect(worker.run)
+            worker.finished.connect(thread.quit)
+            worker.error.connect(thread.quit)
+            thread.finished.connect(lambda j=job_id: self._thread_done.emit(j))
+            self._threads[job_id] = thread
+            self.queue.mark_started(job_id)
+            self.job_updated.emit(job_id)
+            thread.start()
+
+    @Slot(int, object)
+    def _on_worker_finished(self, job_id, args):
+        self._outcomes[job_id] = (JOB_STATE_SUCCEEDED, "完成")
+        callback = self._callbacks.get(job_id, {}).get("finished")
+        if callback:
+            callback(job_id, *args)
+
+    @Slot(int, str)
+    def _on_worker_error(self, job_id, message):
+        cancelled = job_id in self._cancel_requested or CANCELLED_MESSAGE_MARKER in message
+        self._outcomes[job_id] = (JOB_STATE_CANCELLED if cancelled else JOB_STATE_FAILED, message.split("\n", 1)[0])
+        callback = self._callbacks.get(job_id, {}).get("error")
+        if callback:
+            callback(job_id, message)
+
+    @Slot(int, int, int)
+    def _on_worker_progress(self, job_id, done, total):
+        if self.queue.get(job_id) is None:
+            return
+        self.queue.record_progress(job_id, done, total)
+        callback = self._callbacks.get(job_id, {}).get("progress")
+        if callback:
+            callback(job_id, done, total)
+        self.job_updated.emit(job_id)
+
+    @Slot(int, str)
+    def _on_worker_log(self, job_id, message):
+        if self.queue.get(job_id) is None:
+            return
+        self.queue.append_log(job_id, message)
+        callback = self._callbacks.get(job_id, {}).get("log")
+        if callback:
+            callback(job_id, message)
+        self.job_log.emit(job_id, message)
+
+    @Slot(int)
+    def _on_thread_done(self, job_id):
+        state, message = self._outcomes.pop(job_id, (JOB_STATE_FAILED, "工作线程意外结束"))
+        self.queue.mark_finished(job_id, state, message)
+        self._cancel_requested.discard(job_id)
+        self._callbacks.pop(job_id, None)
+        worker = self._workers.pop(job_id, None)
+        thread = self._threads.pop(job_id, None)
+        if worker is not None:
+            worker.deleteLater()
+        if thread is not None:
+            thread.deleteLater()
+        self.job_updated.emit(job_id)
+        self._dispatch()
+
+# --- END OF FILE ui_components/job_scheduler.py ---
@@ -1,18 +1,24 @@
 # --- START OF FILE ui_components/time_window_selector_widget.py ---
-from PySide6.QtWidgets import QWidget, QHBoxLayout, QLabel, QComboBox
+from PySide6.QtWidgets import (QWidget, QHBoxLayout, QVBoxLayout, QLabel, QComboBox, QToolButton, QMenu,
+                               QCheckBox, QSpinBox)
 from PySide6.QtCore import Signal, Slot # Slot 可能不需要，但保留无妨
+from app_config import TIME_WINDOW_ANCHOR_COLUMNS, DEFAULT_CUSTOM_TIME_WINDOW_HOURS
 
 class TimeWindowSelectorWidget(QWidget):
     time_window_changed = Signal(str) # 发出选中的时间窗口文本
 
-    def __init__(self, label_text="时间窗口:", parent=None):
+    def __init__(self, label_text="时间窗口:", parent=None, allow_multiple=False, allow_custom=False):
         super().__init__(parent)
         self._options_with_data = [] # 存储 (display_text, data_value)
+        self._allow_multiple = allow_multiple # 是否允许勾选附加窗口 (多窗口一次提取)
+        self._allow_custom = allow_custom # 是否允许自定义窗口 (锚点 + 小时偏移)
+        self._extra_window_actions = {} # display_text -> 可勾选 QAction
         self.init_ui(label_text)
 
     def init_ui(self, label_text):
-        layout = QHBoxLayout(self)
-        layout.setContentsMargins(0,0,0,0)
+        outer_layout = QVBoxLayout(self)
+        outer_layout.setContentsMargins(0,0,0,0)
+        layout = QHBoxLayout()
 
         self.label = QLabel(label_text)
         layout.addWidget(self.label)
@@ -21,9 +27,83 @@ class TimeWindowSelectorWidget(QWidget):
         # 连接 currentTextChanged 信号，当用户通过UI更改或代码设置currentIndex且文本不同时触发
         self.combo_box.currentTextChanged.connect(self.time_window_changed.emit)
         layout.addWidget(self.combo_box)
+
+        self.extra_windows_btn = None
+        if self._allow_multiple:
+            self.extra_windows_btn = QToolButton()
+            self.extra_windows_btn.setText("附加窗口 (0)")
+            self.extra_windows_btn.setToolTip("勾选的附加窗口与主窗口在同一次扫描中提取，每个窗口输出一组列")
+            self.extra_windows_btn.setPopupMode(QToolButton.ToolButtonPopupMode.InstantPopup)
+            self.extra_windows_btn.setMenu(QMenu(self.extra_windows_btn))
+            self.combo_box.currentTextChanged.connect(self._sync_extra_window_actions)
+            layout.addWidget(self.extra_windows_btn)
         layout.addStretch()
-        
-        self.setLayout(layout)
+        outer_layout.addLayout(layout)
+
+        self.custom_window_cb = None
+        if self._allow_custom:
+            custom_layout = QHBoxLayout()
+            self.custom_window_cb = QCheckBox("自定义窗口:")
+            self.custom_window_cb.setToolTip("窗口 = [开始锚点 + 开始偏移, 结束锚点 + 结束偏移]，偏移单位为小时，可为负数")
+            self.custom_window_cb.toggled.connect(self._on_custom_window_toggled)
+            custom_layout.addWidget(self.custom_window_cb)
+            self.custom_start_anchor_combo = QComboBox()
+            self.custom_end_anchor_combo = QComboBox()
+            for display_name, column_name, _ in TIME_WINDOW_ANCHOR_COLUMNS:
+                self.custom_start_anchor_combo.addItem(display_name, column_name)
+                self.custom_end_anchor_combo.addItem(display_name, column_name)
+            self.custom_start_spin = QSpinBox()
+            self.custom_end_spin = QSpinBox()
+            for spin, default_hours in ((self.custom_start_spin, DEFAULT_CUSTOM_TIME_WINDOW_HOURS[0]),
+                                        (self.custom_end_spin, DEFAULT_CUSTOM_TIME_WINDOW_HOURS[1])):
+                spin.setRange(-24 * 365, 24 * 365)
+                spin.setSuffix(" 小时")
+                spin.setValue(default_hours)
+            custom_layout.addWidget(self.custom_start_anchor_combo)
+            custom_layout.addWidget(self.custom_start_spin)
+            custom_layout.addWidget(QLabel("至"))
+            custom_layout.addWidget(self.custom_end_anchor_combo)
+            custom_layout.addWidget(self.custom_end_spin)
+            custom_layout.addStretch()
+            for combo in (self.custom_start_anchor_combo, self.custom_end_anchor_combo):
+                combo.currentIndexChanged.connect(self._emit_custom_window_changed)
+            for spin in (self.custom_start_spin, self.custom_end_spin):
+                spin.valueChanged.connect(self._emit_custom_window_changed)
+            outer_layout.addLayout(custom_layout)
+            self._apply_custom_window_state(False)
+
+        self.setLayout(outer_layout)
+
+    def _apply_custom_window_state(self, checked):
+        self.combo_box.setEnabled(not checked and bool(self._options_with_data))
+        for w in (self.custom_start_anchor_combo, self.custom_start_spin, self.custom_end_anchor_combo, self.custom_end_spin):
+            w.setEnabled(checked)
+        if self.extra_windows_btn is not None:
+            self._sync_extra_window_actions()
+
+    @Slot(bool)
+    def _on_custom_window_toggled(self, checked):
+        self._apply_custom_window_state(checked)
+        self.time_window_changed.emit(self.combo_box.currentText())
+
+    @Slot()
+    def _emit_custom_window_changed(self, *_):
+        if self.is_custom_window_active():
+            self.time_window_changed.emit(self.combo_box.currentText())
+
+    def is_custom_window_active(self) -> bool:
+        return self.custom_window_cb is not None and self.custom_window_cb.isChecked()
+
+    def get_custom_time_window_spec(self) -> dict | None:
+        """自定义窗口未启用时返回 None，否则返回窗口规格 (见 sql_logic/time_window.py)。"""
+        if not self.is_custom_window_active():
+            return None
+        return {
+            "anchor": self.custom_start_anchor_combo.currentData(),
+            "start_offset_hours": self.custom_start_spin.value(),
+            "end_anchor": self.custom_end_anchor_combo.currentData(),
+            "end_offset_hours": self.custom_end_spin.value(),
+        }
 
     def set_options(self, options: list[str] | list[tuple[str, any]]):
         """
@@ -45,7 +125,9 @@ class TimeWindowSelectorWidget(QWidget):
                  self.time_window_changed.emit("")
             return
 
-        self.combo_box.setEnabled(True)
+        self.combo_box.setEnabled(not self.is_custom_window_active())
+        if self.extra_windows_btn is not None:
+            self._rebuild_extra_window_menu(options)
         for option in options:
             if isinstance(option, tuple) and len(option) == 2:
                 display_text, data_value = option
@@ -79,6 +161,50 @@ class TimeWindowSelectorWidget(QWidget):
             # 这是确保初始值被发出的一个好方法。
              self.time_window_changed.emit(initial_emit_text) # 确保初始值被发送
 
+    def _rebuild_extra_window_menu(self, options):
+        menu = self.extra_windows_btn.menu()
+        menu.clear()
+        self._extra_window_actions = {}
+        for option in options:
+            display_text = option[0] if isinstance(option, tuple) and len(option) == 2 else str(option)
+            action = menu.addAction(display_text)
+            action.setCheckable(True)
+            action.toggled.connect(self._on_extra_window_toggled)
+            self._extra_window_actions[display_text] = action
+
+    @Slot()
+    def _sync_extra_window_actions(self, *_):
+        # 主窗口不能同时作为附加窗口 (启用自定义窗口时预设主窗口不参与提取)
+        current_text = "" if self.is_custom_window_active() else self.combo_box.currentText()
+        for display_text, action in self._extra_window_actions.items():
+            is_primary = (display_text == current_text)
+            if is_primary and action.isChecked():
+                action.blockSignals(True)
+                action.setChecked(False)
+                action.blockSignals(False)
+            action.setEnabled(not is_primary)
+        self._update_extra_windows_btn_text()
+
+    def _update_extra_windows_btn_text(self):
+        if self.extra_windows_btn is not None:
+            self.extra_windows_btn.setText(f"附加窗口 ({len(self.get_extra_time_window_texts())})")
+
+    @Slot(bool)
+    def _on_extra_window_toggled(self, _checked):
+        self._update_extra_windows_btn_text()
+        self.time_window_changed.emit(self.combo_box.currentText())
+
+    def get_extra_time_window_texts(self) -> list[str]:
+        return [text for text, action in self._extra_window_actions.items() if action.isChecked()]
+
+    def get_selected_time_windows(self) -> list:
+        """主窗口 (自定义时为窗口规格 dict) 在前，其后为按选项顺序排列的附加窗口文本。"""
+        custom_spec = self.get_custom_time_window_spec()
+        current_text = self.combo_box.currentText()
+        selected = [custom_spec] if custom_spec else ([current_text] if current_text else [])
+        selected.extend(text for text in self.get_extra_time_window_texts() if custom_spec or text != current_text)
+        return selected
+
     def get_current_time_window_text(self) -> str:
         return self.combo_box.currentText()
 
@@ -106,7 +232,21 @@ class TimeWindowSelectorWidget(QWidget):
                 return
         print(f"警告: 未在时间窗口选项中找到数据值 '{data_value}'")
         
+    def clear_extra_options(self):
+        """取消所有附加窗口和自定义窗口 (不发出信号)。"""
+        for action in self._extra_window_actions.values():
+            action.blockSignals(True)
+            action.setChecked(False)
+            action.blockSignals(False)
+        if self.custom_window_cb is not None:
+            self.custom_window_cb.blockSignals(True)
+            self.custom_window_cb.setChecked(False)
+            self.custom_window_cb.blockSignals(False)
+            self._apply_custom_window_state(False)
+        self._update_extra_windows_btn_text()
+
     def clear_selection(self):
+        self.clear_extra_options()
         if self.combo_box.count() > 0:
             if self.combo_box.currentIndex() != 0: # 如果不是第一个，则设为第一个
                 self.combo_box.setCurrentIndex(0)
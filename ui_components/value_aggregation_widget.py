@@ -8,7 +8,7 @@ class ValueAggregationWidget(QWidget):
 
     NUMERIC_ONLY_METHODS = [ # "MIN", "MAX" 从这里移除，因为它们对文本也有意义（字典序）
         "MEAN", "MEDIAN", "SUM", "STDDEV_SAMP", "VAR_SAMP",
-        "CV", "P25", "P75", "IQR", "RANGE"
+        "CV", "P25", "P75", "IQR", "RANGE", "TIMESERIES_ARRAY" # TIMESERIES_ARRAY 的值数组为 double precision[]
     ]
     # FIRST_VALUE, LAST_VALUE, COUNT, TIMESERIES_JSON, MIN, MAX 可以用于文本和数值
 